@@ -0,0 +1,479 @@
+"""Append-only audit log of recognition decisions, compact enough to keep every one.
+
+Each face the service matches against the gallery becomes one decision:
+time, attendance session (X-Attendance-Session, sent by Django), endpoint,
+gallery namespace, model, bbox, top-k student IDs with similarities, threshold
+and outcome (recognized / below_threshold / no_match).
+
+Requests only append the decision to an in-memory buffer. A background thread
+turns the buffer into blocks every AUDIT_FLUSH_S (or AUDIT_BLOCK_ROWS
+decisions) and appends them to the current file, starting a new file past
+AUDIT_MAX_FILE_BYTES. If the writer ever falls AUDIT_MAX_PENDING decisions
+behind, new decisions are counted as dropped rather than slowing requests.
+
+Block layout (little-endian):
+    header  magic "FAB1", body length, CRC32 of body, first / last timestamp,
+            lowest / highest session, k, rows
+    body    per column: u32 length + zlib-compressed array, in COLUMNS order
+
+Columns are compressed separately, so a query reads the header to skip blocks
+outside its time range or session range, and for a student query decompresses
+the block's string table first and skips blocks that never mention the student.
+A torn block at the end of a file (crash mid-write) fails its CRC and ends the
+scan of that file; the writer always starts a new file after a restart.
+
+Query tool:
+    python audit.py query --day 2026-10-19 --student 42
+    python audit.py query --day 2026-10-19 --session 17 --recognized --json
+    python audit.py stats
+
+Environment:
+    AUDIT_DIR=audit                 log directory, relative to this file ('' disables the log)
+    AUDIT_TOP_K=3                   candidates kept per decision
+    AUDIT_BLOCK_ROWS=4096           decisions per block (at most)
+    AUDIT_FLUSH_S=1.0               write pending decisions at least this often
+    AUDIT_MAX_FILE_BYTES=64MB       rotate to a new file past this size
+    AUDIT_KEEP_BYTES=0              delete the oldest files beyond this total (0 = keep all)
+    AUDIT_MAX_PENDING=200000        decisions buffered before new ones are dropped
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+import calendar
+import threading
+import contextvars
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from memory import parse_size
+
+SESSION_HEADER = 'X-Attendance-Session'
+DECISIONS = ('no_match', 'recognized', 'below_threshold')
+BLOCK_MAGIC = b'FAB1'
+_HEADER = struct.Struct('<4sIIddiiHI')
+_NONE = 0xFFFFFFFF
+FILE_PREFIX = 'decisions-'
+FILE_SUFFIX = '.fab'
+
+# (name, dtype, values per row; 0 = k)
+COLUMNS = (
+    ('ts', np.float64, 1),
+    ('session', np.int32, 1),
+    ('endpoint', np.uint16, 1),
+    ('namespace', np.uint16, 1),
+    ('model', np.uint16, 1),
+    ('decision', np.uint8, 1),
+    ('threshold', np.float16, 1),
+    ('bbox', np.int16, 4),
+    ('ids', np.uint32, 0),
+    ('sims', np.float16, 0),
+)
+
+# Request context of the decisions being made: {"session": int, "endpoint": str}
+_context: contextvars.ContextVar = contextvars.ContextVar('audit_context', default=None)
+
+
+def current_context() -> Dict[str, Any]:
+    return _context.get() or {}
+
+
+class AuditMiddleware:
+    """ASGI middleware: attach the attendance session and endpoint to the request's decisions.
+
+    The scheduler and batch workers carry the context over to the inference threads.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._header = SESSION_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        raw = next((v for k, v in scope.get("headers", []) if k == self._header), b'')
+        session = int(raw) if raw.isdigit() else -1
+        token = _context.set({"session": session, "endpoint": scope["path"].rsplit('/', 1)[-1]})
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            _context.reset(token)
+
+
+def _file_start(name: str) -> float:
+    """Start time encoded in a log file name (decisions-YYYYmmddTHHMMSS-NNN.fab, UTC)."""
+    return calendar.timegm(time.strptime(name[len(FILE_PREFIX):len(FILE_PREFIX) + 15], '%Y%m%dT%H%M%S'))
+
+
+def log_files(directory: str) -> List[str]:
+    """Log files of `directory`, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, n) for n in os.listdir(directory)
+                  if n.startswith(FILE_PREFIX) and n.endswith(FILE_SUFFIX))
+
+
+def encode_block(rows: Sequence[tuple], k: int) -> bytes:
+    """One block from rows of (ts, session, endpoint, namespace, model, threshold, bbox, ids, sims)."""
+    n = len(rows)
+    ts, session, endpoint, namespace, model, threshold, bbox, ids, sims = zip(*rows)
+    strings: Dict[str, int] = {}
+    intern = lambda value: strings.setdefault(value, len(strings))  # noqa: E731
+    # Column-wise list comprehensions: the writer shares the GIL with request threads
+    pad_ids, pad_sims = [None] * k, [np.nan] * k
+    id_rows = [(list(r) + pad_ids)[:k] for r in ids]
+    id_col = np.array([[_NONE if sid is None else intern(sid) for sid in r] for r in id_rows], dtype=np.uint32)
+    sim_col = np.array([(list(r) + pad_sims)[:k] for r in sims], dtype=np.float32)
+    sim_col[id_col == _NONE] = np.nan
+    thresholds = np.array(threshold, dtype=np.float32)
+    decision = np.where(id_col[:, 0] == _NONE, 0, np.where(sim_col[:, 0] >= thresholds, 1, 2))
+    cols = {
+        'ts': np.array(ts, dtype=np.float64),
+        'session': np.array(session, dtype=np.int32),
+        'endpoint': np.array([intern(v) for v in endpoint], dtype=np.uint16),
+        'namespace': np.array([intern(v) for v in namespace], dtype=np.uint16),
+        'model': np.array([intern(v) for v in model], dtype=np.uint16),
+        'decision': decision.astype(np.uint8),
+        'threshold': thresholds.astype(np.float16),
+        'bbox': np.clip(np.array([(0, 0, 0, 0) if b is None else tuple(b[:4]) for b in bbox], dtype=np.int64),
+                        -32768, 32767).astype(np.int16),
+        'ids': id_col,
+        'sims': sim_col.astype(np.float16),
+    }
+
+    parts = [struct.pack('<I', n)]
+    for name, _, _ in COLUMNS:
+        data = zlib.compress(np.ascontiguousarray(cols[name]).tobytes(), 1)
+        parts.append(struct.pack('<I', len(data)))
+        parts.append(data)
+    table = zlib.compress('\n'.join(strings).encode('utf-8'), 1)
+    parts.append(struct.pack('<I', len(table)))
+    parts.append(table)
+    body = b''.join(parts)
+    sessions = cols['session']
+    header = _HEADER.pack(BLOCK_MAGIC, len(body), zlib.crc32(body), float(cols['ts'].min()),
+                          float(cols['ts'].max()), int(sessions.min()), int(sessions.max()), k, n)
+    return header + body
+
+
+class Block:
+    """A block read from disk; columns are decompressed on first access."""
+
+    def __init__(self, header: tuple, body: bytes):
+        _, _, _, self.ts_min, self.ts_max, self.session_min, self.session_max, self.k, self.rows = header
+        self._body = body
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        pos = 4
+        for name, _, _ in COLUMNS + (('strings', None, 1),):
+            (length,) = struct.unpack_from('<I', body, pos)
+            self._offsets[name] = (pos + 4, length)
+            pos += 4 + length
+        self._cache: Dict[str, Any] = {}
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self._cache:
+            start, length = self._offsets[name]
+            dtype, width = next((d, w) for n, d, w in COLUMNS if n == name)
+            arr = np.frombuffer(zlib.decompress(self._body[start:start + length]), dtype=dtype)
+            width = width or self.k
+            self._cache[name] = arr.reshape(self.rows, width) if width > 1 else arr
+        return self._cache[name]
+
+    def strings(self) -> List[str]:
+        if 'strings' not in self._cache:
+            start, length = self._offsets['strings']
+            text = zlib.decompress(self._body[start:start + length]).decode('utf-8')
+            self._cache['strings'] = text.split('\n') if text else []
+        return self._cache['strings']
+
+
+def read_blocks(path: str) -> Iterator[Block]:
+    """Blocks of one log file, stopping at a torn or corrupt tail."""
+    with open(path, 'rb') as f:
+        while True:
+            raw = f.read(_HEADER.size)
+            if len(raw) < _HEADER.size:
+                return
+            header = _HEADER.unpack(raw)
+            if header[0] != BLOCK_MAGIC:
+                print(f"⚠️  {os.path.basename(path)}: bad block header, rest of file skipped", file=sys.stderr)
+                return
+            body = f.read(header[1])
+            if len(body) < header[1] or zlib.crc32(body) != header[2]:
+                print(f"⚠️  {os.path.basename(path)}: torn block at the end, skipped", file=sys.stderr)
+                return
+            yield Block(header, body)
+
+
+def query(directory: str, start: float, end: float, student: Optional[str] = None,
+          session: Optional[int] = None, recognized_only: bool = False) -> Iterator[Dict[str, Any]]:
+    """Decisions in [start, end), optionally for one student (any candidate rank) or session."""
+    files = log_files(directory)
+    starts = [_file_start(os.path.basename(p)) for p in files]
+    for i, path in enumerate(files):
+        # A file holds decisions from its start until the next file starts (a minute of slack for the flush)
+        if starts[i] >= end or (i + 1 < len(files) and starts[i + 1] + 60 < start):
+            continue
+        for block in read_blocks(path):
+            if block.ts_max < start or block.ts_min >= end:
+                continue
+            if session is not None and not block.session_min <= session <= block.session_max:
+                continue
+            strings = block.strings()
+            if student is not None:
+                try:
+                    sid_idx = strings.index(student)
+                except ValueError:
+                    continue
+            ts = block.column('ts')
+            mask = (ts >= start) & (ts < end)
+            if session is not None:
+                mask &= block.column('session') == session
+            ids = block.column('ids')
+            if student is not None:
+                mask &= (ids == sid_idx).any(axis=1)
+            decision = block.column('decision')
+            if recognized_only:
+                mask &= decision == 1
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                continue
+            sims = block.column('sims')
+            sessions, bbox, threshold = block.column('session'), block.column('bbox'), block.column('threshold')
+            endpoint, namespace, model = block.column('endpoint'), block.column('namespace'), block.column('model')
+            for r in rows:
+                yield {
+                    "ts": float(ts[r]),
+                    "session": int(sessions[r]) if sessions[r] >= 0 else None,
+                    "endpoint": strings[endpoint[r]],
+                    "namespace": strings[namespace[r]],
+                    "model": strings[model[r]],
+                    "decision": DECISIONS[decision[r]],
+                    "threshold": round(float(threshold[r]), 3),
+                    "bbox": bbox[r].tolist() if bbox[r].any() else None,
+                    "candidates": [[strings[i], round(float(s), 3)] for i, s in zip(ids[r], sims[r]) if i != _NONE],
+                }
+
+
+class AuditLog:
+    """Background writer of the decision log (see module docstring)."""
+
+    def __init__(self, directory: str, top_k: int = 3, block_rows: int = 4096, flush_s: float = 1.0,
+                 max_file_bytes: int = 64 << 20, keep_bytes: int = 0, max_pending: int = 200_000):
+        """
+        Args:
+            directory: Log directory (created if missing)
+            top_k: Candidates kept per decision
+            block_rows: Decisions per block (at most)
+            flush_s: Write pending decisions at least this often
+            max_file_bytes: Start a new file past this size
+            keep_bytes: Delete the oldest files beyond this total (0 = keep all)
+            max_pending: Decisions buffered before new ones are dropped
+        """
+        self.directory = directory
+        self.top_k = max(1, top_k)
+        self.block_rows = max(1, block_rows)
+        self.flush_s = flush_s
+        self.max_file_bytes = max_file_bytes
+        self.keep_bytes = keep_bytes
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()  # the writer thread vs. close() at exit
+        self._file = None
+        self._file_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.dropped = 0
+        self.blocks = 0
+        self.errors = 0
+        self.clock = time.time  # decision timestamps (benchmarks replay a day faster)
+
+    @classmethod
+    def from_env(cls) -> Optional['AuditLog']:
+        directory = os.environ.get('AUDIT_DIR', 'audit')
+        if not directory:
+            return None
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(
+            os.path.join(base_dir, directory),
+            top_k=int(os.environ.get('AUDIT_TOP_K', 3)),
+            block_rows=int(os.environ.get('AUDIT_BLOCK_ROWS', 4096)),
+            flush_s=float(os.environ.get('AUDIT_FLUSH_S', 1.0)),
+            max_file_bytes=parse_size(os.environ.get('AUDIT_MAX_FILE_BYTES', '64MB')),
+            keep_bytes=parse_size(os.environ.get('AUDIT_KEEP_BYTES', '0')),
+            max_pending=int(os.environ.get('AUDIT_MAX_PENDING', 200_000)),
+        )
+
+    # -------- Request path --------
+    def record(self, model: str, namespace: str, threshold: float, bbox: Optional[Sequence[int]],
+               ids: Sequence[Optional[str]], sims: Sequence[float]) -> None:
+        """Queue one decision; `ids` / `sims` are the search's top candidates, best first."""
+        ctx = _context.get() or {}
+        row = (self.clock(), ctx.get("session", -1), ctx.get("endpoint", ""), namespace, model,
+               float(threshold), bbox, list(ids[:self.top_k]), [float(s) for s in sims[:self.top_k]])
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(row)
+            full = len(self._pending) >= self.block_rows
+        if full:
+            self._wake.set()
+
+    # -------- Writer --------
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(timeout=self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️  Audit log write failed: {e}")
+
+    def flush(self) -> None:
+        """Write every pending decision (called by the writer thread, and on shutdown)."""
+        with self._write_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            self._write(rows)
+
+    def _write(self, rows: List[tuple]) -> None:
+        for i in range(0, len(rows), self.block_rows):
+            block = encode_block(rows[i:i + self.block_rows], self.top_k)
+            if self._file is None or self._file_bytes + len(block) > self.max_file_bytes:
+                self._rotate(rows[i][0])
+            self._file.write(block)
+            self._file_bytes += len(block)
+            self.blocks += 1
+            self.written += min(self.block_rows, len(rows) - i)
+        if rows:
+            self._file.flush()
+
+    def _rotate(self, first_ts: float) -> None:
+        if self._file is not None:
+            self._file.close()
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(first_ts))
+        seq = 0
+        while True:
+            path = os.path.join(self.directory, f"{FILE_PREFIX}{stamp}-{seq:03d}{FILE_SUFFIX}")
+            if not os.path.exists(path):
+                break
+            seq += 1
+        self._file = open(path, 'ab')
+        self._file_bytes = 0
+        if self.keep_bytes:
+            files = log_files(self.directory)
+            total = sum(os.path.getsize(p) for p in files)
+            for old in files[:-1]:
+                if total <= self.keep_bytes:
+                    break
+                total -= os.path.getsize(old)
+                os.unlink(old)
+                print(f"🔁 Deleted audit log {os.path.basename(old)} (AUDIT_KEEP_BYTES)")
+
+    def close(self) -> None:
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # -------- Reporting --------
+    def memory_usage(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        # A pending row is a tuple of ~9 small objects plus two short lists
+        return {"audit_buffer": {"bytes": pending * 600, "pending": pending}}
+
+    def status(self) -> Dict[str, Any]:
+        files = log_files(self.directory)
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "directory": self.directory,
+            "files": len(files),
+            "bytes": sum(os.path.getsize(p) for p in files),
+            "written": self.written,
+            "pending": pending,
+            "dropped": self.dropped,
+            "blocks": self.blocks,
+            "errors": self.errors,
+            "top_k": self.top_k,
+        }
+
+
+def _day_range(day: str) -> Tuple[float, float]:
+    """[start, end) of a local calendar day."""
+    start = datetime.strptime(day, '%Y-%m-%d')
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Query the recognition decision audit log")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      os.environ.get('AUDIT_DIR') or 'audit'))
+    sub = parser.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("query", help="Decisions of one day for a student and/or session")
+    q.add_argument("--day", default=datetime.now().strftime('%Y-%m-%d'), help="Local date, YYYY-MM-DD")
+    q.add_argument("--student", help="Student ID (matches any candidate rank)")
+    q.add_argument("--session", type=int, help="Attendance session ID")
+    q.add_argument("--recognized", action="store_true", help="Only decisions that recognized someone")
+    q.add_argument("--limit", type=int, default=0, help="Stop after this many decisions (0 = all)")
+    q.add_argument("--json", action="store_true", help="One JSON object per line")
+    sub.add_parser("stats", help="Files, blocks and decisions per day")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == "stats":
+        days: Dict[str, Dict[str, int]] = {}
+        total_bytes = 0
+        for path in log_files(args.dir):
+            total_bytes += os.path.getsize(path)
+            for block in read_blocks(path):
+                day = datetime.fromtimestamp(block.ts_min).strftime('%Y-%m-%d')
+                entry = days.setdefault(day, {"blocks": 0, "decisions": 0})
+                entry["blocks"] += 1
+                entry["decisions"] += block.rows
+        for day, entry in sorted(days.items()):
+            print(f"{day}  {entry['decisions']:>10,} decisions  {entry['blocks']:>6} blocks")
+        decisions = sum(e["decisions"] for e in days.values())
+        print(f"✓ {len(log_files(args.dir))} files, {total_bytes / 2**20:.1f} MiB, "
+              f"{total_bytes / max(1, decisions):.1f} bytes/decision")
+        return 0
+
+    if args.student is None and args.session is None:
+        parser.error("query needs --student and/or --session")
+    start, end = _day_range(args.day)
+    count = 0
+    for item in query(args.dir, start, end, student=args.student, session=args.session,
+                      recognized_only=args.recognized):
+        count += 1
+        if args.json:
+            print(json.dumps(item))
+        else:
+            when = datetime.fromtimestamp(item["ts"]).strftime('%H:%M:%S.%f')[:-3]
+            cands = "  ".join(f"{sid}:{sim:.3f}" for sid, sim in item["candidates"])
+            print(f"{when}  session {item['session']}  {item['endpoint']:<16} {item['decision']:<15} "
+                  f"bbox {item['bbox']}  {cands}")
+        if args.limit and count >= args.limit:
+            break
+    print(f"✓ {count} decisions in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Pluggable face detection / embedding backends.
+
+`FaceRecognitionSystem` only talks to a `FaceBackend`:
+- detect(img)        -> list of DetectedFace (bbox, 5-point kps, det_score)
+- embed(img, faces)  -> (n, d) L2-normalized embeddings, one per face
+- align(img, kps)    -> crop_size x crop_size aligned face crop
+- embed_crops(crops) -> embeddings of already aligned crops (recognition model only)
+
+Backends:
+- InsightFaceBackend (default): SCRFD detector + ArcFace recognition from an
+  InsightFace model pack. Models are downloaded on first use.
+- SyntheticBackend: deterministic, dependency-free stand-in for offline
+  benchmarking and load tests. "Faces" are solid coloured rectangles whose
+  colour encodes an identity (see `render_synthetic_scene`); embeddings are
+  reproducible per identity with a little per-crop noise, and the cost of
+  detection/embedding is configurable.
+
+Select with the FACE_BACKEND environment variable ("insightface" | "synthetic").
+"""
+import os
+import time
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import cv2
+
+
+# ArcFace 112x112 reference landmarks (left eye, right eye, nose, mouth left, mouth right)
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+
+class DetectedFace:
+    """A detected face. Attribute names mirror insightface's `Face`."""
+    __slots__ = ('bbox', 'kps', 'det_score', 'normed_embedding')
+
+    def __init__(self, bbox: np.ndarray, kps: Optional[np.ndarray], det_score: float):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.kps = None if kps is None else np.asarray(kps, dtype=np.float32)
+        self.det_score = float(det_score)
+        self.normed_embedding: Optional[np.ndarray] = None
+
+
+class AlignmentError(Exception):
+    """Landmarks from which no similarity transform to the template can be estimated."""
+
+
+def align_face(img: np.ndarray, kps: np.ndarray, image_size: int = 112) -> np.ndarray:
+    """Similarity-align a face to the ArcFace template using its 5 landmarks."""
+    dst = ARCFACE_TEMPLATE * (image_size / 112.0)
+    M, _ = cv2.estimateAffinePartial2D(np.asarray(kps, dtype=np.float32), dst, method=cv2.LMEDS)
+    if M is None:
+        raise AlignmentError("Face alignment failed")
+    return cv2.warpAffine(img, M, (image_size, image_size), borderValue=0.0)
+
+
+class FaceBackend:
+    """Interface for face detection + embedding."""
+    name = "base"
+    dimension = 512
+    crop_size = 112
+
+    def detect(self, img: np.ndarray) -> List[DetectedFace]:
+        raise NotImplementedError
+
+    def detect_many(self, images: Sequence[np.ndarray]) -> List[List[DetectedFace]]:
+        """Detect faces in several images (e.g. tiles of one frame)."""
+        return [self.detect(img) for img in images]
+
+    def align(self, img: np.ndarray, kps: np.ndarray) -> np.ndarray:
+        """Align one face of `img` from its 5 landmarks."""
+        return align_face(img, kps, self.crop_size)
+
+    def embed_crops(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        """Embed aligned crop_size x crop_size face crops -> (n, d) L2-normalized."""
+        raise NotImplementedError
+
+    def embed(self, img: np.ndarray, faces: Sequence[DetectedFace]) -> np.ndarray:
+        """Embed the given faces of `img`; also sets `face.normed_embedding`."""
+        feats = self.embed_crops([self.align(img, f.kps) for f in faces])
+        for f, e in zip(faces, feats):
+            f.normed_embedding = e
+        return feats
+
+    def get(self, img: np.ndarray) -> List[DetectedFace]:
+        """Detect and embed every face (drop-in for `FaceAnalysis.get`)."""
+        faces = self.detect(img)
+        if faces:
+            self.embed(img, faces)
+        return faces
+
+
+class InsightFaceBackend(FaceBackend):
+    """SCRFD detection + ArcFace embedding from an InsightFace model pack."""
+
+    def __init__(self, model_name: str = 'buffalo_sc', det_size: Tuple[int, int] = (640, 640),
+                 providers: Optional[List[str]] = None):
+        # Imported lazily so the synthetic backend works without insightface installed
+        from insightface.app import FaceAnalysis
+        from insightface.utils import face_align
+
+        self._norm_crop = face_align.norm_crop
+        self.name = f"insightface/{model_name}"
+        # Only load the models we run: landmark/gender-age models in larger packs are skipped
+        self.app = FaceAnalysis(name=model_name, providers=providers or ['CPUExecutionProvider'],
+                                allowed_modules=['detection', 'recognition'])
+        # Larger det_size improves detection quality
+        self.app.prepare(ctx_id=0, det_size=det_size)
+        self.det_model = self.app.det_model
+        self.det_size = det_size
+        self.rec_model = self.app.models['recognition']
+        self.dimension = int(self.rec_model.output_shape[1]) if hasattr(self.rec_model, 'output_shape') else 512
+        self.crop_size = int(self.rec_model.input_size[0])
+
+    def detect(self, img: np.ndarray) -> List[DetectedFace]:
+        bboxes, kpss = self.det_model.detect(img, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            faces.append(DetectedFace(bboxes[i, 0:4], kps, bboxes[i, 4]))
+        return faces
+
+    def align(self, img: np.ndarray, kps: np.ndarray) -> np.ndarray:
+        return self._norm_crop(img, landmark=np.asarray(kps, dtype=np.float32), image_size=self.crop_size)
+
+    def embed_crops(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        if len(crops) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        # get_feat runs all crops through ArcFace as one batch
+        feats = np.asarray(self.rec_model.get_feat(list(crops)), dtype=np.float32).reshape(len(crops), -1)
+        feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-10
+        return feats
+
+
+# -------- Deterministic synthetic backend --------
+SYNTHETIC_BACKGROUND_MAX = 40       # any channel above this is "face" pixels
+SYNTHETIC_LEVEL_BASE = 64
+SYNTHETIC_LEVEL_STEP = 12           # 16 levels per channel -> 4096 identities
+SYNTHETIC_MAX_IDENTITIES = 16 ** 3
+
+
+def synthetic_identity_color(identity: int) -> Tuple[int, int, int]:
+    """BGR colour encoding `identity` (0 <= identity < 4096)."""
+    identity = int(identity) % SYNTHETIC_MAX_IDENTITIES
+    r, g, b = identity // 256, (identity // 16) % 16, identity % 16
+    return tuple(SYNTHETIC_LEVEL_BASE + SYNTHETIC_LEVEL_STEP * c for c in (b, g, r))
+
+
+def synthetic_color_identity(bgr: Sequence[float]) -> int:
+    """Inverse of `synthetic_identity_color` (tolerates compression noise)."""
+    b, g, r = (int(np.clip(round((c - SYNTHETIC_LEVEL_BASE) / SYNTHETIC_LEVEL_STEP), 0, 15)) for c in bgr)
+    return r * 256 + g * 16 + b
+
+
+def render_synthetic_scene(width: int, height: int, faces: Sequence[Tuple[int, int, int, int]],
+                           seed: int = 0) -> np.ndarray:
+    """Render a BGR image containing synthetic faces.
+
+    Args:
+        faces: (identity, x, y, size) per face - a size x size square at (x, y)
+        seed: Seed for the low-amplitude texture noise (keeps frames distinct but reproducible)
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(10, 31, size=(height, width, 3), dtype=np.uint8)
+    for identity, x, y, size in faces:
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(width, int(x + size)), min(height, int(y + size))
+        if x1 <= x0 or y1 <= y0:
+            continue
+        color = np.array(synthetic_identity_color(identity), dtype=np.int16)
+        texture = rng.integers(-5, 6, size=(y1 - y0, x1 - x0, 3), dtype=np.int16)
+        img[y0:y1, x0:x1] = np.clip(color + texture, 0, 255).astype(np.uint8)
+    return img
+
+
+def synthetic_identity_embedding(identity: int, dimension: int = 512, variant: int = 0) -> np.ndarray:
+    """The reproducible "true" embedding of a synthetic identity.
+
+    Each `variant` is a separate embedding space, standing in for a different
+    recognition model (vectors of two variants are unrelated).
+    """
+    seed = 1_000_003 + int(identity) if not variant else (int(variant), int(identity))
+    vec = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class SyntheticBackend(FaceBackend):
+    """Deterministic detector/embedder with configurable cost, for offline benchmarks.
+
+    Detection mimics a fixed-input detector: the image is downscaled so its long
+    side fits `det_size`, and faces smaller than `min_face_px` at that scale are
+    missed, just like tiny faces in a real 640x640 SCRFD pass.
+    """
+
+    def __init__(self, det_size: Tuple[int, int] = (640, 640), min_face_px: int = 10,
+                 detect_ms: float = 0.0, embed_ms: float = 0.0, noise: float = 0.3,
+                 dimension: int = 512, variant: int = 0):
+        """
+        Args:
+            det_size: Detector input size (images are downscaled to fit)
+            min_face_px: Smallest detectable face side at detector scale
+            detect_ms: Simulated detector cost per image
+            embed_ms: Simulated recognition cost per face
+            noise: Norm of per-crop noise added to the identity embedding
+            dimension: Embedding dimension
+            variant: Embedding space; 0 is "synthetic", others are "synthetic/v<variant>"
+        """
+        self.name = f"synthetic/v{variant}" if variant else "synthetic"
+        self.variant = variant
+        self.det_size = det_size
+        self.min_face_px = min_face_px
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+        self.noise = noise
+        self.dimension = dimension
+
+    @classmethod
+    def from_env(cls, variant: int = 0) -> "SyntheticBackend":
+        return cls(
+            variant=variant,
+            min_face_px=int(os.environ.get('SYNTHETIC_MIN_FACE_PX', 10)),
+            detect_ms=float(os.environ.get('SYNTHETIC_DETECT_MS', 0)),
+            embed_ms=float(os.environ.get('SYNTHETIC_EMBED_MS', 0)),
+            noise=float(os.environ.get('SYNTHETIC_NOISE', 0.3)),
+        )
+
+    def detect(self, img: np.ndarray) -> List[DetectedFace]:
+        if self.detect_ms:
+            time.sleep(self.detect_ms / 1000.0)
+        h, w = img.shape[:2]
+        scale = min(1.0, self.det_size[0] / float(w), self.det_size[1] / float(h))
+        small = img if scale >= 1.0 else cv2.resize(
+            img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        mask = (small.max(axis=2) > SYNTHETIC_BACKGROUND_MAX).astype(np.uint8)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+
+        faces = []
+        for i in range(1, n):
+            x, y, bw, bh, _ = stats[i]
+            if min(bw, bh) < self.min_face_px:
+                continue
+            bbox = np.array([x, y, x + bw, y + bh], dtype=np.float32) / scale
+            side_x, side_y = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            kps = np.stack([
+                bbox[0] + ARCFACE_TEMPLATE[:, 0] / 112.0 * side_x,
+                bbox[1] + ARCFACE_TEMPLATE[:, 1] / 112.0 * side_y,
+            ], axis=1)
+            det_score = min(0.99, 0.6 + min(bw, bh) / 200.0)
+            faces.append(DetectedFace(bbox, kps, det_score))
+        return faces
+
+    def embed_crops(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        """Embed aligned face crops (the colour at the crop centre encodes identity)."""
+        if self.embed_ms and crops:
+            time.sleep(self.embed_ms * len(crops) / 1000.0)
+        out = np.zeros((len(crops), self.dimension), dtype=np.float32)
+        for i, crop in enumerate(crops):
+            ch, cw = crop.shape[:2]
+            center = crop[ch // 3: 2 * ch // 3 + 1, cw // 3: 2 * cw // 3 + 1].reshape(-1, 3)
+            identity = synthetic_color_identity(np.median(center, axis=0))
+            vec = synthetic_identity_embedding(identity, self.dimension, self.variant)
+            if self.noise:
+                rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(crop).tobytes()))
+                jitter = rng.standard_normal(self.dimension).astype(np.float32)
+                vec = vec + self.noise * jitter / np.linalg.norm(jitter)
+            out[i] = vec / np.linalg.norm(vec)
+        return out
+
+
+def create_backend(name: Optional[str] = None) -> FaceBackend:
+    """Build the backend selected by `name` or the FACE_BACKEND env var."""
+    name = (name or os.environ.get('FACE_BACKEND', 'insightface')).lower()
+    if name == 'insightface':
+        return InsightFaceBackend(model_name=os.environ.get('FACE_MODEL', 'buffalo_sc'))
+    if name == 'synthetic':
+        return SyntheticBackend.from_env(variant=int(os.environ.get('SYNTHETIC_VARIANT', 0)))
+    raise ValueError(f"Unknown face backend: {name}")
@@ -0,0 +1,256 @@
+"""Offline batch recognition of classroom photo folders and archives.
+
+Pipeline (per image):
+    read bytes -> decode (thread pool) -> detect + embed -> batched FAISS search
+
+At most `max_inflight` images are held in memory at once, so a folder of
+thousands of 4K photos is processed with bounded RAM. Results are yielded as
+soon as each image completes (completion order, not input order), which lets
+the HTTP endpoint stream them as NDJSON.
+
+CLI usage:
+    python batch.py /path/to/photos            # directory (recursive)
+    python batch.py lecture_photos.zip -o results.ndjson
+"""
+import os
+import sys
+import json
+import time
+import queue
+import zipfile
+import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterator, Iterable, Tuple
+
+import numpy as np
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# (display name, zero-arg callable returning the encoded image bytes)
+ImageSource = Tuple[str, Callable[[], bytes]]
+
+
+def _is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith('.')
+
+
+def iter_directory(path: str) -> Iterator[ImageSource]:
+    """Yield image sources from a directory tree in sorted order."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            if not _is_image(fname):
+                continue
+            full = os.path.join(root, fname)
+
+            def read(full=full) -> bytes:
+                with open(full, 'rb') as f:
+                    return f.read()
+            yield os.path.relpath(full, path), read
+
+
+def iter_zip(path: str) -> Iterator[ImageSource]:
+    """Yield image sources from a zip archive; members are read lazily."""
+    # The archive stays open until the last pending reader is garbage collected:
+    # reads happen on decode threads after this generator is exhausted.
+    zf = zipfile.ZipFile(path)
+    lock = threading.Lock()  # ZipFile reads are not thread-safe
+    for info in zf.infolist():
+        if info.is_dir() or not _is_image(info.filename):
+            continue
+
+        def read(name=info.filename) -> bytes:
+            with lock:
+                return zf.read(name)
+        yield info.filename, read
+
+
+def iter_sources(path: str) -> Iterator[ImageSource]:
+    """Yield image sources from a directory, zip archive, or single image."""
+    if os.path.isdir(path):
+        return iter_directory(path)
+    if zipfile.is_zipfile(path):
+        return iter_zip(path)
+    if _is_image(path):
+        def read() -> bytes:
+            with open(path, 'rb') as f:
+                return f.read()
+        return iter([(os.path.basename(path), read)])
+    raise Exception(f"Unsupported batch input: {path}")
+
+
+class BatchRecognizer:
+    """Parallel decode -> detect -> embed -> search pipeline over many images."""
+
+    def __init__(self, face_system, threshold: float = 0.7, decode_workers: int = 4,
+                 infer_workers: int = 1, max_inflight: int = 8, scheduler=None):
+        """
+        Args:
+            face_system: FaceRecognitionSystem used for detection, embedding and search
+            threshold: Cosine similarity threshold for a face to count as recognized
+            decode_workers: Threads reading + decoding images (cv2 releases the GIL)
+            infer_workers: Threads running detection/embedding (ONNX is already multi-threaded)
+            max_inflight: Max images held in memory between read and result
+            scheduler: Optional InferenceScheduler; each image then runs as one
+                batch-lane unit, so live recognition is served between images
+        """
+        self.face_system = face_system
+        self.threshold = threshold
+        self.decode_workers = max(1, decode_workers)
+        self.infer_workers = max(1, infer_workers)
+        self.max_inflight = max(1, max_inflight)
+        self.scheduler = scheduler
+
+    @staticmethod
+    def _decode(read: Callable[[], bytes]) -> np.ndarray:
+        data = np.frombuffer(read(), dtype=np.uint8)
+        img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if img is None:
+            raise Exception("Image decode failed")
+        return img
+
+    def run(self, sources: Iterable[ImageSource]) -> Iterator[Dict[str, Any]]:
+        """Process all sources and yield one result dict per image as it completes.
+
+        Each result is either
+            {"image": name, "width", "height", "faces": [...], "elapsed_ms"}
+        or  {"image": name, "error": "..."}
+        """
+        results: "queue.Queue" = queue.Queue()
+        slots = threading.Semaphore(self.max_inflight)
+        stop = threading.Event()
+        fed = {'count': 0, 'done': False}
+        # Pool threads do not inherit context variables: run inference in the caller's (audit context)
+        context = contextvars.copy_context()
+
+        decode_pool = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='batch-decode')
+        infer_pool = ThreadPoolExecutor(max_workers=self.infer_workers, thread_name_prefix='batch-infer')
+
+        def infer(name: str, img: np.ndarray, started: float) -> None:
+            try:
+                if self.scheduler is not None:
+                    out = self.scheduler.call(self.face_system.recognize_faces_in_frame, img,
+                                              lane='batch', threshold=self.threshold)
+                else:
+                    out = self.face_system.recognize_faces_in_frame(img, threshold=self.threshold)
+                results.put({
+                    "image": name,
+                    "width": out["image"]["width"],
+                    "height": out["image"]["height"],
+                    "faces": out["faces"],
+                    "elapsed_ms": round((time.time() - started) * 1000, 2),
+                })
+            except Exception as e:
+                results.put({"image": name, "error": str(e)})
+
+        def decode(name: str, read: Callable[[], bytes]) -> None:
+            started = time.time()
+            try:
+                img = self._decode(read)
+            except Exception as e:
+                results.put({"image": name, "error": str(e)})
+                return
+            if stop.is_set():
+                results.put({"image": name, "error": "cancelled"})
+                return
+            infer_pool.submit(context.copy().run, infer, name, img, started)
+
+        def feed() -> None:
+            try:
+                for name, read in sources:
+                    # Block until an in-flight slot frees up (bounded memory)
+                    while not slots.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    fed['count'] += 1
+                    decode_pool.submit(decode, name, read)
+            except Exception as e:
+                fed['count'] += 1
+                results.put({"image": None, "error": f"Failed to list inputs: {e}"})
+            finally:
+                fed['done'] = True
+                results.put(None)  # wake consumer so it can re-check completion
+
+        feeder = threading.Thread(target=feed, name='batch-feed', daemon=True)
+        feeder.start()
+
+        yielded = 0
+        try:
+            while True:
+                if fed['done'] and yielded >= fed['count']:
+                    break
+                item = results.get()
+                if item is None:
+                    continue
+                yielded += 1
+                slots.release()
+                yield item
+        finally:
+            # Consumer went away (client disconnect) or finished: stop feeding
+            stop.set()
+            feeder.join(timeout=5)
+            decode_pool.shutdown(wait=True)
+            infer_pool.shutdown(wait=True)
+
+
+def to_ndjson(results: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Encode result dicts as NDJSON lines, followed by a summary line."""
+    started = time.time()
+    images = faces = recognized = errors = 0
+    for res in results:
+        images += 1
+        if "error" in res:
+            errors += 1
+        else:
+            faces += len(res["faces"])
+            recognized += sum(1 for f in res["faces"] if f.get("recognized"))
+        yield (json.dumps(res) + "\n").encode("utf-8")
+    yield (json.dumps({
+        "summary": True,
+        "images": images,
+        "errors": errors,
+        "faces": faces,
+        "recognized": recognized,
+        "elapsed_ms": round((time.time() - started) * 1000, 2),
+    }) + "\n").encode("utf-8")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Batch face recognition over a photo folder or archive")
+    parser.add_argument("input", help="Directory, .zip archive or single image")
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--infer-workers", type=int, default=1)
+    parser.add_argument("--max-inflight", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    from face_recognition import FaceRecognitionSystem
+
+    recognizer = BatchRecognizer(
+        # The service's gallery, opened with its index type ('auto' keeps the stored one, no rebuild)
+        FaceRecognitionSystem(index_path=os.environ.get('FACE_INDEX_PATH', 'faiss_index'),
+                              index_type=os.environ.get('FACE_INDEX_TYPE', 'auto')),
+        threshold=args.threshold,
+        decode_workers=args.decode_workers,
+        infer_workers=args.infer_workers,
+        max_inflight=args.max_inflight,
+    )
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for line in to_ndjson(recognizer.run(iter_sources(args.input))):
+            out.write(line)
+            out.flush()
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Cost and size of the decision audit log (see audit.py).
+
+1. Replays a school day (08:00-18:00 local, --sessions lectures over a gallery
+   of --students) through AuditLog.record() as fast as it can, with the writer
+   thread running (pausing whenever it falls 100k decisions behind), and
+   reports the record() cost, the replay rate and the bytes per decision against the same decisions as JSON lines.
+2. Times the query tool's day scans for one student and one session.
+3. Times recognize_frame against the in-process service (synthetic backend)
+   with the audit log off and on.
+
+Usage:
+    python bench_audit.py
+    python bench_audit.py --decisions 5000000 --students 5000
+"""
+import os
+import sys
+import json
+import bisect
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 2) if values else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Audit log benchmark")
+    parser.add_argument("--decisions", type=int, default=2_000_000, help="Decisions in the replayed day")
+    parser.add_argument("--students", type=int, default=3000)
+    parser.add_argument("--sessions", type=int, default=400, help="Lectures in the day")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200, help="recognize_frame calls per run (part 3)")
+    parser.add_argument("--out", default=os.path.join("bench_results", "audit.json"))
+    args = parser.parse_args(argv)
+
+    os.environ['FACE_BACKEND'] = 'synthetic'
+    os.environ.setdefault('FACE_INDEX_PATH', tempfile.mkdtemp(prefix='bench_audit_'))
+    os.environ['AUDIT_DIR'] = tempfile.mkdtemp(prefix='bench_audit_log_')
+    import audit
+
+    directory = tempfile.mkdtemp(prefix='bench_audit_day_')
+    log = audit.AuditLog(directory, top_k=args.top_k)
+    log.start()
+    rng = random.Random(7)
+    day = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    day_start = day.timestamp()
+    span = 10 * 3600.0
+    # Each lecture runs 90 minutes somewhere in the day and sees one class of students
+    lectures = []
+    for s in range(args.sessions):
+        start = day_start + rng.uniform(0, span - 5400)
+        first = rng.randrange(0, args.students - 60)
+        lectures.append((s + 1, start, first))
+    lectures.sort(key=lambda l: l[1])
+    starts = [l[1] for l in lectures]
+    endpoints = ['recognize_frame'] * 6 + ['recognize_crops'] * 3 + ['recognize', 'recognize_batch']
+    ids_pool = [str(i) for i in range(args.students)]
+
+    print(f"== Replaying {args.decisions:,} decisions over 08:00-18:00 ({args.sessions} lectures) ==")
+    costs: List[float] = []
+    jsonl_sample = 0
+    sample_every = max(1, args.decisions // 20_000)
+    replay_start = time.perf_counter()
+    for n in range(args.decisions):
+        ts = day_start + span * n / args.decisions
+        # A lecture running at ts (or no session, e.g. an ad-hoc recognize call)
+        lo, hi = bisect.bisect_left(starts, ts - 5400), bisect.bisect_right(starts, ts)
+        session, _, first = lectures[rng.randrange(lo, hi)] if hi > lo else (-1, 0, rng.randrange(args.students - 60))
+        true_id = first + rng.randrange(60)
+        top = rng.uniform(0.55, 0.95)
+        cands = [ids_pool[true_id]] + [ids_pool[rng.randrange(args.students)] for _ in range(args.top_k - 1)]
+        sims = [top] + sorted((rng.uniform(0.05, top) for _ in range(args.top_k - 1)), reverse=True)
+        x, y = rng.randrange(1800), rng.randrange(1000)
+        bbox = [x, y, x + 120, y + 120]
+        audit._context.set({"session": session, "endpoint": endpoints[n % len(endpoints)]})
+        log.clock = lambda: ts
+        t0 = time.perf_counter()
+        log.record('buffalo_sc', 'default', 0.7, bbox, cands, sims)
+        costs.append(time.perf_counter() - t0)
+        if n % 10_000 == 0:
+            # Replay is far faster than any classroom load: let the writer keep up instead of dropping
+            while log.status()["pending"] > 100_000:
+                time.sleep(0.01)
+        if n % sample_every == 0:
+            # The same decision as a JSON line, for the size comparison
+            jsonl_sample += len(json.dumps({
+                "ts": ts, "session": session, "endpoint": endpoints[n % len(endpoints)], "namespace": "default",
+                "model": "buffalo_sc", "decision": "recognized" if top >= 0.7 else "below_threshold",
+                "threshold": 0.7, "bbox": bbox, "candidates": [[c, round(s, 3)] for c, s in zip(cands, sims)],
+            })) + 1
+    replay_s = time.perf_counter() - replay_start
+    while log.status()["pending"]:
+        time.sleep(0.05)
+    log.close()
+    status = log.status()
+    costs_us = [c * 1e6 for c in costs]
+    jsonl_bytes = jsonl_sample * sample_every
+    replay = {
+        "decisions": args.decisions,
+        "written": status["written"],
+        "dropped": status["dropped"],
+        "files": status["files"],
+        "blocks": status["blocks"],
+        "log_mib": round(status["bytes"] / 2**20, 1),
+        "bytes_per_decision": round(status["bytes"] / max(1, status["written"]), 1),
+        "jsonl_mib_estimate": round(jsonl_bytes / 2**20, 1),
+        "jsonl_bytes_per_decision": round(jsonl_bytes / args.decisions, 1),
+        "record_us_p50": _pct(costs_us, 50),
+        "record_us_p99": _pct(costs_us, 99),
+        "record_us_max": round(max(costs_us), 1),
+        "replay_s": round(replay_s, 1),
+        "decisions_per_s": round(args.decisions / replay_s),
+    }
+    print(f"  record() p50 {replay['record_us_p50']} us  p99 {replay['record_us_p99']} us  "
+          f"max {replay['record_us_max']} us  dropped {replay['dropped']}  "
+          f"({replay['decisions_per_s']:,} decisions/s replayed)")
+    print(f"  {replay['log_mib']} MiB in {replay['files']} file(s), {replay['bytes_per_decision']} bytes/decision "
+          f"(JSON lines: ~{replay['jsonl_mib_estimate']} MiB, {replay['jsonl_bytes_per_decision']} bytes/decision)")
+
+    print("\n== Day queries ==")
+    start, end = day_start - 8 * 3600, day_start + 16 * 3600
+    queries: Dict[str, Dict[str, float]] = {}
+    student = ids_pool[lectures[len(lectures) // 2][2] + 7]
+    session = lectures[len(lectures) // 2][0]
+    for label, kwargs in (("student", {"student": student}), ("session", {"session": session}),
+                          ("student_recognized", {"student": student, "recognized_only": True})):
+        t0 = time.perf_counter()
+        hits = sum(1 for _ in audit.query(directory, start, end, **kwargs))
+        elapsed = time.perf_counter() - t0
+        queries[label] = {"matches": hits, "seconds": round(elapsed, 2)}
+        print(f"  {label:<20} {hits:>7,} decisions in {elapsed:.2f}s")
+
+    print(f"\n== recognize_frame, audit off vs on ({args.requests} requests) ==")
+    import cv2
+    from fastapi.testclient import TestClient
+    from backends import render_synthetic_scene, synthetic_identity_embedding
+    import main as service
+
+    fs = service.face_system
+    fs._add_to_gallery(np.stack([synthetic_identity_embedding(i, fs.dimension) for i in range(200)]),
+                       [str(i) for i in range(200)], check_duplicates=False)
+    frames = []
+    for i in range(20):
+        faces = [(i * 8 + k, 60 + (k % 6) * 200, 120 + (k // 6) * 260, 110) for k in range(8)]
+        ok, buf = cv2.imencode('.jpg', render_synthetic_scene(1280, 720, faces, seed=i))
+        frames.append(buf.tobytes())
+    client = TestClient(service.app)
+    endpoint = {}
+    for label, enabled in (("off", False), ("on", True), ("off_again", False), ("on_again", True)):
+        fs.audit = service.audit_log if enabled else None
+        latencies = []
+        for n in range(args.requests):
+            t0 = time.perf_counter()
+            resp = client.post('/api/face/recognize_frame', files={'file': ('f.jpg', frames[n % len(frames)], 'image/jpeg')},
+                               headers={'X-Attendance-Session': '17'})
+            latencies.append((time.perf_counter() - t0) * 1000)
+            assert resp.status_code == 200, resp.text
+        endpoint[label] = {"p50_ms": _pct(latencies, 50), "p99_ms": _pct(latencies, 99)}
+        print(f"  audit {label:<10} p50 {endpoint[label]['p50_ms']} ms  p99 {endpoint[label]['p99_ms']} ms")
+    service.audit_log.flush()
+    recorded = sum(1 for _ in audit.query(service.audit_log.directory, time.time() - 3600, time.time() + 60, session=17))
+    endpoint["decisions_logged_for_session"] = recorded
+    print(f"  {recorded} decisions logged for session 17 (expected {2 * args.requests * 8})")
+
+    results = {"replay": replay, "queries": queries, "recognize_frame": endpoint}
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Camera clients at a fixed rate vs. following the capture hints (see capture.py).
+
+Simulates --clients classroom cameras posting frames to /api/face/recognize_frame
+for --seconds, against the in-process service with the synthetic backend and a
+simulated detector / ArcFace cost. In each classroom students walk in one by
+one (--arrival-s apart) and then sit still; the camera knows how many of them
+are not marked yet and sends it as X-Capture-Pending, as Django does.
+
+Two runs:
+    fixed     every client posts a full-resolution frame every --interval-ms,
+              whatever the answer (today's Attendance.jsx)
+    adaptive  clients wait max(--interval-ms, hint interval_ms), downscale to
+              max_side / jpeg_quality, and honour Retry-After on 503
+
+Reports frames sent / shed (503) / timed out, latency of answered frames,
+the deepest live queue seen, upload volume, and how long a student waited
+between walking in and being marked.
+
+Usage:
+    python bench_capture.py
+    python bench_capture.py --clients 20 --detect-ms 80 --seconds 40
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from typing import Dict, List
+
+import numpy as np
+import cv2
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 1) if values else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Adaptive capture benchmark")
+    parser.add_argument("--clients", type=int, default=12, help="Classroom cameras")
+    parser.add_argument("--students", type=int, default=8, help="Students per classroom")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--arrival-s", type=float, default=2.0, help="Gap between students walking in")
+    parser.add_argument("--interval-ms", type=int, default=400, help="Client scan interval (UI default)")
+    parser.add_argument("--detect-ms", type=float, default=60.0, help="Simulated detector cost per frame")
+    parser.add_argument("--embed-ms", type=float, default=3.0, help="Simulated ArcFace cost per face")
+    parser.add_argument("--timeout-s", type=float, default=10.0, help="Client request timeout (deadline)")
+    parser.add_argument("--out", default=os.path.join("bench_results", "capture.json"))
+    args = parser.parse_args(argv)
+
+    # Configure the in-process service before `main` is imported
+    os.environ['FACE_BACKEND'] = 'synthetic'
+    os.environ['SYNTHETIC_DETECT_MS'] = str(args.detect_ms)
+    os.environ['SYNTHETIC_EMBED_MS'] = str(args.embed_ms)
+    os.environ.setdefault('FACE_INDEX_PATH', tempfile.mkdtemp(prefix='bench_capture_'))
+
+    from fastapi.testclient import TestClient
+    from backends import render_synthetic_scene, synthetic_identity_embedding
+    import main as service
+
+    fs = service.face_system
+    ids = list(range(args.clients * args.students))
+    fs._add_to_gallery(np.stack([synthetic_identity_embedding(i, fs.dimension) for i in ids]),
+                       [str(i) for i in ids], check_duplicates=False)
+
+    def frame(client: int, present: int, seed: int, max_side: int, quality: int) -> bytes:
+        faces = [(client * args.students + k, 60 + (k % 6) * 200, 120 + (k // 6) * 260, 110)
+                 for k in range(present)]
+        img = render_synthetic_scene(1280, 720, faces, seed=seed)
+        if max_side < 1280:
+            scale = max_side / 1280.0
+            img = cv2.resize(img, (int(1280 * scale), int(720 * scale)), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        return buf.tobytes()
+
+    def run(adaptive: bool) -> Dict[str, object]:
+        stats = {"sent": 0, "answered": 0, "shed": 0, "timed_out": 0, "bytes": 0}
+        latencies: List[float] = []
+        mark_delays: List[float] = []
+        intervals: List[float] = []
+        reasons: Dict[str, int] = {}
+        lock = threading.Lock()
+        max_depth = [0]
+        start = time.monotonic()
+        stop = start + args.seconds
+
+        def camera(c: int) -> None:
+            client = TestClient(service.app)
+            marked = set()
+            hint = None
+            n = 0
+            while time.monotonic() < stop:
+                now = time.monotonic() - start
+                present = min(args.students, int(now / args.arrival_s) + 1)
+                max_side, quality = (hint["max_side"], hint["jpeg_quality"]) if adaptive and hint else (1280, 92)
+                body = frame(c, present, seed=c * 100_000 + n, max_side=max_side, quality=quality)
+                n += 1
+                headers = {"X-Capture-Client": f"session-{c}", "X-Capture-Pending": str(args.students - len(marked)),
+                           "X-Request-Deadline-Ms": str(int(args.timeout_s * 1000))}
+                t0 = time.monotonic()
+                resp = client.post('/api/face/recognize_frame', files={'file': ('f.jpg', body, 'image/jpeg')},
+                                   headers=headers)
+                elapsed = time.monotonic() - t0
+                wait_s = args.interval_ms / 1000.0
+                with lock:
+                    stats["sent"] += 1
+                    stats["bytes"] += len(body)
+                    if resp.status_code == 200 and elapsed <= args.timeout_s:
+                        stats["answered"] += 1
+                        latencies.append(elapsed * 1000)
+                    elif resp.status_code == 503:
+                        stats["shed"] += 1
+                    else:
+                        stats["timed_out"] += 1
+                if resp.status_code == 200 and elapsed <= args.timeout_s:
+                    data = resp.json()
+                    hint = data.get("capture")
+                    seen_at = time.monotonic() - start
+                    for f in data["faces"]:
+                        sid = f.get("student_id")
+                        if f.get("recognized") and sid not in marked:
+                            marked.add(sid)
+                            arrived = (int(sid) - c * args.students) * args.arrival_s
+                            with lock:
+                                mark_delays.append(seen_at - arrived)
+                    if adaptive and hint:
+                        wait_s = max(wait_s, hint["interval_ms"] / 1000.0)
+                        with lock:
+                            reasons[hint["reason"]] = reasons.get(hint["reason"], 0) + 1
+                elif resp.status_code == 503 and adaptive:
+                    wait_s = max(wait_s, float(resp.headers.get("Retry-After", 1)))
+                with lock:
+                    intervals.append(max(wait_s, elapsed) * 1000)
+                # The UI skips a tick while a frame is in flight: the next one leaves on the first tick after
+                remaining = wait_s - elapsed
+                if remaining > 0:
+                    time.sleep(min(remaining, max(0.0, stop - time.monotonic())))
+
+        def monitor() -> None:
+            while time.monotonic() < stop:
+                max_depth[0] = max(max_depth[0], len(service.scheduler.lanes['live'].queue))
+                time.sleep(0.02)
+
+        threads = [threading.Thread(target=camera, args=(c,)) for c in range(args.clients)]
+        threads.append(threading.Thread(target=monitor))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        expected = args.clients * min(args.students, int(args.seconds / args.arrival_s) + 1)
+        return {
+            **stats,
+            "upload_mib": round(stats["bytes"] / 2**20, 1),
+            "frames_per_s": round(stats["sent"] / args.seconds, 1),
+            "latency_p50_ms": _pct(latencies, 50),
+            "latency_p99_ms": _pct(latencies, 99),
+            "max_live_queue": max_depth[0],
+            "interval_p50_ms": _pct(intervals, 50),
+            "marked": len(mark_delays),
+            "expected_marks": expected,
+            "mark_delay_p50_s": _pct(mark_delays, 50),
+            "mark_delay_p90_s": _pct(mark_delays, 90),
+            "hint_reasons": reasons,
+        }
+
+    results: Dict[str, object] = {"clients": args.clients, "students": args.students, "seconds": args.seconds,
+                                  "detect_ms": args.detect_ms, "embed_ms": args.embed_ms,
+                                  "workers": service.scheduler.workers,
+                                  "capacity_fps": round(service.scheduler.workers * 1000.0 / args.detect_ms, 1)}
+    for label, adaptive in (("fixed", False), ("adaptive", True)):
+        print(f"\n== {label}: {args.clients} cameras, {args.seconds:.0f}s ==")
+        r = run(adaptive)
+        results[label] = r
+        print(f"  sent {r['sent']} ({r['frames_per_s']}/s)  answered {r['answered']}  shed {r['shed']}  "
+              f"timed out {r['timed_out']}  latency p50 {r['latency_p50_ms']} p99 {r['latency_p99_ms']} ms  "
+              f"max live queue {r['max_live_queue']}  upload {r['upload_mib']} MiB")
+        print(f"  marked {r['marked']}/{r['expected_marks']}  delay p50 {r['mark_delay_p50_s']}s "
+              f"p90 {r['mark_delay_p90_s']}s  interval p50 {r['interval_p50_ms']} ms  {r['hint_reasons']}")
+        time.sleep(1.0)  # let the queue drain between runs
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Concurrent search + registration stress test for the gallery (see GalleryLock).
+
+Seeds a synthetic gallery, then runs search threads alone and together with
+registration threads, checking every search result while rows are being added:
+- the queried student (registered before the query started) is the top match
+- each returned (row, student ID, similarity) is consistent: the similarity
+  equals the query's dot product with that student's embedding, so the index
+  row and the ID map row refer to the same face
+- after the run, index, ID map and raw vector store have the same row count
+and reports search / registration throughput and search latency for both phases.
+
+Usage:
+    python bench_concurrency.py                               # flat, 20k seed, 4 readers, 2 writers
+    python bench_concurrency.py --index-type hnsw --seconds 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from typing import Dict, List
+
+os.environ.setdefault('FACE_BACKEND', 'synthetic')
+
+import numpy as np
+
+from backends import synthetic_identity_embedding
+from face_recognition import FaceRecognitionSystem
+
+
+class Registry:
+    """Students whose registration has completed (safe to expect in search results)."""
+
+    def __init__(self, ids: List[int]):
+        self._lock = threading.Lock()
+        self.ids = list(ids)
+
+    def add(self, sid: int) -> None:
+        with self._lock:
+            self.ids.append(sid)
+
+    def sample(self, n: int) -> List[int]:
+        with self._lock:
+            count = len(self.ids)
+            return [self.ids[random.randrange(count)] for _ in range(n)]
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+def run_phase(fs: FaceRecognitionSystem, embeddings: np.ndarray, registry: Registry, next_id: List[int],
+              readers: int, writers: int, seconds: float, batch: int, exact: bool) -> Dict[str, object]:
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    counts = {"searches": 0, "queries": 0, "registrations": 0, "misses": 0, "inconsistent": 0, "errors": 0}
+    problems: List[str] = []
+
+    def count(key: str, n: int = 1, problem: str = "") -> None:
+        with lock:
+            counts[key] += n
+            if problem and len(problems) < 10:
+                problems.append(problem)
+
+    def reader(seed: int) -> None:
+        random.seed(seed)
+        while not stop.is_set():
+            sids = registry.sample(random.randint(1, batch))
+            queries = embeddings[sids]
+            t0 = time.perf_counter()
+            try:
+                sims, ids = fs.search_gallery(queries, k=3)
+            except Exception as e:
+                count("errors", problem=f"search: {e!r}")
+                continue
+            elapsed = (time.perf_counter() - t0) * 1000
+            for q, sid, row_sims, row_ids in zip(queries, sids, sims, ids):
+                if row_ids[0] != str(sid):
+                    count("misses", problem=f"query {sid}: top match {row_ids[0]}" if exact else "")
+                for sim, cid in zip(row_sims, row_ids):
+                    if cid is not None and abs(float(sim) - float(q @ embeddings[int(cid)])) > 1e-3:
+                        count("inconsistent", problem=f"query {sid}: row says {cid} at {sim:.4f}, "
+                                                       f"its embedding gives {float(q @ embeddings[int(cid)]):.4f}")
+            with lock:
+                latencies.append(elapsed)
+                counts["searches"] += 1
+                counts["queries"] += len(sids)
+
+    def writer() -> None:
+        while not stop.is_set():
+            with lock:
+                sid = next_id[0]
+                if sid >= len(embeddings):
+                    return
+                next_id[0] += 1
+            try:
+                fs._add_to_gallery(embeddings[sid:sid + 1], [str(sid)])
+            except Exception as e:
+                count("errors", problem=f"register {sid}: {e!r}")
+                continue
+            registry.add(sid)
+            count("registrations")
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "readers": readers,
+        "writers": writers,
+        "searches_per_s": round(counts["searches"] / elapsed, 1),
+        "queries_per_s": round(counts["queries"] / elapsed, 1),
+        "registrations_per_s": round(counts["registrations"] / elapsed, 1),
+        "search_p50_ms": _pct(latencies, 50),
+        "search_p99_ms": _pct(latencies, 99),
+        **counts,
+        "problems": problems,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent search + registration stress test")
+    parser.add_argument("--index-type", default="flat", choices=["flat", "hnsw"])
+    parser.add_argument("--seed-rows", type=int, default=20_000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch", type=int, default=8, help="Max queries per search call")
+    parser.add_argument("--max-new", type=int, default=20_000, help="Registrations available to the writers")
+    parser.add_argument("--out", default=os.path.join("bench_results", "concurrency.json"))
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_concurrency_")
+    fs = FaceRecognitionSystem(index_path=workdir, index_type=args.index_type, shards=None, read_only=False)
+    total = args.seed_rows + args.max_new
+    print(f"\n== Generating {total:,} synthetic identities ==")
+    embeddings = np.stack([synthetic_identity_embedding(i, fs.dimension) for i in range(total)])
+    for start in range(0, args.seed_rows, 10_000):
+        end = min(args.seed_rows, start + 10_000)
+        fs._add_to_gallery(embeddings[start:end], [str(i) for i in range(start, end)], check_duplicates=False)
+    registry = Registry(list(range(args.seed_rows)))
+    next_id = [args.seed_rows]
+    exact = args.index_type == 'flat'
+
+    results: Dict[str, object] = {"index_type": args.index_type, "seed_rows": args.seed_rows}
+    for name, writers in (("search_only", 0), ("search_and_register", args.writers)):
+        print(f"\n== {name}: {args.readers} search threads, {writers} registration threads, {args.seconds:.0f}s ==")
+        phase = run_phase(fs, embeddings, registry, next_id, args.readers, writers, args.seconds, args.batch, exact)
+        results[name] = phase
+        print(f"  searches {phase['searches_per_s']}/s ({phase['queries_per_s']} queries/s), "
+              f"p50 {phase['search_p50_ms']} ms, p99 {phase['search_p99_ms']} ms; "
+              f"registrations {phase['registrations_per_s']}/s")
+        print(f"  misses {phase['misses']}, inconsistent results {phase['inconsistent']}, errors {phase['errors']}")
+        for problem in phase["problems"]:
+            print(f"  ⚠️  {problem}")
+
+    rows = {"index": int(fs.index.ntotal), "id_map": len(fs.student_ids), "vectors": len(fs.load_vectors()),
+            "registered": len(registry.ids)}
+    results["final_rows"] = rows
+    aligned = len(set(rows.values())) == 1
+    print(f"\n  final rows: {rows} -> {'aligned' if aligned else 'MISALIGNED'}")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+    phases = [results["search_only"], results["search_and_register"]]
+    failed = any(p["inconsistent"] or p["errors"] or (exact and p["misses"]) for p in phases)
+    return 1 if failed or not aligned else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
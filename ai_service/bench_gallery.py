@@ -0,0 +1,224 @@
+"""Gallery scaling benchmark across index types and gallery sizes.
+
+For each gallery size and each index configuration supported by
+`FaceRecognitionSystem` (see `face_recognition.INDEX_TYPES`) this measures:
+- build time and index memory (RSS delta during build)
+- on-disk size and load time
+- single-query and batched-query latency
+- recall@1 against exact (Flat inner product) search, and identity accuracy
+
+Galleries are synthetic L2-normalized 512-d vectors with realistic structure:
+identities are drawn around a handful of "population" centres (so impostor
+similarities are not all ~0), each gallery vector is the mean of a few noisy
+enrollment samples of its identity, and queries are fresh noisy samples.
+
+Usage:
+    python bench_gallery.py                                   # 1k, 10k, 100k, 1M
+    python bench_gallery.py --sizes 1000,10000 --out bench_results/gallery.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+import faiss
+
+from face_recognition import INDEX_TYPES, build_index, ivf_nlist_for
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (Linux /proc, fallback to ru_maxrss)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-10
+    return x
+
+
+class SyntheticGallery:
+    """Reproducible clustered face-embedding distribution."""
+
+    def __init__(self, dimension: int = 512, populations: int = 16, population_weight: float = 0.35,
+                 sample_noise: float = 0.7, enroll_samples: int = 5, seed: int = 0):
+        """
+        Args:
+            populations: Number of coarse clusters identities are drawn around
+            population_weight: Pull of identity centres towards their population centre
+                (0.35 gives same-population impostor similarities around 0.17)
+            sample_noise: Relative norm of per-sample noise (0.7 -> genuine similarity ~0.78)
+            enroll_samples: Samples averaged into each gallery vector (multi-frame enrollment)
+        """
+        self.dimension = dimension
+        self.populations = populations
+        self.population_weight = population_weight
+        self.sample_noise = sample_noise
+        self.enroll_samples = enroll_samples
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.population_centres = _normalize(rng.standard_normal((populations, dimension)).astype(np.float32))
+
+    def identity_centres(self, ids: np.ndarray) -> np.ndarray:
+        out = np.empty((len(ids), self.dimension), dtype=np.float32)
+        for row, identity in enumerate(ids):
+            rng = np.random.default_rng((self.seed, int(identity)))
+            pop = self.population_centres[int(identity) % self.populations]
+            own = rng.standard_normal(self.dimension).astype(np.float32)
+            own /= np.linalg.norm(own)
+            out[row] = self.population_weight * pop + (1.0 - self.population_weight) * own
+        return _normalize(out)
+
+    def _samples(self, centres: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        noise = rng.standard_normal(centres.shape).astype(np.float32)
+        noise /= np.linalg.norm(noise, axis=1, keepdims=True)
+        return _normalize(centres + self.sample_noise * noise)
+
+    def gallery(self, n: int, chunk: int = 50_000) -> np.ndarray:
+        """Gallery vectors for identities 0..n-1 (generated in chunks to bound peak memory)."""
+        out = np.empty((n, self.dimension), dtype=np.float32)
+        for start in range(0, n, chunk):
+            ids = np.arange(start, min(n, start + chunk))
+            centres = self.identity_centres(ids)
+            rng = np.random.default_rng((self.seed, 1, start))
+            acc = np.zeros_like(centres)
+            for _ in range(self.enroll_samples):
+                acc += self._samples(centres, rng)
+            out[start:start + len(ids)] = _normalize(acc)
+        return out
+
+    def queries(self, n_gallery: int, n_queries: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Fresh probe samples of random enrolled identities -> (vectors, true identity)."""
+        rng = np.random.default_rng((self.seed, 2, n_gallery))
+        ids = rng.integers(0, n_gallery, size=n_queries)
+        return self._samples(self.identity_centres(ids), rng), ids
+
+
+def _latencies(index: faiss.Index, queries: np.ndarray, batch: int) -> Dict[str, float]:
+    times = []
+    for start in range(0, len(queries), batch):
+        q = queries[start:start + batch]
+        t0 = time.perf_counter()
+        index.search(q, 1)
+        times.append((time.perf_counter() - t0) * 1000 / len(q))
+    arr = np.asarray(times)
+    return {
+        "batch_size": batch,
+        "per_query_ms_p50": round(float(np.percentile(arr, 50)), 4),
+        "per_query_ms_p99": round(float(np.percentile(arr, 99)), 4),
+        "qps": round(1000.0 / float(arr.mean()), 1) if arr.mean() > 0 else 0.0,
+    }
+
+
+def bench_config(index_type: str, gallery: np.ndarray, queries: np.ndarray, query_ids: np.ndarray,
+                 exact_top1: np.ndarray, batch: int, workdir: str) -> Dict[str, object]:
+    d = gallery.shape[1]
+    rss_before = _rss_bytes()
+    t0 = time.perf_counter()
+    index = build_index(index_type, d, nlist=ivf_nlist_for(len(gallery)))
+    if not index.is_trained:
+        index.train(gallery)
+    index.add(gallery)
+    build_s = time.perf_counter() - t0
+    memory_bytes = max(0, _rss_bytes() - rss_before)
+
+    path = os.path.join(workdir, f"{index_type}_{len(gallery)}.faiss")
+    faiss.write_index(index, path)
+    disk_bytes = os.path.getsize(path)
+    del index
+
+    t0 = time.perf_counter()
+    index = faiss.read_index(path)
+    load_s = time.perf_counter() - t0
+    os.remove(path)
+
+    single = _latencies(index, queries[:min(len(queries), 500)], 1)
+    batched = _latencies(index, queries, batch)
+
+    _, top1 = index.search(queries, 1)
+    recall = float(np.mean(top1[:, 0] == exact_top1))
+    accuracy = float(np.mean(top1[:, 0] == query_ids))
+    del index
+
+    return {
+        "index_type": index_type,
+        "gallery_size": len(gallery),
+        "build_s": round(build_s, 3),
+        "memory_bytes": int(memory_bytes),
+        "disk_bytes": int(disk_bytes),
+        "load_s": round(load_s, 4),
+        "single_query": single,
+        "batched_query": batched,
+        "recall_at_1": round(recall, 4),
+        "identity_accuracy": round(accuracy, 4),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gallery scaling benchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=64, help="Batch size for batched-query latency")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 = default)")
+    parser.add_argument("--out", default=os.path.join("bench_results", "gallery_scaling.json"))
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    index_types = [t for t in args.index_types.split(",") if t]
+    synth = SyntheticGallery(dimension=args.dimension)
+    results: List[Dict[str, object]] = []
+
+    with tempfile.TemporaryDirectory(prefix="bench_gallery_") as workdir:
+        for n in sizes:
+            print(f"\n== Gallery size {n:,} ==")
+            t0 = time.perf_counter()
+            gallery = synth.gallery(n)
+            queries, query_ids = synth.queries(n, args.queries)
+            print(f"  generated in {time.perf_counter() - t0:.1f}s")
+
+            exact = faiss.IndexFlatIP(args.dimension)
+            exact.add(gallery)
+            _, exact_top1 = exact.search(queries, 1)
+            exact_top1 = exact_top1[:, 0]
+            del exact
+
+            for index_type in index_types:
+                res = bench_config(index_type, gallery, queries, query_ids, exact_top1, args.batch, workdir)
+                results.append(res)
+                print(f"  {index_type:<6} build {res['build_s']:>8.2f}s  mem {res['memory_bytes'] / 2**20:>8.1f}MB  "
+                      f"disk {res['disk_bytes'] / 2**20:>8.1f}MB  load {res['load_s']:>7.3f}s  "
+                      f"1q p50 {res['single_query']['per_query_ms_p50']:>7.3f}ms  "
+                      f"batch {res['batched_query']['qps']:>9.0f} q/s  recall@1 {res['recall_at_1']:.4f}")
+            del gallery
+
+    report = {
+        "benchmark": "gallery_scaling",
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "dimension": args.dimension,
+        "queries": args.queries,
+        "faiss_version": getattr(faiss, '__version__', 'unknown'),
+        "threads": faiss.omp_get_max_threads(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
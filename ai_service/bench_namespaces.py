@@ -0,0 +1,129 @@
+"""Many tenant galleries in one process: memory bound and lazy-load cost (see namespaces.py).
+
+Creates --tenants namespace galleries of --rows synthetic faces each, then
+replays a skewed (Zipf) stream of searches across tenants twice: with no
+budget (every tenant stays loaded) and with --budget. Reports anonymous RSS,
+loads / evictions, and search latency for requests that hit a loaded
+namespace vs. those that had to load it first.
+
+Usage:
+    python bench_namespaces.py                        # 12 tenants x 20k faces, 200MB budget
+    python bench_namespaces.py --tenants 30 --rows 50000 --budget 1GB
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+
+os.environ.setdefault('FACE_BACKEND', 'synthetic')
+
+import numpy as np
+
+from backends import synthetic_identity_embedding
+from face_recognition import FaceRecognitionSystem
+from memory import anon_rss_bytes, parse_size, release_free_memory
+from namespaces import GalleryNamespaces
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 2) if values else 0.0
+
+
+def replay(namespaces: GalleryNamespaces, tenants: List[str], queries: np.ndarray, stream: List[int]) -> Dict[str, object]:
+    hit_ms, load_ms = [], []
+    peak = anon_rss_bytes()
+    for n, t in enumerate(stream):
+        name = tenants[t]
+        loads = namespaces.loads
+        start = time.perf_counter()
+        system = namespaces.acquire(name)
+        try:
+            system.search_gallery(queries[n % len(queries)][None, :], k=1)
+        finally:
+            namespaces.release(name)
+        elapsed = (time.perf_counter() - start) * 1000
+        (load_ms if namespaces.loads > loads else hit_ms).append(elapsed)
+        if n % 50 == 0:
+            peak = max(peak, anon_rss_bytes())
+    status = namespaces.status()
+    return {
+        "requests": len(stream),
+        "loads": len(load_ms),
+        "evictions": status["evictions"],
+        "loaded_at_end": sum(1 for ns in status["namespaces"] if ns["loaded"]),
+        "loaded_mib_at_end": round(status["loaded_bytes"] / 2**20, 1),
+        "peak_anon_rss_mib": round(peak / 2**20, 1),
+        "hit_p50_ms": _pct(hit_ms, 50),
+        "hit_p99_ms": _pct(hit_ms, 99),
+        "load_p50_ms": _pct(load_ms, 50),
+        "load_p99_ms": _pct(load_ms, 99),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gallery namespace memory / lazy-load benchmark")
+    parser.add_argument("--tenants", type=int, default=12)
+    parser.add_argument("--rows", type=int, default=20_000, help="Faces per tenant")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--zipf", type=float, default=1.2, help="Tenant popularity skew")
+    parser.add_argument("--budget", default="200MB")
+    parser.add_argument("--index-type", default="flat", choices=["flat", "hnsw"])
+    parser.add_argument("--out", default=os.path.join("bench_results", "namespaces.json"))
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_namespaces_")
+    try:
+        default = FaceRecognitionSystem(index_path=os.path.join(workdir, "default"), index_type=args.index_type,
+                                        shards=None, read_only=False)
+        tenants = [f"college{i:02d}" for i in range(args.tenants)]
+        print(f"\n== Building {args.tenants} namespaces x {args.rows:,} faces ==")
+        builder = GalleryNamespaces(default, os.path.join(workdir, "ns"), index_type=args.index_type)
+        base = np.stack([synthetic_identity_embedding(i, default.dimension) for i in range(args.rows)])
+        for t, name in enumerate(tenants):
+            system = builder.acquire(name, create=True)
+            # Distinct galleries per tenant: rotate the shared identity set
+            rows = np.roll(base, t * 97, axis=0)
+            for start in range(0, args.rows, 10_000):
+                system._add_to_gallery(rows[start:start + 10_000],
+                                       [f"{name}-{i}" for i in range(start, min(args.rows, start + 10_000))],
+                                       check_duplicates=False)
+            builder.release(name)
+            builder.evict_idle()
+        del builder, system, rows
+        release_free_memory()
+
+        rng = np.random.default_rng(0)
+        weights = 1.0 / np.arange(1, args.tenants + 1) ** args.zipf
+        stream = list(rng.choice(args.tenants, size=args.requests, p=weights / weights.sum()))
+        queries = base[rng.integers(0, args.rows, size=256)]
+
+        results: Dict[str, object] = {"tenants": args.tenants, "rows": args.rows, "index_type": args.index_type,
+                                      "baseline_anon_rss_mib": round(anon_rss_bytes() / 2**20, 1)}
+        for label, budget in (("unbounded", 0), (f"budget_{args.budget}", parse_size(args.budget))):
+            namespaces = GalleryNamespaces(default, os.path.join(workdir, "ns"), budget_bytes=budget,
+                                           index_type=args.index_type)
+            phase = replay(namespaces, tenants, queries, stream)
+            results[label] = phase
+            print(f"  {label:16s} loads {phase['loads']:4d}  evictions {phase['evictions']:4d}  "
+                  f"loaded at end {phase['loaded_at_end']:3d} ({phase['loaded_mib_at_end']} MiB)  "
+                  f"peak anon RSS {phase['peak_anon_rss_mib']} MiB  hit p50 {phase['hit_p50_ms']} ms  "
+                  f"load p50 {phase['load_p50_ms']} ms")
+            namespaces.evict_idle()
+            del namespaces
+            release_free_memory()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Registration latency with and without the frame pre-screen (FACE_PRESCREEN_KEEP).
+
+Each synthetic student sends a burst like the attendance UI does: a few sharp
+frames with small head movement, exact repeats of them (a camera that did not
+move between grabs), motion-blurred frames and under-exposed frames. Every
+burst is registered twice on separate galleries - once processing all frames,
+once with the pre-screen - and the bench reports per-registration latency,
+frames that went through detection + ArcFace, and whether both runs made the
+same accept / reject decision with the same best quality score.
+
+Use --detect-ms / --embed-ms to model detector and ArcFace cost; by default
+they approximate SCRFD-2.5G + ArcFace R50 on a laptop CPU.
+
+Usage:
+    python bench_prescreen.py
+    python bench_prescreen.py --students 40 --keep 6 --out bench_results/prescreen.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+import cv2
+
+import face_recognition
+from backends import SyntheticBackend, render_synthetic_scene, synthetic_identity_embedding
+from face_recognition import FaceRecognitionSystem
+
+
+def make_burst(identity: int, out_dir: str, sharp: int, repeats: int, blurred: int, dark: int) -> List[str]:
+    """Write one registration burst as JPEGs (shuffled, as frames arrive in capture order)."""
+    rng = np.random.default_rng(identity)
+    frames = []
+    for k in range(sharp):
+        dx, dy = rng.integers(-12, 13, size=2)
+        frames.append(render_synthetic_scene(640, 480, [(identity, 220 + dx, 140 + dy, 200)], seed=identity * 31 + k))
+    frames += [frames[k % sharp].copy() for k in range(repeats)]
+    for k in range(blurred):
+        frames.append(cv2.GaussianBlur(frames[k % sharp], (0, 0), sigmaX=3.0))
+    for k in range(dark):
+        frames.append((frames[k % sharp] * 0.45).astype(np.uint8))
+    order = rng.permutation(len(frames))
+    paths = []
+    for n, i in enumerate(order):
+        path = os.path.join(out_dir, f"{identity}_{n}.jpg")
+        cv2.imwrite(path, frames[i], [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths.append(path)
+    return paths
+
+
+class CountingBackend(SyntheticBackend):
+    """Synthetic backend that counts detector passes."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.detections = 0
+
+    def detect(self, img):
+        self.detections += 1
+        return super().detect(img)
+
+
+def run(bursts: Dict[int, List[str]], keep: int, detect_ms: float, embed_ms: float) -> Dict[str, object]:
+    face_recognition.PRESCREEN_KEEP = keep
+    backend = CountingBackend(detect_ms=detect_ms, embed_ms=embed_ms)
+    system = FaceRecognitionSystem(index_path=tempfile.mkdtemp(prefix="bench_prescreen_"), use_hnsw=False,
+                                   backend=backend)
+    latencies, outcomes = [], {}
+    for identity, paths in bursts.items():
+        start = time.perf_counter()
+        try:
+            system.register_face_multi(paths, str(identity))
+            outcomes[identity] = system.metadata[str(identity)]['quality_best']
+        except Exception as e:
+            outcomes[identity] = f"rejected: {str(e)[:60]}"
+        latencies.append((time.perf_counter() - start) * 1000)
+    rows = {sid: row for row, sid in enumerate(system.student_ids)}
+    vectors = system.load_vectors()
+    accuracy = [float(vectors[rows[str(i)]] @ synthetic_identity_embedding(i, system.dimension))
+                for i in bursts if str(i) in rows]
+    return {
+        "keep": keep,
+        "registration_p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "registration_mean_ms": round(float(np.mean(latencies)), 1),
+        "detector_passes_per_registration": round(backend.detections / len(bursts), 2),
+        "accepted": sum(1 for v in outcomes.values() if not isinstance(v, str)),
+        "mean_cosine_to_identity": round(float(np.mean(accuracy)), 4) if accuracy else None,
+        "outcomes": outcomes,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Registration pre-screen benchmark")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--sharp", type=int, default=5, help="Distinct sharp frames per burst")
+    parser.add_argument("--repeats", type=int, default=4, help="Exact repeats of sharp frames")
+    parser.add_argument("--blurred", type=int, default=4)
+    parser.add_argument("--dark", type=int, default=2)
+    parser.add_argument("--keep", type=int, default=face_recognition.PRESCREEN_KEEP)
+    parser.add_argument("--detect-ms", type=float, default=30.0, help="Simulated detector cost per frame")
+    parser.add_argument("--embed-ms", type=float, default=15.0, help="Simulated ArcFace cost per face")
+    parser.add_argument("--out", default=os.path.join("bench_results", "prescreen.json"))
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bursts = {i: make_burst(i, tmp, args.sharp, args.repeats, args.blurred, args.dark)
+                  for i in range(args.students)}
+        frames = len(next(iter(bursts.values())))
+        print(f"\n== {args.students} registrations x {frames} frames "
+              f"(detect {args.detect_ms} ms, embed {args.embed_ms} ms) ==")
+        baseline = run(bursts, 0, args.detect_ms, args.embed_ms)
+        screened = run(bursts, args.keep, args.detect_ms, args.embed_ms)
+
+    same = sum(1 for i in bursts if baseline["outcomes"][i] == screened["outcomes"][i])
+    for result in (baseline, screened):
+        label = "all frames" if not result["keep"] else f"pre-screen keep={result['keep']}"
+        print(f"  {label:22s} p50 {result['registration_p50_ms']:7.1f} ms  mean {result['registration_mean_ms']:7.1f} ms  "
+              f"detector passes {result['detector_passes_per_registration']:5.2f}  "
+              f"accepted {result['accepted']}/{args.students}  cosine to identity {result['mean_cosine_to_identity']}")
+    print(f"  same decision and best quality: {same}/{args.students}")
+
+    results = {"students": args.students, "frames_per_burst": frames, "detect_ms": args.detect_ms,
+               "embed_ms": args.embed_ms, "all_frames": baseline, "prescreen": screened,
+               "same_outcome": same,
+               "speedup": round(baseline["registration_mean_ms"] / screened["registration_mean_ms"], 2)}
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\n✓ Results written to {args.out}")
+    return 0 if same == args.students else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""End-to-end benchmark of the AI service HTTP endpoints.
+
+Runs the real FastAPI app (I/O, batching, FAISS search, voting, persistence,
+HTTP handling) against the deterministic synthetic backend, so it needs no
+model downloads and is reproducible on isolated build boxes.
+
+Usage:
+    python bench_service.py                        # in-process, synthetic backend
+    python bench_service.py --students 500 --concurrency 4 --out bench_results/service.json
+    python bench_service.py --url http://localhost:8001   # against a running service
+
+Reports throughput and latency percentiles (p50/p90/p99) per endpoint.
+"""
+import os
+import io
+import sys
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+import cv2
+
+
+def _jpeg(img: np.ndarray, quality: int = 90) -> bytes:
+    ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise Exception("JPEG encode failed")
+    return buf.tobytes()
+
+
+def _percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "mean": 0.0}
+    arr = np.asarray(samples_ms)
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 2),
+        "p90": round(float(np.percentile(arr, 90)), 2),
+        "p99": round(float(np.percentile(arr, 99)), 2),
+        "mean": round(float(arr.mean()), 2),
+    }
+
+
+class _Client:
+    """Thread-local HTTP client: in-process TestClient or `requests` against --url."""
+
+    def __init__(self, url: str = None):
+        self.url = url.rstrip('/') if url else None
+        self._local = threading.local()
+        self._app = None
+        if not self.url:
+            import main  # loads the face system once, before worker threads start
+            self._app = main.app
+
+    def _get(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            if self.url:
+                import requests
+                client = requests.Session()
+            else:
+                from fastapi.testclient import TestClient
+                client = TestClient(self._app)
+            self._local.client = client
+        return client
+
+    def post(self, path: str, **kwargs):
+        return self._get().post((self.url or '') + path, **kwargs)
+
+    def get(self, path: str, **kwargs):
+        return self._get().get((self.url or '') + path, **kwargs)
+
+
+def _run(name: str, fn: Callable[[int], None], n: int, concurrency: int) -> Dict[str, object]:
+    """Call fn(i) for i in range(n) with `concurrency` threads; time each call."""
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            with lock:
+                errors[0] += 1
+            if errors[0] <= 3:
+                print(f"  ⚠️  {name}[{i}]: {e}")
+            return
+        dt = (time.perf_counter() - t0) * 1000
+        with lock:
+            latencies.append(dt)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    wall = time.perf_counter() - start
+
+    result = {
+        "endpoint": name,
+        "requests": n,
+        "errors": errors[0],
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": _percentiles(latencies),
+    }
+    lat = result["latency_ms"]
+    print(f"  {name:<28} {result['throughput_rps']:>8.1f} req/s   "
+          f"p50 {lat['p50']:>8.1f}  p90 {lat['p90']:>8.1f}  p99 {lat['p99']:>8.1f} ms   errors {errors[0]}")
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AI service end-to-end benchmark")
+    parser.add_argument("--url", help="Benchmark a running service instead of in-process")
+    parser.add_argument("--students", type=int, default=200, help="Synthetic students to register")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per recognition endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--faces-per-frame", type=int, default=12)
+    parser.add_argument("--batch-images", type=int, default=20)
+    parser.add_argument("--detect-ms", type=float, default=0.0, help="Simulated detector cost (synthetic)")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Simulated per-face embed cost (synthetic)")
+    parser.add_argument("--out", help="Write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if not args.url:
+        # Configure the in-process service before `main` is imported
+        os.environ['FACE_BACKEND'] = 'synthetic'
+        os.environ['SYNTHETIC_DETECT_MS'] = str(args.detect_ms)
+        os.environ['SYNTHETIC_EMBED_MS'] = str(args.embed_ms)
+        os.environ.setdefault('FACE_INDEX_PATH', tempfile.mkdtemp(prefix='bench_index_'))
+
+    from backends import render_synthetic_scene, SYNTHETIC_MAX_IDENTITIES
+
+    n_students = min(args.students, SYNTHETIC_MAX_IDENTITIES)
+    client = _Client(args.url)
+    rng = np.random.default_rng(0)
+
+    def portrait(identity: int, seed: int) -> bytes:
+        jitter = int(rng.integers(-10, 11)) if seed else 0
+        return _jpeg(render_synthetic_scene(320, 320, [(identity, 60 + jitter, 60, 200)], seed=seed))
+
+    def scene(seed: int) -> bytes:
+        r = np.random.default_rng(seed)
+        ids = r.choice(n_students, size=min(args.faces_per_frame, n_students), replace=False)
+        faces, cols = [], 6
+        for j, identity in enumerate(ids):
+            faces.append((int(identity), 40 + (j % cols) * 200, 40 + (j // cols) * 220, int(r.integers(60, 120))))
+        return _jpeg(render_synthetic_scene(1280, 720, faces, seed=seed))
+
+    print(f"Preparing payloads ({n_students} students)...")
+    reg_frames = [[portrait(i, i * 10 + k + 1) for k in range(5)] for i in range(n_students)]
+    probe_frames = [portrait(i % n_students, 10_000 + i) for i in range(args.requests)]
+    scenes = [scene(20_000 + i) for i in range(args.requests)]
+
+    def check(resp) -> dict:
+        if resp.status_code != 200:
+            raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        return resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {}
+
+    def register(i: int) -> None:
+        files = [('files', (f'f{k}.jpg', b, 'image/jpeg')) for k, b in enumerate(reg_frames[i])]
+        check(client.post('/api/face/register_multi', files=files, data={'student_id': str(i)}))
+
+    def recognize(i: int) -> None:
+        check(client.post('/api/face/recognize', files={'file': ('p.jpg', probe_frames[i], 'image/jpeg')}))
+
+    def recognize_multi(i: int) -> None:
+        # Same identity across all frames, as from one camera burst
+        frames = [reg_frames[i % n_students][k] for k in range(3)]
+        files = [('files', (f'f{k}.jpg', b, 'image/jpeg')) for k, b in enumerate(frames)]
+        check(client.post('/api/face/recognize_multi', files=files))
+
+    def recognize_frame(i: int) -> None:
+        check(client.post('/api/face/recognize_frame', files={'file': ('s.jpg', scenes[i], 'image/jpeg')}))
+
+    def recognize_batch(i: int) -> None:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+            for k in range(args.batch_images):
+                zf.writestr(f'photo_{k:03d}.jpg', scenes[(i + k) % len(scenes)])
+        resp = client.post('/api/face/recognize_batch', files={'archive': ('b.zip', buf.getvalue(), 'application/zip')})
+        check(resp)
+        lines = [ln for ln in resp.text.splitlines() if ln]
+        if not lines or not json.loads(lines[-1]).get('summary'):
+            raise Exception("Batch stream ended without summary line")
+
+    def stats(i: int) -> None:
+        check(client.get('/api/face/stats'))
+
+    print("\nEndpoint                        throughput     latency")
+    results = [
+        _run('register_multi', register, n_students, args.concurrency),
+        _run('recognize', recognize, args.requests, args.concurrency),
+        _run('recognize_multi', recognize_multi, args.requests, args.concurrency),
+        _run('recognize_frame', recognize_frame, args.requests, args.concurrency),
+        _run(f'recognize_batch[{args.batch_images}]', recognize_batch, max(1, args.requests // 20), args.concurrency),
+        _run('stats', stats, args.requests, args.concurrency),
+    ]
+
+    report = {
+        "target": args.url or "in-process (synthetic backend)",
+        "students": n_students,
+        "faces_per_frame": args.faces_per_frame,
+        "simulated_cost_ms": {"detect": args.detect_ms, "embed_per_face": args.embed_ms},
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "results": results,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
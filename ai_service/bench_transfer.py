@@ -0,0 +1,185 @@
+"""Gallery export/import throughput benchmark (see gallery_transfer.py).
+
+Builds a synthetic gallery of --rows vectors by importing a generated stream,
+then measures:
+- export to a file, float32 and float16 (rows/s, MB/s, file size)
+- import of the float32 file into a fresh gallery, verified row for row
+- interrupted float16 import (killed at --interrupt-at of the file), reopened
+  and resumed from the target's row count; cosine error of the fp16 round trip
+- peak anonymous RSS per phase: streaming holds one chunk; imports also
+  include the index built at the end (rows x dim x 4 bytes for Flat)
+
+Usage:
+    python bench_transfer.py                       # 1M x 512-d
+    python bench_transfer.py --rows 100000 --out bench_results/transfer.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from typing import Dict, Iterator
+
+os.environ.setdefault('FACE_BACKEND', 'synthetic')
+
+import numpy as np
+
+from face_recognition import FaceRecognitionSystem
+from gallery_transfer import (GalleryImporter, encode_header, encode_chunk, export_stream, iter_file_from,
+                              import_file, TRAILER)
+
+
+def _anon_rss_bytes() -> int:
+    """Anonymous RSS: excludes page cache mapped from the memory-mapped vector store."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RssPeak:
+    """Sample anonymous RSS on a background thread while a phase runs."""
+
+    def __enter__(self):
+        self.start = _anon_rss_bytes()
+        self.peak = self.start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(0.05):
+            self.peak = max(self.peak, _anon_rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def synthetic_stream(rows: int, dim: int, model: str, chunk_rows: int) -> Iterator[bytes]:
+    rng = np.random.default_rng(0)
+    yield encode_header('f32', dim, rows, 0, model)
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [str(100_000 + start + i) for i in range(n)]
+        meta = {sid: {"registration_date": "2025-01-01T00:00:00", "quality_avg": 0.8, "model_version": model}
+                for sid in ids}
+        yield encode_chunk(start, ids, vectors, [1.7e9 + start + i for i in range(n)], meta)
+    yield TRAILER.pack(b'FEND', rows)
+
+
+def _system(path: str) -> FaceRecognitionSystem:
+    return FaceRecognitionSystem(index_path=path, index_type='flat', shards=None, read_only=False)
+
+
+def _rate(rows: int, nbytes: int, seconds: float) -> Dict[str, float]:
+    return {"seconds": round(seconds, 2), "rows_per_s": round(rows / seconds), "mb_per_s": round(nbytes / 1e6 / seconds, 1)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gallery export/import throughput benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=8192)
+    parser.add_argument("--interrupt-at", type=float, default=0.4, help="Fraction of the fp16 file fed before the simulated crash")
+    parser.add_argument("--workdir", help="Scratch directory (default: temp dir; needs ~5 GB per 1M rows)")
+    parser.add_argument("--out", default=os.path.join("bench_results", "transfer.json"))
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_transfer_")
+    results: Dict[str, object] = {"rows": args.rows, "chunk_rows": args.chunk_rows}
+
+    # -- Seed gallery A from a generated stream (also measures streaming import)
+    a = _system(os.path.join(workdir, "a"))
+    print(f"\n== Seeding {args.rows:,} rows ==")
+    importer = GalleryImporter(a)
+    nbytes = 0
+    t0 = time.perf_counter()
+    with RssPeak() as rss:
+        for data in synthetic_stream(args.rows, a.dimension, a.backend.name, args.chunk_rows):
+            nbytes += len(data)
+            importer.feed(data)
+    results["seed_import"] = {**_rate(args.rows, nbytes, time.perf_counter() - t0),
+                              "rss_peak_delta_mb": round((rss.peak - rss.start) / 1e6)}
+    print(f"  import (generated stream, incl. index build): {results['seed_import']}")
+
+    # -- Export to files
+    files = {}
+    for dtype in ('f32', 'f16'):
+        path = os.path.join(workdir, f"gallery_{dtype}.fgal")
+        t0 = time.perf_counter()
+        with RssPeak() as rss, open(path, "wb") as out:
+            for data in export_stream(a, dtype=dtype, chunk_rows=args.chunk_rows):
+                out.write(data)
+        size = os.path.getsize(path)
+        results[f"export_{dtype}"] = {**_rate(args.rows, size, time.perf_counter() - t0),
+                                      "file_mb": round(size / 1e6), "rss_peak_delta_mb": round((rss.peak - rss.start) / 1e6)}
+        files[dtype] = path
+        print(f"  export {dtype}: {results[f'export_{dtype}']}")
+    source_vectors_path = a._vectors_file()
+    source_ids = a.student_ids.codes().copy()
+    a.close_stores()
+    del a, importer
+
+    # -- Import f32 into B, verify exactly
+    b = _system(os.path.join(workdir, "b"))
+    t0 = time.perf_counter()
+    with RssPeak() as rss, open(files['f32'], "rb") as f:
+        report = import_file(b, f)
+    results["import_f32"] = {**_rate(args.rows, os.path.getsize(files['f32']), time.perf_counter() - t0),
+                             "rss_peak_delta_mb": round((rss.peak - rss.start) / 1e6)}
+    src = np.memmap(source_vectors_path, dtype=np.float32, mode='r').reshape(-1, b.dimension)
+    dst = b.load_vectors()
+    identical = bool(np.array_equal(source_ids, b.student_ids.codes()) and
+                     all(np.array_equal(src[i:i + 65536], dst[i:i + 65536]) for i in range(0, len(src), 65536)))
+    results["import_f32"]["identical"] = identical
+    print(f"  import f32 (incl. index build): {results['import_f32']}  [{report['rows']} rows]")
+    b.close_stores()
+    del b, dst
+
+    # -- Interrupted fp16 import into C, then resume
+    c_path = os.path.join(workdir, "c")
+    c = _system(c_path)
+    size = os.path.getsize(files['f16'])
+    cut = int(size * args.interrupt_at)
+    importer = GalleryImporter(c)
+    t0 = time.perf_counter()
+    with open(files['f16'], "rb") as f:
+        importer.feed(f.read(cut))
+    partial_rows = len(c.student_ids)
+    c.close_stores()
+    del c, importer
+    c = _system(c_path)  # "restart": partial rows kept, torn chunk dropped
+    resumed_at = len(c.student_ids)
+    importer = GalleryImporter(c)
+    with open(files['f16'], "rb") as f:
+        for data in iter_file_from(f, resumed_at):
+            importer.feed(data)
+    elapsed = time.perf_counter() - t0
+    dst = c.load_vectors()
+    cos_error = max(float(np.max(1.0 - np.sum(src[i:i + 65536] * dst[i:i + 65536], axis=1)))
+                    for i in range(0, len(src), 65536))
+    results["import_f16_resumed"] = {
+        **_rate(args.rows, size, elapsed),
+        "interrupted_at_row": partial_rows,
+        "resumed_at_row": resumed_at,
+        "finished": importer.finished,
+        "rows": len(c.student_ids),
+        "max_cosine_error_vs_f32": float(f"{cos_error:.2e}"),
+    }
+    print(f"  import f16, interrupted + resumed: {results['import_f16_resumed']}")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.out} (scratch data in {workdir})")
+    return 0 if identical and importer.finished else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Capture hints: how often, and how large, camera clients should send frames.
+
+Live recognition responses carry
+    "capture": {"interval_ms": 800, "max_side": 960, "jpeg_quality": 85, "reason": "busy"}
+and a client that follows them (wait interval_ms between frames, downscale so
+the long side is at most max_side, encode at jpeg_quality) keeps the service
+out of overload without anyone tuning a scan speed.
+
+The interval is the largest of:
+- the configured minimum (CAPTURE_MIN_INTERVAL_MS);
+- what keeps the live lane at CAPTURE_TARGET_UTIL of the inference workers,
+  given its recent service time and the number of camera clients active in
+  the last few seconds, plus the time to drain live requests already queued;
+- 1.5x the recent per-frame latency, so frames are not sent faster than
+  answers come back;
+- a slower rate once a client's scene is stable: the same recognized
+  students and face count for several frames (backs off exponentially up to
+  CAPTURE_STABLE_INTERVAL_MS, resets on any change);
+- CAPTURE_MAX_INTERVAL_MS when the caller reports that every student of the
+  session is already marked (X-Capture-Pending: 0).
+
+The service is busy when the active clients could not all send at the
+minimum interval within the target utilisation, or live requests are
+queueing; overloaded when they need more than twice the minimum interval, or
+two requests per worker are queued. Resolution and JPEG quality drop one step
+while busy and two while overloaded, but never so far that the smallest face
+of the last frame would shrink below twice the detector's minimum face size.
+
+Clients identify themselves with X-Capture-Client (e.g. the attendance session);
+requests without it share one anonymous client.
+
+Environment:
+    CAPTURE_MIN_INTERVAL_MS=400        fastest suggested rate
+    CAPTURE_MAX_INTERVAL_MS=5000       slowest suggested rate (everyone marked)
+    CAPTURE_STABLE_INTERVAL_MS=2000    cap of the stable-scene back-off
+    CAPTURE_TARGET_UTIL=0.7            live-lane share of inference capacity to aim for
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+CLIENT_HEADER = 'X-Capture-Client'
+PENDING_HEADER = 'X-Capture-Pending'
+
+# (max_side, jpeg_quality) per load level
+_LEVELS = {
+    'normal': (1280, 92),
+    'busy': (960, 85),
+    'overloaded': (640, 75),
+}
+
+
+def parse_pending(value: Optional[str]) -> Optional[int]:
+    """Unmarked students from the X-Capture-Pending header (None if absent or invalid)."""
+    if value is None or value == '':
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return None
+
+
+class _Client:
+    __slots__ = ('last_seen', 'signature', 'stable_frames')
+
+    def __init__(self):
+        self.last_seen = 0.0
+        self.signature = None
+        self.stable_frames = 0
+
+
+class CaptureAdvisor:
+    """Suggested capture interval, resolution and quality per camera client."""
+
+    def __init__(self, scheduler, min_interval_ms: int = 400, max_interval_ms: int = 5000,
+                 stable_interval_ms: int = 2000, target_util: float = 0.7, min_face_px: int = 32,
+                 stable_after: int = 3, active_window_s: float = 10.0, max_clients: int = 1024):
+        """
+        Args:
+            scheduler: InferenceScheduler whose live lane is being protected
+            min_interval_ms: Fastest suggested rate
+            max_interval_ms: Slowest suggested rate
+            stable_interval_ms: Cap of the back-off while a scene does not change
+            target_util: Fraction of inference capacity the live lane should use at most
+            min_face_px: Detector's minimum face size (resolution never drops below 2x that)
+            stable_after: Unchanged frames before the stable-scene back-off starts
+            active_window_s: A client counts as active this long after its last frame
+            max_clients: Clients remembered (least recently seen are forgotten)
+        """
+        self.scheduler = scheduler
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max(min_interval_ms, max_interval_ms)
+        self.stable_interval_ms = min(self.max_interval_ms, max(min_interval_ms, stable_interval_ms))
+        self.target_util = min(1.0, max(0.05, target_util))
+        self.min_face_px = min_face_px
+        self.stable_after = max(1, stable_after)
+        self.active_window_s = active_window_s
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients: 'OrderedDict[str, _Client]' = OrderedDict()
+        self._latency_s = 0.0  # EWMA of per-frame latency (queue wait + inference)
+        self.reasons = {'normal': 0, 'busy': 0, 'overloaded': 0, 'latency': 0, 'stable': 0, 'all_marked': 0}
+
+    @classmethod
+    def from_env(cls, scheduler, min_face_px: int = 32) -> 'CaptureAdvisor':
+        return cls(
+            scheduler,
+            min_interval_ms=int(os.environ.get('CAPTURE_MIN_INTERVAL_MS', 400)),
+            max_interval_ms=int(os.environ.get('CAPTURE_MAX_INTERVAL_MS', 5000)),
+            stable_interval_ms=int(os.environ.get('CAPTURE_STABLE_INTERVAL_MS', 2000)),
+            target_util=float(os.environ.get('CAPTURE_TARGET_UTIL', 0.7)),
+            min_face_px=min_face_px,
+        )
+
+    def hints(self, client: Optional[str], started: float, faces: Optional[List[Dict[str, Any]]] = None,
+              image: Optional[Dict[str, Any]] = None, pending: Optional[int] = None) -> Dict[str, Any]:
+        """Hints for the client's next frame.
+
+        Args:
+            client: X-Capture-Client value (None = anonymous)
+            started: time.perf_counter() when the request's work began
+            faces: Faces of this frame's result (recognized ids and bboxes), when known
+            image: {"width", "height"} of this frame, when known
+            pending: Students of the session not yet marked (None = unknown)
+        """
+        now = time.monotonic()
+        latency_s = time.perf_counter() - started
+        lane = self.scheduler.lanes['live']
+        workers = self.scheduler.workers
+        with self._lock:
+            self._latency_s = latency_s if not self._latency_s else 0.8 * self._latency_s + 0.2 * latency_s
+            state = self._clients.get(client or '')
+            if state is None:
+                state = self._clients[client or ''] = _Client()
+            self._clients.move_to_end(client or '')
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            state.last_seen = now
+            if faces is not None:
+                signature = (len(faces), tuple(sorted(str(f.get('student_id')) for f in faces if f.get('recognized'))))
+                state.stable_frames = state.stable_frames + 1 if signature == state.signature else 0
+                state.signature = signature
+            active = sum(1 for c in self._clients.values() if now - c.last_seen <= self.active_window_s)
+            latency_ms = self._latency_s * 1000
+            stable_frames = state.stable_frames
+
+            # Interval at which all active clients together keep the live lane at target_util,
+            # plus the time to drain what is already queued
+            depth = len(lane.queue)
+            load_ms = 1000.0 * active * lane.service_s / (workers * self.target_util)
+            load_ms += 1000.0 * depth * lane.service_s / workers
+            if depth >= 2 * workers or load_ms > 2 * self.min_interval_ms:
+                level = 'overloaded'
+            elif depth or load_ms > self.min_interval_ms:
+                level = 'busy'
+            else:
+                level = 'normal'
+
+            candidates = {
+                level: max(self.min_interval_ms, load_ms),
+                'latency': 1.5 * latency_ms,
+            }
+            if stable_frames >= self.stable_after:
+                candidates['stable'] = min(self.stable_interval_ms,
+                                           self.min_interval_ms * 2 ** (stable_frames - self.stable_after + 1))
+            if pending == 0:
+                candidates['all_marked'] = self.max_interval_ms
+            reason = max(candidates, key=candidates.get)
+            self.reasons[reason] += 1
+
+        interval_ms = min(self.max_interval_ms, int(math.ceil(candidates[reason] / 50.0) * 50))
+        max_side, quality = _LEVELS[level]
+        if image and faces:
+            # Keep the smallest face at least 2x the detector minimum after downscaling
+            long_side = max(int(image.get('width') or 0), int(image.get('height') or 0))
+            sides = [min(f['bbox'][2] - f['bbox'][0], f['bbox'][3] - f['bbox'][1]) for f in faces if f.get('bbox')]
+            if long_side and sides and min(sides) > 0:
+                needed = long_side * 2 * self.min_face_px / min(sides)
+                max_side = max(max_side, min(long_side, int(math.ceil(needed / 160.0) * 160)))
+        return {"interval_ms": interval_ms, "max_side": max_side, "jpeg_quality": quality, "reason": reason}
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "active_clients": sum(1 for c in self._clients.values() if now - c.last_seen <= self.active_window_s),
+                "latency_ms": round(self._latency_s * 1000, 2),
+                "min_interval_ms": self.min_interval_ms,
+                "max_interval_ms": self.max_interval_ms,
+                "target_util": self.target_util,
+                "reasons": dict(self.reasons),
+            }
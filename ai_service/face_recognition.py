@@ -7,18 +7,38 @@ Enhancements:
 - Quality gating to prevent low-quality registrations
 - Metadata storage for tracking and analytics
 - Performance monitoring and metrics
+- Pluggable detector/embedder backend (see backends.py)
+- IVF-PQ compressed index for very large galleries, trained from stored raw vectors
+- Optional sharded gallery with scatter-gather search (see sharding.py)
+- Append-only change log for primary/replica log shipping (see replication.py)
+- Memory-mapped int64 ID map and SQLite metadata store (see gallery_store.py)
+- Chunked binary export/import for provisioning nodes (see gallery_transfer.py)
+- Embedding model recorded per gallery and per student; model switches via
+  shadow re-embedding and atomic cutover (see model_registry.py, migration.py)
+- Thread-safe gallery: searches run concurrently under a shared lock, inserts
+  and index swaps take it exclusively only to publish new rows (GalleryLock)
 """
 import os
+import sys
 import pickle
 import json
 import time
-from typing import Optional, List, Tuple, Dict, Any
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional, List, Tuple, Dict, Any
 from datetime import datetime
 
 import faiss
 import numpy as np
 import cv2
-from insightface.app import FaceAnalysis
+
+from backends import FaceBackend, AlignmentError, create_backend
+from sharding import ShardClient
+from replication import ChangeLog
+from gallery_store import IdMap, MetadataStore, sqlite_memory_used
+from memory import anon_rss_bytes
+import tracing
 
 
 def _l2_normalize(vec: np.ndarray, eps: float = 1e-10) -> np.ndarray:
@@ -31,103 +51,835 @@ def _l2_normalize(vec: np.ndarray, eps: float = 1e-10) -> np.ndarray:
     return vec / norms
 
 
+# Index configurations supported by FaceRecognitionSystem
+INDEX_TYPES = ('flat', 'hnsw', 'ivfpq')
+HNSW_M = 32                 # bi-directional links per node (higher = more accuracy, more memory)
+HNSW_EF_CONSTRUCTION = 40   # quality during construction
+HNSW_EF_SEARCH = 32         # search breadth (higher = more accurate but slower)
+
+# IVF-PQ: inverted lists over a coarse k-means + product-quantized vectors.
+# 512-d float32 = 2048 bytes/vector; with PQ_M=64 x 8 bits a vector costs 64 bytes.
+IVF_NLIST = int(os.environ.get('FACE_IVF_NLIST', 0))          # coarse centroids (0 = auto from gallery size)
+IVF_NPROBE = int(os.environ.get('FACE_IVF_NPROBE', 16))       # lists scanned per query
+PQ_M = int(os.environ.get('FACE_PQ_M', 64))                   # sub-quantizers = code size in bytes
+PQ_NBITS = 8                                                  # bits per sub-quantizer code
+IVF_RERANK = int(os.environ.get('FACE_IVF_RERANK', 4))        # exact re-rank of k * RERANK candidates (0 = off)
+IVF_MIN_TRAIN = int(os.environ.get('FACE_IVF_MIN_TRAIN', 10000))  # below this, ivfpq mode uses exact Flat
+# (8-bit PQ codebooks need ~39 x 256 training points; smaller galleries are fast enough exact)
+IVF_RETRAIN_GROWTH = float(os.environ.get('FACE_IVF_RETRAIN_GROWTH', 2.0))  # retrain when gallery grows by this factor
+
+# Automatic index selection (FACE_INDEX_TYPE=auto)
+AUTO_LATENCY_TARGET_MS = float(os.environ.get('FACE_INDEX_LATENCY_MS', 1.0))     # single-query search budget
+AUTO_IVFPQ_MIN_SIZE = int(os.environ.get('FACE_AUTO_IVFPQ_MIN', 500_000))        # beyond this, HNSW RAM is too high
+
+# Neighbours examined per new row by the duplicate check
+DUPLICATE_CHECK_K = 5
+
+# Registration pre-screen: only the best PRESCREEN_KEEP frames of a burst go through
+# detection + ArcFace first (0 = process every frame). Frames are ranked on a
+# reduced-resolution decode (long side PRESCREEN_SIDE px); a frame whose 48x36 thumbnail
+# differs from an already chosen one by less than PRESCREEN_MIN_CHANGE grey levels
+# (mean absolute difference) is a near-duplicate.
+PRESCREEN_KEEP = int(os.environ.get('FACE_PRESCREEN_KEEP', 8))
+PRESCREEN_SIDE = 160
+PRESCREEN_MIN_CHANGE = float(os.environ.get('FACE_PRESCREEN_MIN_CHANGE', 0.5))
+
+# Latency / quality samples kept for stats (older samples are dropped)
+METRICS_WINDOW = int(os.environ.get('FACE_METRICS_WINDOW', 1000))
+
+# Re-embedding migration: the new gallery is built in <index_dir>SHADOW_SUFFIX
+SHADOW_SUFFIX = '.reembed'
+CUTOVER_MARKER = 'cutover.json'
+
+
+def complete_cutover(index_dir: str) -> bool:
+    """Move a shadow gallery marked for cutover into `index_dir`.
+
+    The marker is written before the first rename, so a crash between the two
+    renames is finished here on the next start. The replaced gallery is kept
+    as <index_dir>.prev-<timestamp>.
+
+    Returns:
+        True if a cutover was performed
+    """
+    shadow_dir = index_dir + SHADOW_SUFFIX
+    marker = os.path.join(shadow_dir, CUTOVER_MARKER)
+    if not os.path.exists(marker):
+        return False
+    if os.path.exists(index_dir):
+        os.rename(index_dir, f"{index_dir}.prev-{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.rename(shadow_dir, index_dir)
+    os.remove(os.path.join(index_dir, CUTOVER_MARKER))
+    return True
+
+
+def ivf_nlist_for(n: int) -> int:
+    """Number of coarse centroids for a gallery of n vectors (~4 sqrt(n), >= 39 points per list)."""
+    if IVF_NLIST:
+        return IVF_NLIST
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+def build_index(index_type: str, dimension: int, nlist: Optional[int] = None) -> faiss.Index:
+    """Create an empty gallery index of the given type.
+
+    All index types use inner product on L2-normalized embeddings, so search
+    scores are cosine similarities (higher is better). IVF-PQ indexes must be
+    trained before vectors are added (`index.is_trained`).
+
+    Args:
+        nlist: Coarse centroids for 'ivfpq' (default: from IVF_NLIST, else 1024)
+    """
+    if index_type == 'ivfpq':
+        quantizer = faiss.IndexFlatIP(dimension)
+        ivf = faiss.IndexIVFPQ(quantizer, dimension, nlist or IVF_NLIST or 1024, PQ_M, PQ_NBITS,
+                               faiss.METRIC_INNER_PRODUCT)
+        ivf.nprobe = IVF_NPROBE
+        return ivf
+    if index_type == 'hnsw':
+        # HNSW: Hierarchical Navigable Small World
+        # Best for: Fast approximate search, read-heavy workloads
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if index_type == 'flat':
+        # Flat: Exact brute-force search using inner product
+        return faiss.IndexFlatIP(dimension)
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def _nms(faces: List[Any], iou_threshold: float) -> List[Any]:
+    """Greedy non-maximum suppression over detected faces (by det_score)."""
+    if len(faces) <= 1:
+        return list(faces)
+    boxes = np.stack([f.bbox for f in faces]).astype(np.float32)
+    scores = np.array([f.det_score for f in faces], dtype=np.float32)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx0 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy0 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx1 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy1 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx1 - xx0, 0, None) * np.clip(yy1 - yy0, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-6)
+        order = rest[iou <= iou_threshold]
+    return [faces[i] for i in keep]
+
+
+def index_memory_bytes(index: Optional[faiss.Index]) -> int:
+    """Approximate heap size of a FAISS index: stored vectors / codes, graph links, coarse quantizer."""
+    if index is None:
+        return 0
+    n, d = int(index.ntotal), index.d
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        pq = getattr(faiss.downcast_index(ivf), 'pq', None)
+        codebooks = pq.M * pq.ksub * pq.dsub * 4 if pq is not None else 0
+        # codes + 64-bit IDs in the inverted lists, centroids, PQ codebooks
+        return n * (ivf.code_size + 8) + int(ivf.quantizer.ntotal) * d * 4 + codebooks
+    if hasattr(index, 'hnsw'):
+        hnsw = index.hnsw
+        # full vectors + int32 neighbour slots + per-node level (int32) and offset (int64)
+        return n * d * 4 + hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+    return n * index.code_size
+
+
+def _index_kind(index: faiss.Index) -> str:
+    """Map a FAISS index object to its INDEX_TYPES name."""
+    if faiss.try_extract_index_ivf(index) is not None:
+        return 'ivfpq'
+    if hasattr(index, 'hnsw'):
+        return 'hnsw'
+    return 'flat'
+
+
+class GalleryLock:
+    """Reader-writer lock over the live index and ID map.
+
+    FAISS searches may run concurrently with each other but not with an
+    in-place `index.add`, and a search result is only meaningful with the ID
+    map it was produced against. Searches hold the lock shared for the search
+    and the row -> ID lookup; writers hold it exclusively just long enough to
+    add rows to the index and publish them in the ID map (or to swap the index).
+    Waiting writers block new readers, so a steady search load cannot starve
+    registrations. Not reentrant.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class DuplicateFaceError(Exception):
+    """Registration refused: the face matches other students already in the gallery."""
+
+    def __init__(self, matches: Dict[str, list]):
+        self.matches = matches
+        desc = "; ".join(f"{sid} ~ " + ", ".join(f"{m['student_id']} ({m['similarity']:.2f})" for m in ms)
+                         for sid, ms in matches.items())
+        super().__init__(f"Face already registered: {desc}")
+
+
 class FaceRecognitionSystem:
     # Quality thresholds
     MIN_QUALITY_THRESHOLD = 0.65  # Minimum quality score for registration
     RECOGNITION_THRESHOLD = 0.70   # Similarity threshold for recognition (70%)
+
+    # Face filtering before embedding in multi-face frames: tiny background faces
+    # never reach the recognition threshold, so they are dropped before ArcFace runs
+    MIN_FACE_SIZE = int(os.environ.get('FACE_MIN_SIZE', 32))            # px, shorter bbox side
+    MIN_DET_SCORE = float(os.environ.get('FACE_MIN_DET_SCORE', 0.5))    # detector confidence
+    MAX_FACES_PER_FRAME = int(os.environ.get('FACE_MAX_PER_FRAME', 200)) # keep largest/most confident
+
+    # Tiled detection for high-resolution group photos: back-row faces shrink to a
+    # few pixels when a 4K frame is squeezed into the 640x640 detector input
+    TILED_DETECTION = os.environ.get('FACE_TILED_DETECTION', 'auto')  # 'auto' | 'on' | 'off'
+    TILE_MIN_IMAGE_SIDE = 1600   # 'auto' tiles frames whose long side exceeds this
+    TILE_SCALE = 2.0             # tile side = TILE_SCALE x detector input side
+    TILE_OVERLAP = 0.25          # fraction of tile side shared with neighbours
+    TILE_NMS_IOU = 0.4
+
+    # Near-duplicate check before insert (one batched search over the rows being added)
+    DUPLICATE_THRESHOLD = float(os.environ.get('FACE_DUPLICATE_THRESHOLD', 0.75))
+    DUPLICATE_POLICY = os.environ.get('FACE_DUPLICATE_POLICY', 'flag')      # other IDs: 'reject' | 'flag' | 'off'
+    REREGISTER_POLICY = os.environ.get('FACE_REREGISTER_POLICY', 'merge')   # same ID: 'merge' (skip) | 'add'
     
-    def __init__(self, index_path: str = "faiss_index", use_hnsw: bool = True):
+    def __init__(self, index_path: str = "faiss_index", use_hnsw: Optional[bool] = None,
+                 backend: Optional[FaceBackend] = None, index_type: Optional[str] = None,
+                 shards: Optional[ShardClient] = None, read_only: Optional[bool] = None):
         """Initialize face recognition system with enhanced features.
         
         Args:
             index_path: Directory to store FAISS index and metadata
-            use_hnsw: Use HNSW index for faster search (recommended for >100 students)
+            use_hnsw: Force HNSW (True) or Flat (False) when index_type is not given
+            backend: Detector/embedder backend (default: from FACE_BACKEND env, InsightFace)
+            index_type: 'flat' | 'hnsw' | 'ivfpq' | 'auto' (default: FACE_INDEX_TYPE env, else
+                from use_hnsw, else 'auto'). 'auto' picks the structure from gallery size and
+                measured search latency and migrates in the background as the gallery grows;
+                an existing gallery keeps its stored structure instead of being rebuilt.
+            shards: Coordinator mode - gallery lives on these shard nodes (default: from AI_SHARDS env)
+            read_only: Reject registrations; rows arrive only via apply_replicated
+                (default: True when AI_ROLE=replica)
         """
         # Persist FAISS artifacts relative to this file so they survive cwd changes
         base_dir = os.path.dirname(os.path.abspath(__file__))
         self.index_dir = os.path.join(base_dir, index_path)
+        if complete_cutover(self.index_dir):
+            print(f"🔁 Finished interrupted model cutover in {self.index_dir}")
         os.makedirs(self.index_dir, exist_ok=True)
 
         self.index: Optional[faiss.Index] = None
-        self.student_ids: list[str] = []
-        self.metadata: Dict[str, Dict[str, Any]] = {}  # Store metadata per student
-        self.use_hnsw = use_hnsw
-        
-        # ArcFace (buffalo_l) embedding dimension
-        self.dimension = 512
+        # Row -> student ID map and per-student metadata; opened by load_or_create_index
+        self.student_ids: Optional[IdMap] = None
+        self.metadata: Optional[MetadataStore] = None
+        self.changelog = ChangeLog(os.path.join(self.index_dir, "changelog.bin"))
+        self.read_only = read_only if read_only is not None else os.environ.get('AI_ROLE') == 'replica'
+        self.index_mode = index_type or os.environ.get('FACE_INDEX_TYPE') or \
+            ('auto' if use_hnsw is None else 'hnsw' if use_hnsw else 'flat')
+        if self.index_mode not in INDEX_TYPES + ('auto',):
+            raise ValueError(f"Unknown index type: {self.index_mode}")
+        # Structure actually in use; in 'auto' mode it starts as Flat and changes as the gallery grows
+        self.index_type = 'flat' if self.index_mode == 'auto' else self.index_mode
+        self.use_hnsw = self.index_type == 'hnsw'
+        # Gallery size the current IVF-PQ index was trained on (0 = untrained, exact Flat staging)
+        self.trained_on = 0
+        self.index_decision: Optional[Dict[str, Any]] = None  # last auto-selection measurement
+        self._next_auto_check = 0
+        self._write_lock = threading.RLock()  # serializes gallery writes and index swaps
+        self._gallery_lock = GalleryLock()    # searches vs. publishing rows / swapping the index
+        self.import_state: Optional[Dict[str, Any]] = None  # bulk import in progress (gallery_transfer.py)
+        self._rebuild_thread: Optional[threading.Thread] = None
+
+        # Detector + embedder. Default: InsightFace buffalo_sc
+        # (SCRFD detector: 6.9x faster than RetinaFace, 98.57% accuracy on LFW)
+        rss_before = anon_rss_bytes()
+        self.backend = backend if backend is not None else create_backend()
+        # Model sessions (ONNX Runtime arenas, weights) as seen by the process when they loaded
+        self.backend_load_bytes = max(0, anon_rss_bytes() - rss_before) if backend is None else None
+
+        # Coordinator mode: searches and inserts go to the shard nodes, the local index stays empty
+        self.shards = shards if shards is not None else ShardClient.from_env()
+
+        # ArcFace embedding dimension (512)
+        self.dimension = self.backend.dimension
+        # Model that produced the stored vectors; differs from backend.name after a FACE_MODEL
+        # change, and then searches and inserts are refused until the gallery is re-embedded
+        self.gallery_model = self.backend.name
         
-        # Performance metrics
+        # Performance metrics (sample windows are bounded: a long-running service must not grow them)
         self.metrics = {
-            'search_times': [],
-            'registration_times': [],
-            'quality_scores': [],
+            'search_times': deque(maxlen=METRICS_WINDOW),
+            'registration_times': deque(maxlen=METRICS_WINDOW),
+            'quality_scores': deque(maxlen=METRICS_WINDOW),
             'total_searches': 0,
             'total_registrations': 0
         }
-
-        # Initialize InsightFace FaceAnalysis (CPU)
-        # buffalo_sc: SCRFD detector (6.9x faster than RetinaFace, 98.57% accuracy on LFW)
-        self.face_app = FaceAnalysis(name='buffalo_sc', providers=['CPUExecutionProvider'])
-        # Larger det_size improves detection quality
-        self.face_app.prepare(ctx_id=0, det_size=(640, 640))
+        # Decision audit log (audit.py) and the gallery namespace recorded with each decision
+        self.audit = None
+        self.namespace = 'default'
 
         self.load_or_create_index()
+        if self.index_mode == 'auto' and self.student_ids:
+            self._maybe_select_index()
         print(f"✓ FaceRecognitionSystem initialized")
-        print(f"  - Model: InsightFace buffalo_sc (SCRFD + ArcFace)")
-        print(f"  - Detection: SCRFD (6.9x faster, 98.57% accuracy)")
-        print(f"  - Recognition: ArcFace (99.83% accuracy)")
-        print(f"  - Index type: {'HNSW (fast)' if use_hnsw else 'Flat (exact)'}")
+        print(f"  - Backend: {self.backend.name}")
+        if self.gallery_model != self.backend.name:
+            print(f"⚠️  Gallery was embedded with {self.gallery_model}; re-embed it (reembed_gallery) "
+                  f"or set FACE_MODEL back")
+        if self.shards is not None:
+            print(f"  - Shards: {len(self.shards.urls)} ({self.shards.partition} partition)")
+        else:
+            print(f"  - Index type: {self._index_description()}")
         print(f"  - Dimension: {self.dimension}")
         print(f"  - Students registered: {len(self.student_ids)}")
 
     def load_or_create_index(self) -> None:
-        """Load existing FAISS index or create a new one with optional HNSW."""
+        """Load existing FAISS index or create a new one of the configured type."""
         index_file = os.path.join(self.index_dir, "index.faiss")
-        ids_file = os.path.join(self.index_dir, "student_ids.pkl")
-        metadata_file = os.path.join(self.index_dir, "metadata.json")
+        index_meta_file = os.path.join(self.index_dir, "index_meta.json")
+        import_file = os.path.join(self.index_dir, "import.json")
+        self._open_stores()
+        if os.path.exists(import_file):
+            with open(import_file, "r") as f:
+                self.import_state = json.load(f)
 
-        if os.path.exists(index_file) and os.path.exists(ids_file):
+        if os.path.exists(index_file):
             self.index = faiss.read_index(index_file)
-            with open(ids_file, "rb") as f:
-                self.student_ids = pickle.load(f)
-            
-            # Load metadata if exists
-            if os.path.exists(metadata_file):
-                with open(metadata_file, "r") as f:
-                    self.metadata = json.load(f)
+            self._migrate_legacy_stores()
+
+            stored_type = _index_kind(self.index)
+            if os.path.exists(index_meta_file):
+                with open(index_meta_file, "r") as f:
+                    index_meta = json.load(f)
+                self.trained_on = int(index_meta.get('trained_on', 0))
+                stored_type = index_meta.get('index_type', stored_type)
+                # Galleries saved before the model was recorded are assumed to match
+                if self.student_ids:
+                    self.gallery_model = index_meta.get('model', self.gallery_model)
             
             # Safety: ensure index dimension matches expected
             if self.index.d != self.dimension:
                 print(f"⚠️  Index dimension mismatch: {self.index.d} != {self.dimension}. Recreating...")
                 self._create_new_index()
+                return
+
+            if self.import_state is not None:
+                # Imported rows are not in the index yet: keep them, only drop a torn tail
+                self._align_partial_import()
+                print(f"⚠️  Gallery import in progress ({len(self.student_ids)}/{self.import_state.get('total')} rows); "
+                      f"resume it with transfer_gallery.py")
+                return
+            self._sync_vector_store()
+            if len(self.student_ids) > self.index.ntotal:
+                # Crash between ID append and index save: drop the unsaved tail
+                self.student_ids.truncate(int(self.index.ntotal))
+            elif len(self.student_ids) < self.index.ntotal:
+                print(f"⚠️  ID map has {len(self.student_ids)} rows, index {self.index.ntotal}; "
+                      f"unmapped rows are never returned")
+            self.changelog.sync(self.student_ids)
+            if self.index_mode == 'auto':
+                # Keep whatever structure was chosen last; re-evaluated on the next registration
+                self.index_type = stored_type
+                self.use_hnsw = stored_type == 'hnsw'
+            elif stored_type != self.index_type:
+                print(f"⚠️  Stored index is {stored_type}, configured {self.index_type}. Rebuilding...")
+                self.rebuild_index()
+                self.save_index()
         else:
             self._create_new_index()
     
     def _create_new_index(self) -> None:
         """Create a new FAISS index based on configuration."""
-        if self.use_hnsw:
-            # HNSW: Hierarchical Navigable Small World
-            # Best for: Fast approximate search, read-heavy workloads
-            # M=32: number of bi-directional links per node (higher = more accuracy, more memory)
-            # efConstruction=40: quality during construction
-            # efSearch will be set dynamically during search
-            self.index = faiss.IndexHNSWFlat(self.dimension, 32)
-            self.index.hnsw.efConstruction = 40
-            print("✓ Created HNSW index for fast similarity search")
+        if self.index_type == 'ivfpq':
+            # IVF-PQ needs training data: start exact, train once the gallery is big enough
+            self.index = build_index('flat', self.dimension)
+            print(f"✓ Created Flat staging index (IVF-PQ is trained at {IVF_MIN_TRAIN} students)")
         else:
-            # Flat: Exact brute-force search using inner product
-            # Use inner product on L2-normalized embeddings -> cosine similarity
-            self.index = faiss.IndexFlatIP(self.dimension)
-            print("✓ Created Flat index for exact search")
+            self.index = build_index(self.index_type, self.dimension)
+            if self.use_hnsw:
+                print("✓ Created HNSW index for fast similarity search")
+            else:
+                print("✓ Created Flat index for exact search")
         
-        self.student_ids = []
-        self.metadata = {}
+        self.trained_on = 0
+        self.gallery_model = self.backend.name
+        for name in ("vectors.f32", "changelog.bin"):
+            stale = os.path.join(self.index_dir, name)
+            if os.path.exists(stale):
+                os.remove(stale)
+        self._open_stores(reset=True)
 
-    def save_index(self) -> None:
-        """Persist FAISS index, student IDs, and metadata to disk."""
-        index_file = os.path.join(self.index_dir, "index.faiss")
+    # -------- ID map / metadata stores --------
+    def _open_stores(self, reset: bool = False) -> None:
+        """(Re)open the ID map and metadata store of self.index_dir; `reset` empties them."""
+        self.close_stores()
+        if reset:
+            for name in ("student_ids.i64", "metadata.db", "metadata.db-wal", "metadata.db-shm"):
+                stale = os.path.join(self.index_dir, name)
+                if os.path.exists(stale):
+                    os.remove(stale)
+        self.metadata = MetadataStore(os.path.join(self.index_dir, "metadata.db"))
+        self.student_ids = IdMap(os.path.join(self.index_dir, "student_ids.i64"), self.metadata)
+
+    def close_stores(self) -> None:
+        """Close the metadata database (the ID map stays readable until reopened)."""
+        if self.metadata is not None:
+            self.metadata.close()
+
+    def set_import_state(self, state: Optional[Dict[str, Any]]) -> None:
+        """Mark a bulk import as in progress (persisted in import.json) or finished (None)."""
+        import_file = os.path.join(self.index_dir, "import.json")
+        with self._write_lock:
+            if state is None:
+                if os.path.exists(import_file):
+                    os.remove(import_file)
+            else:
+                if self.import_state is None:
+                    self.save_index()  # an index file marks the directory as a gallery
+                with open(import_file, "w") as f:
+                    json.dump(state, f)
+            self.import_state = state
+
+    def _align_partial_import(self) -> None:
+        """Trim the ID map, raw vectors and change log to the rows all three have."""
+        path = self._vectors_file()
+        row_bytes = 4 * self.dimension
+        vector_rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        rows = min(len(self.student_ids), vector_rows, len(self.changelog))
+        if vector_rows > rows:
+            with open(path, "r+b") as f:
+                f.truncate(rows * row_bytes)
+        if len(self.student_ids) > rows:
+            self.student_ids.truncate(rows)
+        self.changelog.sync(self.student_ids)
+
+    def _migrate_legacy_stores(self) -> None:
+        """Convert student_ids.pkl / metadata.json of older galleries (kept as *.migrated)."""
         ids_file = os.path.join(self.index_dir, "student_ids.pkl")
         metadata_file = os.path.join(self.index_dir, "metadata.json")
+        if os.path.exists(ids_file):
+            if not len(self.student_ids):
+                with open(ids_file, "rb") as f:
+                    self.student_ids.extend(pickle.load(f))
+                print(f"✓ Converted student_ids.pkl to int64 ID map ({len(self.student_ids)} rows)")
+            os.rename(ids_file, ids_file + ".migrated")
+        if os.path.exists(metadata_file):
+            with open(metadata_file, "r") as f:
+                self.metadata.set_many(json.load(f))
+            os.rename(metadata_file, metadata_file + ".migrated")
+            print(f"✓ Converted metadata.json to SQLite ({len(self.metadata)} students)")
+
+    def _index_description(self) -> str:
+        if self.index_type == 'ivfpq':
+            if not self.trained_on:
+                return f"IVF-PQ (untrained: exact Flat until {IVF_MIN_TRAIN} students)"
+            ivf = faiss.extract_index_ivf(self.index)
+            return (f"IVF-PQ (nlist={ivf.nlist}, nprobe={IVF_NPROBE}, {PQ_M} B/vector, "
+                    f"rerank={'x%d' % IVF_RERANK if IVF_RERANK else 'off'})")
+        return 'HNSW (fast)' if self.use_hnsw else 'Flat (exact)'
+
+    # -------- Raw vector store --------
+    # The index may be lossy (PQ) or rebuilt in another structure, so the exact
+    # float32 embeddings are kept in an append-only file, row-aligned with
+    # student_ids. It is memory-mapped on demand and never held in RAM.
+    def _vectors_file(self) -> str:
+        return os.path.join(self.index_dir, "vectors.f32")
+
+    def load_vectors(self) -> np.ndarray:
+        """Memory-mapped (n, d) float32 view of all stored gallery embeddings."""
+        path = self._vectors_file()
+        row_bytes = 4 * self.dimension
+        n = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if n == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='r', shape=(n, self.dimension))
+
+    def _append_vectors(self, vectors: np.ndarray) -> None:
+        with open(self._vectors_file(), "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+    def _sync_vector_store(self) -> None:
+        """Make vectors.f32 row-aligned with the index (creates it for older galleries)."""
+        path = self._vectors_file()
+        row_bytes = 4 * self.dimension
+        rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        ntotal = int(self.index.ntotal)
+        if rows > ntotal:
+            # Crash between vector append and index save: drop the unsaved tail
+            with open(path, "r+b") as f:
+                f.truncate(ntotal * row_bytes)
+        elif rows < ntotal:
+            if _index_kind(self.index) == 'ivfpq':
+                print(f"⚠️  Raw vectors missing for {ntotal - rows} rows; IVF-PQ codes cannot be reconstructed exactly")
+                return
+            with open(path, "r+b" if rows else "wb") as f:
+                f.truncate(rows * row_bytes)
+                f.seek(rows * row_bytes)
+                for start in range(rows, ntotal, 10_000):
+                    count = min(10_000, ntotal - start)
+                    f.write(self.index.reconstruct_n(start, count).astype(np.float32).tobytes())
+            print(f"✓ Rebuilt raw vector store from index ({ntotal} vectors)")
+
+    # -------- Index training / rebuilding --------
+    def _build_from_vectors(self, index_type: str, vectors: np.ndarray) -> Tuple[faiss.Index, int]:
+        """Build (train + add) an index of `index_type` over `vectors` -> (index, trained_on)."""
+        n = len(vectors)
+        if index_type == 'ivfpq' and n < IVF_MIN_TRAIN:
+            index, trained_on = build_index('flat', self.dimension), 0
+        else:
+            index, trained_on = build_index(index_type, self.dimension, nlist=ivf_nlist_for(n)), 0
+            if not index.is_trained:
+                index.train(np.ascontiguousarray(vectors))
+                trained_on = n
+        for start in range(0, n, 50_000):
+            index.add(np.ascontiguousarray(vectors[start:start + 50_000]))
+        return index, trained_on
+
+    def _swap_index(self, index: faiss.Index, index_type: str, trained_on: int) -> None:
+        # In-flight searches finish on the old object first; none sees a half-swapped state
+        with self._gallery_lock.write():
+            self.index = index
+            self.index_type = index_type
+            self.use_hnsw = index_type == 'hnsw'
+            self.trained_on = trained_on
+
+    def rebuild_index(self, index_type: Optional[str] = None) -> None:
+        """Rebuild the index from the raw vector store (train + add), then swap it in."""
+        index_type = index_type or self.index_type
+        vectors = self.load_vectors()
+        build_start = time.time()
+        with self._write_lock:
+            index, trained_on = self._build_from_vectors(index_type, vectors)
+            self._swap_index(index, index_type, trained_on)
+        print(f"✓ Rebuilt {self._index_description()} over {len(vectors)} vectors in {(time.time() - build_start):.1f}s")
+
+    def _rebuild_in_background(self, index_type: str, reason: str) -> None:
+        """Build a new index on a worker thread while the current one keeps serving.
+
+        Rows registered during the build are caught up from the raw vector
+        store under the write lock, then the new index is swapped in atomically.
+        """
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+
+        def run() -> None:
+            build_start = time.time()
+            try:
+                with self._write_lock:
+                    snapshot = len(self.student_ids)
+                vectors = self.load_vectors()[:snapshot]
+                index, trained_on = self._build_from_vectors(index_type, vectors)
+                build_s = time.time() - build_start
+                with self._write_lock:
+                    vectors = self.load_vectors()
+                    if len(vectors) > snapshot:
+                        index.add(np.ascontiguousarray(vectors[snapshot:]))
+                    self._swap_index(index, index_type, trained_on)
+                    self.save_index()
+                print(f"✓ Background rebuild done: {self._index_description()} over {int(index.ntotal)} vectors "
+                      f"(build {build_s:.1f}s, caught up {int(index.ntotal) - snapshot} rows) [{reason}]")
+            except Exception as e:
+                print(f"⚠️  Background index rebuild failed ({reason}): {e}")
+
+        print(f"🔁 Rebuilding index as {index_type} in background [{reason}]")
+        self._rebuild_thread = threading.Thread(target=run, name='index-rebuild', daemon=True)
+        self._rebuild_thread.start()
+
+    def _needs_retrain(self) -> bool:
+        if self.index_type != 'ivfpq':
+            return False
+        n = int(self.index.ntotal)
+        if not self.trained_on:
+            return n >= IVF_MIN_TRAIN
+        # Coarse centroids drift out of date as the gallery grows past what they were trained on
+        return n >= self.trained_on * IVF_RETRAIN_GROWTH
+
+    # -------- Automatic index selection ('auto' mode) --------
+    def _measure_search_ms(self, samples: int = 32) -> float:
+        """Median single-query latency (ms) of the live index, probed with gallery vectors."""
+        vectors = self.load_vectors()
+        if len(vectors) == 0:
+            return 0.0
+        rows = np.random.default_rng(len(vectors)).choice(len(vectors), size=min(samples, len(vectors)), replace=False)
+        probes = np.ascontiguousarray(vectors[np.sort(rows)])
+        times = []
+        for q in probes:
+            t0 = time.perf_counter()
+            with self._gallery_lock.read():
+                self._search(q[None, :], 1)
+            times.append((time.perf_counter() - t0) * 1000)
+        return float(np.median(times))
+
+    def choose_index_type(self, n: int, search_ms: float) -> str:
+        """Pick the index structure for a gallery of n vectors given the measured search latency.
+
+        Flat while exact search meets AUTO_LATENCY_TARGET_MS, then HNSW, then
+        IVF-PQ once full vectors + graph links would cost too much RAM.
+        Galleries never shrink in practice, so there is no downgrade path.
+        """
+        if n >= AUTO_IVFPQ_MIN_SIZE:
+            return 'ivfpq'
+        if self.index_type == 'flat' and search_ms <= AUTO_LATENCY_TARGET_MS:
+            return 'flat'
+        return 'ivfpq' if self.index_type == 'ivfpq' else 'hnsw'
+
+    def _maybe_select_index(self) -> None:
+        """Re-evaluate the index choice (auto mode) every ~10% of gallery growth."""
+        n = len(self.student_ids)
+        if n < self._next_auto_check or (self._rebuild_thread is not None and self._rebuild_thread.is_alive()):
+            return
+        self._next_auto_check = int(n * 1.1) + 50
+        search_ms = self._measure_search_ms()
+        target = self.choose_index_type(n, search_ms)
+        self.index_decision = {
+            "gallery_size": n,
+            "current": self.index_type,
+            "chosen": target,
+            "measured_search_ms": round(search_ms, 3),
+            "latency_target_ms": AUTO_LATENCY_TARGET_MS,
+            "ivfpq_min_size": AUTO_IVFPQ_MIN_SIZE,
+            "timestamp": datetime.now().isoformat(),
+        }
+        if target != self.index_type:
+            print(f"🔁 Index auto-select: {n} students, {self.index_type} search {search_ms:.3f} ms "
+                  f"(target {AUTO_LATENCY_TARGET_MS} ms, IVF-PQ from {AUTO_IVFPQ_MIN_SIZE}) -> {target}")
+            self._rebuild_in_background(target, f"auto: {self.index_type} -> {target} at {n} students")
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise Exception("Read-only replica: register faces on the primary AI service")
+        if self.import_state is not None:
+            raise Exception("Gallery import in progress: registrations are disabled until it completes")
+        self._check_model()
+
+    def _check_model(self) -> None:
+        """Embeddings of different models are not comparable: never search or mix them."""
+        if self.gallery_model != self.backend.name and self.student_ids:
+            raise Exception(f"Gallery was embedded with {self.gallery_model} but the service runs "
+                            f"{self.backend.name}; re-embed the gallery or set FACE_MODEL back")
+
+    def adopt_gallery(self, other: 'FaceRecognitionSystem') -> None:
+        """Take over another system's backend and gallery in place (model cutover).
+
+        The caller holds both write locks, closed both systems' stores and has
+        already moved `other`'s files into self.index_dir (complete_cutover);
+        metrics and settings are kept.
+        """
+        with self._gallery_lock.write():
+            for attr in ('backend', 'dimension', 'gallery_model', 'index',
+                         'index_type', 'use_hnsw', 'trained_on', 'index_decision', '_next_auto_check'):
+                setattr(self, attr, getattr(other, attr))
+            self._open_stores()
+
+    def apply_replicated(self, embeddings: np.ndarray, student_ids: List[str],
+                         metadata: Dict[str, Any], timestamps: List[float]) -> None:
+        """Apply rows shipped from the primary's change log (replica side)."""
+        self.metadata.set_many(metadata)
+        self._add_to_gallery(embeddings, student_ids, timestamps=timestamps, check_duplicates=False)
+
+    def _check_duplicates(self, embeddings: np.ndarray, student_ids: List[str]) -> Tuple[List[bool], Dict[str, list]]:
+        """Near-duplicate check for rows about to be inserted, in one batched gallery search.
+
+        Rows are also compared with each other, so a bulk insert cannot add the
+        same face twice. Same-ID matches are re-registrations (REREGISTER_POLICY);
+        other-ID matches are handled by DUPLICATE_POLICY.
+
+        Returns:
+            (keep mask per row, {student_id: [{"student_id", "similarity"}]} other-ID matches)
+
+        Raises:
+            DuplicateFaceError: DUPLICATE_POLICY is 'reject' and another student matches
+        """
+        n = len(student_ids)
+        if self.DUPLICATE_POLICY == 'off' and self.REREGISTER_POLICY == 'add':
+            return [True] * n, {}
+        threshold = self.DUPLICATE_THRESHOLD
+        sims, ids = self.search_gallery(embeddings, k=DUPLICATE_CHECK_K)
+        gram = embeddings @ embeddings.T
+        keep = [True] * n
+        others: Dict[str, list] = {}
+        for i, sid in enumerate(student_ids):
+            candidates = [(float(sim), cid) for sim, cid in zip(sims[i], ids[i]) if cid is not None and sim >= threshold]
+            # Earlier rows of the same batch count as already in the gallery
+            candidates += [(float(gram[i, j]), student_ids[j]) for j in range(i) if keep[j] and gram[i, j] >= threshold]
+            if any(cid == sid for _, cid in candidates) and self.REREGISTER_POLICY == 'merge':
+                keep[i] = False
+            matches = {}
+            for sim, cid in sorted(candidates, reverse=True):
+                if cid != sid and cid not in matches:
+                    matches[cid] = round(sim, 4)
+            if matches:
+                others[sid] = [{"student_id": cid, "similarity": sim} for cid, sim in matches.items()]
+        if others and self.DUPLICATE_POLICY == 'reject':
+            raise DuplicateFaceError(others)
+        if self.DUPLICATE_POLICY == 'off':
+            others = {}
+        return keep, others
+
+    def _add_to_gallery(self, embeddings: np.ndarray, student_ids: List[str],
+                        shard_key: Optional[str] = None, timestamps: Optional[List[float]] = None,
+                        check_duplicates: bool = True,
+                        metadata: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Single write path: append to index, raw vector store and ID map, then persist.
+
+        New registrations are checked for near-duplicates first (see _check_duplicates);
+        replicated rows and rows routed by a coordinator were checked at their origin.
+        `metadata` ({student_id: {...}}) is stored only for rows that are actually
+        added: a rejected registration leaves nothing behind, and a merged one only
+        bumps the existing row's counter.
+        In coordinator mode the rows go to their owning shard instead (placed by
+        student ID hash or `shard_key`, the department code); only metadata is kept here.
+
+        Returns:
+            {"added": n, "merged": [student_id, ...], "flagged": {student_id: [matches]}}
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        with self._write_lock:
+            merged, flagged = [], {}
+            if check_duplicates:
+                keep, flagged = self._check_duplicates(embeddings, student_ids)
+                merged = [sid for sid, k in zip(student_ids, keep) if not k]
+                now = datetime.now().isoformat()
+                for sid in merged:
+                    count = (self.metadata.get(sid) or {}).get('merged_registrations', 0)
+                    self.metadata.merge(sid, {'merged_registrations': count + 1, 'last_merged': now})
+                if merged:
+                    rows = [i for i, k in enumerate(keep) if k]
+                    embeddings = embeddings[rows]
+                    student_ids = [student_ids[i] for i in rows]
+                    timestamps = [timestamps[i] for i in rows] if timestamps else None
+            added = {sid: dict(metadata[sid]) for sid in student_ids if metadata and sid in metadata}
+            for sid, matches in flagged.items():
+                if sid in added:
+                    added[sid]['possible_duplicates'] = matches
+                else:
+                    self.metadata.merge(sid, {'possible_duplicates': matches})
+            self.metadata.set_many(added)
+            report = {"added": len(student_ids), "merged": merged, "flagged": flagged}
+            if not student_ids:
+                self.save_index()
+                return report
+            if self.shards is not None:
+                owners = self.shards.add(embeddings, student_ids, self.metadata, shard_key)
+                for sid, shard in zip(student_ids, owners):
+                    if sid in self.metadata:
+                        self.metadata.merge(sid, {'shard': shard})
+                self.save_index()
+                return report
+            self._append_vectors(embeddings)
+            # Log after the vectors: a log record always has its vector on disk
+            self.changelog.append(student_ids, timestamps)
+            # Searches see the new rows in the index and the ID map together, never one without the other
+            with self._gallery_lock.write():
+                self.index.add(embeddings)
+                self.student_ids.extend(student_ids)
+            self.save_index()
+        if self._needs_retrain():
+            self._rebuild_in_background('ivfpq', f"retrain at {int(self.index.ntotal)} vectors")
+        elif self.index_mode == 'auto':
+            self._maybe_select_index()
+        return report
+
+    def find_duplicate_clusters(self, threshold: Optional[float] = None, k: int = 10,
+                                chunk: int = 4096) -> List[Dict[str, Any]]:
+        """Scan the whole gallery for groups of near-identical embeddings.
+
+        Each stored vector is searched against the index (k neighbours, in chunks,
+        so HNSW/IVF make this ~n log n rather than n^2); pairs above `threshold`
+        are joined with union-find. Clusters spanning several student IDs are
+        likely the same person registered twice; single-ID clusters are redundant
+        re-registrations.
+
+        Returns:
+            Clusters sorted by size: {"student_ids", "rows", "max_similarity", "cross_student"}
+        """
+        threshold = self.DUPLICATE_THRESHOLD if threshold is None else threshold
+        vectors = self.load_vectors()
+        n = min(len(vectors), len(self.student_ids))
+        parent = list(range(n))
+
+        def find(x: int) -> int:
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        best: Dict[int, float] = {}
+        for start in range(0, n, chunk):
+            with self._gallery_lock.read():
+                sims, rows = self._search(np.ascontiguousarray(vectors[start:min(n, start + chunk)]), k=min(k + 1, n))
+            for qi in range(len(rows)):
+                i = start + qi
+                for sim, j in zip(sims[qi], rows[qi]):
+                    if j < 0 or j == i or j >= n or sim < threshold:
+                        continue
+                    j = int(j)
+                    ri, rj = find(i), find(j)
+                    if ri != rj:
+                        parent[ri] = rj
+                    for m in (i, j):
+                        best[m] = max(best.get(m, 0.0), float(sim))
+
+        groups: Dict[int, List[int]] = {}
+        for m in best:
+            groups.setdefault(find(m), []).append(m)
+        clusters = []
+        for members in groups.values():
+            members.sort()
+            sids = sorted({self.student_ids[m] for m in members})
+            clusters.append({
+                "student_ids": sids,
+                "rows": members,
+                "max_similarity": round(max(best[m] for m in members), 4),
+                "cross_student": len(sids) > 1,
+            })
+        clusters.sort(key=lambda c: (-c["cross_student"], -len(c["rows"]), -c["max_similarity"]))
+        return clusters
+
+    def save_index(self) -> None:
+        """Persist the FAISS index and its settings.
+
+        The ID map, raw vectors and change log are appended as rows are added and
+        metadata is written per student, so only the index itself is rewritten here.
+        """
+        index_file = os.path.join(self.index_dir, "index.faiss")
         
         # Create backup before saving (keep last version)
         backup_dir = os.path.join(self.index_dir, "backups")
@@ -148,10 +900,9 @@ class FaceRecognitionSystem:
 
         # Save index and data
         faiss.write_index(self.index, index_file)
-        with open(ids_file, "wb") as f:
-            pickle.dump(self.student_ids, f)
-        with open(metadata_file, "w") as f:
-            json.dump(self.metadata, f, indent=2)
+        with open(os.path.join(self.index_dir, "index_meta.json"), "w") as f:
+            json.dump({"index_type": self.index_type, "trained_on": self.trained_on,
+                       "dimension": self.dimension, "model": self.gallery_model}, f)
 
     def extract_embedding(self, image_path: str) -> np.ndarray:
         """Extract a L2-normalized face embedding using InsightFace ArcFace.
@@ -162,7 +913,7 @@ class FaceRecognitionSystem:
             img = cv2.imread(image_path)
             if img is None:
                 raise Exception("Image load failed")
-            faces = self.face_app.get(img)
+            faces = self.backend.detect(img)
             if not faces:
                 raise Exception("No face detected")
             # Choose best face by detection score, fallback to largest area
@@ -170,8 +921,9 @@ class FaceRecognitionSystem:
                 faces,
                 key=lambda f: getattr(f, 'det_score', 0.0) * 10.0 + (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1])
             )
-            emb = best.normed_embedding.astype("float32")
-            # normed_embedding is already L2-normalized, normalize again for safety
+            # Only the chosen face goes through ArcFace
+            emb = self.backend.embed(img, [best])[0].astype("float32")
+            # Backend embeddings are already L2-normalized, normalize again for safety
             return _l2_normalize(emb)
         except Exception as e:
             raise Exception(f"Face extraction failed: {str(e)}")
@@ -235,6 +987,50 @@ class FaceRecognitionSystem:
         
         return round(total_score, 3)
 
+    @staticmethod
+    def _prescreen_frames(image_paths: List[str]) -> List[int]:
+        """Order frames for registration: sharp, well-exposed and mutually distinct first.
+
+        Works on a reduced decode (JPEG is decoded at 1/4 scale directly) with the
+        same signals as `_image_quality_score` - Laplacian variance and mean
+        brightness, minus clipped pixels. Sharpness is relative to the sharpest
+        frame of the burst, since downscaling changes its absolute value.
+        Near-duplicates of a frame already chosen, then unreadable frames, go last.
+
+        Returns: Indices into image_paths, best first
+        """
+        candidates = []
+        for idx, path in enumerate(image_paths):
+            gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+            if gray is None:
+                continue
+            h, w = gray.shape
+            if max(h, w) > PRESCREEN_SIDE:
+                scale = PRESCREEN_SIDE / float(max(h, w))
+                gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                  interpolation=cv2.INTER_AREA)
+            sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+            mean_brightness = float(np.mean(gray))
+            clipped = float(np.mean((gray < 8) | (gray > 247)))
+            exposure = (1.0 - min(abs(mean_brightness - 125.0) / 125.0, 1.0)) * (1.0 - clipped)
+            thumb = cv2.resize(gray, (48, 36), interpolation=cv2.INTER_AREA).astype(np.float32)
+            candidates.append((idx, float(sharpness), exposure, thumb))
+
+        max_sharpness = max((c[1] for c in candidates), default=0.0) or 1.0
+        candidates.sort(key=lambda c: 0.40 * c[1] / max_sharpness + 0.25 * c[2], reverse=True)
+
+        chosen: List[int] = []
+        thumbs: List[np.ndarray] = []
+        redundant: List[int] = []
+        for idx, _, _, thumb in candidates:
+            if any(float(np.mean(np.abs(thumb - t))) < PRESCREEN_MIN_CHANGE for t in thumbs):
+                redundant.append(idx)
+            else:
+                chosen.append(idx)
+                thumbs.append(thumb)
+        ranked = set(chosen) | set(redundant)
+        return chosen + redundant + [i for i in range(len(image_paths)) if i not in ranked]
+
     def _aggregate_embeddings(self, emb_list: List[np.ndarray], topk: int = 5) -> Optional[np.ndarray]:
         if not emb_list:
             return None
@@ -243,32 +1039,51 @@ class FaceRecognitionSystem:
         mean_emb = np.mean(stack, axis=0)
         return _l2_normalize(mean_emb)
 
-    def register_face(self, image_path: str, student_id: str) -> bool:
-        """Register a new face in FAISS index (persistent)."""
+    def register_face(self, image_path: str, student_id: str, shard_key: Optional[str] = None) -> Dict[str, Any]:
+        """Register a new face in FAISS index (persistent).
+
+        Returns:
+            The gallery write report: {"added", "merged", "flagged"} (see _add_to_gallery)
+        """
+        self._check_writable()
         embedding = self.extract_embedding(image_path)
 
-        self.index.add(np.expand_dims(embedding, axis=0))
-        self.student_ids.append(student_id)
-        self.save_index()
-        return True
+        return self._add_to_gallery(np.expand_dims(embedding, axis=0), [student_id], shard_key,
+                                    metadata={student_id: {'registration_date': datetime.now().isoformat(),
+                                                           'model_version': self.backend.name}})
 
-    def register_face_multi(self, image_paths: List[str], student_id: str) -> bool:
+    def register_face_multi(self, image_paths: List[str], student_id: str,
+                            shard_key: Optional[str] = None) -> Dict[str, Any]:
         """Register using multiple frames: quality filter + aggregate embeddings.
         
         Args:
             image_paths: List of paths to face images
             student_id: Unique identifier for the student
+            shard_key: Department code, used for placement when sharded by department
             
         Returns:
-            True if registration successful
+            The gallery write report: {"added", "merged", "flagged"} (see _add_to_gallery);
+            `student_id` in "merged" means the face was already registered and nothing was added
             
         Raises:
             Exception: If no valid faces found or aggregation fails
         """
+        self._check_writable()
         scored: List[Tuple[float, np.ndarray]] = []
         errors = []
-        
-        for idx, p in enumerate(image_paths):
+        required = min(3, len(image_paths))
+
+        # Pre-screened best frames first; the rest only if those fail the checks below
+        order = list(range(len(image_paths)))
+        if 0 < PRESCREEN_KEEP < len(image_paths):
+            order = self._prescreen_frames(image_paths)
+        processed = 0
+        for idx in order:
+            if processed >= PRESCREEN_KEEP > 0 and len(scored) >= required and \
+                    max(q for q, _ in scored) >= self.MIN_QUALITY_THRESHOLD:
+                break
+            processed += 1
+            p = image_paths[idx]
             try:
                 emb = self.extract_embedding(p)
                 q = self._image_quality_score(p)
@@ -282,7 +1097,7 @@ class FaceRecognitionSystem:
             raise Exception(f"No valid faces found in {len(image_paths)} frames. Details: {error_detail}")
         
         # Require at least 3 valid faces for robust registration
-        if len(scored) < min(3, len(image_paths)):
+        if len(scored) < required:
             raise Exception(
                 f"Only {len(scored)} valid faces found out of {len(image_paths)} frames. "
                 f"Need at least 3 clear face images for reliable registration."
@@ -313,33 +1128,34 @@ class FaceRecognitionSystem:
         # Track registration time
         reg_start = time.time()
         
-        # Add to FAISS index
-        self.index.add(np.expand_dims(agg, axis=0))
-        self.student_ids.append(student_id)
-        
-        # Store metadata
-        self.metadata[student_id] = {
+        # Metadata is stored with the row, after the duplicate check
+        meta = {
             'registration_date': datetime.now().isoformat(),
             'quality_best': float(best_quality),
             'quality_avg': float(avg_quality),
             'frames_used': len(scored),
+            'frames_processed': processed,
             'frames_total': len(image_paths),
-            'model_version': 'buffalo_l',
+            'model_version': self.backend.name,
             'embedding_norm': float(np.linalg.norm(agg)),
             'threshold_used': self.RECOGNITION_THRESHOLD
         }
         
-        # Save everything
-        self.save_index()
+        # Add to FAISS index + raw vector store and save everything
+        report = self._add_to_gallery(np.expand_dims(agg, axis=0), [student_id], shard_key,
+                                      metadata={student_id: meta})
         
         reg_time = (time.time() - reg_start) * 1000
         self.metrics['registration_times'].append(reg_time)
         self.metrics['quality_scores'].append(avg_quality)
-        self.metrics['total_registrations'] += 1
-        
-        print(f"✓ Registered student {student_id} with {len(scored)}/{len(image_paths)} valid frames")
+        if student_id in report['merged']:
+            print(f"🔁 Student {student_id} already registered with this face: merged, nothing added")
+        else:
+            self.metrics['total_registrations'] += 1
+            print(f"✓ Registered student {student_id} with {len(scored)}/{len(image_paths)} valid frames "
+                  f"({len(image_paths) - processed} skipped by pre-screen)")
         print(f"  Registration time: {reg_time:.1f}ms")
-        return True
+        return report
 
     def recognize_face(self, image_path: str, threshold: float = 0.70):
         """Recognize a face and return the best match if over cosine threshold.
@@ -347,27 +1163,26 @@ class FaceRecognitionSystem:
         Using inner product on normalized embeddings -> cosine similarity (higher is better).
         Default threshold: 0.70 (70%) for high security and accuracy.
         """
-        if self.index is None or self.index.ntotal == 0:
+        if self._gallery_empty():
             return None
 
-        # Set HNSW search quality if using HNSW index
-        if self.use_hnsw and hasattr(self.index, 'hnsw'):
-            self.index.hnsw.efSearch = 32  # Higher = more accurate but slower
-        
         search_start = time.time()
-        embedding = self.extract_embedding(image_path)
-        sims, indices = self.index.search(np.expand_dims(embedding, axis=0), k=1)
+        with tracing.span('embed', faces=1):
+            embedding = self.extract_embedding(image_path)
+        with tracing.span('search', faces=1):
+            sims, ids = self.search_gallery(np.expand_dims(embedding, axis=0), k=self._search_k())
         search_time = (time.time() - search_start) * 1000
+        self._audit_decisions(threshold, [None], sims, ids)
 
-        idx = int(indices[0][0]) if indices.size > 0 else -1
-        sim = float(sims[0][0]) if sims.size > 0 else -1.0
+        sid = ids[0][0]
+        sim = float(sims[0][0])
 
         # Track search performance
         self.metrics['search_times'].append(search_time)
         self.metrics['total_searches'] += 1
 
-        if idx >= 0 and sim >= threshold:
-            student_id = self.student_ids[idx]
+        if sid is not None and sim >= threshold:
+            student_id = sid
             # confidence ~ normalize similarity into 0..1 with threshold as baseline
             confidence = max(0.0, min(1.0, (sim - threshold) / (1.0 - threshold)))
             return {"student_id": student_id, "confidence": confidence, "similarity": sim}
@@ -393,17 +1208,13 @@ class FaceRecognitionSystem:
             Dict with student_id, confidence, similarity, frames, votes
             None if no confident match found
         """
-        if self.index is None or self.index.ntotal == 0:
+        if self._gallery_empty():
             return None
         
         # Use class threshold if not specified
         if threshold is None:
             threshold = self.RECOGNITION_THRESHOLD
         
-        # Set HNSW search quality if using HNSW index
-        if self.use_hnsw and hasattr(self.index, 'hnsw'):
-            self.index.hnsw.efSearch = 32  # Higher = more accurate but slower
-        
         multi_search_start = time.time()
         
         # Track votes and similarities for each student ID
@@ -422,12 +1233,12 @@ class FaceRecognitionSystem:
             total_frames += 1
             
             # Search FAISS index for nearest match
-            sims, indices = self.index.search(np.expand_dims(emb, axis=0), k=1)
-            match_idx = int(indices[0][0]) if indices.size > 0 else -1
-            similarity = float(sims[0][0]) if sims.size > 0 else -1.0
+            sims, ids = self.search_gallery(np.expand_dims(emb, axis=0), k=self._search_k())
+            self._audit_decisions(threshold, [None], sims, ids)
+            sid = ids[0][0]
+            similarity = float(sims[0][0])
             
-            if match_idx >= 0 and similarity >= threshold:
-                sid = self.student_ids[match_idx]
+            if sid is not None and similarity >= threshold:
                 votes[sid] = votes.get(sid, 0) + 1
                 if sid not in similarities:
                     similarities[sid] = []
@@ -473,17 +1284,26 @@ class FaceRecognitionSystem:
 
     def stats(self) -> dict:
         """Get comprehensive statistics about the face recognition system."""
-        avg_search_time = np.mean(self.metrics['search_times'][-100:]) if self.metrics['search_times'] else 0
-        avg_reg_time = np.mean(self.metrics['registration_times'][-100:]) if self.metrics['registration_times'] else 0
-        avg_quality = np.mean(self.metrics['quality_scores'][-100:]) if self.metrics['quality_scores'] else 0
+        avg_search_time = np.mean(list(self.metrics['search_times'])[-100:]) if self.metrics['search_times'] else 0
+        avg_reg_time = np.mean(list(self.metrics['registration_times'])[-100:]) if self.metrics['registration_times'] else 0
+        avg_quality = np.mean(list(self.metrics['quality_scores'])[-100:]) if self.metrics['quality_scores'] else 0
+        shard_stats = self.shards.stats() if self.shards is not None else None
+        registered = len(self.student_ids)
+        if shard_stats is not None:
+            registered = sum(s.get("ntotal") or 0 for s in shard_stats)
         
         return {
             "index_path": self.index_dir,
             "dimension": self.dimension,
-            "index_type": "HNSW" if self.use_hnsw else "Flat",
+            "index_type": self._index_description(),
+            "index_mode": self.index_mode,
+            "index_decision": self.index_decision,
+            "index_rebuilding": self._rebuild_thread is not None and self._rebuild_thread.is_alive(),
+            "shards": shard_stats,
             "ntotal": int(self.index.ntotal) if self.index is not None else 0,
-            "registered_students": len(self.student_ids),
-            "model": "InsightFace buffalo_l (ArcFace)",
+            "registered_students": registered,
+            "model": self.backend.name,
+            "gallery_model": self.gallery_model,
             "thresholds": {
                 "recognition": self.RECOGNITION_THRESHOLD,
                 "min_quality": self.MIN_QUALITY_THRESHOLD
@@ -498,10 +1318,130 @@ class FaceRecognitionSystem:
                 "avg_quality_score": round(avg_quality, 3),
                 "samples": len(self.metrics['quality_scores'])
             },
-            "registered_students": len(self.student_ids),
+            "registered_students": registered,
+        }
+
+    def memory_usage(self) -> Dict[str, Dict[str, Any]]:
+        """Memory held per component (see memory.py for the report format)."""
+        def file_size(name: str) -> int:
+            path = os.path.join(self.index_dir, name)
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        rebuilding = self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+        names = self.student_ids._names if self.student_ids is not None else []
+        samples = sum(len(self.metrics[k]) for k in ('search_times', 'registration_times', 'quality_scores'))
+        return {
+            "index": {
+                "bytes": index_memory_bytes(self.index),
+                "type": self._index_description(),
+                "ntotal": int(self.index.ntotal) if self.index is not None else 0,
+                # A rebuild holds a second index until it is swapped in
+                "rebuilding": rebuilding,
+            },
+            "id_map": {
+                # int64 codes are memory-mapped; interned non-numeric IDs live on the heap
+                # (string + list slot + name -> code dict entry)
+                "bytes": sum(sys.getsizeof(n) + 100 for n in names),
+                "file_bytes": file_size("student_ids.i64"),
+                "rows": len(self.student_ids) if self.student_ids is not None else 0,
+                "interned_ids": len(names),
+            },
+            "raw_vectors": {"bytes": 0, "file_bytes": file_size("vectors.f32")},
+            "changelog": {"bytes": 0, "file_bytes": file_size("changelog.bin")},
+            "metadata": {
+                # SQLite page caches of all connections (this gallery, a migration shadow, ...)
+                "bytes": sqlite_memory_used() or 0,
+                "db_file_bytes": file_size("metadata.db") + file_size("metadata.db-wal"),
+            },
+            "model_sessions": {
+                "bytes": self.backend_load_bytes or 0,
+                "backend": self.backend.name,
+                "measured": "anonymous RSS growth while the backend loaded",
+            },
+            "metrics": {
+                # float + deque slot per sample
+                "bytes": samples * (sys.getsizeof(0.0) + 8),
+                "samples": samples,
+                "window": METRICS_WINDOW,
+            },
         }
 
+    def trim_metrics(self) -> None:
+        """Drop latency / quality samples (counters are kept)."""
+        for key in ('search_times', 'registration_times', 'quality_scores'):
+            self.metrics[key].clear()
+
     # -------- Multi-face recognition on a single image --------
+    def _gallery_empty(self) -> bool:
+        # A coordinator cannot know cheaply; the shards answer with no matches instead
+        return self.shards is None and (self.index is None or self.index.ntotal == 0)
+
+    def search_gallery(self, embeddings: np.ndarray, k: int = 1) -> Tuple[np.ndarray, List[List[Optional[str]]]]:
+        """Top-k gallery matches as student IDs, from the local index or the shards.
+
+        Returns:
+            (similarities (n, k), student_ids n x k lists; None where there is no match)
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        if self.shards is not None:
+            return self.shards.search(embeddings, k)
+        self._check_model()
+        with self._gallery_lock.read():
+            if self.index is None or self.index.ntotal == 0:
+                return np.full((len(embeddings), k), -1.0, dtype=np.float32), [[None] * k for _ in embeddings]
+            sims, indices = self._search(embeddings, k)
+            id_map = self.student_ids
+            ids = [[id_map[j] if 0 <= j < len(id_map) else None for j in row] for row in indices]
+        return sims, ids
+
+    def _search(self, embeddings: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Batch nearest-neighbour search over the gallery (caller holds the gallery lock shared).
+
+        Search breadth is passed per call (SearchParameters*) rather than set on
+        the shared index, so concurrent searches never race on it.
+
+        Args:
+            embeddings: (n, d) float32 array of L2-normalized embeddings
+            k: Number of neighbours per query
+
+        Returns:
+            (similarities, row_indices), both shaped (n, k)
+        """
+        params = None
+        if self.use_hnsw and hasattr(self.index, 'hnsw'):
+            params = faiss.SearchParametersHNSW(efSearch=HNSW_EF_SEARCH)
+        elif self.trained_on:
+            if IVF_RERANK:
+                return self._search_reranked(embeddings, k)
+            params = faiss.SearchParametersIVF(nprobe=IVF_NPROBE)
+        sims, indices = self.index.search(np.ascontiguousarray(embeddings, dtype="float32"), k, params=params)
+        if self.index.metric_type == faiss.METRIC_L2:
+            # Legacy HNSW indexes were built with the L2 metric: for unit vectors
+            # squared L2 distance d relates to cosine similarity as 1 - d / 2
+            sims = 1.0 - sims / 2.0
+        return sims, indices
+
+    def _search_reranked(self, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """IVF-PQ candidate search, then exact re-scoring from the memory-mapped raw vectors.
+
+        PQ similarities are approximate (a few hundredths off), which matters
+        right at the recognition threshold; only k * IVF_RERANK rows are read.
+        """
+        queries = np.ascontiguousarray(embeddings, dtype="float32")
+        _, candidates = self.index.search(queries, k * IVF_RERANK, params=faiss.SearchParametersIVF(nprobe=IVF_NPROBE))
+        vectors = self.load_vectors()
+        sims = np.full((len(queries), k), -1.0, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, cand in enumerate(candidates):
+            cand = cand[cand >= 0]
+            if len(cand) == 0:
+                continue
+            exact = vectors[np.sort(cand)] @ queries[row]
+            order = np.argsort(-exact)[:k]
+            sims[row, :len(order)] = exact[order]
+            indices[row, :len(order)] = np.sort(cand)[order]
+        return sims, indices
+
     def recognize_faces_in_image(self, image_path: str, threshold: float = 0.35):
         """Detect multiple faces in a single image and recognize each independently.
         
@@ -523,100 +1463,195 @@ class FaceRecognitionSystem:
             }] 
         }
         """
-        img = cv2.imread(image_path)
+        with tracing.span('decode'):
+            img = cv2.imread(image_path)
         if img is None:
             raise Exception("Image load failed")
+        return self.recognize_faces_in_frame(img, threshold=threshold)
+
+    def recognize_faces_in_frame(self, img: np.ndarray, threshold: float = 0.35, tiled: Optional[bool] = None):
+        """Same as `recognize_faces_in_image` but for an already decoded BGR frame.
 
+        Pipeline: detect (single pass or tiled) -> drop faces below MIN_FACE_SIZE /
+        MIN_DET_SCORE and cap at MAX_FACES_PER_FRAME -> align + ArcFace on the
+        survivors in one batch -> one batched FAISS search.
+
+        Args:
+            tiled: Force tiled (True) or single-pass (False) detection; None follows TILED_DETECTION
+        """
         h, w = img.shape[:2]
-        faces = self.face_app.get(img) or []
+        with tracing.span('detect', width=int(w), height=int(h)) as sp:
+            faces, detected = self.detect_faces(img, tiled)
+            if sp:
+                sp.set('faces', len(faces))
+        image_meta = {"width": int(w), "height": int(h)}
 
         if not faces:
-            return {"image": {"width": w, "height": h}, "faces": []}
+            return {"image": image_meta, "faces": [], "filtered_faces": detected}
 
-        results = []
-        
-        # Batch process all embeddings for speed
-        embeddings = []
+        with tracing.span('embed', faces=len(faces)):
+            embeddings = self.backend.embed(img, faces)
         face_data = []
-        
         for f in faces:
-            bbox = getattr(f, 'bbox', None)
-            emb = getattr(f, 'normed_embedding', None)
-            det_score = getattr(f, 'det_score', 0.0)
-            rect = [int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3])] if bbox is not None else [0, 0, 0, 0]
-            
+            bbox = f.bbox
             face_data.append({
-                "bbox": rect,
-                "det_score": float(det_score)
+                "bbox": [int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3])],
+                "det_score": float(f.det_score),
             })
-            
-            if emb is not None:
-                embeddings.append(_l2_normalize(emb.astype("float32")))
-            else:
-                embeddings.append(None)
-
-        # Batch FAISS search for all valid embeddings (fast!)
-        if self.index is not None and self.index.ntotal > 0:
-            valid_embs = [e for e in embeddings if e is not None]
-            if valid_embs:
-                # Single batch search for all faces - much faster than individual searches
-                emb_array = np.stack(valid_embs, axis=0)
-                sims, indices = self.index.search(emb_array, k=1)
-                
-                valid_idx = 0
-                for i, emb in enumerate(embeddings):
-                    if emb is None:
-                        # No embedding extracted for this face
-                        results.append({
-                            **face_data[i],
-                            "recognized": False,
-                            "student_id": None,
-                            "similarity": None,
-                            "confidence": None,
-                        })
-                    else:
-                        # Use pre-computed batch search result
-                        match_idx = int(indices[valid_idx][0])
-                        similarity = float(sims[valid_idx][0])
-                        valid_idx += 1
-                        
-                        if match_idx >= 0 and similarity >= threshold:
-                            sid = self.student_ids[match_idx]
-                            conf = max(0.0, min(1.0, (similarity - threshold) / (1.0 - threshold)))
-                            results.append({
-                                **face_data[i],
-                                "recognized": True,
-                                "student_id": sid,
-                                "similarity": similarity,
-                                "confidence": conf,
-                            })
-                        else:
-                            results.append({
-                                **face_data[i],
-                                "recognized": False,
-                                "student_id": None,
-                                "similarity": similarity if match_idx >= 0 else None,
-                                "confidence": None,
-                            })
+
+        return {
+            "image": image_meta,
+            "faces": self._match_faces(face_data, list(embeddings), threshold),
+            "filtered_faces": detected - len(faces),
+        }
+
+    def detect_faces(self, img: np.ndarray, tiled: Optional[bool] = None) -> Tuple[List[Any], int]:
+        """Detect (single pass or tiled) and keep the faces worth embedding.
+
+        Returns:
+            (selected faces, number of faces detected before filtering)
+        """
+        h, w = img.shape[:2]
+        if tiled is None:
+            tiled = self.TILED_DETECTION == 'on' or (
+                self.TILED_DETECTION == 'auto' and max(h, w) > self.TILE_MIN_IMAGE_SIDE)
+        detected = self._detect_tiled(img) if tiled else self.backend.detect(img)
+        return self._select_faces(detected), len(detected)
+
+    def recognize_crops(self, crops: List[np.ndarray], landmarks: Optional[List[Optional[np.ndarray]]] = None,
+                        threshold: float = 0.7) -> List[Dict[str, Any]]:
+        """Recognize faces cropped by the client, skipping server-side detection.
+
+        Args:
+            crops: BGR face crops. Without landmarks each must already be aligned
+                to the ArcFace template at backend.crop_size (112x112).
+            landmarks: Optional 5-point landmarks per crop (crop coordinates); when
+                given, the crop is aligned server-side first.
+            threshold: Cosine similarity threshold
+
+        Returns:
+            [{index, recognized, student_id, similarity, confidence}] in input order
+
+        Raises:
+            AlignmentError: A crop's landmarks cannot be aligned to the template
+        """
+        size = self.backend.crop_size
+        aligned = []
+        for i, crop in enumerate(crops):
+            kps = landmarks[i] if landmarks is not None and i < len(landmarks) else None
+            if kps is not None:
+                kps = np.asarray(kps, dtype=np.float32).reshape(5, 2)
+                try:
+                    aligned.append(self.backend.align(crop, kps))
+                except AlignmentError as e:
+                    raise AlignmentError(f"Crop {i}: {e} (degenerate landmarks)")
+            elif crop.shape[0] == size and crop.shape[1] == size:
+                aligned.append(crop)
             else:
-                # No valid embeddings extracted
-                for i in range(len(face_data)):
-                    results.append({
-                        **face_data[i],
-                        "recognized": False,
-                        "student_id": None,
-                        "similarity": None,
-                        "confidence": None,
-                    })
-        else:
-            # No index or empty index
-            for i in range(len(face_data)):
-                results.append({
-                    **face_data[i],
-                    "recognized": False,
-                    "student_id": None,
-                    "similarity": None,
-                    "confidence": None,
-                })
-
-        return {"image": {"width": int(w), "height": int(h)}, "faces": results}
+                raise Exception(
+                    f"Crop {i} is {crop.shape[1]}x{crop.shape[0]}: expected an aligned {size}x{size} crop "
+                    f"or 5-point landmarks"
+                )
+
+        search_start = time.time()
+        with tracing.span('embed', faces=len(aligned)):
+            embeddings = self.backend.embed_crops(aligned)
+        results = self._match_faces([{"index": i} for i in range(len(aligned))], list(embeddings), threshold)
+        self.metrics['search_times'].append((time.time() - search_start) * 1000)
+        self.metrics['total_searches'] += 1
+        return results
+
+    def _tile_grid(self, w: int, h: int) -> List[Tuple[int, int, int, int]]:
+        """Overlapping tiles (x0, y0, x1, y1) covering a w x h frame."""
+        det_side = max(getattr(self.backend, 'det_size', (640, 640)))
+        tile = int(min(max(w, h), det_side * self.TILE_SCALE))
+        step = max(1, int(tile * (1.0 - self.TILE_OVERLAP)))
+
+        def starts(length: int) -> List[int]:
+            if length <= tile:
+                return [0]
+            n = int(np.ceil((length - tile) / step)) + 1
+            # spread tiles evenly so the last one ends exactly at the border
+            return [int(round(i * (length - tile) / (n - 1))) for i in range(n)]
+
+        return [(x, y, min(w, x + tile), min(h, y + tile)) for y in starts(h) for x in starts(w)]
+
+    def _detect_tiled(self, img: np.ndarray) -> List[Any]:
+        """Detect on a downscaled full frame plus native-resolution tiles, then merge.
+
+        The full-frame pass catches large faces; tiles catch small ones. Tile
+        detections touching an inner tile border are dropped (the face is cut and
+        is found whole by a neighbouring tile or the full-frame pass), and the
+        rest are merged across tiles with NMS.
+        """
+        h, w = img.shape[:2]
+        tiles = self._tile_grid(w, h)
+        crops = [img] + [img[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+        per_image = self.backend.detect_many(crops)
+
+        candidates = list(per_image[0])
+        margin = 2.0
+        for (x0, y0, x1, y1), faces in zip(tiles, per_image[1:]):
+            for f in faces:
+                bx0, by0, bx1, by1 = f.bbox
+                cut = ((x0 > 0 and bx0 <= margin) or (y0 > 0 and by0 <= margin) or
+                       (x1 < w and bx1 >= (x1 - x0) - margin) or (y1 < h and by1 >= (y1 - y0) - margin))
+                if cut:
+                    continue
+                f.bbox = f.bbox + np.array([x0, y0, x0, y0], dtype=np.float32)
+                if f.kps is not None:
+                    f.kps = f.kps + np.array([x0, y0], dtype=np.float32)
+                candidates.append(f)
+        return _nms(candidates, self.TILE_NMS_IOU)
+
+    def _select_faces(self, faces: List[Any]) -> List[Any]:
+        """Keep faces worth embedding: big and confident enough, best first, capped."""
+        kept = []
+        for f in faces:
+            side = min(f.bbox[2] - f.bbox[0], f.bbox[3] - f.bbox[1])
+            if side >= self.MIN_FACE_SIZE and f.det_score >= self.MIN_DET_SCORE:
+                kept.append((float(side) * float(f.det_score), f))
+        kept.sort(key=lambda x: x[0], reverse=True)
+        return [f for _, f in kept[:self.MAX_FACES_PER_FRAME]]
+
+    def _search_k(self) -> int:
+        """Candidates per recognition search: the best match, or the audit log's top-k."""
+        return 1 if self.audit is None else self.audit.top_k
+
+    def _audit_decisions(self, threshold: float, bboxes: List[Optional[List[int]]],
+                         sims: np.ndarray, ids: List[List[Optional[str]]]) -> None:
+        """Queue one audit record per searched face (no-op without an audit log)."""
+        if self.audit is None:
+            return
+        for bbox, row_sims, row_ids in zip(bboxes, sims, ids):
+            self.audit.record(self.gallery_model, self.namespace, threshold, bbox, row_ids, row_sims)
+
+    def _match_faces(self, face_data: List[Dict[str, Any]], embeddings: List[Optional[np.ndarray]],
+                     threshold: float) -> List[Dict[str, Any]]:
+        """Search all valid embeddings in one FAISS call and build per-face results."""
+        results = [
+            {**fd, "recognized": False, "student_id": None, "similarity": None, "confidence": None}
+            for fd in face_data
+        ]
+        if self._gallery_empty():
+            return results
+
+        valid = [i for i, e in enumerate(embeddings) if e is not None]
+        if not valid:
+            return results
+
+        # Single batch search for all faces - much faster than individual searches
+        with tracing.span('search', faces=len(valid)):
+            sims, ids = self.search_gallery(np.stack([embeddings[i] for i in valid], axis=0), k=self._search_k())
+        self._audit_decisions(threshold, [face_data[i].get("bbox") for i in valid], sims, ids)
+        for row, i in enumerate(valid):
+            sid = ids[row][0]
+            similarity = float(sims[row][0])
+            if sid is None:
+                continue
+            results[i]["similarity"] = similarity
+            if similarity >= threshold:
+                results[i]["recognized"] = True
+                results[i]["student_id"] = sid
+                results[i]["confidence"] = max(0.0, min(1.0, (similarity - threshold) / (1.0 - threshold)))
+        return results
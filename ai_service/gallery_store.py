@@ -0,0 +1,233 @@
+"""Compact on-disk ID map and metadata store for the face gallery.
+
+student_ids.i64   row -> student code, little-endian int64, append-only and
+                  memory-mapped: startup cost and RSS do not grow with Python
+                  objects per row. Numeric student IDs (Django primary keys)
+                  are stored as their value; any other ID is interned in the
+                  `names` table and stored as -(name row).
+metadata.db       SQLite: one JSON document per student, upserted on write,
+                  read on demand (never loaded whole). Every write stamps the
+                  row with the next store version, so replicas can fetch the
+                  documents changed since the last version they applied.
+
+Galleries saved as student_ids.pkl + metadata.json are converted on first
+load (see FaceRecognitionSystem.load_or_create_index); the old files are kept
+with a .migrated suffix.
+"""
+import os
+import json
+import ctypes
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Numeric IDs up to 18 digits fit in int64 without colliding with interned (negative) codes
+_MAX_NUMERIC_DIGITS = 18
+
+
+def sqlite_memory_used() -> Optional[int]:
+    """Heap bytes held by SQLite across all connections of the process (None if unavailable)."""
+    try:
+        import _sqlite3
+        fn = ctypes.CDLL(_sqlite3.__file__).sqlite3_memory_used
+    except (ImportError, OSError, AttributeError):
+        return None
+    fn.restype = ctypes.c_int64
+    return int(fn())
+
+
+class MetadataStore:
+    """Per-student metadata in SQLite with a small dict-like interface."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit; writes are single-row upserts or explicit transactions
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS metadata (student_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                           "version INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS names (code INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+        if 'version' not in [c[1] for c in self._conn.execute("PRAGMA table_info(metadata)")]:
+            # Stores written before versioning: existing rows are version 0 (shipped with their vectors)
+            self._conn.execute("ALTER TABLE metadata ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_version ON metadata (version)")
+        self._version = self._conn.execute("SELECT COALESCE(MAX(version), 0) FROM metadata").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def shrink_memory(self) -> None:
+        """Release this connection's page cache (refilled from disk on demand)."""
+        with self._lock:
+            self._conn.execute("PRAGMA shrink_memory")
+
+    def get(self, student_id: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM metadata WHERE student_id = ?", (student_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __getitem__(self, student_id: str) -> Dict[str, Any]:
+        meta = self.get(student_id)
+        if meta is None:
+            raise KeyError(student_id)
+        return meta
+
+    def __contains__(self, student_id: object) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM metadata WHERE student_id = ?", (student_id,)).fetchone() is not None
+
+    def __setitem__(self, student_id: str, meta: Dict[str, Any]) -> None:
+        self.set_many({student_id: meta})
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def set_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Upsert several students in one transaction."""
+        if not items:
+            return
+        with self._lock:
+            rows = [(str(sid), json.dumps(meta), self._version + i + 1) for i, (sid, meta) in enumerate(items.items())]
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO metadata (student_id, data, version) VALUES (?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET data = excluded.data, version = excluded.version", rows)
+            self._conn.execute("COMMIT")
+            self._version += len(rows)
+
+    def merge(self, student_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Update some fields of one student's metadata (created if missing); returns the result."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT data FROM metadata WHERE student_id = ?", (student_id,)).fetchone()
+            meta = json.loads(row[0]) if row else {}
+            meta.update(fields)
+            self._conn.execute(
+                "INSERT INTO metadata (student_id, data, version) VALUES (?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET data = excluded.data, version = excluded.version",
+                (student_id, json.dumps(meta), self._version + 1))
+            self._conn.execute("COMMIT")
+            self._version += 1
+        return meta
+
+    def version(self) -> int:
+        """Version of the latest write (0 for a store never written since versioning)."""
+        return self._version
+
+    def changed_since(self, version: int, limit: int) -> Tuple[Dict[str, Dict[str, Any]], int]:
+        """Documents written after `version`, oldest first (at most `limit`), and the version they reach."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT student_id, data, version FROM metadata WHERE version > ? ORDER BY version LIMIT ?",
+                (version, limit)).fetchall()
+        return {sid: json.loads(data) for sid, data, _ in rows}, (rows[-1][2] if rows else version)
+
+    def get_many(self, student_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ids = list(dict.fromkeys(student_ids))
+        out = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for sid, data in self._conn.execute(
+                        f"SELECT student_id, data FROM metadata WHERE student_id IN ({marks})", chunk):
+                    out[sid] = json.loads(data)
+        return out
+
+    def items(self, batch: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream all (student_id, metadata) pairs without loading them at once."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT student_id, data FROM metadata WHERE student_id > ? ORDER BY student_id LIMIT ?",
+                    (last, batch)).fetchall()
+            if not rows:
+                return
+            for sid, data in rows:
+                yield sid, json.loads(data)
+            last = rows[-1][0]
+
+    # -------- Interned non-numeric student IDs (for IdMap) --------
+    def load_names(self) -> List[str]:
+        with self._lock:
+            return [name for (name,) in self._conn.execute("SELECT name FROM names ORDER BY code")]
+
+    def add_names(self, names: List[str], first_code: int) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO names (code, name) VALUES (?, ?)",
+                                   [(first_code + i, n) for i, n in enumerate(names)])
+            self._conn.execute("COMMIT")
+
+
+class IdMap:
+    """Append-only row -> student ID map backed by a memory-mapped int64 file.
+
+    Behaves like the list it replaces (len, indexing, slicing, iteration, extend).
+    """
+
+    def __init__(self, path: str, store: MetadataStore):
+        self.path = path
+        self.store = store
+        self._names = store.load_names()                      # interned IDs, code -(i + 1)
+        self._name_codes = {n: -(i + 1) for i, n in enumerate(self._names)}
+        self._codes = np.zeros(0, dtype='<i8')
+        self._map()
+
+    def _map(self) -> None:
+        n = os.path.getsize(self.path) // 8 if os.path.exists(self.path) else 0
+        self._codes = np.memmap(self.path, dtype='<i8', mode='r', shape=(n,)) if n else np.zeros(0, dtype='<i8')
+
+    @staticmethod
+    def _numeric(student_id: str) -> bool:
+        return (student_id.isascii() and student_id.isdigit() and len(student_id) <= _MAX_NUMERIC_DIGITS
+                and (student_id == '0' or student_id[0] != '0'))
+
+    def _name(self, code: int) -> str:
+        return str(code) if code >= 0 else self._names[-code - 1]
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self._name(int(c)) for c in self._codes[i]]
+        return self._name(int(self._codes[i]))
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self._codes), 65536):
+            for c in self._codes[start:start + 65536].tolist():
+                yield self._name(c)
+
+    def codes(self) -> np.ndarray:
+        """Read-only int64 view of all row codes."""
+        return self._codes
+
+    def extend(self, student_ids: Iterable[str]) -> None:
+        student_ids = [str(s) for s in student_ids]
+        new_names = []
+        for sid in student_ids:
+            if not self._numeric(sid) and sid not in self._name_codes:
+                self._names.append(sid)
+                self._name_codes[sid] = -len(self._names)
+                new_names.append(sid)
+        if new_names:
+            self.store.add_names(new_names, len(self._names) - len(new_names) + 1)
+        codes = np.array([int(sid) if self._numeric(sid) else self._name_codes[sid] for sid in student_ids],
+                         dtype='<i8')
+        with open(self.path, "ab") as f:
+            f.write(codes.tobytes())
+        self._map()
+
+    def truncate(self, n: int) -> None:
+        """Drop rows beyond n (unsaved tail after a crash)."""
+        with open(self.path, "r+b") as f:
+            f.truncate(n * 8)
+        self._map()
@@ -0,0 +1,311 @@
+"""Chunked binary export/import of a gallery, for provisioning nodes and restoring shards.
+
+Stream layout (little-endian):
+
+    header   'FGAL' | version u16 | dtype u16 (0 = float32, 1 = float16) | dim u32
+             | total rows u64 | since u64 | model name (u16 length + UTF-8)
+    chunk*   'CHNK' | start row u64 | rows u32 | payload bytes u32 | crc32(payload) u32
+             payload = ids (u32 length + UTF-8, '\\n' separated) | vectors (rows x dim)
+                       | change-log timestamps (rows x f64) | zlib(JSON metadata of the chunk's students)
+    trailer  'FEND' | total rows u64
+
+Chunks carry their absolute start row, so an import is resumable: the target's
+row count is its position, chunks below it are skipped and the rest appended.
+The importer holds one chunk in memory at a time. Rows go straight to the raw
+vector store, ID map, change log and metadata store; the index is built once
+at the end from the raw vectors (an in-progress import is marked by
+import.json in the index directory, which also blocks registrations).
+
+float16 halves the transfer size; vectors are re-normalised on import
+(cosine error below 1e-6, far below recognition thresholds).
+
+The service endpoints that read or replace the whole gallery (export, import,
+replication log, shard inserts, re-embedding migration, memory eviction and
+allocation tracing)
+require the shared secret GALLERY_TOKEN in the X-Gallery-Token header; without
+GALLERY_TOKEN they are disabled.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+
+MAGIC = b'FGAL'
+VERSION = 1
+DTYPES = {'f32': (0, np.dtype('<f4')), 'f16': (1, np.dtype('<f2'))}
+HEADER = struct.Struct('<4sHHIQQ')
+CHUNK = struct.Struct('<4sQIII')
+TRAILER = struct.Struct('<4sQ')
+DEFAULT_CHUNK_ROWS = 8192
+TOKEN_HEADER = 'X-Gallery-Token'
+
+
+class TransferError(Exception):
+    """Malformed, corrupt or incompatible gallery stream."""
+
+
+def token_headers() -> Dict[str, str]:
+    """Request headers carrying GALLERY_TOKEN, for clients of the gallery endpoints (empty if unset)."""
+    token = os.environ.get('GALLERY_TOKEN')
+    return {TOKEN_HEADER: token} if token else {}
+
+
+# -------- Export --------
+def encode_header(dtype: str, dim: int, total: int, since: int, model: str) -> bytes:
+    raw_model = model.encode('utf-8')
+    return HEADER.pack(MAGIC, VERSION, DTYPES[dtype][0], dim, total, since) + struct.pack('<H', len(raw_model)) + raw_model
+
+
+def encode_chunk(start: int, student_ids: List[str], vectors: np.ndarray, timestamps: List[float],
+                 metadata: Dict[str, Any], dtype: str = 'f32') -> bytes:
+    ids_blob = "\n".join(student_ids).encode('utf-8')
+    if any("\n" in sid for sid in student_ids):
+        raise TransferError("Student IDs containing newlines cannot be exported")
+    payload = b"".join([
+        struct.pack('<I', len(ids_blob)), ids_blob,
+        np.ascontiguousarray(vectors, dtype=DTYPES[dtype][1]).tobytes(),
+        np.asarray(timestamps, dtype='<f8').tobytes(),
+        zlib.compress(json.dumps(metadata, separators=(',', ':')).encode('utf-8'), 1),
+    ])
+    return CHUNK.pack(b'CHNK', start, len(student_ids), len(payload), zlib.crc32(payload)) + payload
+
+
+def export_stream(face_system, since: int = 0, dtype: str = 'f32',
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Yield the gallery rows [since, n) as a binary stream (n fixed when the export starts).
+
+    The gallery is append-only, so rows below the starting count never change
+    and no lock is held while streaming.
+    """
+    if dtype not in DTYPES:
+        raise TransferError(f"Unknown dtype: {dtype}")
+    if face_system.shards is not None:
+        raise TransferError("Export each shard node, not the coordinator")
+    with face_system._write_lock:
+        total = len(face_system.student_ids)
+    since = max(0, min(since, total))
+    yield encode_header(dtype, face_system.dimension, total, since, face_system.gallery_model)
+    vectors = face_system.load_vectors()
+    for start in range(since, total, chunk_rows):
+        end = min(total, start + chunk_rows)
+        ids = face_system.student_ids[start:end]
+        timestamps, _ = face_system.changelog.read(start, end - start)
+        yield encode_chunk(start, ids, vectors[start:end], timestamps,
+                           face_system.metadata.get_many(ids), dtype)
+    yield TRAILER.pack(b'FEND', total)
+
+
+# -------- Import --------
+class StreamReader:
+    """Incremental parser: feed() bytes as they arrive, get header / chunks / trailer events."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.header: Optional[Dict[str, Any]] = None
+        self.total: Optional[int] = None  # set by the trailer
+
+    def feed(self, data: bytes) -> Iterator[Dict[str, Any]]:
+        self._buf += data
+        while True:
+            event = self._next()
+            if event is None:
+                return
+            yield event
+
+    def _take(self, n: int) -> bytes:
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def _next(self) -> Optional[Dict[str, Any]]:
+        buf = self._buf
+        if self.header is None:
+            if len(buf) < HEADER.size + 2:
+                return None
+            magic, version, dtype_code, dim, total, since = HEADER.unpack_from(buf)
+            if magic != MAGIC:
+                raise TransferError("Not a gallery stream")
+            if version != VERSION:
+                raise TransferError(f"Unsupported gallery stream version {version}")
+            (model_len,) = struct.unpack_from('<H', buf, HEADER.size)
+            if len(buf) < HEADER.size + 2 + model_len:
+                return None
+            self._take(HEADER.size + 2)
+            dtype = next((name for name, (code, _) in DTYPES.items() if code == dtype_code), None)
+            if dtype is None:
+                raise TransferError(f"Unknown dtype code {dtype_code}")
+            self.header = {"dtype": dtype, "dim": dim, "total": total, "since": since,
+                           "model": self._take(model_len).decode('utf-8')}
+            return {"type": "header", **self.header}
+        if len(buf) < 4:
+            return None
+        if bytes(buf[:4]) == b'FEND':
+            if len(buf) < TRAILER.size:
+                return None
+            _, total = TRAILER.unpack(self._take(TRAILER.size))
+            self.total = total
+            return {"type": "end", "total": total}
+        if len(buf) < CHUNK.size:
+            return None
+        magic, start, rows, size, crc = CHUNK.unpack_from(buf)
+        if magic != b'CHNK':
+            raise TransferError("Corrupt stream: chunk marker missing")
+        if len(buf) < CHUNK.size + size:
+            return None
+        self._take(CHUNK.size)
+        payload = self._take(size)
+        if zlib.crc32(payload) != crc:
+            raise TransferError(f"Checksum mismatch in chunk at row {start}")
+        return {"type": "chunk", "start": start, "rows": rows, **self._decode(payload, rows)}
+
+    def _decode(self, payload: bytes, rows: int) -> Dict[str, Any]:
+        dim = self.header["dim"]
+        dt = DTYPES[self.header["dtype"]][1]
+        (ids_len,) = struct.unpack_from('<I', payload)
+        off = 4
+        ids = payload[off:off + ids_len].decode('utf-8').split("\n") if rows else []
+        off += ids_len
+        vec_bytes = rows * dim * dt.itemsize
+        vectors = np.frombuffer(payload, dtype=dt, count=rows * dim, offset=off).reshape(rows, dim)
+        off += vec_bytes
+        timestamps = np.frombuffer(payload, dtype='<f8', count=rows, offset=off).tolist()
+        off += rows * 8
+        metadata = json.loads(zlib.decompress(payload[off:]).decode('utf-8'))
+        if len(ids) != rows:
+            raise TransferError("Corrupt chunk: ID count does not match rows")
+        return {"student_ids": ids, "vectors": vectors, "timestamps": timestamps, "metadata": metadata}
+
+
+def import_status(face_system) -> Dict[str, Any]:
+    state = face_system.import_state
+    return {
+        "rows": len(face_system.student_ids),
+        "importing": state is not None,
+        "total": state.get("total") if state else None,
+        "model": face_system.gallery_model,
+        "dimension": face_system.dimension,
+    }
+
+
+class GalleryImporter:
+    """Apply a gallery stream to an empty (or partially imported) local gallery."""
+
+    def __init__(self, face_system):
+        """
+        Args:
+            face_system: Target system; must be empty unless resuming an import
+        """
+        if face_system.shards is not None:
+            raise TransferError("Import into each shard node, not the coordinator")
+        self.fs = face_system
+        self.reader = StreamReader()
+        self.applied = 0
+        self.skipped = 0
+        self.started = time.time()
+        self.finished = False
+
+    def feed(self, data: bytes) -> None:
+        for event in self.reader.feed(data):
+            if event["type"] == "header":
+                self._begin(event)
+            elif event["type"] == "chunk":
+                self._apply(event)
+            else:
+                self._finish(event["total"])
+
+    def _begin(self, header: Dict[str, Any]) -> None:
+        fs = self.fs
+        if header["dim"] != fs.dimension:
+            raise TransferError(f"Stream dimension {header['dim']} != local {fs.dimension}")
+        if header["model"] != fs.backend.name:
+            raise TransferError(f"Stream was embedded with {header['model']}, this node runs {fs.backend.name}")
+        with fs._write_lock:
+            if fs.import_state is None and len(fs.student_ids):
+                raise TransferError(f"Target gallery is not empty ({len(fs.student_ids)} rows)")
+            if fs.import_state is not None and fs.import_state.get("total") != header["total"]:
+                print(f"⚠️  Resuming import with a different source size "
+                      f"({fs.import_state.get('total')} -> {header['total']} rows)")
+            fs.set_import_state({"total": header["total"], "model": header["model"], "started": self.started})
+
+    def _apply(self, chunk: Dict[str, Any]) -> None:
+        fs = self.fs
+        with fs._write_lock:
+            done = len(fs.student_ids)
+            start, rows = chunk["start"], chunk["rows"]
+            if start > done:
+                raise TransferError(f"Gap in stream: expected row {done}, got chunk at {start}")
+            skip = done - start
+            if skip >= rows:
+                self.skipped += rows
+                return
+            vectors = np.asarray(chunk["vectors"][skip:], dtype=np.float32)
+            if chunk["vectors"].dtype != np.float32:
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10
+            ids = chunk["student_ids"][skip:]
+            fs.metadata.set_many(chunk["metadata"])
+            # Same order as the normal write path: vectors, then the log, then the ID map
+            fs._append_vectors(vectors)
+            fs.changelog.append(ids, chunk["timestamps"][skip:])
+            fs.student_ids.extend(ids)
+            self.skipped += skip
+            self.applied += len(ids)
+
+    def _finish(self, total: int) -> None:
+        fs = self.fs
+        if len(fs.student_ids) != total:
+            raise TransferError(f"Stream ended at row {len(fs.student_ids)} of {total}")
+        fs.rebuild_index()
+        fs.save_index()
+        fs.set_import_state(None)
+        self.finished = True
+        elapsed = time.time() - self.started
+        print(f"✓ Imported {self.applied} rows ({self.skipped} already present) in {elapsed:.1f}s; "
+              f"gallery {total} rows, {fs._index_description()}")
+        if fs.index_mode == 'auto':
+            fs._maybe_select_index()
+
+    def report(self) -> Dict[str, Any]:
+        return {"applied": self.applied, "skipped": self.skipped, "finished": self.finished,
+                "seconds": round(time.time() - self.started, 2), **import_status(self.fs)}
+
+
+def import_file(face_system, f: BinaryIO, block: int = 1 << 20) -> Dict[str, Any]:
+    """Import a stream from a file object in `block`-sized reads."""
+    importer = GalleryImporter(face_system)
+    while True:
+        data = f.read(block)
+        if not data:
+            break
+        importer.feed(data)
+    return importer.report()
+
+
+def iter_file_from(f: BinaryIO, since: int, block: int = 1 << 20) -> Iterator[bytes]:
+    """Re-stream a saved export, skipping whole chunks that end at or below row `since`."""
+    head = f.read(HEADER.size + 2)
+    (model_len,) = struct.unpack_from('<H', head, HEADER.size)
+    yield head + f.read(model_len)
+    while True:
+        marker = f.read(4)
+        if not marker:
+            return
+        if marker == b'FEND':
+            yield marker + f.read(TRAILER.size - 4)
+            return
+        rest = f.read(CHUNK.size - 4)
+        _, start, rows, size, _ = CHUNK.unpack(marker + rest)
+        if start + rows <= since:
+            f.seek(size, os.SEEK_CUR)
+            continue
+        yield marker + rest
+        remaining = size
+        while remaining:
+            data = f.read(min(block, remaining))
+            if not data:
+                raise TransferError("Truncated export file")
+            remaining -= len(data)
+            yield data
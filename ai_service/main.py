@@ -1,17 +1,109 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Body, Header, Request, Depends
 from typing import List
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse
 import uvicorn
 import os
+import json
+import asyncio
+import shutil
 import tempfile
+import time
+import atexit
 from typing import Optional
-from face_recognition import FaceRecognitionSystem
+from face_recognition import FaceRecognitionSystem, DuplicateFaceError
+from backends import AlignmentError
+from batch import BatchRecognizer, iter_sources, to_ndjson
+from sharding import decode_embeddings
+from model_registry import normalize_model_id
+from replication import ReplicaFollower, read_log_batch
+from scheduler import InferenceScheduler, Overloaded, DeadlineExceeded, parse_deadline_ms, resolve_lane
+from migration import ReembedMigration, MigrationIncomplete
+from gallery_transfer import export_stream, GalleryImporter, TransferError, import_status, DTYPES
+from gallery_transfer import TOKEN_HEADER as GALLERY_TOKEN_HEADER
+from memory import MemoryAccountant
+from profiler import SamplingProfiler, ProfileMiddleware, TOKEN_HEADER, token_matches
+from namespaces import GalleryNamespaces, NamespaceError, NamespaceNotFound, DEFAULT_NAMESPACE
+from video import VideoAttendance, probe_video
+from capture import CaptureAdvisor, parse_pending
+from audit import AuditLog, AuditMiddleware
+from tracing import SpanExporter, TraceMiddleware
+import numpy as np
 import cv2
 
 app = FastAPI(title="Face Recognition AI Service")
 
 # Initialize face recognition system
-face_system = FaceRecognitionSystem()
+# FACE_BACKEND selects the detector/embedder ("insightface" default, "synthetic" for benchmarks)
+# AI_SHARDS turns this process into a coordinator over shard nodes (see sharding.py)
+# AI_ROLE=replica + AI_PRIMARY_URL makes it a read-only replica of a primary (see replication.py)
+face_system = FaceRecognitionSystem(index_path=os.environ.get('FACE_INDEX_PATH', 'faiss_index'),
+                                    index_type=os.environ.get('FACE_INDEX_TYPE', 'auto'))
+# Other tenants' galleries, selected per request with X-Gallery-Namespace; loaded lazily and
+# closed least-recently-used first under FACE_NAMESPACE_BUDGET (see namespaces.py)
+namespaces = GalleryNamespaces.from_env(face_system, index_type=os.environ.get('FACE_INDEX_TYPE', 'auto'))
+namespaces.start()
+replica = ReplicaFollower.from_env(face_system)
+if replica is not None:
+    replica.start()
+
+# Inference runs on bounded per-lane queues + worker threads (AI_INFER_WORKERS, AI_MAX_QUEUE);
+# live recognition goes first, then registration, then batch work. Overload and
+# expired deadlines are answered immediately instead of queueing
+scheduler = InferenceScheduler.from_env()
+# Suggested capture interval / resolution returned to camera clients from live-lane load (see capture.py)
+capture_advisor = CaptureAdvisor.from_env(scheduler, min_face_px=face_system.MIN_FACE_SIZE)
+
+# Append-only log of every recognition decision (AUDIT_DIR, see audit.py); shared by all namespaces.
+# Written by a background thread: requests only append to a buffer
+audit_log = AuditLog.from_env()
+if audit_log is not None:
+    face_system.audit = audit_log
+    audit_log.start()
+    atexit.register(audit_log.close)
+
+# One bulk gallery import at a time (see gallery_transfer.py)
+_import_lock = asyncio.Lock()
+
+# Re-embedding into a shadow gallery for a model switch (see migration.py); resumed after restarts
+migration = None if face_system.read_only else ReembedMigration.resume(face_system)
+
+# Per-component memory report and optional budgets (AI_MEMORY_BUDGETS, see memory.py)
+memory = MemoryAccountant.from_env()
+memory.add_source(lambda: face_system.memory_usage())
+memory.add_source(lambda: {"request_buffers": scheduler.memory_usage()})
+memory.add_source(lambda: {} if migration is None else {
+    "migration_shadow": {**migration.shadow.memory_usage()["index"], "target_model": migration.target_model}})
+memory.add_evictor("metrics", lambda: face_system.trim_metrics())
+memory.add_evictor("metadata", lambda: face_system.metadata.shrink_memory())
+memory.add_source(namespaces.memory_usage)
+memory.add_evictor("namespaces", namespaces.evict_idle)
+if audit_log is not None:
+    memory.add_source(audit_log.memory_usage)
+memory.start()
+
+# Batch-lane admissions tried per image by /api/face/migration/embed before reporting it failed
+MIGRATION_EMBED_ATTEMPTS = 3
+
+# Shared secret for the endpoints that read or replace the whole gallery (see gallery_transfer.py)
+gallery_token = os.environ.get('GALLERY_TOKEN')
+
+# On-demand sampling profiler (see profiler.py); not installed at all without PROFILE_TOKEN
+profile_token = os.environ.get('PROFILE_TOKEN')
+profiler = SamplingProfiler.from_env()
+if profile_token:
+    app.add_middleware(ProfileMiddleware, profiler=profiler, token=profile_token)
+
+# Attendance session (X-Attendance-Session) and endpoint of each audited decision
+if audit_log is not None:
+    app.add_middleware(AuditMiddleware)
+
+# Request tracing (TRACE_DIR, see tracing.py): continues Django's traceparent, spans per stage as JSON lines.
+# Installed after CORS so it is the outermost middleware and times the whole request
+span_exporter = SpanExporter.from_env()
+if span_exporter is not None:
+    span_exporter.start()
+    atexit.register(span_exporter.close)
 
 # CORS middleware
 app.add_middleware(
@@ -21,6 +113,43 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if span_exporter is not None:
+    app.add_middleware(TraceMiddleware, exporter=span_exporter, sample=float(os.environ.get('TRACE_SAMPLE', 1.0)))
+
+def _gallery_dependency(create):
+    async def gallery(x_gallery_namespace: Optional[str] = Header(None), namespace: Optional[str] = None,
+                      x_gallery_token: Optional[str] = Header(None)):
+        """The request's gallery: X-Gallery-Namespace header or ?namespace=, else the default one."""
+        name = x_gallery_namespace or namespace or DEFAULT_NAMESPACE
+        if name == DEFAULT_NAMESPACE:
+            yield face_system
+            return
+        # New namespaces only for configured names or token holders: a header must not create directories
+        may_create = create and (name in namespaces.configured or token_matches(gallery_token, x_gallery_token))
+        try:
+            # Loading a namespace reads its index from disk: keep it off the event loop
+            system = await asyncio.to_thread(namespaces.acquire, name, may_create)
+        except NamespaceNotFound as e:
+            if create:
+                raise HTTPException(status_code=403, detail=f"{e}; registrations create only namespaces listed "
+                                                            f"in FACE_NAMESPACES, or with {GALLERY_TOKEN_HEADER}")
+            raise HTTPException(status_code=404, detail=str(e))
+        except NamespaceError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            yield system
+        finally:
+            await asyncio.to_thread(namespaces.release, name)
+    return gallery
+
+# Searches need an existing namespace; registrations may create it (see _gallery_dependency)
+gallery = _gallery_dependency(create=False)
+writable_gallery = _gallery_dependency(create=True)
+
+async def capture_request(x_capture_client: Optional[str] = Header(None),
+                          x_capture_pending: Optional[str] = Header(None)):
+    """Camera client and its unmarked students, for the capture hints of live responses."""
+    return {"client": x_capture_client, "pending": parse_pending(x_capture_pending), "started": time.perf_counter()}
 
 @app.get("/")
 async def root():
@@ -29,9 +158,14 @@ async def root():
 @app.post("/api/face/register")
 async def register_face(
     file: UploadFile = File(...),
-    student_id: str = Form(...)
+    student_id: str = Form(...),
+    department: Optional[str] = Form(None),
+    x_request_deadline_ms: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
+    fs: FaceRecognitionSystem = Depends(writable_gallery)
 ):
     """Register a new student's face"""
+    _require_writable()
     try:
         # Save uploaded file temporarily
         with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
@@ -41,28 +175,32 @@ async def register_face(
         
         try:
             # Register face using face recognition system
-            success = face_system.register_face(temp_file_path, student_id)
+            report = await _infer('interactive', x_request_deadline_ms, x_priority,
+                                  fs.register_face, temp_file_path, student_id, shard_key=department)
             
-            if success:
-                return {
-                    "status": "success",
-                    "message": "Face registered successfully",
-                    "embedding_id": student_id,
-                    "student_id": student_id
-                }
-            else:
-                raise HTTPException(status_code=400, detail="Face registration failed")
+            return {
+                "status": "success",
+                "embedding_id": student_id,
+                "student_id": student_id,
+                **_registration_info(fs, student_id, report, "Face registered successfully")
+            }
                 
         finally:
             # Clean up temp file
             if os.path.exists(temp_file_path):
                 os.unlink(temp_file_path)
                 
+    except HTTPException:
+        raise
+    except DuplicateFaceError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "duplicates": e.matches})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing face: {str(e)}")
 
 @app.post("/api/face/recognize")
-async def recognize_face(file: UploadFile = File(...)):
+async def recognize_face(file: UploadFile = File(...), fs: FaceRecognitionSystem = Depends(gallery),
+                         x_request_deadline_ms: Optional[str] = Header(None),
+                         x_priority: Optional[str] = Header(None), capture: dict = Depends(capture_request)):
     """Recognize a face from the uploaded image"""
     try:
         # Save uploaded file temporarily
@@ -73,7 +211,7 @@ async def recognize_face(file: UploadFile = File(...)):
         
         try:
             # Recognize face
-            result = face_system.recognize_face(temp_file_path)
+            result = await _infer('live', x_request_deadline_ms, x_priority, fs.recognize_face, temp_file_path)
             
             if result:
                 return {
@@ -81,13 +219,15 @@ async def recognize_face(file: UploadFile = File(...)):
                     "recognized": True,
                     "student_id": result["student_id"],
                     "confidence": result["confidence"],
-                    "similarity": result.get("similarity")
+                    "similarity": result.get("similarity"),
+                    "capture": capture_advisor.hints(**capture),
                 }
             else:
                 return {
                     "status": "success",
                     "recognized": False,
-                    "message": "No matching face found"
+                    "message": "No matching face found",
+                    "capture": capture_advisor.hints(**capture),
                 }
                 
         finally:
@@ -95,15 +235,26 @@ async def recognize_face(file: UploadFile = File(...)):
             if os.path.exists(temp_file_path):
                 os.unlink(temp_file_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error recognizing face: {str(e)}")
 
 @app.post("/api/face/register_multi")
 async def register_face_multi(
     files: List[UploadFile] = File(...),
-    student_id: str = Form(...)
+    student_id: str = Form(...),
+    department: Optional[str] = Form(None),
+    x_request_deadline_ms: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
+    fs: FaceRecognitionSystem = Depends(writable_gallery)
 ):
-    """Register a new student's face from multiple frames with quality validation."""
+    """Register a new student's face from multiple frames with quality validation.
+
+    `department` (code) is only used to place the student when the gallery is
+    sharded by department.
+    """
+    _require_writable()
     temp_paths = []
     try:
         # Validate minimum frames
@@ -130,25 +281,23 @@ async def register_face_multi(
                 temp_paths.append(tf.name)
         
         # Register face with multi-frame aggregation
-        success = face_system.register_face_multi(temp_paths, student_id)
+        report = await _infer('interactive', x_request_deadline_ms, x_priority,
+                              fs.register_face_multi, temp_paths, student_id, shard_key=department)
         
-        if success:
-            return {
-                "status": "success",
-                "message": f"Face registered successfully using {len(temp_paths)} frames",
-                "embedding_id": student_id,
-                "student_id": student_id,
-                "frames": len(temp_paths),
-                "method": "multi-frame-aggregation"
-            }
-        else:
-            raise HTTPException(
-                status_code=400, 
-                detail="Face registration failed. No valid faces detected in provided frames."
-            )
+        return {
+            "status": "success",
+            "embedding_id": student_id,
+            "student_id": student_id,
+            "frames": len(temp_paths),
+            "method": "multi-frame-aggregation",
+            **_registration_info(fs, student_id, report,
+                                 f"Face registered successfully using {len(temp_paths)} frames")
+        }
             
     except HTTPException:
         raise
+    except DuplicateFaceError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "duplicates": e.matches})
     except Exception as e:
         error_msg = str(e)
         if "No face detected" in error_msg or "No valid faces" in error_msg:
@@ -170,7 +319,9 @@ async def register_face_multi(
                     pass
 
 @app.post("/api/face/recognize_multi")
-async def recognize_face_multi(files: List[UploadFile] = File(...)):
+async def recognize_face_multi(files: List[UploadFile] = File(...), fs: FaceRecognitionSystem = Depends(gallery),
+                               x_request_deadline_ms: Optional[str] = Header(None),
+                               x_priority: Optional[str] = Header(None), capture: dict = Depends(capture_request)):
     """Recognize a face from multiple frames and aggregate results."""
     temp_paths = []
     try:
@@ -178,7 +329,7 @@ async def recognize_face_multi(files: List[UploadFile] = File(...)):
             with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tf:
                 tf.write(await f.read())
                 temp_paths.append(tf.name)
-        result = face_system.recognize_face_multi(temp_paths)
+        result = await _infer('live', x_request_deadline_ms, x_priority, fs.recognize_face_multi, temp_paths)
         if result:
             return {
                 "status": "success",
@@ -188,6 +339,7 @@ async def recognize_face_multi(files: List[UploadFile] = File(...)):
                 "similarity": result.get("similarity"),
                 "frames": result.get("frames", len(temp_paths)),
                 "votes": result.get("votes", 0),
+                "capture": capture_advisor.hints(**capture),
             }
         else:
             return {
@@ -195,7 +347,10 @@ async def recognize_face_multi(files: List[UploadFile] = File(...)):
                 "recognized": False,
                 "message": "No matching face found across frames",
                 "frames": len(temp_paths),
+                "capture": capture_advisor.hints(**capture),
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error recognizing faces: {str(e)}")
     finally:
@@ -204,12 +359,18 @@ async def recognize_face_multi(files: List[UploadFile] = File(...)):
                 os.unlink(p)
 
 @app.get("/api/face/stats")
-async def get_stats():
-    """Get statistics about FAISS index and registered faces"""
-    return face_system.stats()
+async def get_stats(fs: FaceRecognitionSystem = Depends(gallery)):
+    """Get statistics about FAISS index and registered faces (of the request's namespace)"""
+    stats = fs.stats()
+    if fs is face_system:
+        stats["replication"] = _replication_status()
+    stats["scheduler"] = scheduler.stats()
+    return stats
 
 @app.post("/api/face/recognize_frame")
-async def recognize_frame(file: UploadFile = File(...)):
+async def recognize_frame(file: UploadFile = File(...), fs: FaceRecognitionSystem = Depends(gallery),
+                          x_request_deadline_ms: Optional[str] = Header(None),
+                          x_priority: Optional[str] = Header(None), capture: dict = Depends(capture_request)):
     """Detect multiple faces in a single frame and recognize each if possible.
     
     Uses 0.7 threshold (70% similarity) for marking attendance - High accuracy.
@@ -220,13 +381,567 @@ async def recognize_frame(file: UploadFile = File(...)):
             path = tf.name
         try:
             # Use 0.7 threshold = 70% similarity minimum for high accuracy attendance marking
-            result = face_system.recognize_faces_in_image(path, threshold=0.7)
+            result = await _infer('live', x_request_deadline_ms, x_priority,
+                                  fs.recognize_faces_in_image, path, threshold=0.7)
+            result["capture"] = capture_advisor.hints(**capture, faces=result["faces"], image=result["image"])
             return result
         finally:
             if os.path.exists(path):
                 os.unlink(path)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error recognizing frame: {str(e)}")
 
+@app.post("/api/face/recognize_crops")
+async def recognize_crops(
+    files: List[UploadFile] = File(...),
+    landmarks: Optional[str] = Form(None),
+    threshold: float = Form(0.7),
+    x_request_deadline_ms: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
+    fs: FaceRecognitionSystem = Depends(gallery),
+    capture: dict = Depends(capture_request),
+):
+    """Recognize client-cropped faces: only ArcFace + search run on the server.
+
+    - files: face crops (JPEG/PNG). Without landmarks each must be a 112x112 crop
+      aligned to the ArcFace template.
+    - landmarks: optional JSON list, one entry per crop: null or [[x, y] x 5]
+      (left eye, right eye, nose, mouth left, mouth right) in crop coordinates,
+      in which case the server aligns the crop.
+    """
+    if len(files) > fs.MAX_FACES_PER_FRAME:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum {fs.MAX_FACES_PER_FRAME} crops allowed. Received: {len(files)}"
+        )
+
+    kps_list = [None] * len(files)
+    if landmarks:
+        try:
+            entries = json.loads(landmarks)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="landmarks must be a JSON list")
+        if not isinstance(entries, list) or len(entries) != len(files):
+            raise HTTPException(status_code=400, detail="landmarks must have one entry per crop")
+        for idx, entry in enumerate(entries):
+            if entry is None:
+                continue
+            try:
+                kps = np.asarray(entry, dtype=np.float32)
+            except (TypeError, ValueError):
+                kps = None
+            if kps is None or kps.shape != (5, 2) or not np.isfinite(kps).all():
+                raise HTTPException(status_code=400, detail=f"landmarks[{idx}] must be null or five [x, y] points")
+            kps_list[idx] = kps
+
+    size = fs.backend.crop_size
+    crops = []
+    for idx, f in enumerate(files):
+        data = np.frombuffer(await f.read(), dtype=np.uint8)
+        crop = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+        if crop is None:
+            raise HTTPException(status_code=400, detail=f"Crop {idx} could not be decoded")
+        if kps_list[idx] is None and crop.shape[:2] != (size, size):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Crop {idx} is {crop.shape[1]}x{crop.shape[0]}: expected an aligned {size}x{size} crop "
+                       f"or 5-point landmarks"
+            )
+        crops.append(crop)
+
+    try:
+        faces = await _infer('live', x_request_deadline_ms, x_priority,
+                             fs.recognize_crops, crops, landmarks=kps_list, threshold=threshold)
+    except HTTPException:
+        raise
+    except AlignmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error recognizing crops: {str(e)}")
+    return {"faces": faces, "capture": capture_advisor.hints(**capture, faces=faces)}
+
+@app.post("/api/face/recognize_batch")
+async def recognize_batch(
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(default=None),
+    threshold: float = Form(0.7),
+    fs: FaceRecognitionSystem = Depends(gallery),
+):
+    """Recognize all faces in a set of photos (multiple files and/or a .zip archive).
+
+    Results are streamed as NDJSON, one line per image as it completes, followed
+    by a summary line: {"summary": true, "images", "faces", "recognized", ...}
+    """
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Provide photo files or a zip archive")
+
+    temp_paths = []
+    try:
+        # Spool uploads to disk so that only `max_inflight` images are decoded at once
+        batch_dir = tempfile.mkdtemp(prefix='batch_')
+        temp_paths.append(batch_dir)
+        for idx, f in enumerate(files):
+            name = os.path.basename(f.filename or f'photo_{idx}.jpg')
+            with open(os.path.join(batch_dir, f'{idx:05d}_{name}'), 'wb') as out:
+                while chunk := await f.read(1 << 20):
+                    out.write(chunk)
+        if archive is not None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tf:
+                while chunk := await archive.read(1 << 20):
+                    tf.write(chunk)
+                temp_paths.append(tf.name)
+    except Exception as e:
+        _cleanup_paths(temp_paths)
+        raise HTTPException(status_code=500, detail=f"Error receiving batch: {str(e)}")
+
+    def stream():
+        # Each image is one batch-lane unit: live requests cut in between images
+        recognizer = BatchRecognizer(fs, threshold=threshold, scheduler=scheduler)
+        try:
+            sources = []
+            if files:
+                sources.append(iter_sources(temp_paths[0]))
+            if archive is not None:
+                try:
+                    sources.append(iter_sources(temp_paths[-1]))
+                except Exception as e:
+                    yield (json.dumps({"image": archive.filename, "error": str(e)}) + "\n").encode("utf-8")
+            chained = (src for it in sources for src in it)
+            yield from to_ndjson(recognizer.run(chained))
+        finally:
+            _cleanup_paths(temp_paths)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/face/recognize_video")
+async def recognize_video(
+    request: Request,
+    sample_fps: float = 1.0,
+    threshold: float = 0.7,
+    min_appearances: int = 3,
+    reembed_every: int = 5,
+    fs: FaceRecognitionSystem = Depends(gallery),
+):
+    """Attendance from a recorded lecture: the request body is the video file (see video.py).
+
+    Streams NDJSON progress lines while the video is processed, then a summary
+    line: {"summary": true, "present": {student_id: similarity}, "students": {...}, ...}
+    """
+    if not 0 < sample_fps <= 30:
+        raise HTTPException(status_code=400, detail="sample_fps must be in (0, 30]")
+    temp_paths = []
+    try:
+        # OpenCV needs a seekable file: spool the upload to disk without holding it in memory
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.video') as tf:
+            temp_paths.append(tf.name)
+            async for data in request.stream():
+                tf.write(data)
+        info = probe_video(temp_paths[0])
+    except Exception as e:
+        _cleanup_paths(temp_paths)
+        raise HTTPException(status_code=400, detail=f"Invalid video: {str(e)}")
+    if not info["frames"]:
+        _cleanup_paths(temp_paths)
+        raise HTTPException(status_code=400, detail="Invalid video: no frames")
+
+    def stream():
+        # Each sampled frame is one batch-lane unit: live requests cut in between frames
+        job = VideoAttendance(fs, sample_fps=sample_fps, threshold=threshold, min_appearances=min_appearances,
+                              reembed_every=reembed_every, scheduler=scheduler)
+        try:
+            for item in job.run(temp_paths[0]):
+                yield (json.dumps(item) + "\n").encode("utf-8")
+        except Exception as e:
+            yield (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+        finally:
+            _cleanup_paths(temp_paths)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/api/face/search")
+async def search_embeddings(payload: dict = Body(...), fs: FaceRecognitionSystem = Depends(gallery),
+                            x_request_deadline_ms: Optional[str] = Header(None),
+                            x_priority: Optional[str] = Header(None)):
+    """Shard endpoint: top-k gallery matches for query embeddings.
+
+    Body: {"embeddings": base64 float32, "dim": 512, "k": 1} (see sharding.encode_embeddings)
+    Returns {"similarities": [[...]], "student_ids": [[...]]}; no threshold is applied here,
+    the coordinator merges shards and applies threshold and voting. Runs on the live
+    lane: the coordinator is answering a recognition request.
+    """
+    try:
+        queries = decode_embeddings(payload)
+        k = max(1, min(int(payload.get("k", 1)), 100))
+        if queries.shape[1] != fs.dimension:
+            raise HTTPException(status_code=400, detail=f"Expected {fs.dimension}-d embeddings")
+        sims, ids = await _infer('live', x_request_deadline_ms, x_priority, fs.search_gallery, queries, k=k)
+        return {"similarities": sims.tolist(), "student_ids": ids}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching gallery: {str(e)}")
+
+@app.post("/api/face/gallery/add")
+async def add_embeddings(payload: dict = Body(...), fs: FaceRecognitionSystem = Depends(writable_gallery),
+                         x_request_deadline_ms: Optional[str] = Header(None),
+                         x_priority: Optional[str] = Header(None),
+                         x_gallery_token: Optional[str] = Header(None)):
+    """Shard endpoint: insert precomputed embeddings routed here by a coordinator.
+
+    Body: {"embeddings": base64 float32, "dim": 512, "student_ids": [...], "metadata": {id: {...}}}
+    Runs on the interactive lane, like the registrations it comes from. Requires the
+    gallery token: these rows skip the duplicate check.
+    """
+    _require_gallery_token(x_gallery_token)
+    _require_writable()
+    try:
+        embeddings = decode_embeddings(payload)
+        student_ids = [str(s) for s in payload.get("student_ids", [])]
+        if len(student_ids) != len(embeddings) or embeddings.shape[1] != fs.dimension:
+            raise HTTPException(status_code=400, detail="embeddings and student_ids do not match")
+        # The coordinator already ran the duplicate check against all shards
+        await _infer('interactive', x_request_deadline_ms, x_priority, fs._add_to_gallery,
+                     embeddings, student_ids, check_duplicates=False,
+                     metadata={str(sid): meta for sid, meta in (payload.get("metadata") or {}).items()})
+        return {"status": "success", "added": len(student_ids), "ntotal": int(fs.index.ntotal)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding embeddings: {str(e)}")
+
+@app.get("/api/face/gallery/export")
+async def export_gallery(since: int = 0, dtype: str = 'f32', chunk_rows: int = 8192,
+                         x_gallery_token: Optional[str] = Header(None)):
+    """Stream gallery rows [since, n) as chunked binary with checksums (see gallery_transfer.py)."""
+    _require_gallery_token(x_gallery_token)
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype must be one of {list(DTYPES)}")
+    if face_system.shards is not None:
+        raise HTTPException(status_code=400, detail="Export each shard node, not the coordinator")
+    return StreamingResponse(export_stream(face_system, since, dtype, max(1, min(chunk_rows, 65536))),
+                             media_type="application/octet-stream",
+                             headers={"X-Gallery-Rows": str(len(face_system.student_ids))})
+
+@app.get("/api/face/gallery/import")
+async def gallery_import_status(x_gallery_token: Optional[str] = Header(None)):
+    """Rows present locally: where a resumed import continues from."""
+    _require_gallery_token(x_gallery_token)
+    return import_status(face_system)
+
+@app.post("/api/face/gallery/import")
+async def import_gallery(request: Request, x_gallery_token: Optional[str] = Header(None)):
+    """Stream an export into this node (empty, or resuming an interrupted import).
+
+    Memory is bounded to one chunk; chunks below the local row count are skipped.
+    """
+    _require_gallery_token(x_gallery_token)
+    _require_writable()
+    if _import_lock.locked():
+        raise HTTPException(status_code=409, detail="Another import is running")
+    async with _import_lock:
+        try:
+            importer = GalleryImporter(face_system)
+            async for data in request.stream():
+                if data:
+                    await asyncio.to_thread(importer.feed, data)
+        except TransferError as e:
+            raise HTTPException(status_code=400, detail={"message": str(e), **import_status(face_system)})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+    if not importer.finished:
+        raise HTTPException(status_code=400, detail={"message": "Stream ended before the trailer; resume the import",
+                                                     **importer.report()})
+    return importer.report()
+
+@app.get("/api/face/replication/log")
+async def replication_log(since: int = 0, limit: int = 1000, meta_since: Optional[int] = None,
+                          x_gallery_token: Optional[str] = Header(None)):
+    """Change-log records [since, since + limit) with their embeddings, for replicas.
+
+    `meta_since` (metadata store version) adds the metadata documents changed since then.
+    """
+    _require_gallery_token(x_gallery_token)
+    try:
+        return read_log_batch(face_system, since, max(1, min(limit, 10000)), meta_since)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading change log: {str(e)}")
+
+@app.get("/api/face/replication/status")
+async def replication_status():
+    """Role, log position and (on replicas) replication lag."""
+    return _replication_status()
+
+@app.get("/api/face/duplicates")
+async def duplicate_clusters(threshold: Optional[float] = None, k: int = 10,
+                             fs: FaceRecognitionSystem = Depends(gallery)):
+    """Scan the gallery for near-duplicate clusters (runs in the batch lane)."""
+    try:
+        clusters = await scheduler.run(fs.find_duplicate_clusters, lane='batch',
+                                       threshold=threshold, k=max(1, min(k, 100)))
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error scanning duplicates: {str(e)}")
+    return {
+        "threshold": threshold if threshold is not None else fs.DUPLICATE_THRESHOLD,
+        "clusters": clusters,
+        "cross_student_clusters": sum(1 for c in clusters if c["cross_student"]),
+    }
+
+@app.post("/api/face/migration/start")
+async def start_migration(payload: dict = Body(...), x_gallery_token: Optional[str] = Header(None)):
+    """Begin or resume re-embedding the gallery with another model into a shadow index.
+
+    Body: {"model": "buffalo_l" | "insightface/buffalo_l", "restart": false}
+    """
+    global migration
+    _require_gallery_token(x_gallery_token)
+    _require_writable()
+    model = payload.get("model")
+    if not model:
+        raise HTTPException(status_code=400, detail="model is required")
+    restart = bool(payload.get("restart", False))
+    try:
+        if migration is not None and (restart or migration.target_model != normalize_model_id(model)):
+            if not restart:
+                raise HTTPException(status_code=409, detail=f"Migration to {migration.target_model} in progress; "
+                                                            f"abort it or pass restart")
+            migration = None
+        if migration is None:
+            # Loading a model takes seconds: keep it off the event loop
+            migration = await scheduler.run(ReembedMigration, face_system, model, lane='batch', restart=restart)
+        return migration.status()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting migration: {str(e)}")
+
+@app.post("/api/face/migration/embed")
+async def migration_embed(files: List[UploadFile] = File(...), student_ids: List[str] = Form(...),
+                          x_gallery_token: Optional[str] = Header(None)):
+    """Re-embed stored face images (one per student) into the shadow gallery.
+
+    Each image is one batch-lane unit, so live recognition keeps priority;
+    callers parallelise by sending several requests at once. An image still
+    shed after MIGRATION_EMBED_ATTEMPTS tries is reported in `failed` (the
+    student stays pending) rather than holding the request open.
+    """
+    _require_gallery_token(x_gallery_token)
+    m = _require_migration()
+    if len(files) != len(student_ids):
+        raise HTTPException(status_code=400, detail="One student_id per file required")
+    temp_paths = []
+    try:
+        for f in files:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tf:
+                tf.write(await f.read())
+                temp_paths.append(tf.name)
+        embeddings, ok_ids, failed = [], [], {}
+        for sid, path in zip(student_ids, temp_paths):
+            for attempt in range(MIGRATION_EMBED_ATTEMPTS):
+                try:
+                    embeddings.append(await scheduler.run(m.embed_one, path, lane='batch'))
+                    ok_ids.append(sid)
+                except Overloaded as e:
+                    if attempt + 1 < MIGRATION_EMBED_ATTEMPTS:
+                        await asyncio.sleep(min(e.retry_after, 5))
+                        continue
+                    # Still shed: left pending for the caller's next pass
+                    failed[sid] = f"Overloaded, retry after {e.retry_after}s: {e}"
+                except Exception as e:
+                    failed[sid] = str(e)
+                break
+        if ok_ids:
+            await scheduler.run(m.add, np.stack(embeddings), ok_ids, lane='batch')
+        m.failed += len(failed)
+        return {"embedded": len(ok_ids), "failed": failed}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error re-embedding: {str(e)}")
+    finally:
+        _cleanup_paths(temp_paths)
+
+@app.get("/api/face/migration")
+async def migration_status(pending: bool = False, x_gallery_token: Optional[str] = Header(None)):
+    """Coverage, throughput and ETA of the running migration (`pending=true` lists student IDs left)."""
+    _require_gallery_token(x_gallery_token)
+    if migration is None:
+        return {"active": False, "model": face_system.backend.name, "gallery_model": face_system.gallery_model}
+    return {"active": True, **migration.status(include_pending=pending)}
+
+@app.post("/api/face/migration/cutover")
+async def migration_cutover(x_gallery_token: Optional[str] = Header(None)):
+    """Atomically switch to the shadow gallery and its model; 409 until coverage is 100%."""
+    global migration
+    _require_gallery_token(x_gallery_token)
+    m = _require_migration()
+    try:
+        result = await asyncio.to_thread(m.cutover)
+    except MigrationIncomplete as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "pending": e.pending[:100]})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cutover failed: {str(e)}")
+    migration = None
+    return result
+
+@app.delete("/api/face/migration")
+async def abort_migration(x_gallery_token: Optional[str] = Header(None)):
+    """Discard the shadow gallery; the live gallery and model are untouched."""
+    global migration
+    _require_gallery_token(x_gallery_token)
+    m = _require_migration()
+    await asyncio.to_thread(m.abort)
+    migration = None
+    return {"status": "aborted", "model": face_system.backend.name}
+
+@app.get("/api/face/scheduler")
+async def scheduler_stats():
+    """Inference queue depth, wait times and shed counts, and the capture hints being handed out."""
+    return {**scheduler.stats(), "capture": capture_advisor.status()}
+
+@app.get("/api/face/audit")
+async def audit_status():
+    """Decision audit log: files, bytes, decisions written / pending / dropped."""
+    if audit_log is None:
+        raise HTTPException(status_code=404, detail="Audit log disabled (AUDIT_DIR is empty)")
+    return await asyncio.to_thread(audit_log.status)
+
+@app.get("/api/face/namespaces")
+async def list_namespaces():
+    """Gallery namespaces on disk and loaded, with memory use against FACE_NAMESPACE_BUDGET."""
+    return await asyncio.to_thread(namespaces.status)
+
+@app.get("/api/face/memory")
+async def memory_report(top: int = 0, group_by: str = 'lineno'):
+    """Process RSS and memory per component; `top=N` adds tracemalloc's N fastest-growing allocation sites."""
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(memory.report, max(0, min(top, 200)), group_by)
+
+@app.post("/api/face/memory/evict")
+async def memory_evict(component: Optional[str] = None, x_gallery_token: Optional[str] = Header(None)):
+    """Evict one component (or every evictable one) and return freed heap to the OS."""
+    _require_gallery_token(x_gallery_token)
+    try:
+        return await asyncio.to_thread(memory.evict, component)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e.args[0]))
+
+@app.post("/api/face/memory/tracemalloc")
+async def memory_trace_start(frames: int = 10, x_gallery_token: Optional[str] = Header(None)):
+    """Start tracing Python allocations (growth is reported against this moment)."""
+    _require_gallery_token(x_gallery_token)
+    memory.start_tracing(max(1, min(frames, 50)))
+    return memory.tracemalloc_status()
+
+@app.delete("/api/face/memory/tracemalloc")
+async def memory_trace_stop(x_gallery_token: Optional[str] = Header(None)):
+    _require_gallery_token(x_gallery_token)
+    memory.stop_tracing()
+    return memory.tracemalloc_status()
+
+def _require_profile_token(token):
+    if not profile_token:
+        raise HTTPException(status_code=404, detail="Profiler disabled (PROFILE_TOKEN not set)")
+    if not token_matches(profile_token, token):
+        raise HTTPException(status_code=403, detail=f"Missing or invalid {TOKEN_HEADER}")
+
+@app.post("/api/face/profile")
+async def profile_window(seconds: float = 30, include_idle: bool = False,
+                         x_profile_token: Optional[str] = Header(None)):
+    """Sample all threads for `seconds` and save a folded-stacks profile (returns when done)."""
+    _require_profile_token(x_profile_token)
+    try:
+        return await asyncio.to_thread(profiler.profile_for, max(0.1, seconds), f"window-{seconds:g}s", include_idle)
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/face/profile")
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    _require_profile_token(x_profile_token)
+    return {"active": profiler.active, "dir": profiler.out_dir, "profiles": profiler.list()}
+
+@app.get("/api/face/profile/{name}")
+async def download_profile(name: str, x_profile_token: Optional[str] = Header(None)):
+    _require_profile_token(x_profile_token)
+    try:
+        return FileResponse(profiler.path_of(name), media_type="text/plain", filename=name)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def _infer(lane, deadline_header, priority_header, fn, *args, **kwargs):
+    """Run blocking inference through the scheduler in `lane` (X-Priority may lower it).
+
+    Overload -> 503 with Retry-After; deadline passed while queued -> 504.
+    """
+    try:
+        return await scheduler.run(fn, *args, lane=resolve_lane(lane, priority_header),
+                                   deadline_ms=parse_deadline_ms(deadline_header), **kwargs)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+def _registration_info(fs, student_id, report, message):
+    """Response fields for this registration's duplicate-check outcome (the _add_to_gallery report).
+
+    A re-registration merged into the existing one (REREGISTER_POLICY=merge) added
+    nothing and says so; `possible_duplicates` are the matches found by this check only.
+    """
+    if student_id in report["merged"]:
+        meta = fs.metadata.get(student_id, {})
+        return {
+            "registered": False,
+            "outcome": "merged",
+            "message": "Face already registered for this student: merged with the existing registration, nothing added",
+            "merged_registrations": meta.get("merged_registrations", 0),
+            "possible_duplicates": report["flagged"].get(student_id, []),
+        }
+    return {
+        "registered": True,
+        "outcome": "added",
+        "message": message,
+        "possible_duplicates": report["flagged"].get(student_id, []),
+    }
+
+def _replication_status():
+    if replica is not None:
+        return replica.status()
+    return {
+        "role": os.environ.get('AI_ROLE', 'standalone'),
+        "lsn": len(face_system.changelog),
+        "last_write": face_system.changelog.last_timestamp() or None,
+    }
+
+def _require_gallery_token(token):
+    if not gallery_token:
+        raise HTTPException(status_code=404, detail="Disabled: GALLERY_TOKEN not set on this node")
+    if not token_matches(gallery_token, token):
+        raise HTTPException(status_code=403, detail=f"Missing or invalid {GALLERY_TOKEN_HEADER}")
+
+def _require_migration():
+    _require_writable()
+    if migration is None:
+        raise HTTPException(status_code=404, detail="No re-embedding migration in progress")
+    return migration
+
+def _require_writable():
+    if face_system.read_only:
+        raise HTTPException(status_code=403, detail="Read-only replica: register faces on the primary AI service")
+
+def _cleanup_paths(paths):
+    for p in paths:
+        try:
+            if os.path.isdir(p):
+                shutil.rmtree(p, ignore_errors=True)
+            elif os.path.exists(p):
+                os.unlink(p)
+        except Exception:
+            pass
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,242 @@
+"""Per-component memory accounting and budgets for the AI service.
+
+Process RSS alone cannot say whether growth comes from the FAISS index, the
+model sessions, Python objects or the allocator. Components are reported by
+sources (functions returning {component: {"bytes": ..., ...}}) next to the
+process figures, and the remainder of anonymous RSS is shown as unattributed:
+
+    bytes        heap / anonymous memory the component holds
+    file_bytes   memory-mapped file data (page cache: the kernel reclaims it
+                 under pressure, so it shows in RSS without being a leak)
+
+A component can have an evictor. With budgets configured, a background check
+evicts every component over its budget; the special budget "rss" evicts all
+evictable components when anonymous RSS exceeds it. Each eviction ends with
+gc + malloc_trim so freed memory actually leaves the process.
+
+tracemalloc (Python allocations only) runs on demand: started with
+AI_TRACEMALLOC=<frames> or POST /api/face/memory/tracemalloc (X-Gallery-Token); the top-N report
+ranks allocation sites by growth since tracing started.
+
+Environment:
+    AI_MEMORY_BUDGETS      e.g. "metrics=4MB,metadata=32MB,rss=3GB" (B / KB / MB / GB)
+    AI_MEMORY_CHECK_S=60   budget check interval (0 = only when requested)
+    AI_TRACEMALLOC=0       frames per traceback to trace from startup (0 = off)
+"""
+import gc
+import os
+import time
+import ctypes
+import threading
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+_UNITS = {'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """'512MB' -> bytes (binary units; a bare number is bytes)."""
+    text = value.strip().lower()
+    for unit in ('gb', 'mb', 'kb', 'b'):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * _UNITS[unit])
+    return int(float(text))
+
+
+def parse_budgets(spec: Optional[str]) -> Dict[str, int]:
+    budgets = {}
+    for item in (spec or "").split(","):
+        if item.strip():
+            name, _, size = item.partition("=")
+            budgets[name.strip()] = parse_size(size)
+    return budgets
+
+
+def process_memory() -> Dict[str, int]:
+    """Resident set of this process from /proc (rss, rss_anon, rss_file, rss_peak, swap in bytes)."""
+    fields = {'VmRSS': 'rss', 'RssAnon': 'rss_anon', 'RssFile': 'rss_file', 'VmHWM': 'rss_peak', 'VmSwap': 'swap'}
+    out = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in fields:
+                    out[fields[key]] = int(rest.split()[0]) * 1024
+    except OSError:
+        import resource
+        out['rss_peak'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return out
+
+
+def anon_rss_bytes() -> int:
+    """Anonymous RSS (falls back to total RSS where /proc has no breakdown)."""
+    mem = process_memory()
+    return mem.get('rss_anon', mem.get('rss', 0))
+
+
+def release_free_memory() -> bool:
+    """Collect garbage and return free heap pages to the OS (glibc malloc_trim)."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class MemoryAccountant:
+    """Collects component reports, enforces budgets, runs tracemalloc on demand."""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, check_interval_s: float = 60.0):
+        """
+        Args:
+            budgets: {component or "rss": max bytes}
+            check_interval_s: Background budget check period (0 = no background checks)
+        """
+        self.budgets = budgets or {}
+        self.check_interval_s = check_interval_s
+        self._sources: List[Callable[[], Dict[str, Dict[str, Any]]]] = []
+        self._evictors: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self.evictions: List[Dict[str, Any]] = []  # most recent first, bounded
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> 'MemoryAccountant':
+        accountant = cls(budgets=parse_budgets(os.environ.get('AI_MEMORY_BUDGETS')),
+                         check_interval_s=float(os.environ.get('AI_MEMORY_CHECK_S', 60)))
+        frames = int(os.environ.get('AI_TRACEMALLOC', 0))
+        if frames:
+            accountant.start_tracing(frames)
+        return accountant
+
+    def add_source(self, source: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+        self._sources.append(source)
+
+    def add_evictor(self, component: str, evict: Callable[[], Any]) -> None:
+        self._evictors[component] = evict
+
+    # -------- Reporting --------
+    def components(self) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        for source in self._sources:
+            try:
+                out.update(source())
+            except Exception as e:
+                out.setdefault("errors", {"bytes": 0, "detail": []})["detail"].append(repr(e))
+        for name, info in out.items():
+            info.setdefault("bytes", 0)
+            info["evictable"] = name in self._evictors
+            if name in self.budgets:
+                info["budget"] = self.budgets[name]
+                info["over_budget"] = info["bytes"] > self.budgets[name]
+        return out
+
+    def report(self, top: int = 0, group_by: str = 'lineno') -> Dict[str, Any]:
+        components = self.components()
+        process = process_memory()
+        attributed = sum(info["bytes"] for info in components.values())
+        report: Dict[str, Any] = {
+            "process": process,
+            "components": components,
+            "attributed_bytes": attributed,
+            "unattributed_anon_bytes": process.get('rss_anon', process.get('rss', 0)) - attributed,
+            "budgets": self.budgets,
+            "evictions": self.evictions[:20],
+            "tracemalloc": self.tracemalloc_status(),
+        }
+        if top:
+            report["tracemalloc_top"] = self.tracemalloc_top(top, group_by)
+        return report
+
+    # -------- Budgets --------
+    def evict(self, component: Optional[str] = None, reason: str = "manual") -> Dict[str, Any]:
+        """Evict one component (or all evictable ones) and release freed memory to the OS."""
+        names = [component] if component else list(self._evictors)
+        unknown = [n for n in names if n not in self._evictors]
+        if unknown:
+            raise KeyError(f"Not evictable: {', '.join(unknown)} (evictable: {', '.join(self._evictors)})")
+        with self._lock:
+            before = anon_rss_bytes()
+            for name in names:
+                self._evictors[name]()
+            release_free_memory()
+            event = {"time": time.time(), "components": names, "reason": reason,
+                     "anon_rss_before": before, "anon_rss_after": anon_rss_bytes()}
+            self.evictions.insert(0, event)
+            del self.evictions[100:]
+        print(f"🔁 Memory eviction ({reason}): {', '.join(names)}; anon RSS "
+              f"{event['anon_rss_before'] / 2**20:.0f} -> {event['anon_rss_after'] / 2**20:.0f} MiB")
+        return event
+
+    def enforce(self) -> List[Dict[str, Any]]:
+        """Evict components over budget; the 'rss' budget evicts everything evictable."""
+        events = []
+        if not self.budgets:
+            return events
+        over = [name for name, info in self.components().items()
+                if info.get("over_budget") and name in self._evictors]
+        for name in over:
+            events.append(self.evict(name, reason=f"{name} over budget"))
+        rss_budget = self.budgets.get("rss")
+        if rss_budget and self._evictors and anon_rss_bytes() > rss_budget:
+            events.append(self.evict(reason="rss over budget"))
+        return events
+
+    def start(self) -> None:
+        """Background budget checks (no-op without budgets or with a 0 interval)."""
+        if not self.budgets or self.check_interval_s <= 0 or self._thread is not None:
+            return
+
+        def run() -> None:
+            while True:
+                time.sleep(self.check_interval_s)
+                try:
+                    self.enforce()
+                except Exception as e:
+                    print(f"⚠️  Memory budget check failed: {e}")
+
+        self._thread = threading.Thread(target=run, name='memory-budget', daemon=True)
+        self._thread.start()
+
+    # -------- tracemalloc --------
+    def start_tracing(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+
+    def stop_tracing(self) -> None:
+        tracemalloc.stop()
+        self._baseline = None
+
+    def tracemalloc_status(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "frames": tracemalloc.get_traceback_limit(),
+                "traced_bytes": current, "traced_peak_bytes": peak,
+                "overhead_bytes": tracemalloc.get_tracemalloc_memory()}
+
+    def tracemalloc_top(self, n: int = 20, group_by: str = 'lineno') -> List[Dict[str, Any]]:
+        """Top-n Python allocation sites by growth since tracing started (by size if no baseline)."""
+        if not tracemalloc.is_tracing():
+            return []
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+        if self._baseline is not None:
+            stats = snapshot.compare_to(self._baseline.filter_traces(ignore), group_by)
+        else:
+            stats = snapshot.statistics(group_by)
+        out = []
+        for stat in stats[:n]:
+            frame = stat.traceback[0]
+            out.append({
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size_bytes": stat.size,
+                "size_diff_bytes": getattr(stat, "size_diff", None),
+                "count": stat.count,
+                "count_diff": getattr(stat, "count_diff", None),
+                "traceback": stat.traceback.format()[-6:] if group_by == 'traceback' else None,
+            })
+        return out
@@ -0,0 +1,211 @@
+"""Re-embedding the gallery with a new face model, with atomic cutover.
+
+Switching recognition models makes every stored vector useless (see
+model_registry.py). The new gallery is built beside the live one while the
+old model keeps serving:
+
+1. start    loads the target model and opens a shadow gallery in
+            <index_dir>.reembed (resumable: rows already there are kept)
+2. embed    re-embeds students from their stored face images (Django's
+            Student.face_image, sent by `manage.py reembed_gallery`) into the
+            shadow, one batch-lane inference unit per image
+3. cutover  once every student of the live gallery is covered, swaps the
+            shadow in under the write lock: on disk by directory rename
+            (complete_cutover), in memory by adopting its backend and index
+
+Registrations keep going to the live gallery meanwhile; a student registered
+or re-registered after their shadow row was written counts as pending again,
+so cutover cannot lose a registration. Replicas must be re-seeded afterwards.
+"""
+import os
+import json
+import time
+import shutil
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from face_recognition import FaceRecognitionSystem, SHADOW_SUFFIX, CUTOVER_MARKER, complete_cutover
+from model_registry import normalize_model_id, load_model, describe_model
+
+STATE_FILE = 'migration.json'
+
+
+class MigrationIncomplete(Exception):
+    """Cutover refused: some live students have no up-to-date shadow embedding."""
+
+    def __init__(self, pending: List[str]):
+        self.pending = pending
+        preview = ", ".join(pending[:10]) + (" ..." if len(pending) > 10 else "")
+        super().__init__(f"{len(pending)} student(s) not re-embedded yet: {preview}")
+
+
+class ReembedMigration:
+    """Shadow gallery for `target_model` next to the live gallery of `face_system`."""
+
+    def __init__(self, face_system: FaceRecognitionSystem, target_model: str, restart: bool = False):
+        """
+        Args:
+            face_system: Live system; keeps serving with its current model until cutover
+            target_model: Model ID or InsightFace pack name (e.g. "buffalo_l")
+            restart: Discard an existing shadow gallery instead of resuming it
+        """
+        if face_system.shards is not None:
+            raise Exception("Re-embedding is not supported on a shard coordinator; migrate each shard's gallery")
+        self.face_system = face_system
+        self.target_model = normalize_model_id(target_model)
+        if self.target_model == face_system.gallery_model:
+            raise Exception(f"Gallery already uses {self.target_model}")
+        self.shadow_dir = face_system.index_dir + SHADOW_SUFFIX
+        state_file = os.path.join(self.shadow_dir, STATE_FILE)
+
+        state = None
+        if os.path.exists(state_file):
+            with open(state_file, "r") as f:
+                state = json.load(f)
+            if restart or state.get('target_model') != self.target_model:
+                if not restart:
+                    raise Exception(f"A migration to {state.get('target_model')} exists; abort it or restart")
+                state = None
+        if state is None:
+            if os.path.exists(self.shadow_dir):
+                shutil.rmtree(self.shadow_dir)
+            os.makedirs(self.shadow_dir)
+            with face_system._write_lock:
+                state = {
+                    'source_model': face_system.gallery_model,
+                    'target_model': self.target_model,
+                    'started_at': time.time(),
+                    # Live rows written after this were registered during the migration
+                    'start_lsn': len(face_system.changelog),
+                }
+            with open(state_file, "w") as f:
+                json.dump(state, f)
+        self.state = state
+
+        backend = load_model(self.target_model, current=face_system.backend)
+        self.shadow = FaceRecognitionSystem(index_path=self.shadow_dir, backend=backend,
+                                            index_type=face_system.index_mode, shards=None, read_only=False)
+        # Throughput of this process (the shadow may already hold rows from an earlier run)
+        self.session_start = time.time()
+        self.embedded = 0
+        self.failed = 0
+        print(f"✓ Re-embedding migration {state['source_model']} -> {self.target_model} "
+              f"({len(set(self.shadow.student_ids))} students already in {self.shadow_dir})")
+
+    @classmethod
+    def resume(cls, face_system: FaceRecognitionSystem) -> Optional['ReembedMigration']:
+        """Reopen an unfinished migration after a restart (None if there is none)."""
+        state_file = os.path.join(face_system.index_dir + SHADOW_SUFFIX, STATE_FILE)
+        if face_system.shards is not None or not os.path.exists(state_file):
+            return None
+        with open(state_file, "r") as f:
+            state = json.load(f)
+        try:
+            return cls(face_system, state['target_model'])
+        except Exception as e:
+            print(f"⚠️  Could not resume re-embedding migration: {e}")
+            return None
+
+    # -------- Re-embedding --------
+    def embed_one(self, image_path: str) -> np.ndarray:
+        """Target-model embedding of one stored face image (one inference unit)."""
+        return self.shadow.extract_embedding(image_path)
+
+    def add(self, embeddings: np.ndarray, student_ids: List[str]) -> None:
+        """Insert re-embedded rows into the shadow gallery, carrying over live metadata."""
+        now = time.time()
+        with self.shadow._write_lock:
+            for sid in student_ids:
+                meta = dict(self.face_system.metadata.get(sid) or {})
+                meta.update({
+                    'model_version': self.target_model,
+                    'reembedded_from': self.state['source_model'],
+                    'reembedded_at': now,
+                })
+                self.shadow.metadata[sid] = meta
+            # Duplicates were checked when the students were first registered
+            self.shadow._add_to_gallery(embeddings, student_ids, check_duplicates=False)
+        self.embedded += len(student_ids)
+
+    def pending(self) -> List[str]:
+        """Live students without an up-to-date shadow embedding, in registration order."""
+        live = self.face_system
+        with live._write_lock:
+            live_ids = list(dict.fromkeys(live.student_ids))
+            lsn = len(live.changelog)
+        with self.shadow._write_lock:
+            shadow_ids = set(self.shadow.student_ids)
+            done_at = {sid: float(meta.get('reembedded_at', 0.0))
+                       for sid, meta in self.shadow.metadata.items() if sid in shadow_ids}
+        stale = set()
+        start = min(int(self.state['start_lsn']), lsn)
+        if lsn > start:
+            timestamps, ids = live.changelog.read(start, lsn - start)
+            stale = {sid for ts, sid in zip(timestamps, ids) if sid in done_at and ts > done_at[sid]}
+        return [sid for sid in live_ids if sid not in done_at or sid in stale]
+
+    def status(self, include_pending: bool = False) -> Dict[str, Any]:
+        pending = self.pending()
+        live = len(set(self.face_system.student_ids))
+        elapsed = max(1e-6, time.time() - self.session_start)
+        rate = self.embedded / elapsed
+        status = {
+            "source_model": self.state['source_model'],
+            "target_model": describe_model(self.target_model),
+            "started_at": self.state['started_at'],
+            "shadow_dir": self.shadow_dir,
+            "live_students": live,
+            "covered": live - len(pending),
+            "pending": len(pending),
+            "coverage": round((live - len(pending)) / live, 4) if live else 1.0,
+            "shadow_rows": len(self.shadow.student_ids),
+            "embedded": self.embedded,
+            "failed": self.failed,
+            "throughput_per_s": round(rate, 2),
+            "eta_seconds": round(len(pending) / rate, 1) if rate > 0 else None,
+            "ready": not pending,
+        }
+        if include_pending:
+            status["pending_ids"] = pending
+        return status
+
+    # -------- Cutover / abort --------
+    def cutover(self) -> Dict[str, Any]:
+        """Swap the shadow gallery in; refused unless coverage is 100%.
+
+        Holding the live write lock across the coverage check and the swap means
+        no registration can land in the old gallery in between.
+        """
+        live = self.face_system
+        if self.shadow._rebuild_thread is not None:
+            self.shadow._rebuild_thread.join()
+        with live._write_lock, self.shadow._write_lock:
+            pending = self.pending()
+            if pending:
+                raise MigrationIncomplete(pending)
+            if self.shadow._rebuild_thread is not None and self.shadow._rebuild_thread.is_alive():
+                raise Exception("Shadow index is being rebuilt; retry the cutover shortly")
+            source = self.state['source_model']
+            self.shadow.save_index()
+            os.remove(os.path.join(self.shadow_dir, STATE_FILE))
+            # Marker first: a crash after it is finished by complete_cutover on the next start
+            with open(os.path.join(self.shadow_dir, CUTOVER_MARKER), "w") as f:
+                json.dump({"source_model": source, "target_model": self.target_model, "time": time.time()}, f)
+            live.close_stores()
+            self.shadow.close_stores()
+            complete_cutover(live.index_dir)
+            live.adopt_gallery(self.shadow)
+        print(f"🔁 Model cutover {source} -> {self.target_model}: {len(set(live.student_ids))} students")
+        print(f"⚠️  Set the service's model to {self.target_model} (FACE_MODEL) before the next restart")
+        return {"status": "success", "source_model": source, "model": self.target_model,
+                "students": len(set(live.student_ids)), "ntotal": int(live.index.ntotal)}
+
+    def abort(self) -> None:
+        """Drop the shadow gallery; the live gallery is untouched."""
+        if self.shadow._rebuild_thread is not None:
+            self.shadow._rebuild_thread.join()
+        with self.shadow._write_lock:
+            self.shadow.close_stores()
+            shutil.rmtree(self.shadow_dir, ignore_errors=True)
+        print(f"⚠️  Re-embedding migration to {self.target_model} aborted")
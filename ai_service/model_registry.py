@@ -0,0 +1,73 @@
+"""Registry of face embedding models.
+
+Embeddings from different recognition models live in unrelated vector spaces:
+a gallery built with one model is useless to another, even at the same
+dimension. Every gallery therefore records the model that produced it
+(`model` in index_meta.json, `model_version` per student in metadata), and
+FaceRecognitionSystem refuses to mix models. Switching models means
+re-embedding every student into a new gallery (see migration.py).
+
+Model IDs are "<backend>/<pack>", the same string as `FaceBackend.name`:
+    insightface/buffalo_sc   InsightFace pack (FACE_MODEL=buffalo_sc, the default)
+    insightface/buffalo_l    ...any InsightFace pack name works
+    synthetic, synthetic/v2  offline stand-ins; each variant is its own embedding space
+"""
+from typing import Any, Dict, Optional
+
+from backends import FaceBackend, InsightFaceBackend, SyntheticBackend
+
+# Known packs, for reporting; unknown InsightFace packs still load
+MODELS: Dict[str, Dict[str, Any]] = {
+    'insightface/buffalo_sc': {
+        'dimension': 512, 'detector': 'SCRFD-500MF', 'recognizer': 'MobileFaceNet (WebFace600K)',
+        'notes': 'Fastest pack; default',
+    },
+    'insightface/buffalo_s': {
+        'dimension': 512, 'detector': 'SCRFD-500MF', 'recognizer': 'MobileFaceNet (WebFace600K)',
+        'notes': 'buffalo_sc plus landmark/attribute models (not used here)',
+    },
+    'insightface/buffalo_m': {
+        'dimension': 512, 'detector': 'SCRFD-2.5GF', 'recognizer': 'ResNet50 (WebFace600K)',
+        'notes': '',
+    },
+    'insightface/buffalo_l': {
+        'dimension': 512, 'detector': 'SCRFD-10GF', 'recognizer': 'ResNet50 (WebFace600K)',
+        'notes': 'Most accurate buffalo pack, ~4x slower detection than buffalo_sc',
+    },
+    'insightface/antelopev2': {
+        'dimension': 512, 'detector': 'SCRFD-10GF', 'recognizer': 'ResNet100 (Glint360K)',
+        'notes': 'Manual download',
+    },
+    'synthetic': {
+        'dimension': 512, 'detector': 'colour blobs', 'recognizer': 'identity lookup',
+        'notes': 'Offline benchmarks only',
+    },
+}
+
+
+def normalize_model_id(model: str) -> str:
+    """Accept a bare InsightFace pack name ("buffalo_l") as well as a full model ID."""
+    model = model.strip().lower()
+    if '/' not in model and model != 'synthetic':
+        return f"insightface/{model}"
+    return model
+
+
+def describe_model(model: str) -> Dict[str, Any]:
+    model = normalize_model_id(model)
+    info = MODELS.get(model) or MODELS.get(model.split('/')[0]) or {}
+    return {"model": model, **info}
+
+
+def load_model(model: str, current: Optional[FaceBackend] = None) -> FaceBackend:
+    """Backend for `model`; reuses `current` when it already is that model."""
+    model = normalize_model_id(model)
+    if current is not None and current.name == model:
+        return current
+    kind, _, pack = model.partition('/')
+    if kind == 'insightface' and pack:
+        return InsightFaceBackend(model_name=pack)
+    if kind == 'synthetic':
+        variant = int(pack.lstrip('v') or 0) if pack else 0
+        return SyntheticBackend.from_env(variant=variant)
+    raise ValueError(f"Unknown face model: {model}")
@@ -0,0 +1,266 @@
+"""Named gallery namespaces: isolated galleries for several tenants in one AI service.
+
+Requests choose a namespace with the X-Gallery-Namespace header (or ?namespace=).
+Without one they use the default gallery (FACE_INDEX_PATH), which is always
+loaded. Every other namespace is its own FaceRecognitionSystem in
+<FACE_NAMESPACE_ROOT>/<name> - index, raw vectors, ID map, metadata, change log
+and metrics are separate - and all of them share the process's detector /
+embedder backend, so a tenant costs gallery memory only.
+
+A namespace's gallery is created by its first registration, but only for the
+names listed in FACE_NAMESPACES or when the request carries the gallery token
+(X-Gallery-Token, see gallery_transfer.py): arbitrary header values cannot
+create directories. Existing namespaces need neither.
+
+A namespace is loaded on first use and stays loaded while requests use it.
+When the loaded namespaces together exceed FACE_NAMESPACE_BUDGET, the least
+recently used idle ones (no request in flight, no background index rebuild)
+are closed; the next request for them reloads from disk. Writes are persisted
+before a request returns, so closing an idle namespace loses nothing, and its
+metrics (bounded sample windows) are kept for the reload.
+
+Shard coordinators and replicas serve the default gallery only; gallery
+export / import, replication and re-embedding migrations also work on the
+default gallery alone.
+
+Environment:
+    FACE_NAMESPACES=                 namespaces registrations may create, e.g. "campus-a,campus-b"
+    FACE_NAMESPACE_ROOT=galleries    directory of namespace galleries (relative to this file)
+    FACE_NAMESPACE_BUDGET=0          memory for loaded namespaces, e.g. 2GB (0 = unlimited)
+    FACE_NAMESPACE_IDLE_S=0          also close namespaces unused this long (0 = only over budget)
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from face_recognition import FaceRecognitionSystem
+from memory import parse_size, release_free_memory
+
+DEFAULT_NAMESPACE = 'default'
+NAMESPACE_HEADER = 'X-Gallery-Namespace'
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+class NamespaceError(Exception):
+    """Invalid namespace name, or namespaces are not available on this node."""
+
+
+class NamespaceNotFound(NamespaceError):
+    """Searching a namespace that has no gallery yet."""
+
+
+def namespace_footprint(system: FaceRecognitionSystem) -> int:
+    """Heap held by one loaded gallery: its index, interned IDs and metric samples (see memory_usage)."""
+    usage = system.memory_usage()
+    return sum(usage[name]["bytes"] for name in ("index", "id_map", "metrics"))
+
+
+class GalleryNamespaces:
+    """Loaded namespace galleries in least-recently-used order, with a shared memory budget."""
+
+    def __init__(self, default: FaceRecognitionSystem, root: str, budget_bytes: int = 0, idle_s: float = 0.0,
+                 index_type: Optional[str] = None, configured: Iterable[str] = ()):
+        """
+        Args:
+            default: The default gallery (never closed; its backend is shared)
+            root: Directory holding one gallery directory per namespace
+            configured: Namespaces any registration may create (others need the gallery token)
+            budget_bytes: Memory for all loaded namespaces together (0 = unlimited)
+            idle_s: Close namespaces unused this long (0 = only when over budget)
+            index_type: Index type of namespace galleries (see FaceRecognitionSystem)
+        """
+        self.default = default
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.idle_s = idle_s
+        self.index_type = index_type
+        self.configured = frozenset(configured)
+        self.enabled = default.shards is None and not default.read_only
+        self._lock = threading.Lock()       # guards _loaded and the counters
+        self._load_lock = threading.Lock()  # one gallery load at a time
+        self._loaded: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()  # least recently used first
+        self._metrics: Dict[str, Dict[str, Any]] = {}  # metrics of closed namespaces, restored on reload
+        self.loads = 0
+        self.evictions = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, default: FaceRecognitionSystem, index_type: Optional[str] = None) -> 'GalleryNamespaces':
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(
+            default,
+            root=os.path.join(base_dir, os.environ.get('FACE_NAMESPACE_ROOT', 'galleries')),
+            budget_bytes=parse_size(os.environ.get('FACE_NAMESPACE_BUDGET', '0')),
+            idle_s=float(os.environ.get('FACE_NAMESPACE_IDLE_S', 0)),
+            index_type=index_type,
+            configured=[n.strip() for n in os.environ.get('FACE_NAMESPACES', '').split(',') if n.strip()],
+        )
+
+    def _path(self, name: str) -> str:
+        if not _NAME.match(name):
+            raise NamespaceError(f"Invalid namespace {name!r}: use up to 64 letters, digits, '_', '-' or '.'")
+        if not self.enabled:
+            raise NamespaceError("Gallery namespaces are not available on shard coordinators or replicas")
+        return os.path.join(self.root, name)
+
+    # -------- Request path --------
+    def acquire(self, name: Optional[str], create: bool = False) -> FaceRecognitionSystem:
+        """The gallery of `name`, loaded if needed; pair every call with release(name).
+
+        Args:
+            create: Start an empty gallery if the namespace does not exist (registrations)
+
+        Raises:
+            NamespaceNotFound: Namespace has no gallery and `create` is False
+            NamespaceError: Invalid name, or namespaces are disabled on this node
+        """
+        if not name or name == DEFAULT_NAMESPACE:
+            return self.default
+        path = self._path(name)
+        system = self._use_loaded(name)
+        if system is not None:
+            return system
+        with self._load_lock:
+            # Another request may have loaded it while this one waited
+            system = self._use_loaded(name)
+            if system is not None:
+                return system
+            if not create and not os.path.isdir(path):
+                raise NamespaceNotFound(f"Unknown gallery namespace: {name}")
+            start = time.perf_counter()
+            system = FaceRecognitionSystem(index_path=path, backend=self.default.backend,
+                                           index_type=self.index_type, read_only=False)
+            system.audit = self.default.audit
+            system.namespace = name
+            with self._lock:
+                system.metrics = self._metrics.pop(name, system.metrics)
+            entry = {
+                "system": system,
+                "refs": 1,
+                "last_used": time.time(),
+                "load_ms": round((time.perf_counter() - start) * 1000, 1),
+                "bytes": namespace_footprint(system),
+                "ntotal": int(system.index.ntotal),
+            }
+            with self._lock:
+                self._loaded[name] = entry
+                self.loads += 1
+        print(f"✓ Loaded gallery namespace {name}: {entry['ntotal']} faces in {entry['load_ms']} ms")
+        self.enforce()
+        return system
+
+    def _use_loaded(self, name: str) -> Optional[FaceRecognitionSystem]:
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is None:
+                return None
+            entry["refs"] += 1
+            entry["last_used"] = time.time()
+            self._loaded.move_to_end(name)
+            return entry["system"]
+
+    def release(self, name: Optional[str]) -> None:
+        """End a request's use of `name`; re-measures it after writes, then applies the budget."""
+        if not name or name == DEFAULT_NAMESPACE:
+            return
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            entry["last_used"] = time.time()
+        system = entry["system"]
+        if int(system.index.ntotal) != entry["ntotal"]:
+            entry["ntotal"] = int(system.index.ntotal)
+            entry["bytes"] = namespace_footprint(system)
+        if self.budget_bytes or self.idle_s:
+            self.enforce()
+
+    # -------- Eviction --------
+    @staticmethod
+    def _idle(entry: Dict[str, Any]) -> bool:
+        rebuild = entry["system"]._rebuild_thread
+        return entry["refs"] <= 0 and not (rebuild is not None and rebuild.is_alive())
+
+    def enforce(self, evict_all_idle: bool = False) -> List[str]:
+        """Close idle namespaces, least recently used first, until the loaded ones fit the budget.
+
+        Namespaces idle longer than idle_s are closed regardless of the budget;
+        `evict_all_idle` closes every idle one (memory pressure, see memory.py).
+        """
+        now = time.time()
+        victims = []
+        with self._lock:
+            total = sum(entry["bytes"] for entry in self._loaded.values())
+            for name, entry in self._loaded.items():
+                if not self._idle(entry):
+                    continue
+                expired = self.idle_s and now - entry["last_used"] > self.idle_s
+                if evict_all_idle or expired or (self.budget_bytes and total > self.budget_bytes):
+                    victims.append((name, entry))
+                    total -= entry["bytes"]
+            for name, entry in victims:
+                del self._loaded[name]
+                self._metrics[name] = entry["system"].metrics
+            self.evictions += len(victims)
+        if not victims:
+            return []
+        names = []
+        for name, entry in victims:
+            entry["system"].close_stores()
+            names.append(name)
+            print(f"🔁 Closed gallery namespace {name} ({entry['bytes'] / 2**20:.1f} MiB, "
+                  f"idle {now - entry['last_used']:.0f}s)")
+        # Drop the last references so the index and memory maps are freed before trimming the heap
+        del entry
+        victims.clear()
+        release_free_memory()
+        return names
+
+    def evict_idle(self) -> List[str]:
+        return self.enforce(evict_all_idle=True)
+
+    def start(self) -> None:
+        """Background check for namespaces idle past idle_s (no-op when idle_s is 0)."""
+        if self.idle_s <= 0 or self._thread is not None:
+            return
+
+        def run() -> None:
+            while True:
+                time.sleep(min(60.0, max(1.0, self.idle_s / 2)))
+                try:
+                    self.enforce()
+                except Exception as e:
+                    print(f"⚠️  Namespace idle check failed: {e}")
+
+        self._thread = threading.Thread(target=run, name='namespace-idle', daemon=True)
+        self._thread.start()
+
+    # -------- Reporting --------
+    def memory_usage(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            loaded = {name: entry["bytes"] for name, entry in self._loaded.items()}
+        return {"namespaces": {"bytes": sum(loaded.values()), "loaded": loaded, "budget": self.budget_bytes}}
+
+    def status(self) -> Dict[str, Any]:
+        """Namespaces on disk and in memory, with load / eviction counters."""
+        on_disk = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        with self._lock:
+            loaded = {name: {"faces": entry["ntotal"], "bytes": entry["bytes"], "in_use": entry["refs"],
+                             "idle_s": round(time.time() - entry["last_used"], 1), "load_ms": entry["load_ms"]}
+                      for name, entry in self._loaded.items()}
+            counters = {"loads": self.loads, "evictions": self.evictions}
+        return {
+            "enabled": self.enabled,
+            "default": {"faces": int(self.default.index.ntotal) if self.default.index is not None else 0,
+                        "index_path": self.default.index_dir},
+            "namespaces": [{"name": name, "loaded": name in loaded, **loaded.get(name, {})}
+                           for name in on_disk if _NAME.match(name)],
+            "loaded_bytes": sum(info["bytes"] for info in loaded.values()),
+            "budget_bytes": self.budget_bytes,
+            "idle_s": self.idle_s,
+            **counters,
+        }
@@ -0,0 +1,241 @@
+"""On-demand sampling profiler for the AI service.
+
+A sampler thread reads every thread's Python stack (sys._current_frames) at a
+fixed interval and counts identical stacks. Output is the "folded" format
+(`thread;outer (file:line);...;inner (file:line) count` per line) read by
+flamegraph.pl, inferno, speedscope and py-spy's tooling.
+
+Triggers (both need PROFILE_TOKEN; without it nothing is installed and the
+request path is untouched):
+- per request:  header `X-Profile-Token: <token>` profiles from request start
+  to the last response byte; the response carries `X-Profile: <file>`
+- time window:  POST /api/face/profile?seconds=30 with the same header
+
+All threads are sampled, so inference on the scheduler's worker threads is
+included; concurrent requests show up in the same profile. Threads blocked in
+waits / selects are skipped unless include_idle is set. One session at a
+time; a second trigger gets `X-Profile: busy`.
+
+Environment:
+    PROFILE_TOKEN             shared secret; unset = profiler disabled
+    PROFILE_DIR=profiles      output directory (relative to this file)
+    PROFILE_INTERVAL_MS=10    sampling interval
+    PROFILE_MAX_SECONDS=120   cap for one session
+    PROFILE_KEEP=50           newest profiles kept ...
+    PROFILE_MAX_MB=100        ... within this total size
+"""
+import os
+import re
+import sys
+import hmac
+import asyncio
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+TOKEN_HEADER = 'X-Profile-Token'
+RESULT_HEADER = 'X-Profile'
+
+# Leaf frames of threads parked with nothing to do (including a window session's own timer)
+_IDLE = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get'),
+         ('socket.py', 'accept'), ('base_events.py', '_run_once'), ('threading.py', '_wait_for_tstate_lock'),
+         ('profiler.py', 'profile_for')}
+
+
+def _stack(frame, include_idle: bool) -> Optional[tuple]:
+    """Code objects from innermost to outermost (None for an idle thread); formatted only when written."""
+    code = frame.f_code
+    if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+        return None
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(codes)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """One sampling session at a time, written as a folded-stacks file."""
+
+    def __init__(self, out_dir: str, interval_s: float = 0.01, max_seconds: float = 120.0,
+                 keep: int = 50, max_bytes: int = 100 * 2**20, service: str = 'ai'):
+        self.out_dir = out_dir
+        self.interval_s = interval_s
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.service = service
+        self._lock = threading.Lock()
+        self._session: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls) -> 'SamplingProfiler':
+        out_dir = os.environ.get('PROFILE_DIR', 'profiles')
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(
+            out_dir=os.path.join(base_dir, out_dir),
+            interval_s=float(os.environ.get('PROFILE_INTERVAL_MS', 10)) / 1000,
+            max_seconds=float(os.environ.get('PROFILE_MAX_SECONDS', 120)),
+            keep=int(os.environ.get('PROFILE_KEEP', 50)),
+            max_bytes=int(float(os.environ.get('PROFILE_MAX_MB', 100)) * 2**20),
+        )
+
+    @property
+    def active(self) -> bool:
+        return self._session is not None
+
+    def start(self, label: str, include_idle: bool = False) -> Optional[str]:
+        """Begin sampling -> name of the profile file it will write (None if a session is running)."""
+        with self._lock:
+            if self._session is not None:
+                return None
+            slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')[:80] or 'profile'
+            session = {
+                "label": label,
+                "file": f"{self.service}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{slug}.folded",
+                "started": time.time(),
+                "stop": threading.Event(),
+                "counts": Counter(),
+                "samples": 0,
+                "include_idle": include_idle,
+            }
+            session["thread"] = threading.Thread(target=self._sample, args=(session,), name='profiler', daemon=True)
+            self._session = session
+        session["thread"].start()
+        return session["file"]
+
+    def stop(self) -> Dict[str, Any]:
+        """End the session and write its profile -> {"file", "samples", "seconds", ...}."""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is None:
+            raise Exception("No profiling session is running")
+        session["stop"].set()
+        session["thread"].join()
+        return self._write(session)
+
+    def profile_for(self, seconds: float, label: str = 'window', include_idle: bool = False) -> Dict[str, Any]:
+        """Sample for a time window (blocking)."""
+        if self.start(label, include_idle) is None:
+            raise Exception("A profiling session is already running")
+        time.sleep(min(seconds, self.max_seconds))
+        return self.stop()
+
+    def _sample(self, session: Dict[str, Any]) -> None:
+        own = threading.get_ident()
+        counts: Counter = session["counts"]
+        deadline = session["started"] + self.max_seconds
+        while not session["stop"].wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = _stack(frame, session["include_idle"])
+                if stack:
+                    counts[(names.get(ident, str(ident)), stack)] += 1
+            session["samples"] += 1
+            if time.time() > deadline:
+                break
+
+    def _write(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = session["file"]
+        frame_names: Dict[Any, str] = {}
+        with open(os.path.join(self.out_dir, name), "w") as f:
+            for (thread, stack), count in session["counts"].most_common():
+                frames = [frame_names.setdefault(code, _frame_name(code)) for code in reversed(stack)]
+                f.write(f"{thread};{';'.join(frames)} {count}\n")
+        self._prune()
+        return {"file": name, "label": session["label"], "samples": session["samples"],
+                "stacks": len(session["counts"]), "seconds": round(time.time() - session["started"], 3),
+                "interval_ms": self.interval_s * 1000}
+
+    def _prune(self) -> None:
+        """Keep the newest `keep` profiles within `max_bytes`."""
+        files = self.list()
+        total = 0
+        for i, info in enumerate(files):
+            total += info["bytes"]
+            if i >= self.keep or total > self.max_bytes:
+                try:
+                    os.remove(os.path.join(self.out_dir, info["file"]))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Saved profiles, newest first."""
+        if not os.path.isdir(self.out_dir):
+            return []
+        out = []
+        for name in os.listdir(self.out_dir):
+            if name.endswith('.folded'):
+                st = os.stat(os.path.join(self.out_dir, name))
+                out.append({"file": name, "bytes": st.st_size, "modified": st.st_mtime})
+        return sorted(out, key=lambda info: info["modified"], reverse=True)
+
+    def path_of(self, name: str) -> str:
+        """Absolute path of a saved profile (no directory traversal)."""
+        if os.path.basename(name) != name or not name.endswith('.folded'):
+            raise ValueError("Invalid profile name")
+        path = os.path.join(self.out_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(name)
+        return path
+
+
+def token_matches(expected: Optional[str], given: Optional[str]) -> bool:
+    return bool(expected) and given is not None and hmac.compare_digest(expected.encode(), given.encode())
+
+
+class ProfileMiddleware:
+    """ASGI middleware: profile requests carrying a valid X-Profile-Token header.
+
+    Installed only when PROFILE_TOKEN is set, so a disabled profiler adds
+    nothing to the request path. Requests without the header pass straight
+    through after one header lookup.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler, token: str):
+        self.app = app
+        self.profiler = profiler
+        self.token = token
+        self._header = TOKEN_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        given = next((v.decode('latin-1') for k, v in scope.get("headers", []) if k == self._header), None)
+        # The window endpoint manages its own session
+        if given is None or scope["path"].startswith("/api/face/profile"):
+            return await self.app(scope, receive, send)
+        if not token_matches(self.token, given):
+            return await self.app(scope, receive, send)
+        name = self.profiler.start(f"{scope['method']} {scope['path']}")
+        header = (RESULT_HEADER.lower().encode(), (name or "busy").encode())
+        done = name is None
+
+        async def finish() -> None:
+            nonlocal done
+            if done:
+                return
+            done = True
+            result = await asyncio.to_thread(self.profiler.stop)
+            print(f"✓ Profiled {result['label']}: {result['samples']} samples -> {result['file']}")
+
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [header]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                await finish()
+
+        try:
+            await self.app(scope, receive, wrapped)
+        finally:
+            await finish()
@@ -0,0 +1,252 @@
+"""Primary/replica log shipping for the face gallery.
+
+The gallery is append-only: every insert is a new row in the raw vector store
+(vectors.f32) and the student ID map (student_ids.i64). The change log records, per row, when
+it was written and for which student, in fixed-size records, so a row number
+doubles as a log sequence number (LSN).
+
+Replicas (AI_ROLE=replica, AI_PRIMARY_URL=http://primary:8001) poll
+    GET /api/face/replication/log?since=<their row count>
+apply the returned rows through the normal insert path (their own index type,
+their own files) and serve read-only recognition. Metadata changed without a
+new row (duplicate flags, merge counters, shard placement) ships in the same
+response by metadata store version (`meta_since`); the replica keeps the
+version it has applied in replica_state.json. Lag is reported in rows and
+seconds in /api/face/replication/status and /api/face/stats. The log carries
+every stored embedding, so primary and replicas share GALLERY_TOKEN (sent as
+X-Gallery-Token, see gallery_transfer.py).
+"""
+import os
+import json
+import time
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sharding import encode_embeddings, decode_embeddings
+from gallery_transfer import token_headers
+
+ROLES = ('standalone', 'primary', 'replica')
+STATE_FILE = 'replica_state.json'
+
+
+class ChangeLog:
+    """Append-only log of (timestamp, student_id) records, row-aligned with vectors.f32."""
+
+    RECORD = struct.Struct('<d64s')  # unix time, UTF-8 student ID (NUL padded)
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.path) // self.RECORD.size if os.path.exists(self.path) else 0
+
+    def append(self, student_ids: List[str], timestamps: Optional[List[float]] = None) -> None:
+        now = time.time()
+        records = []
+        for i, sid in enumerate(student_ids):
+            raw = str(sid).encode('utf-8')
+            if len(raw) > 64:
+                raise Exception(f"Student ID too long for change log (64 bytes max): {sid}")
+            records.append(self.RECORD.pack(timestamps[i] if timestamps else now, raw))
+        with open(self.path, "ab") as f:
+            f.write(b"".join(records))
+
+    def read(self, since: int, limit: int) -> Tuple[List[float], List[str]]:
+        """Records [since, since + limit) as (timestamps, student_ids)."""
+        size = self.RECORD.size
+        with open(self.path, "rb") as f:
+            f.seek(since * size)
+            data = f.read(limit * size)
+        timestamps, ids = [], []
+        for off in range(0, len(data) - len(data) % size, size):
+            ts, raw = self.RECORD.unpack_from(data, off)
+            timestamps.append(ts)
+            ids.append(raw.rstrip(b'\0').decode('utf-8'))
+        return timestamps, ids
+
+    def last_timestamp(self) -> float:
+        n = len(self)
+        return self.read(n - 1, 1)[0][0] if n else 0.0
+
+    def sync(self, student_ids: List[str]) -> None:
+        """Make the log row-aligned with the ID map (trims a torn tail, backfills older galleries)."""
+        n = len(self)
+        if n > len(student_ids):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(student_ids) * self.RECORD.size)
+        elif n < len(student_ids):
+            if n == 0 and os.path.exists(self.path):
+                os.remove(self.path)
+            # Time unknown for rows written before the log existed
+            self.append(student_ids[n:], [0.0] * (len(student_ids) - n))
+
+
+def read_log_batch(face_system, since: int, limit: int, meta_since: Optional[int] = None) -> Dict[str, Any]:
+    """Primary side of GET /api/face/replication/log.
+
+    With `meta_since`, also returns up to `limit` metadata documents written after
+    that store version ("metadata_updates") and the version they reach.
+    """
+    with face_system._write_lock:
+        lsn = len(face_system.changelog)
+    since = max(0, min(since, lsn))
+    count = max(0, min(limit, lsn - since))
+    timestamps, ids = face_system.changelog.read(since, count) if count else ([], [])
+    vectors = face_system.load_vectors()[since:since + count]
+    metadata = face_system.metadata.get_many(ids)
+    updates = {}
+    if meta_since is not None:
+        changed, meta_version = face_system.metadata.changed_since(max(0, meta_since), limit)
+        updates = {"metadata_updates": changed, "metadata_version": meta_version,
+                   "metadata_more": meta_version < face_system.metadata.version()}
+    return {
+        "since": since,
+        "count": count,
+        "primary_lsn": lsn,
+        "primary_time": time.time(),
+        "model": face_system.gallery_model,
+        "timestamps": timestamps,
+        "student_ids": ids,
+        "metadata": metadata,
+        **updates,
+        **encode_embeddings(np.asarray(vectors, dtype=np.float32).reshape(-1, face_system.dimension)),
+    }
+
+
+class ReplicaFollower:
+    """Background thread that pulls the primary's change log and applies it locally."""
+
+    def __init__(self, face_system, primary_url: str, poll_interval: float = 1.0, batch: int = 2000,
+                 timeout: float = 10.0):
+        """
+        Args:
+            face_system: Local FaceRecognitionSystem (read-only for clients)
+            primary_url: Base URL of the primary AI service
+            poll_interval: Seconds between polls once caught up
+            batch: Max log records per request
+        """
+        self.face_system = face_system
+        self.primary_url = primary_url.rstrip('/')
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.timeout = timeout
+        self.primary_lsn = 0
+        self.primary_time = 0.0
+        # Newest applied write time; rows backfilled before the change log existed are stamped 0
+        self.applied_time = face_system.changelog.last_timestamp()
+        self.state_path = os.path.join(face_system.index_dir, STATE_FILE)
+        self.meta_version = self._load_state().get("meta_version", 0)
+        self.meta_more = False
+        self.last_sync = 0.0
+        self.last_error: Optional[str] = None
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session = None
+
+    @classmethod
+    def from_env(cls, face_system) -> Optional['ReplicaFollower']:
+        if os.environ.get('AI_ROLE', 'standalone') != 'replica':
+            return None
+        primary = os.environ.get('AI_PRIMARY_URL')
+        if not primary:
+            raise Exception("AI_ROLE=replica requires AI_PRIMARY_URL")
+        return cls(face_system, primary, poll_interval=float(os.environ.get('AI_REPLICA_POLL_S', 1.0)))
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='replica-follower', daemon=True)
+        self._thread.start()
+        print(f"✓ Replica following {self.primary_url} from LSN {len(self.face_system.student_ids)}")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"meta_version": self.meta_version}, f)
+        os.replace(tmp, self.state_path)
+
+    def _fetch(self, since: int) -> Dict[str, Any]:
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update(token_headers())
+        resp = self._session.get(f"{self.primary_url}/api/face/replication/log",
+                                 params={"since": since, "limit": self.batch, "meta_since": self.meta_version},
+                                 timeout=self.timeout)
+        if resp.status_code != 200:
+            raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        return resp.json()
+
+    def poll_once(self) -> int:
+        """Fetch and apply one batch (rows, then metadata-only updates); returns the number of rows applied."""
+        since = len(self.face_system.student_ids)
+        res = self._fetch(since)
+        self.primary_lsn = int(res["primary_lsn"])
+        self.primary_time = float(res["primary_time"])
+        model = res.get("model")
+        if model and model != self.face_system.backend.name:
+            # After a model cutover on the primary the replica must be re-seeded with the new model
+            raise Exception(f"Primary gallery model {model} != replica model {self.face_system.backend.name}; "
+                            f"restart the replica with FACE_MODEL matching and an empty index")
+        if res["since"] != since:
+            raise Exception(f"Primary log diverged (asked {since}, got {res['since']}); "
+                            f"replica has more rows than primary")
+        if res["count"]:
+            self.face_system.apply_replicated(decode_embeddings(res), res["student_ids"],
+                                              res.get("metadata") or {}, res["timestamps"])
+            self.applied_time = max([self.applied_time] + [t for t in res["timestamps"] if t > 0])
+        if res.get("metadata_version", self.meta_version) != self.meta_version:
+            # Re-applying after a crash before the state is saved is harmless: documents are replaced whole
+            self.face_system.metadata.set_many(res.get("metadata_updates") or {})
+            self.meta_version = int(res["metadata_version"])
+            self._save_state()
+        self.meta_more = bool(res.get("metadata_more"))
+        self.last_sync = time.time()
+        self.last_error = None
+        return int(res["count"])
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                applied = self.poll_once()
+                if (applied and len(self.face_system.student_ids) < self.primary_lsn) or self.meta_more:
+                    continue  # more to catch up: no sleep
+            except Exception as e:
+                self.errors += 1
+                if self.last_error != str(e):
+                    print(f"⚠️  Replication poll failed: {e}")
+                self.last_error = str(e)
+            self._stop.wait(self.poll_interval)
+
+    def status(self) -> Dict[str, Any]:
+        applied = len(self.face_system.student_ids)
+        lag_rows = max(0, self.primary_lsn - applied)
+        # Age of the newest applied write relative to the primary clock; 0 when caught up,
+        # None while only backfilled rows (no write time) have been applied
+        lag_seconds = 0.0
+        if lag_rows:
+            lag_seconds = round(max(0.0, self.primary_time - self.applied_time), 3) if self.applied_time else None
+        return {
+            "role": "replica",
+            "primary": self.primary_url,
+            "applied_lsn": applied,
+            "primary_lsn": self.primary_lsn,
+            "lag_rows": lag_rows,
+            "lag_seconds": lag_seconds,
+            "metadata_version": self.meta_version,
+            "seconds_since_sync": round(time.time() - self.last_sync, 3) if self.last_sync else None,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,154 @@
+"""Run a sharded AI service locally: N shard processes plus a coordinator.
+
+Each shard is a normal AI service on its own port with its own index
+directory; the coordinator is started with AI_SHARDS pointing at them and
+serves the usual API on --port (point Django's AI_SERVICE_URL there).
+
+Usage:
+    python run_shards.py --shards 3                        # serve until Ctrl-C
+    python run_shards.py --shards 3 --backend synthetic --smoke 300
+        # register 300 synthetic students through the coordinator, recognize
+        # probes, compare with the expected IDs and report per-shard sizes
+"""
+import os
+import sys
+import time
+import secrets
+import signal
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List
+
+import numpy as np
+import cv2
+import requests
+
+
+def _start(port: int, env: Dict[str, str], log_dir: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **env},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 120.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise Exception(f"{url} exited with code {proc.returncode}")
+        try:
+            if requests.get(url + "/", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise Exception(f"{url} did not become ready in {timeout:.0f}s")
+
+
+def _jpeg(img: np.ndarray) -> bytes:
+    ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+    if not ok:
+        raise Exception("JPEG encode failed")
+    return buf.tobytes()
+
+
+def smoke(url: str, students: int, departments: List[str]) -> int:
+    """Register synthetic students through the coordinator and check recognition."""
+    from backends import render_synthetic_scene, SYNTHETIC_MAX_IDENTITIES
+
+    students = min(students, SYNTHETIC_MAX_IDENTITIES)
+    t0 = time.time()
+    for i in range(students):
+        frames = [_jpeg(render_synthetic_scene(320, 320, [(i, 60 + k, 60, 200)], seed=i * 10 + k)) for k in range(3)]
+        files = [('files', (f'f{k}.jpg', b, 'image/jpeg')) for k, b in enumerate(frames)]
+        resp = requests.post(url + '/api/face/register_multi', files=files,
+                             data={'student_id': str(i), 'department': departments[i % len(departments)]}, timeout=30)
+        if resp.status_code != 200:
+            print(f"⚠️  register {i}: HTTP {resp.status_code}: {resp.text[:200]}")
+            return 1
+    print(f"✓ Registered {students} students in {time.time() - t0:.1f}s")
+
+    correct = 0
+    latencies = []
+    for i in range(students):
+        probe = _jpeg(render_synthetic_scene(320, 320, [(i, 70, 50, 190)], seed=50_000 + i))
+        t0 = time.perf_counter()
+        resp = requests.post(url + '/api/face/recognize', files={'file': ('p.jpg', probe, 'image/jpeg')}, timeout=30)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if resp.status_code == 200 and resp.json().get('student_id') == str(i):
+            correct += 1
+    print(f"✓ Recognized {correct}/{students} via scatter-gather "
+          f"(p50 {np.percentile(latencies, 50):.1f} ms, p99 {np.percentile(latencies, 99):.1f} ms)")
+
+    stats = requests.get(url + '/api/face/stats', timeout=10).json()
+    for shard in stats.get('shards') or []:
+        print(f"  shard {shard['shard']}: {shard.get('ntotal')} vectors ({shard['status']})")
+    return 0 if correct == students else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run N local AI shard processes and a coordinator")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8001, help="Coordinator port")
+    parser.add_argument("--base-port", type=int, default=8101, help="First shard port")
+    parser.add_argument("--partition", choices=("hash", "department"), default="hash")
+    parser.add_argument("--backend", help="FACE_BACKEND for all processes (e.g. synthetic)")
+    parser.add_argument("--data-dir", help="Parent directory for shard indexes (default: temp dir)")
+    parser.add_argument("--smoke", type=int, default=0, metavar="N",
+                        help="Register and recognize N synthetic students, then exit")
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.abspath(args.data_dir or tempfile.mkdtemp(prefix="ai_shards_"))
+    os.makedirs(data_dir, exist_ok=True)
+    common = {"FACE_BACKEND": args.backend} if args.backend else {}
+    # Shards only accept rows from a coordinator holding their gallery token
+    common["GALLERY_TOKEN"] = os.environ.get('GALLERY_TOKEN') or secrets.token_hex(16)
+    procs: List[subprocess.Popen] = []
+    try:
+        shard_urls = []
+        for i in range(args.shards):
+            port = args.base_port + i
+            env = {**common, "FACE_INDEX_PATH": os.path.join(data_dir, f"shard_{i}"), "AI_SHARDS": ""}
+            procs.append(_start(port, env, data_dir, f"shard_{i}"))
+            shard_urls.append(f"http://127.0.0.1:{port}")
+        for url, proc in zip(shard_urls, procs):
+            _wait_ready(url, proc)
+
+        coordinator_env = {
+            **common,
+            "FACE_INDEX_PATH": os.path.join(data_dir, "coordinator"),
+            "AI_SHARDS": ",".join(shard_urls),
+            "AI_SHARD_PARTITION": args.partition,
+        }
+        procs.append(_start(args.port, coordinator_env, data_dir, "coordinator"))
+        coordinator = f"http://127.0.0.1:{args.port}"
+        _wait_ready(coordinator, procs[-1])
+        print(f"✓ Coordinator {coordinator} over {args.shards} shards ({args.partition}); logs in {data_dir}")
+
+        if args.smoke:
+            return smoke(coordinator, args.smoke, ["CSE", "ECE", "MECH", "CIVIL", "IT"])
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+        print("⚠️  A process exited; shutting down")
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""One-off scan of the gallery for near-duplicate clusters.
+
+Finds groups of stored embeddings above a similarity threshold: clusters
+spanning several student IDs are most likely one person registered twice;
+single-ID clusters are redundant re-registrations.
+
+Usage:
+    python scan_duplicates.py                          # default index, FACE_DUPLICATE_THRESHOLD
+    python scan_duplicates.py --threshold 0.8 -o duplicates.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Find near-duplicate clusters in the face gallery")
+    parser.add_argument("--index-path", default=os.environ.get('FACE_INDEX_PATH', 'faiss_index'))
+    parser.add_argument("--threshold", type=float, help="Cosine similarity (default: FACE_DUPLICATE_THRESHOLD)")
+    parser.add_argument("-k", type=int, default=10, help="Neighbours examined per vector")
+    parser.add_argument("-o", "--output", help="Write clusters as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from face_recognition import FaceRecognitionSystem
+
+    system = FaceRecognitionSystem(index_path=args.index_path, index_type=os.environ.get('FACE_INDEX_TYPE', 'auto'))
+    t0 = time.time()
+    clusters = system.find_duplicate_clusters(threshold=args.threshold, k=args.k)
+    cross = [c for c in clusters if c["cross_student"]]
+    print(f"\n✓ Scanned {len(system.student_ids)} vectors in {time.time() - t0:.1f}s: "
+          f"{len(cross)} cross-student clusters, {len(clusters) - len(cross)} re-registration clusters")
+    for c in cross[:20]:
+        print(f"  ⚠️  {', '.join(c['student_ids'])}  (max similarity {c['max_similarity']:.3f}, {len(c['rows'])} vectors)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"threshold": args.threshold or system.DUPLICATE_THRESHOLD, "clusters": clusters}, f, indent=2)
+        print(f"✓ Clusters written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""Admission control, deadlines and priority lanes for inference work.
+
+Inference (detection + ArcFace + search) runs on a fixed pool of worker
+threads fed by bounded per-lane queues, so the event loop keeps accepting
+requests and can refuse work quickly instead of letting latency grow without
+bound:
+
+- lane queue full                     -> Overloaded (HTTP 503 + Retry-After)
+- expected wait exceeds the deadline  -> Overloaded (nobody would get the answer)
+- deadline passed while queued        -> DeadlineExceeded, dropped before inference
+
+Lanes, in dispatch order:
+    live         classroom recognition (recognize*, recognize_frame, recognize_crops)
+    interactive  teacher-driven registration
+    batch        backfill, bulk enrolment, recognize_batch, re-embedding
+
+Workers always take live work first, then interactive. Batch work is split
+into small units (one image / one registration) and only starts when no
+higher lane is waiting, so live requests wait at most for one batch unit
+already running. While higher lanes are active, batch is further capped to
+AI_BATCH_SHARE of worker time; when they are idle batch may use everything.
+
+Callers pass their remaining budget in the `X-Request-Deadline-Ms` header
+(relative milliseconds, so client and server clocks need not agree) and may
+lower their lane with `X-Priority` (never raise it above the endpoint's).
+
+Environment:
+    AI_INFER_WORKERS=1            inference threads (ONNX Runtime already uses several cores)
+    AI_MAX_QUEUE=16               queued live / interactive requests before shedding
+    AI_MAX_BATCH_QUEUE=64         queued batch units before shedding
+    AI_BATCH_SHARE=0.2            max fraction of worker time for batch while live work is active
+    AI_DEFAULT_DEADLINE_MS=30000  budget for live/interactive requests that carry none
+"""
+import os
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import tracing
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+PRIORITY_HEADER = 'X-Priority'
+LANES = ('live', 'interactive', 'batch')
+
+# Higher lanes count as active for this long after their last arrival
+_CONTENTION_WINDOW_S = 2.0
+# Batch utilisation is measured over this sliding window
+_SHARE_WINDOW_S = 10.0
+
+
+class Overloaded(Exception):
+    """Request refused at admission; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The caller's deadline passed before the work could start."""
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'lane', 'deadline', 'enqueued', 'future', 'context')
+
+    def __init__(self, fn, args, kwargs, lane: str, deadline: float):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.future: Future = Future()
+        # The submitter's context variables (e.g. the request's audit context) for the worker
+        self.context = contextvars.copy_context()
+
+
+def _run_traced(job: _Job, dequeued: float) -> Any:
+    """Run the job; its queue wait and run time become spans of the submitting request's trace."""
+    waited = dequeued - job.enqueued
+    tracing.record_span('queue', time.time() - (time.monotonic() - job.enqueued), waited * 1000, lane=job.lane)
+    with tracing.span('inference', lane=job.lane):
+        return job.fn(*job.args, **job.kwargs)
+
+
+class _Lane:
+    def __init__(self, name: str, max_queue: int):
+        self.name = name
+        self.max_queue = max_queue
+        self.queue: Deque[_Job] = deque()
+        self.running = 0
+        # EWMA of service time, used for Retry-After and expected-wait estimates
+        self.service_s = 0.05
+        self.last_arrival = 0.0
+        self.wait_ms: List[float] = []
+        self.counters = {
+            'admitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'shed_queue_full': 0,
+            'shed_infeasible': 0,
+            'shed_expired': 0,
+        }
+
+
+class InferenceScheduler:
+    """Per-lane bounded queues in front of a fixed pool of inference threads."""
+
+    def __init__(self, workers: int = 1, max_queue: int = 16, max_batch_queue: int = 64,
+                 batch_share: float = 0.2, default_deadline_ms: int = 30000):
+        """
+        Args:
+            workers: Inference threads
+            max_queue: Waiting live / interactive jobs (each) before new ones are shed
+            max_batch_queue: Waiting batch jobs before new ones are shed
+            batch_share: Max fraction of worker time batch may use while higher lanes are active
+            default_deadline_ms: Budget for live/interactive requests that carry no deadline
+        """
+        self.workers = max(1, workers)
+        self.batch_share = min(1.0, max(0.0, batch_share))
+        self.default_deadline_ms = default_deadline_ms
+        self.lanes = {
+            'live': _Lane('live', max(1, max_queue)),
+            'interactive': _Lane('interactive', max(1, max_queue)),
+            'batch': _Lane('batch', max(1, max_batch_queue)),
+        }
+        self._cond = threading.Condition()
+        self._batch_busy: Deque = deque()  # (start, end) of finished batch units
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'infer-{i}', daemon=True).start()
+
+    @classmethod
+    def from_env(cls) -> 'InferenceScheduler':
+        return cls(
+            workers=int(os.environ.get('AI_INFER_WORKERS', 1)),
+            max_queue=int(os.environ.get('AI_MAX_QUEUE', 16)),
+            max_batch_queue=int(os.environ.get('AI_MAX_BATCH_QUEUE', 64)),
+            batch_share=float(os.environ.get('AI_BATCH_SHARE', 0.2)),
+            default_deadline_ms=int(os.environ.get('AI_DEFAULT_DEADLINE_MS', 30000)),
+        )
+
+    # -------- Estimates --------
+    def _expected_wait_s(self, lane: str) -> float:
+        """Time until a new job in `lane` would start: everything ahead of it, spread over the workers."""
+        ahead = 0.0
+        for name in LANES[:LANES.index(lane) + 1]:
+            l = self.lanes[name]
+            ahead += len(l.queue) * l.service_s
+        running = sum(l.running * l.service_s for l in self.lanes.values()) / 2  # on average half done
+        return (ahead + running) / self.workers
+
+    def _retry_after(self, lane: str) -> int:
+        return max(1, math.ceil(self._expected_wait_s(lane)))
+
+    # -------- Submission --------
+    def submit(self, fn: Callable, *args, lane: str = 'live', deadline_ms: Optional[float] = None,
+               **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) in `lane`; raises Overloaded instead of queueing hopeless work.
+
+        Batch jobs without a deadline never expire.
+        """
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        if deadline_ms is None and lane != 'batch':
+            deadline_ms = self.default_deadline_ms
+        with self._cond:
+            l = self.lanes[lane]
+            depth = len(l.queue)
+            if depth >= l.max_queue:
+                l.counters['shed_queue_full'] += 1
+                raise Overloaded(f"{lane} queue full ({depth} waiting)", self._retry_after(lane))
+            if deadline_ms is not None:
+                wait_s = self._expected_wait_s(lane)
+                if wait_s + l.service_s > deadline_ms / 1000.0:
+                    l.counters['shed_infeasible'] += 1
+                    raise Overloaded(f"Expected wait {wait_s * 1000:.0f} ms exceeds deadline {deadline_ms:.0f} ms",
+                                     self._retry_after(lane))
+            deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms is not None else math.inf
+            job = _Job(fn, args, kwargs, lane, deadline)
+            l.counters['admitted'] += 1
+            l.last_arrival = job.enqueued
+            l.queue.append(job)
+            self._cond.notify()
+        return job.future
+
+    async def run(self, fn: Callable, *args, lane: str = 'live', deadline_ms: Optional[float] = None,
+                  **kwargs) -> Any:
+        """Await fn(*args, **kwargs) on an inference thread (see submit)."""
+        return await asyncio.wrap_future(self.submit(fn, *args, lane=lane, deadline_ms=deadline_ms, **kwargs))
+
+    def call(self, fn: Callable, *args, lane: str = 'batch', **kwargs) -> Any:
+        """Blocking submit for worker-side batch loops: waits out overload instead of failing."""
+        while True:
+            try:
+                return self.submit(fn, *args, lane=lane, **kwargs).result()
+            except Overloaded as e:
+                time.sleep(min(e.retry_after, 5))
+
+    # -------- Dispatch --------
+    def _batch_allowed(self, now: float) -> bool:
+        contended = any(now - self.lanes[n].last_arrival < _CONTENTION_WINDOW_S for n in ('live', 'interactive'))
+        if not contended:
+            return True
+        while self._batch_busy and self._batch_busy[0][1] < now - _SHARE_WINDOW_S:
+            self._batch_busy.popleft()
+        busy = sum(end - max(start, now - _SHARE_WINDOW_S) for start, end in self._batch_busy)
+        busy += self.lanes['batch'].running * self.lanes['batch'].service_s / 2
+        return busy < self.batch_share * self.workers * _SHARE_WINDOW_S
+
+    def _next_job(self) -> _Job:
+        with self._cond:
+            while True:
+                for name in ('live', 'interactive'):
+                    if self.lanes[name].queue:
+                        return self.lanes[name].queue.popleft()
+                batch = self.lanes['batch']
+                if batch.queue and self._batch_allowed(time.monotonic()):
+                    return batch.queue.popleft()
+                # Re-check periodically: the batch share frees up over time
+                self._cond.wait(timeout=0.05 if batch.queue else None)
+
+    def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                # One bad job must not take the worker (and with it all inference) down
+                print(f"⚠️  Inference worker: job in {job.lane} lane failed outside its future: {e}")
+
+    def _run_job(self, job: _Job) -> None:
+        # A cancelled future (caller disconnected while queued) accepts no result or exception
+        if not job.future.set_running_or_notify_cancel():
+            return
+        lane = self.lanes[job.lane]
+        now = time.monotonic()
+        if now > job.deadline:
+            # The caller has already timed out: don't spend inference on it
+            with self._cond:
+                lane.counters['shed_expired'] += 1
+            job.future.set_exception(DeadlineExceeded(
+                f"Deadline passed after {(now - job.enqueued) * 1000:.0f} ms in {job.lane} queue"))
+            return
+        with self._cond:
+            lane.running += 1
+            lane.wait_ms.append((now - job.enqueued) * 1000)
+            del lane.wait_ms[:-1000]
+        started = time.monotonic()
+        ok = False
+        try:
+            result = job.context.run(_run_traced, job, now)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+            ok = True
+        finally:
+            # Lane accounting is restored even if delivering the outcome fails
+            finished = time.monotonic()
+            with self._cond:
+                lane.running -= 1
+                lane.service_s = 0.8 * lane.service_s + 0.2 * (finished - started)
+                lane.counters['completed' if ok else 'failed'] += 1
+                if job.lane == 'batch':
+                    self._batch_busy.append((started, finished))
+                self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            lanes = {}
+            shed_total = 0
+            for name in LANES:
+                l = self.lanes[name]
+                waits = sorted(l.wait_ms)
+                shed = l.counters['shed_queue_full'] + l.counters['shed_infeasible'] + l.counters['shed_expired']
+                shed_total += shed
+                lanes[name] = {
+                    "max_queue": l.max_queue,
+                    "queue_depth": len(l.queue),
+                    "running": l.running,
+                    "service_time_ms": round(l.service_s * 1000, 2),
+                    "expected_wait_ms": round(self._expected_wait_s(name) * 1000, 2),
+                    "queue_wait_ms_p50": round(waits[len(waits) // 2], 2) if waits else 0.0,
+                    "queue_wait_ms_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 2) if waits else 0.0,
+                    **l.counters,
+                    "shed_total": shed,
+                }
+            return {
+                "workers": self.workers,
+                "batch_share": self.batch_share,
+                "queue_depth": sum(len(l.queue) for l in self.lanes.values()),
+                "running": sum(l.running for l in self.lanes.values()),
+                "shed_total": shed_total,
+                "lanes": lanes,
+            }
+
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """Request payloads (decoded frames, crops, raw bytes) held by queued jobs."""
+        def size(value: Any) -> int:
+            if hasattr(value, 'nbytes'):
+                return int(value.nbytes)
+            if isinstance(value, (bytes, bytearray)):
+                return len(value)
+            if isinstance(value, (list, tuple)):
+                return sum(size(v) for v in value)
+            return 0
+
+        with self._cond:
+            jobs = [job for lane in self.lanes.values() for job in lane.queue]
+            running = sum(l.running for l in self.lanes.values())
+        return {
+            "bytes": sum(size(job.args) + size(list(job.kwargs.values())) for job in jobs),
+            "queued_jobs": len(jobs),
+            "running_jobs": running,
+        }
+
+
+def parse_deadline_ms(value: Optional[str]) -> Optional[float]:
+    """Remaining budget from the X-Request-Deadline-Ms header (None if absent or invalid)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def resolve_lane(default: str, requested: Optional[str]) -> str:
+    """Lane for a request: the X-Priority header may lower the endpoint's lane, never raise it."""
+    if requested and requested in LANES and LANES.index(requested) > LANES.index(default):
+        return requested
+    return default
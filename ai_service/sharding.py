@@ -0,0 +1,190 @@
+"""Sharded gallery: scatter-gather search across several AI service nodes.
+
+A coordinator is a normal AI service started with AI_SHARDS set. It still
+runs detection, quality gating, aggregation, thresholds and voting, but the
+gallery lives on the shard nodes (plain AI services, each with its own
+FACE_INDEX_PATH). Query embeddings are fanned out to every shard in parallel
+and the per-shard top-k lists are merged by similarity.
+
+Environment (coordinator):
+    AI_SHARDS=http://10.0.0.5:8101,http://10.0.0.6:8101   shard base URLs, order is significant
+    AI_SHARD_PARTITION=hash | department                     how registrations are placed
+    AI_SHARD_MAP=CSE=0,ECE=1                                 optional department -> shard pins
+    AI_SHARD_TIMEOUT=5                                       seconds per shard request
+    AI_SHARD_ALLOW_PARTIAL=0                                 1 = answer from the shards that replied
+    GALLERY_TOKEN=...                                        shared with the shards, which require it
+                                                             to add rows (see gallery_transfer.py)
+
+Shard order must not change once students are registered: placement is a
+function of the shard count and position. See run_shards.py for a local
+multi-process setup.
+"""
+import os
+import zlib
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import tracing
+from gallery_transfer import token_headers
+
+PARTITIONS = ('hash', 'department')
+
+
+def encode_embeddings(embeddings: np.ndarray) -> Dict[str, Any]:
+    """Pack an (n, d) float32 array for JSON transport (base64, ~1/3 the size of a float list)."""
+    arr = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if arr.ndim == 1:
+        arr = arr[None, :]
+    return {"embeddings": base64.b64encode(arr.tobytes()).decode('ascii'), "dim": int(arr.shape[1])}
+
+
+def decode_embeddings(payload: Dict[str, Any]) -> np.ndarray:
+    """Inverse of encode_embeddings."""
+    dim = int(payload["dim"])
+    raw = base64.b64decode(payload["embeddings"])
+    if dim <= 0 or len(raw) % (4 * dim):
+        raise Exception("Malformed embeddings payload")
+    return np.frombuffer(raw, dtype=np.float32).reshape(-1, dim)
+
+
+def merge_topk(per_shard: List[Tuple[np.ndarray, List[List[Optional[str]]]]], n_queries: int,
+               k: int) -> Tuple[np.ndarray, List[List[Optional[str]]]]:
+    """Merge per-shard (similarities, student_ids) top-k lists into a global top-k per query."""
+    sims = np.full((n_queries, k), -1.0, dtype=np.float32)
+    ids: List[List[Optional[str]]] = [[None] * k for _ in range(n_queries)]
+    for q in range(n_queries):
+        candidates = []
+        for shard_sims, shard_ids in per_shard:
+            for sim, sid in zip(shard_sims[q], shard_ids[q]):
+                if sid is not None:
+                    candidates.append((float(sim), sid))
+        candidates.sort(key=lambda c: -c[0])
+        for j, (sim, sid) in enumerate(candidates[:k]):
+            sims[q, j] = sim
+            ids[q][j] = sid
+    return sims, ids
+
+
+class ShardClient:
+    """Coordinator-side view of the shard nodes."""
+
+    def __init__(self, urls: List[str], partition: str = 'hash', pins: Optional[Dict[str, int]] = None,
+                 timeout: float = 5.0, allow_partial: bool = False):
+        """
+        Args:
+            urls: Shard base URLs; registration placement depends on their order
+            partition: 'hash' (crc32 of student ID) or 'department' (crc32 of department code)
+            pins: Department code -> shard index overrides for 'department' partitioning
+            timeout: Seconds per shard request
+            allow_partial: Answer searches from the shards that replied instead of failing
+        """
+        if not urls:
+            raise ValueError("ShardClient needs at least one shard URL")
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown shard partition: {partition}")
+        self.urls = [u.rstrip('/') for u in urls]
+        self.partition = partition
+        self.pins = pins or {}
+        self.timeout = timeout
+        self.allow_partial = allow_partial
+        self._pool = ThreadPoolExecutor(max_workers=len(self.urls), thread_name_prefix='shard')
+        self._session = None
+        self.failures = [0] * len(self.urls)
+
+    @classmethod
+    def from_env(cls) -> Optional['ShardClient']:
+        """Build from AI_SHARDS and related variables; None when sharding is off."""
+        urls = [u.strip() for u in os.environ.get('AI_SHARDS', '').split(',') if u.strip()]
+        if not urls:
+            return None
+        pins = {}
+        for item in os.environ.get('AI_SHARD_MAP', '').split(','):
+            if '=' in item:
+                key, shard = item.split('=', 1)
+                pins[key.strip()] = int(shard)
+        return cls(
+            urls,
+            partition=os.environ.get('AI_SHARD_PARTITION', 'hash'),
+            pins=pins,
+            timeout=float(os.environ.get('AI_SHARD_TIMEOUT', 5)),
+            allow_partial=os.environ.get('AI_SHARD_ALLOW_PARTIAL', '0') == '1',
+        )
+
+    def _http(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update(token_headers())
+        return self._session
+
+    def _post(self, shard: int, path: str, payload: Dict[str, Any],
+              headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        resp = self._http().post(self.urls[shard] + path, json=payload, timeout=self.timeout, headers=headers)
+        if resp.status_code != 200:
+            raise Exception(f"Shard {shard} ({self.urls[shard]}) HTTP {resp.status_code}: {resp.text[:200]}")
+        return resp.json()
+
+    def shard_for(self, student_id: str, shard_key: Optional[str] = None) -> int:
+        """Shard that owns a student's embeddings."""
+        if self.partition == 'department' and shard_key:
+            if shard_key in self.pins:
+                return self.pins[shard_key] % len(self.urls)
+            return zlib.crc32(shard_key.encode('utf-8')) % len(self.urls)
+        return zlib.crc32(str(student_id).encode('utf-8')) % len(self.urls)
+
+    def search(self, embeddings: np.ndarray, k: int = 1) -> Tuple[np.ndarray, List[List[Optional[str]]]]:
+        """Fan query embeddings out to every shard and merge the per-shard top-k."""
+        n = len(embeddings)
+        payload = {**encode_embeddings(embeddings), "k": int(k)}
+        with tracing.span('shard_search', shards=len(self.urls)) as sp:
+            # Shards drop a search still queued when this client gives up on it, and continue
+            # this trace (pool threads do not see the current span)
+            headers = {'X-Request-Deadline-Ms': str(int(self.timeout * 1000))}
+            if sp:
+                headers[tracing.TRACEPARENT_HEADER] = sp.traceparent()
+            futures = [self._pool.submit(self._post, i, '/api/face/search', payload, headers)
+                       for i in range(len(self.urls))]
+            per_shard = []
+            for i, fut in enumerate(futures):
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    self.failures[i] += 1
+                    if not self.allow_partial:
+                        raise Exception(f"Shard {i} unavailable: {e}")
+                    print(f"⚠️  Shard {i} skipped: {e}")
+                    continue
+                per_shard.append((np.asarray(res["similarities"], dtype=np.float32).reshape(n, -1),
+                                  res["student_ids"]))
+        if not per_shard:
+            raise Exception("No shard answered the search")
+        return merge_topk(per_shard, n, k)
+
+    def add(self, embeddings: np.ndarray, student_ids: List[str], metadata: Dict[str, Any],
+            shard_key: Optional[str] = None) -> List[int]:
+        """Route embeddings to their owning shards; returns the shard index per row."""
+        owners = [self.shard_for(sid, shard_key) for sid in student_ids]
+        for shard in sorted(set(owners)):
+            rows = [r for r, o in enumerate(owners) if o == shard]
+            sids = [student_ids[r] for r in rows]
+            self._post(shard, '/api/face/gallery/add', {
+                **encode_embeddings(embeddings[rows]),
+                "student_ids": sids,
+                "metadata": {sid: metadata.get(sid) for sid in sids if metadata.get(sid) is not None},
+            })
+        return owners
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-shard gallery size and health."""
+        def one(i: int) -> Dict[str, Any]:
+            try:
+                resp = self._http().get(self.urls[i] + '/api/face/stats', timeout=self.timeout)
+                data = resp.json()
+                return {"shard": i, "url": self.urls[i], "status": "ok", "ntotal": data.get("ntotal"),
+                        "index_type": data.get("index_type"), "failures": self.failures[i]}
+            except Exception as e:
+                return {"shard": i, "url": self.urls[i], "status": f"error: {e}", "failures": self.failures[i]}
+        return list(self._pool.map(one, range(len(self.urls))))
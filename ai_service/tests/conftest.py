@@ -0,0 +1,36 @@
+"""Shared fixtures for the AI service tests.
+
+The service modules import each other as top-level modules (they run with
+ai_service/ as the working directory), so the directory is put on sys.path
+here. Tests use the synthetic backend: no model download, no GPU.
+
+    cd ai_service && python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['FACE_BACKEND'] = 'synthetic'
+os.environ['AUDIT_DIR'] = ''
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch):
+    """A fresh single-node Flat gallery in a temporary directory."""
+    from face_recognition import FaceRecognitionSystem
+    monkeypatch.delenv('AI_SHARDS', raising=False)
+    monkeypatch.delenv('AI_ROLE', raising=False)
+    return FaceRecognitionSystem(index_path=str(tmp_path / 'gallery'), index_type='flat', read_only=False)
+
+
+@pytest.fixture
+def embeddings():
+    """Return the normalized synthetic embeddings of the given identities."""
+    import numpy as np
+    from backends import synthetic_identity_embedding
+
+    def make(*identities: int) -> 'np.ndarray':
+        return np.stack([synthetic_identity_embedding(i) for i in identities]).astype(np.float32)
+    return make
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pytest
+
+import audit
+from audit import AuditLog, Block, encode_block, log_files, query, read_blocks
+
+T0 = 1_790_000_000.0  # 2026-09-21 UTC
+
+# (ts, session, endpoint, namespace, model, threshold, bbox, ids, sims)
+ROWS = [
+    (T0, 7, 'recognize', 'default', 'synthetic', 0.5, (1, 2, 30, 40), ['42', 'S9'], [0.91, 0.4]),
+    (T0 + 1, 7, 'recognize', 'default', 'synthetic', 0.5, None, ['S9'], [0.3]),
+    (T0 + 2, -1, 'recognize_batch', 'campus-b', 'synthetic', 0.6, (5, 5, 9, 9), [], []),
+]
+
+
+def _decode(data: bytes) -> Block:
+    header = audit._HEADER.unpack_from(data)
+    return Block(header, data[audit._HEADER.size:audit._HEADER.size + header[1]])
+
+
+def test_block_round_trip():
+    block = _decode(encode_block(ROWS, k=3))
+
+    assert (block.rows, block.k) == (3, 3)
+    assert (block.ts_min, block.ts_max, block.session_min, block.session_max) == (T0, T0 + 2, -1, 7)
+    strings = block.strings()
+    assert [strings[i] for i in block.column('endpoint')] == ['recognize', 'recognize', 'recognize_batch']
+    assert [strings[i] for i in block.column('namespace')] == ['default', 'default', 'campus-b']
+    assert [audit.DECISIONS[d] for d in block.column('decision')] == ['recognized', 'below_threshold', 'no_match']
+    assert block.column('bbox').tolist() == [[1, 2, 30, 40], [0, 0, 0, 0], [5, 5, 9, 9]]
+    ids = block.column('ids')
+    assert [strings[i] for i in ids[0][:2]] == ['42', 'S9'] and ids[0][2] == audit._NONE
+    assert (ids[2] == audit._NONE).all()
+    sims = block.column('sims')
+    assert sims.dtype == np.float16 and sims.shape == (3, 3)
+    assert abs(float(sims[0, 0]) - 0.91) < 1e-3 and np.isnan(sims[0, 2])
+
+
+def test_read_blocks_stops_at_torn_or_corrupt_block(tmp_path):
+    first, second = encode_block(ROWS[:2], k=2), encode_block(ROWS[2:], k=2)
+    path = str(tmp_path / 'decisions-20260921T000000-000.fab')
+
+    with open(path, 'wb') as f:
+        f.write(first + second + second[:len(second) // 2])  # crash mid-write
+    assert [b.rows for b in read_blocks(path)] == [2, 1]
+
+    corrupt = bytearray(second)
+    corrupt[-1] ^= 0xFF
+    with open(path, 'wb') as f:
+        f.write(first + bytes(corrupt) + first)
+    assert [b.rows for b in read_blocks(path)] == [2]
+
+    with open(path, 'wb') as f:
+        f.write(b'JUNK' + first[4:])
+    assert list(read_blocks(path)) == []
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit'), top_k=2, block_rows=2)
+    now = iter(T0 + i for i in range(100))
+    log.clock = lambda: next(now)
+    yield log
+    log.close()
+
+
+def test_query_filters_by_time_student_session_and_outcome(log):
+    token = audit._context.set({"session": 7, "endpoint": "recognize"})
+    try:
+        log.record('synthetic', 'default', 0.5, (1, 2, 3, 4), ['42', 'S9', 'S1'], [0.9, 0.6, 0.2])  # T0
+        log.record('synthetic', 'default', 0.5, None, ['S9'], [0.45])                               # T0 + 1
+    finally:
+        audit._context.reset(token)
+    log.record('synthetic', 'default', 0.5, None, [], [])                                           # T0 + 2
+    log.record('synthetic', 'default', 0.5, None, ['42'], [0.8])                                   # T0 + 3
+    log.close()
+
+    everything = list(query(log.directory, T0, T0 + 10))
+    assert [d['decision'] for d in everything] == ['recognized', 'below_threshold', 'no_match', 'recognized']
+    assert everything[0]['candidates'] == [['42', 0.9], ['S9', 0.6]]  # top_k = 2
+    assert everything[0]['session'] == 7 and everything[2]['session'] is None
+    assert everything[0]['endpoint'] == 'recognize' and everything[0]['bbox'] == [1, 2, 3, 4]
+    assert everything[1]['bbox'] is None
+
+    assert [d['ts'] for d in query(log.directory, T0 + 1, T0 + 3)] == [T0 + 1, T0 + 2]
+    # A student matches at any candidate rank
+    assert [d['ts'] for d in query(log.directory, T0, T0 + 10, student='S9')] == [T0, T0 + 1]
+    assert [d['ts'] for d in query(log.directory, T0, T0 + 10, student='42', recognized_only=True)] == [T0, T0 + 3]
+    assert [d['ts'] for d in query(log.directory, T0, T0 + 10, session=7)] == [T0, T0 + 1]
+    assert list(query(log.directory, T0, T0 + 10, student='nobody')) == []
+
+
+def test_rotation_retention_and_dropping(log):
+    log.max_file_bytes = 1  # every block starts a new file
+    for i in range(6):
+        log.record('synthetic', 'default', 0.5, None, [str(i)], [0.9])
+    log.flush()
+    assert len(log_files(log.directory)) == 3
+    assert len(list(query(log.directory, T0, T0 + 10))) == 6
+
+    log.keep_bytes = os.path.getsize(log_files(log.directory)[0]) * 2
+    log.record('synthetic', 'default', 0.5, None, ['6'], [0.9])
+    log.flush()
+    # The oldest file is deleted when the new one is opened
+    assert len(log_files(log.directory)) == 3
+    assert [d['candidates'][0][0] for d in query(log.directory, T0, T0 + 10)] == ['2', '3', '4', '5', '6']
+    assert log.status()['written'] == 7
+
+    log.max_pending = 1
+    log.record('synthetic', 'default', 0.5, None, ['7'], [0.9])
+    log.record('synthetic', 'default', 0.5, None, ['8'], [0.9])
+    assert log.dropped == 1 and log.status()['pending'] == 1
@@ -0,0 +1,62 @@
+import json
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+from backends import render_synthetic_scene
+from batch import BatchRecognizer, iter_sources, to_ndjson
+
+
+def _png(identity: int) -> bytes:
+    img = render_synthetic_scene(320, 240, [(identity, 100, 60, 120)], seed=identity)
+    ok, buf = cv2.imencode('.png', img)
+    assert ok
+    return buf.tobytes()
+
+
+def test_iter_sources_directory_zip_and_single_file(tmp_path):
+    folder = tmp_path / 'photos'
+    (folder / 'b').mkdir(parents=True)
+    (folder / 'a.png').write_bytes(_png(1))
+    (folder / 'b' / 'c.jpg').write_bytes(_png(2))
+    (folder / '.hidden.png').write_bytes(_png(3))
+    (folder / 'notes.txt').write_text('not an image')
+
+    assert [name for name, _ in iter_sources(str(folder))] == ['a.png', 'b/c.jpg']
+
+    archive = tmp_path / 'photos.zip'
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('x/one.png', _png(1))
+        zf.writestr('readme.md', 'skip me')
+    sources = list(iter_sources(str(archive)))
+    assert [name for name, _ in sources] == ['x/one.png']
+    assert sources[0][1]() == _png(1)
+
+    single = list(iter_sources(str(folder / 'a.png')))
+    assert [name for name, _ in single] == ['a.png']
+
+    with pytest.raises(Exception, match='Unsupported batch input'):
+        iter_sources(str(folder / 'notes.txt'))
+
+
+def test_batch_recognizer_reports_matches_and_decode_errors(system, embeddings):
+    system._add_to_gallery(embeddings(1, 2), ['S1', 'S2'], check_duplicates=False)
+    sources = [
+        ('one.png', lambda: _png(1)),
+        ('two.png', lambda: _png(2)),
+        ('broken.png', lambda: b'not a png'),
+    ]
+
+    results = {r['image']: r for r in BatchRecognizer(system, threshold=0.5, decode_workers=2).run(sources)}
+
+    assert set(results) == {'one.png', 'two.png', 'broken.png'}
+    assert 'error' in results['broken.png']
+    assert [f['student_id'] for f in results['one.png']['faces']] == ['S1']
+    assert [f['student_id'] for f in results['two.png']['faces']] == ['S2']
+
+    lines = [json.loads(line) for line in to_ndjson(results[name] for name in sorted(results))]
+    assert [line.get('image') for line in lines[:-1]] == ['broken.png', 'one.png', 'two.png']
+    assert lines[-1]['summary'] and lines[-1]['images'] == 3 and lines[-1]['errors'] == 1
+    assert lines[-1]['faces'] == 2 and lines[-1]['recognized'] == 2
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+import pytest
+
+from backends import render_synthetic_scene
+from face_recognition import DuplicateFaceError
+
+
+def _photo(tmp_path, identity: int, seed: int = 0) -> str:
+    path = str(tmp_path / f'face_{identity}_{seed}.png')
+    cv2.imwrite(path, render_synthetic_scene(480, 480, [(identity, 140, 120, 200)], seed=seed))
+    return path
+
+
+def test_reject_policy_refuses_another_students_face_and_stores_nothing(system, embeddings):
+    system.DUPLICATE_POLICY = 'reject'
+    system._add_to_gallery(embeddings(1), ['S1'], metadata={'S1': {'name': 'One'}})
+
+    with pytest.raises(DuplicateFaceError) as exc:
+        system._add_to_gallery(embeddings(1), ['S2'], metadata={'S2': {'name': 'Two'}})
+
+    assert [m['student_id'] for m in exc.value.matches['S2']] == ['S1']
+    assert list(system.student_ids) == ['S1']
+    assert system.metadata.get('S2') is None
+    assert 'possible_duplicates' not in system.metadata.get('S1')
+
+
+def test_flag_policy_adds_the_row_and_records_the_match(system, embeddings):
+    system.DUPLICATE_POLICY = 'flag'
+    system._add_to_gallery(embeddings(1), ['S1'])
+
+    report = system._add_to_gallery(embeddings(1), ['S2'], metadata={'S2': {'name': 'Two'}})
+
+    assert report['added'] == 1
+    assert [m['student_id'] for m in report['flagged']['S2']] == ['S1']
+    assert list(system.student_ids) == ['S1', 'S2']
+    assert system.metadata.get('S2')['possible_duplicates'][0]['student_id'] == 'S1'
+
+
+def test_reregistration_is_merged_and_counted(system, embeddings):
+    system.REREGISTER_POLICY = 'merge'
+    system._add_to_gallery(embeddings(1), ['S1'])
+
+    for expected in (1, 2):
+        report = system._add_to_gallery(embeddings(1), ['S1'])
+        assert report == {"added": 0, "merged": ['S1'], "flagged": {}}
+        assert system.metadata.get('S1')['merged_registrations'] == expected
+    assert list(system.student_ids) == ['S1']
+
+    system.REREGISTER_POLICY = 'add'
+    assert system._add_to_gallery(embeddings(1), ['S1'])['added'] == 1
+    assert list(system.student_ids) == ['S1', 'S1']
+
+
+def test_duplicates_within_one_batch_are_caught(system, embeddings):
+    system.DUPLICATE_POLICY = 'reject'
+    with pytest.raises(DuplicateFaceError):
+        system._add_to_gallery(embeddings(3, 3), ['S1', 'S2'])
+    assert len(system.student_ids) == 0
+
+    # Distinct identities are not duplicates of each other
+    assert system._add_to_gallery(embeddings(3, 4), ['S1', 'S2'])['added'] == 2
+
+
+def test_register_face_reports_the_gallery_write(system, tmp_path):
+    system.DUPLICATE_POLICY = 'reject'
+    assert system.register_face(_photo(tmp_path, 7), 'S7')['added'] == 1
+    assert system.register_face(_photo(tmp_path, 7, seed=1), 'S7')['merged'] == ['S7']
+    with pytest.raises(DuplicateFaceError):
+        system.register_face(_photo(tmp_path, 7, seed=2), 'S8')
+    assert list(system.student_ids) == ['S7']
+
+
+def test_find_duplicate_clusters_groups_same_face_under_two_ids(system, embeddings):
+    system._add_to_gallery(embeddings(1, 1, 2), ['S1', 'S9', 'S2'], check_duplicates=False)
+    clusters = system.find_duplicate_clusters()
+    assert len(clusters) == 1
+    assert sorted(clusters[0]['student_ids']) == ['S1', 'S9'] and clusters[0]['cross_student']
@@ -0,0 +1,107 @@
+import json
+import os
+import pickle
+import sqlite3
+
+import faiss
+import numpy as np
+
+from face_recognition import FaceRecognitionSystem, build_index
+from gallery_store import IdMap, MetadataStore
+
+
+def test_metadata_store_round_trip(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    store = MetadataStore(path)
+    store.set_many({'1': {'name': 'One'}, 'S2': {'name': 'Two', 'tags': ['a']}})
+    store['3'] = {'name': 'Three'}
+    assert store.merge('1', {'shard': 2}) == {'name': 'One', 'shard': 2}
+    store.close()
+
+    store = MetadataStore(path)
+    assert len(store) == 3
+    assert store['1'] == {'name': 'One', 'shard': 2}
+    assert store.get('missing', {}) == {} and 'missing' not in store and 'S2' in store
+    assert store.get_many(['S2', '3', 'missing']) == {'S2': {'name': 'Two', 'tags': ['a']}, '3': {'name': 'Three'}}
+    assert [sid for sid, _ in store.items(batch=2)] == ['1', '3', 'S2']
+
+
+def test_changed_since_pages_by_version(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    assert store.version() == 0 and store.changed_since(0, 10) == ({}, 0)
+
+    store.set_many({'1': {'n': 1}, '2': {'n': 2}, '3': {'n': 3}})
+    assert store.version() == 3
+    page, version = store.changed_since(0, 2)
+    assert (list(page), version) == (['1', '2'], 2)
+    page, version = store.changed_since(version, 2)
+    assert (list(page), version) == (['3'], 3)
+
+    # Rewriting a document moves it to the newest version; unchanged documents are not resent
+    store.merge('1', {'n': 10})
+    assert store.changed_since(3, 10) == ({'1': {'n': 10}}, 4)
+
+
+def test_unversioned_store_is_upgraded(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE metadata (student_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    conn.execute("INSERT INTO metadata VALUES ('1', '{\"name\": \"Old\"}')")
+    conn.commit()
+    conn.close()
+
+    store = MetadataStore(path)
+    assert store['1'] == {'name': 'Old'}
+    assert store.version() == 0 and store.changed_since(0, 10) == ({}, 0)
+    store.merge('1', {'shard': 0})
+    assert store.changed_since(0, 10) == ({'1': {'name': 'Old', 'shard': 0}}, 1)
+
+
+def test_id_map_round_trip_numeric_and_interned_ids(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    ids = IdMap(str(tmp_path / 'student_ids.i64'), store)
+    ids.extend(['12', 'S-1', '007', '12', 'S-1', '0', '1234567890123456789'])
+    ids.extend([34])
+
+    expected = ['12', 'S-1', '007', '12', 'S-1', '0', '1234567890123456789', '34']
+    assert list(ids) == expected
+    assert len(ids) == 8 and ids[1] == 'S-1' and ids[-1] == '34' and ids[2:4] == ['007', '12']
+    # Numeric IDs are stored as their value, others as negative interned codes
+    assert ids.codes()[0] == 12 and ids.codes()[1] < 0 and ids.codes()[2] < 0
+    assert os.path.getsize(tmp_path / 'student_ids.i64') == 8 * 8
+
+    reopened = IdMap(str(tmp_path / 'student_ids.i64'), store)
+    assert list(reopened) == expected
+    reopened.truncate(3)
+    assert list(reopened) == expected[:3]
+
+
+def test_legacy_pickle_and_json_gallery_is_converted(tmp_path, embeddings, monkeypatch):
+    monkeypatch.delenv('AI_SHARDS', raising=False)
+    gallery = tmp_path / 'legacy'
+    gallery.mkdir()
+    vectors = embeddings(1, 2, 3)
+    index = build_index('flat', vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, str(gallery / 'index.faiss'))
+    with open(gallery / 'student_ids.pkl', 'wb') as f:
+        pickle.dump(['1', 'S2', '3'], f)
+    with open(gallery / 'metadata.json', 'w') as f:
+        json.dump({'1': {'name': 'One'}, 'S2': {'name': 'Two'}}, f, indent=2)
+
+    system = FaceRecognitionSystem(index_path=str(gallery), index_type='flat', read_only=False)
+
+    assert list(system.student_ids) == ['1', 'S2', '3']
+    assert system.metadata['S2'] == {'name': 'Two'}
+    assert (gallery / 'student_ids.pkl.migrated').exists() and (gallery / 'metadata.json.migrated').exists()
+    assert not (gallery / 'student_ids.pkl').exists() and not (gallery / 'metadata.json').exists()
+    # The raw vector store and change log are rebuilt row-aligned with the index
+    np.testing.assert_allclose(system.load_vectors(), vectors, atol=1e-6)
+    assert len(system.changelog) == 3
+    sims, ids = system.search_gallery(embeddings(2), k=1)
+    assert ids[0][0] == 'S2'
+
+    # A second start finds nothing left to convert
+    system.close_stores()
+    reopened = FaceRecognitionSystem(index_path=str(gallery), index_type='flat', read_only=False)
+    assert list(reopened.student_ids) == ['1', 'S2', '3'] and len(reopened.metadata) == 2
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+import pytest
+
+from face_recognition import FaceRecognitionSystem
+from gallery_transfer import (CHUNK, GalleryImporter, TransferError, export_stream, import_file,
+                              iter_file_from)
+
+IDS = ['1', 'S2', '3', 'S4', '5']
+
+
+@pytest.fixture
+def source(system, embeddings):
+    system._add_to_gallery(embeddings(1, 2, 3, 4, 5), IDS, timestamps=[10.0, 11.0, 12.0, 13.0, 14.0],
+                           check_duplicates=False, metadata={'1': {'name': 'One'}, 'S4': {'name': 'Four'}})
+    return system
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    monkeypatch.delenv('AI_SHARDS', raising=False)
+
+    def open_target(name: str = 'target') -> FaceRecognitionSystem:
+        return FaceRecognitionSystem(index_path=str(tmp_path / name), index_type='flat', read_only=False)
+    return open_target
+
+
+def _export(system, **kw) -> bytes:
+    return b''.join(export_stream(system, chunk_rows=2, **kw))
+
+
+def test_export_import_round_trip(source, target, embeddings):
+    stream = _export(source)
+    dest = target()
+    importer = GalleryImporter(dest)
+    for off in range(0, len(stream), 7):  # arbitrary network-sized pieces
+        importer.feed(stream[off:off + 7])
+
+    report = importer.report()
+    assert report['finished'] and report['applied'] == 5 and not report['importing']
+    assert list(dest.student_ids) == IDS
+    np.testing.assert_array_equal(dest.load_vectors(), source.load_vectors())
+    assert dest.changelog.read(0, 10) == source.changelog.read(0, 10)
+    assert dest.metadata.get_many(IDS) == source.metadata.get_many(IDS)
+    assert dest.index.ntotal == 5
+    sims, ids = dest.search_gallery(embeddings(4), k=1)
+    assert ids[0][0] == 'S4' and sims[0][0] > 0.99
+
+
+def test_float16_export_is_renormalised(source, target):
+    stream = _export(source, dtype='f16')
+    assert len(stream) < len(_export(source))
+
+    report = import_file(target(), io.BytesIO(stream), block=64)
+    dest = target()
+    assert report['applied'] == 5
+    vectors = np.asarray(dest.load_vectors())
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-6)
+    np.testing.assert_allclose(vectors, source.load_vectors(), atol=1e-3)
+
+
+def test_interrupted_import_resumes_from_the_row_count(source, target, tmp_path):
+    stream = _export(source)
+    path = tmp_path / 'gallery.fgal'
+    path.write_bytes(stream)
+
+    dest = target()
+    first_chunk_end = stream.index(b'CHNK', stream.index(b'CHNK') + CHUNK.size)
+    GalleryImporter(dest).feed(stream[:first_chunk_end])
+    dest.close_stores()
+
+    # Restart: the partial import is kept and registrations stay blocked until it finishes
+    dest = target()
+    assert len(dest.student_ids) == 2 and dest.import_state['total'] == 5
+    with open(path, 'rb') as f:
+        resumed = b''.join(iter_file_from(f, since=len(dest.student_ids)))
+    assert len(resumed) < len(stream)
+    report = import_file(dest, io.BytesIO(resumed))
+    assert (report['applied'], report['finished']) == (3, True)
+    assert list(dest.student_ids) == IDS and dest.import_state is None
+
+
+def test_import_refusals(source, target, embeddings):
+    stream = _export(source)
+
+    with pytest.raises(TransferError, match='Not a gallery stream'):
+        GalleryImporter(target()).feed(b'XXXX' + stream[4:])
+
+    corrupt = bytearray(stream)
+    corrupt[-40] ^= 0xFF  # inside the last chunk's payload
+    with pytest.raises(TransferError, match='Checksum mismatch'):
+        GalleryImporter(target('corrupt')).feed(bytes(corrupt))
+
+    with pytest.raises(TransferError, match='Gap in stream'):
+        GalleryImporter(target('gap')).feed(_export(source, since=3))
+
+    with pytest.raises(TransferError, match='not empty'):
+        GalleryImporter(source).feed(stream)
+
+    with pytest.raises(TransferError, match='Unknown dtype'):
+        next(export_stream(source, dtype='f64'))
@@ -0,0 +1,96 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from backends import render_synthetic_scene, synthetic_identity_embedding
+from migration import MigrationIncomplete, ReembedMigration
+from sharding import ShardClient
+
+
+def _v2(*identities: int) -> np.ndarray:
+    return np.stack([synthetic_identity_embedding(i, variant=2) for i in identities])
+
+
+@pytest.fixture
+def live(system, embeddings):
+    system._add_to_gallery(embeddings(1, 2), ['S1', 'S2'], check_duplicates=False,
+                           metadata={'S1': {'name': 'One'}, 'S2': {'name': 'Two'}})
+    return system
+
+
+def test_cutover_is_refused_until_every_student_is_reembedded(live):
+    migration = ReembedMigration(live, 'synthetic/v2')
+    assert migration.pending() == ['S1', 'S2']
+
+    with pytest.raises(MigrationIncomplete) as exc:
+        migration.cutover()
+    assert exc.value.pending == ['S1', 'S2']
+
+    migration.add(_v2(1), ['S1'])
+    assert migration.pending() == ['S2']
+    assert migration.status()['coverage'] == 0.5
+    with pytest.raises(MigrationIncomplete):
+        migration.cutover()
+    # Nothing was swapped by the refused cutovers
+    assert live.gallery_model == 'synthetic'
+    assert os.path.isdir(migration.shadow_dir)
+
+
+def test_registration_during_migration_makes_the_student_pending_again(live, embeddings):
+    migration = ReembedMigration(live, 'synthetic/v2')
+    migration.add(_v2(1, 2), ['S1', 'S2'])
+    assert migration.pending() == []
+
+    live._add_to_gallery(embeddings(1), ['S1'], timestamps=[time.time() + 1], check_duplicates=False)
+    live._add_to_gallery(embeddings(3), ['S3'], check_duplicates=False)
+    assert migration.pending() == ['S1', 'S3']
+    with pytest.raises(MigrationIncomplete) as exc:
+        migration.cutover()
+    assert exc.value.pending == ['S1', 'S3']
+
+
+def test_complete_cutover_swaps_model_and_gallery(live):
+    migration = ReembedMigration(live, 'synthetic/v2')
+    migration.add(_v2(1, 2), ['S1', 'S2'])
+
+    result = migration.cutover()
+
+    assert result['model'] == live.gallery_model == 'synthetic/v2'
+    assert result['students'] == 2
+    assert not os.path.exists(migration.shadow_dir)
+    assert live.metadata.get('S1')['name'] == 'One'
+    assert live.metadata.get('S1')['reembedded_from'] == 'synthetic'
+    sims, ids = live.search_gallery(_v2(2), k=1)
+    assert ids[0][0] == 'S2' and sims[0][0] > 0.99
+
+
+def test_embed_one_uses_the_target_model(live, tmp_path):
+    migration = ReembedMigration(live, 'synthetic/v2')
+    path = str(tmp_path / 'face.png')
+    cv2.imwrite(path, render_synthetic_scene(480, 480, [(5, 140, 120, 200)]))
+    embedding = migration.embed_one(path)
+    assert float(embedding @ _v2(5)[0]) > float(embedding @ synthetic_identity_embedding(5))
+
+
+def test_migration_refusals_and_resume(live, tmp_path):
+    with pytest.raises(Exception, match='already uses'):
+        ReembedMigration(live, 'synthetic')
+
+    migration = ReembedMigration(live, 'synthetic/v2')
+    migration.add(_v2(1), ['S1'])
+    with pytest.raises(Exception, match='exists'):
+        ReembedMigration(live, 'synthetic/v3')
+
+    resumed = ReembedMigration.resume(live)
+    assert resumed.target_model == 'synthetic/v2' and resumed.pending() == ['S2']
+
+    resumed.abort()
+    assert not os.path.exists(migration.shadow_dir)
+    assert ReembedMigration.resume(live) is None
+
+    live.shards = ShardClient(['http://shard-0'])
+    with pytest.raises(Exception, match='shard coordinator'):
+        ReembedMigration(live, 'synthetic/v2')
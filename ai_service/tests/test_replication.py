@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from face_recognition import FaceRecognitionSystem
+from replication import ChangeLog, ReplicaFollower, read_log_batch
+
+
+def test_changelog_append_read_and_last_timestamp(tmp_path):
+    log = ChangeLog(str(tmp_path / 'changelog.bin'))
+    assert len(log) == 0 and log.last_timestamp() == 0.0
+
+    log.append(['S1', 'S2'], [10.0, 11.0])
+    log.append(['S3'], [12.5])
+
+    assert len(log) == 3
+    assert log.read(1, 5) == ([11.0, 12.5], ['S2', 'S3'])
+    assert log.last_timestamp() == 12.5
+    with pytest.raises(Exception, match='too long'):
+        log.append(['x' * 65])
+
+
+def test_changelog_sync_trims_torn_tail_and_backfills(tmp_path):
+    path = str(tmp_path / 'changelog.bin')
+    log = ChangeLog(path)
+    log.append(['S1', 'S2', 'S3'], [1.0, 2.0, 3.0])
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')  # torn record from a crash mid-append
+
+    log.sync(['S1', 'S2'])
+    assert os.path.getsize(path) == 2 * ChangeLog.RECORD.size
+    assert log.read(0, 10) == ([1.0, 2.0], ['S1', 'S2'])
+
+    # Gallery rows written before the log existed are backfilled with time 0
+    log.sync(['S1', 'S2', 'S3', 'S4'])
+    assert log.read(0, 10) == ([1.0, 2.0, 0.0, 0.0], ['S1', 'S2', 'S3', 'S4'])
+
+
+def test_read_log_batch_pages_rows_and_metadata(system, embeddings):
+    system._add_to_gallery(embeddings(1, 2, 3), ['S1', 'S2', 'S3'], timestamps=[1.0, 2.0, 3.0],
+                           check_duplicates=False, metadata={'S2': {'name': 'Two'}})
+
+    batch = read_log_batch(system, since=1, limit=5, meta_since=0)
+    assert (batch['since'], batch['count'], batch['primary_lsn']) == (1, 2, 3)
+    assert batch['student_ids'] == ['S2', 'S3'] and batch['timestamps'] == [2.0, 3.0]
+    assert batch['metadata']['S2']['name'] == 'Two'
+    assert batch['dim'] == system.dimension
+    assert 'S2' in batch['metadata_updates'] and not batch['metadata_more']
+
+    # Out-of-range requests are clamped, not errors
+    past_end = read_log_batch(system, since=10, limit=5)
+    assert (past_end['since'], past_end['count']) == (3, 0)
+    assert 'metadata_updates' not in past_end
+
+    # A metadata-only change moves the store version without a new row
+    version = batch['metadata_version']
+    system.metadata.merge('S1', {'name': 'One'})
+    update = read_log_batch(system, since=3, limit=5, meta_since=version)
+    assert update['count'] == 0
+    assert set(update['metadata_updates']) == {'S1'}
+    assert update['metadata_version'] > version
+
+
+def test_replica_follower_applies_rows_and_metadata(system, embeddings, tmp_path):
+    system._add_to_gallery(embeddings(1, 2), ['S1', 'S2'], timestamps=[5.0, 6.0], check_duplicates=False,
+                           metadata={'S1': {'name': 'One'}})
+    replica = FaceRecognitionSystem(index_path=str(tmp_path / 'replica'), index_type='flat', read_only=True)
+    follower = ReplicaFollower(replica, 'http://primary', batch=1)
+    follower._fetch = lambda since: read_log_batch(system, since, follower.batch, follower.meta_version)
+
+    assert follower.poll_once() == 1
+    assert follower.poll_once() == 1
+    assert follower.poll_once() == 0
+    assert list(replica.student_ids) == ['S1', 'S2']
+    assert follower.applied_time == 6.0
+    assert replica.metadata.get('S1')['name'] == 'One'
+
+    system.metadata.merge('S2', {'name': 'Two'})
+    follower.poll_once()
+    assert replica.metadata.get('S2')['name'] == 'Two'
+    # The applied metadata version survives a restart
+    assert ReplicaFollower(replica, 'http://primary').meta_version == follower.meta_version
+
+    sims, ids = replica.search_gallery(embeddings(2), k=1)
+    assert ids[0][0] == 'S2' and sims[0][0] > 0.99
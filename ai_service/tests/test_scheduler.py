@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import DeadlineExceeded, InferenceScheduler, Overloaded, parse_deadline_ms, resolve_lane
+
+
+def _occupy(scheduler: InferenceScheduler, lane: str = 'live'):
+    """Hold the (single) worker on a job until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+        return 'held'
+    future = scheduler.submit(hold, lane=lane)
+    assert started.wait(5)
+    return future, release
+
+
+@pytest.fixture
+def scheduler():
+    s = InferenceScheduler(workers=1, max_queue=2, max_batch_queue=2)
+    for lane in s.lanes.values():
+        lane.service_s = 0.001  # keep deadline feasibility independent of the machine
+    return s
+
+
+def test_results_and_exceptions_reach_the_caller(scheduler):
+    assert scheduler.submit(lambda a, b=0: a + b, 2, b=3).result(5) == 5
+
+    def boom():
+        raise ValueError('bad frame')
+    with pytest.raises(ValueError, match='bad frame'):
+        scheduler.submit(boom).result(5)
+    assert asyncio.run(scheduler.run(lambda: 'async')) == 'async'
+
+    counters = scheduler.lanes['live'].counters
+    assert (counters['admitted'], counters['completed'], counters['failed']) == (3, 2, 1)
+    with pytest.raises(ValueError):
+        scheduler.submit(lambda: None, lane='urgent')
+
+
+def test_full_queue_is_shed_with_retry_after(scheduler):
+    held, release = _occupy(scheduler)
+    queued = [scheduler.submit(lambda i=i: i) for i in range(2)]
+
+    with pytest.raises(Overloaded) as exc:
+        scheduler.submit(lambda: 'late')
+    assert exc.value.retry_after >= 1
+    assert scheduler.lanes['live'].counters['shed_queue_full'] == 1
+    # Lanes are bounded independently
+    batch = scheduler.submit(lambda: 'batch', lane='batch')
+
+    release.set()
+    assert held.result(5) == 'held'
+    assert [f.result(5) for f in queued] == [0, 1]
+    assert batch.result(5) == 'batch'
+
+
+def test_infeasible_deadline_is_refused_at_admission(scheduler):
+    scheduler.lanes['live'].service_s = 0.5
+    with pytest.raises(Overloaded, match='exceeds deadline'):
+        scheduler.submit(lambda: None, deadline_ms=100)
+    assert scheduler.lanes['live'].counters['shed_infeasible'] == 1
+    assert scheduler.lanes['live'].counters['admitted'] == 0
+    # Batch work without a deadline is always admitted
+    assert scheduler.submit(lambda: 'ok', lane='batch').result(5) == 'ok'
+
+
+def test_job_whose_deadline_passes_in_the_queue_is_dropped(scheduler):
+    held, release = _occupy(scheduler)
+    ran = []
+    expired = scheduler.submit(lambda: ran.append(1), deadline_ms=50)
+    time.sleep(0.1)
+    release.set()
+
+    with pytest.raises(DeadlineExceeded):
+        expired.result(5)
+    assert ran == []
+    assert scheduler.lanes['live'].counters['shed_expired'] == 1
+
+
+def test_cancelled_job_is_skipped_and_the_worker_survives(scheduler):
+    held, release = _occupy(scheduler)
+    ran = []
+    cancelled = scheduler.submit(lambda: ran.append('cancelled'))
+    assert cancelled.cancel()
+    release.set()
+
+    # The only worker must still serve later work
+    assert scheduler.submit(lambda: 'after').result(5) == 'after'
+    assert ran == []
+    assert scheduler.stats()['running'] == 0
+
+
+def test_live_work_is_dispatched_before_queued_batch_work(scheduler):
+    held, release = _occupy(scheduler, lane='batch')
+    order = []
+    batch = scheduler.submit(lambda: order.append('batch'), lane='batch')
+    live = scheduler.submit(lambda: order.append('live'))
+    release.set()
+
+    batch.result(5)
+    live.result(5)
+    assert order == ['live', 'batch']
+
+
+def test_header_parsing():
+    assert parse_deadline_ms('250') == 250.0
+    assert parse_deadline_ms('-5') == 0.0
+    assert parse_deadline_ms('soon') is None and parse_deadline_ms(None) is None
+    assert resolve_lane('live', 'batch') == 'batch'
+    assert resolve_lane('batch', 'live') == 'batch'  # never raised above the endpoint's lane
+    assert resolve_lane('interactive', 'bogus') == 'interactive'
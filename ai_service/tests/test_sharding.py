@@ -0,0 +1,52 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from sharding import ShardClient, decode_embeddings, encode_embeddings, merge_topk
+
+
+def test_merge_topk_orders_across_shards_and_pads():
+    shard_a = (np.array([[0.9, 0.4], [0.3, -1.0]], dtype=np.float32), [['A1', 'A2'], ['A3', None]])
+    shard_b = (np.array([[0.7, 0.6], [0.8, 0.1]], dtype=np.float32), [['B1', 'B2'], ['B3', 'B4']])
+
+    sims, ids = merge_topk([shard_a, shard_b], n_queries=2, k=3)
+
+    assert ids == [['A1', 'B1', 'B2'], ['B3', 'A3', 'B4']]
+    np.testing.assert_allclose(sims, [[0.9, 0.7, 0.6], [0.8, 0.3, 0.1]], rtol=1e-6)
+
+
+def test_merge_topk_pads_missing_slots():
+    sims, ids = merge_topk([(np.array([[0.5]], dtype=np.float32), [['A1']])], n_queries=1, k=3)
+    assert ids == [['A1', None, None]]
+    assert sims[0].tolist() == [0.5, -1.0, -1.0]
+
+
+def test_shard_for_hash_partition_is_stable_crc32():
+    client = ShardClient(['http://a', 'http://b', 'http://c'])
+    for sid in ('S1', 'S2', '2024CSE001', 'Ünïcode'):
+        assert client.shard_for(sid) == zlib.crc32(sid.encode('utf-8')) % 3
+    # Without department partitioning the shard key is ignored
+    assert client.shard_for('S1', 'CSE') == client.shard_for('S1')
+
+
+def test_shard_for_department_partition_and_pins():
+    client = ShardClient(['http://a', 'http://b'], partition='department', pins={'ECE': 3})
+    assert client.shard_for('S1', 'CSE') == client.shard_for('S2', 'CSE') == zlib.crc32(b'CSE') % 2
+    assert client.shard_for('S1', 'ECE') == 1  # pins wrap onto the shard count
+    # Students without a department fall back to hashing their ID
+    assert client.shard_for('S1') == zlib.crc32(b'S1') % 2
+
+
+def test_shard_client_rejects_bad_configuration():
+    with pytest.raises(ValueError):
+        ShardClient([])
+    with pytest.raises(ValueError):
+        ShardClient(['http://a'], partition='round-robin')
+
+
+def test_embedding_transport_round_trip():
+    arr = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+    np.testing.assert_array_equal(decode_embeddings(encode_embeddings(arr)), arr)
+    with pytest.raises(Exception, match='Malformed'):
+        decode_embeddings({"embeddings": encode_embeddings(arr)["embeddings"], "dim": 5})
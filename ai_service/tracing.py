@@ -0,0 +1,443 @@
+"""Distributed request tracing: W3C traceparent in, span timings out as JSON lines.
+
+Django starts a trace for each API request and sends `traceparent` on its calls
+to this service (backend/attendance_system/tracing.py). The middleware here
+continues that trace, or starts one for direct callers (sampled at
+TRACE_SAMPLE), and the stages of the request record child spans: scheduler
+queue wait, inference, image decode, detection, ArcFace, gallery search.
+Inference threads see the request's span through the context the scheduler
+carries over (see scheduler._Job). Responses carry X-Trace-Id.
+
+Spans are buffered and appended by a background thread to
+TRACE_DIR/ai-<pid>.jsonl, one object per line:
+    {"trace": "<32 hex>", "span": "<16 hex>", "parent": "<16 hex>" | null, "service": "ai",
+     "name": "detect", "start": 1760000000.123, "ms": 41.2, "attrs": {...}}
+Django writes the same records. Point both services' TRACE_DIR at one
+directory and reconstruct the slowest requests end to end with
+    python tracing.py slowest --dir /srv/traces --top 10 [--name recognize_frame] [--since 60]
+    python tracing.py stages --dir /srv/traces
+Files rotate past TRACE_FILE_MB; the oldest rotated files are deleted beyond TRACE_MAX_MB.
+
+Environment:
+    TRACE_DIR=              span directory, relative to this file ('' disables tracing)
+    TRACE_SAMPLE=1.0        share of requests without an incoming traceparent that are traced
+    TRACE_FILE_MB=20        rotate span files past this size
+    TRACE_MAX_MB=200        delete the oldest span files beyond this total
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import contextvars
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+SERVICE = 'ai'
+
+_HEX = re.compile(r'^[0-9a-f]+$')
+# <service>-<pid>-<stamp>.jsonl: a rotated span file; the one a process is appending to has no stamp
+_ROTATED = re.compile(r'-\d+-\d{8}-\d{6}\.jsonl$')
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent span_id, sampled) from a W3C traceparent header, None if absent/invalid."""
+    if not value:
+        return None
+    parts = value.strip().lower().split('-')
+    if len(parts) < 4 or parts[0] == 'ff' or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    if not all(_HEX.match(p) for p in parts[:4]) or parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """One timed stage of a trace; attributes are added with `set`."""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'sampled', 'name', 'start', 'attrs', 'exporter', '_t0')
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], sampled: bool, name: str,
+                 exporter: 'SpanExporter', attrs: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.exporter = exporter
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if not self.sampled:
+            return
+        if error is not None:
+            self.attrs['error'] = f"{type(error).__name__}: {error}"[:300]
+        self.exporter.export({
+            "trace": self.trace_id, "span": self.span_id, "parent": self.parent_id, "service": SERVICE,
+            "name": self.name, "start": round(self.start, 6),
+            "ms": round((time.perf_counter() - self._t0) * 1000, 3), "attrs": self.attrs,
+        })
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('trace_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+class _Scope:
+    __slots__ = ('span', '_token')
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current.reset(self._token)
+        self.span.finish(exc)
+        return False
+
+
+class _NoScope:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NO_SCOPE = _NoScope()
+
+
+def span(name: str, **attrs):
+    """Context manager timing a child of the current span (a no-op outside a sampled trace).
+
+    Yields the Span (or None) so the caller can add attributes:
+        with tracing.span('detect') as sp:
+            ...
+            if sp: sp.set('faces', n)
+    """
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return _NO_SCOPE
+    return _Scope(Span(parent.trace_id, parent.span_id, True, name, parent.exporter, attrs))
+
+
+def record_span(name: str, start: float, ms: float, **attrs) -> None:
+    """Record an already measured child of the current span (start = wall-clock seconds)."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return
+    parent.exporter.export({
+        "trace": parent.trace_id, "span": _new_id(64), "parent": parent.span_id, "service": SERVICE,
+        "name": name, "start": round(start, 6), "ms": round(ms, 3), "attrs": attrs,
+    })
+
+
+class SpanExporter:
+    """Buffers span records and appends them to TRACE_DIR/<service>-<pid>.jsonl from a background thread."""
+
+    def __init__(self, directory: str, service: str = SERVICE, file_bytes: int = 20 << 20,
+                 max_bytes: int = 200 << 20, flush_s: float = 1.0, max_pending: int = 100_000):
+        """
+        Args:
+            directory: Span directory (created if missing)
+            service: File name prefix
+            file_bytes: Rotate the current file past this size
+            max_bytes: Delete the oldest span files beyond this total
+            flush_s: Write buffered spans at least this often
+            max_pending: Spans buffered before new ones are dropped
+        """
+        self.directory = directory
+        self.service = service
+        self.file_bytes = file_bytes
+        self.max_bytes = max_bytes
+        self.flush_s = flush_s
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._path = os.path.join(directory, f"{service}-{os.getpid()}.jsonl")
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['SpanExporter']:
+        directory = os.environ.get('TRACE_DIR', '')
+        if not directory:
+            return None
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(os.path.join(base_dir, directory),
+                   file_bytes=int(float(os.environ.get('TRACE_FILE_MB', 20)) * 2**20),
+                   max_bytes=int(float(os.environ.get('TRACE_MAX_MB', 200)) * 2**20))
+
+    def export(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(record)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_s)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Span export failed: {e}")
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return
+            if self._file is None:
+                self._file = open(self._path, 'a', encoding='utf-8')
+            self._file.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records))
+            self._file.flush()
+            self.exported += len(records)
+            if self._file.tell() > self.file_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        os.replace(self._path, os.path.join(self.directory, f"{self.service}-{os.getpid()}-{stamp}.jsonl"))
+        # Only rotated files count against TRACE_MAX_MB: other processes' active files are never deleted
+        files = sorted((os.path.join(self.directory, n) for n in os.listdir(self.directory) if _ROTATED.search(n)),
+                       key=os.path.getmtime)
+        total = sum(os.path.getsize(p) for p in files)
+        for old in files:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(old)
+            os.unlink(old)
+
+    def close(self) -> None:
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {"directory": self.directory, "exported": self.exported, "pending": pending, "dropped": self.dropped}
+
+
+class TraceMiddleware:
+    """ASGI middleware: continue the caller's trace (or start one) for every HTTP request.
+
+    Installed only when TRACE_DIR is set.
+    """
+
+    def __init__(self, app, exporter: SpanExporter, sample: float = 1.0):
+        self.app = app
+        self.exporter = exporter
+        self.sample = sample
+        self._header = TRACEPARENT_HEADER.encode()
+        self._id_header = TRACE_ID_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = parse_traceparent(next(
+            (v.decode('latin-1') for k, v in scope.get("headers", []) if k == self._header), None))
+        if incoming is not None:
+            trace_id, parent_id, sampled = incoming
+        else:
+            trace_id, parent_id, sampled = _new_id(128), None, random.random() < self.sample
+        root = Span(trace_id, parent_id, sampled, f"{scope['method']} {scope['path']}", self.exporter)
+        token = _current.set(root)
+        error = None
+
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                root.set("status", message["status"])
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (self._id_header, trace_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            root.finish(error)
+
+
+# -------- Viewer --------
+def load_spans(paths: List[str], since: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Span records of the given files / directories, grouped by trace."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, n) for n in sorted(os.listdir(path)) if n.endswith('.jsonl'))
+        elif os.path.exists(path):
+            files.append(path)
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut by a crash
+                if since is None or record["start"] >= since:
+                    traces[record["trace"]].append(record)
+    return traces
+
+
+def _roots(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ids = {s["span"] for s in spans}
+    return sorted((s for s in spans if s["parent"] not in ids), key=lambda s: s["start"])
+
+
+def trace_summary(trace_id: str, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    roots = _roots(spans)
+    start = min(s["start"] for s in spans)
+    end = max(s["start"] + s["ms"] / 1000 for s in spans)
+    return {"trace": trace_id, "root": roots[0], "start": start, "ms": (end - start) * 1000,
+            "services": sorted({s["service"] for s in spans}), "spans": len(spans)}
+
+
+def _print_tree(spans: List[Dict[str, Any]], t0: float) -> None:
+    children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+    by_id = {s["span"]: s for s in spans}
+    for s in spans:
+        children[s["parent"] if s["parent"] in by_id else None].append(s)
+    for group in children.values():
+        group.sort(key=lambda s: s["start"])
+
+    def line(depth: int, s: Dict[str, Any], label: str, ms: float) -> None:
+        attrs = " ".join(f"{k}={v}" for k, v in s["attrs"].items() if k != "sql")
+        offset = (s["start"] - t0) * 1000
+        print(f"  {offset:>+9.1f} {ms:>9.1f} ms  {'  ' * depth}{s['service']:<6} {label}  {attrs}".rstrip())
+
+    def walk(parent: Optional[str], depth: int) -> None:
+        group = children.get(parent, [])
+        # Repeated leaf spans (per-face queries, ...) are folded into one line
+        leaves: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for s in group:
+            if s["span"] not in children:
+                leaves[s["name"]].append(s)
+        folded = set()
+        for s in group:
+            same = leaves.get(s["name"], [])
+            if s["span"] not in children and len(same) > 1:
+                if s["name"] in folded:
+                    continue
+                folded.add(s["name"])
+                line(depth, s, f"{s['name']} x{len(same)}", sum(x["ms"] for x in same))
+                continue
+            label = s["name"]
+            caller = by_id.get(s["parent"])
+            if caller is not None and caller["service"] != s["service"]:
+                label += f"  ({caller['ms'] - s['ms']:.1f} ms in transit)"
+            line(depth, s, label, s["ms"])
+            walk(s["span"], depth + 1)
+
+    walk(None, 0)
+
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def _stage_name(record: Dict[str, Any]) -> str:
+    """Span name with numeric path segments folded (/sessions/12/ -> /sessions/:id/)."""
+    return _ID_SEGMENT.sub('/:id', record["name"])
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))] if values else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reconstruct traces from the span files of Django and the AI service")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("slowest", "Slowest end-to-end requests as span trees"),
+                            ("stages", "Time per stage (span name) across all traces")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--dir", action="append", help="Span directory or file (repeatable; default TRACE_DIR)")
+        p.add_argument("--since", type=float, help="Only the last N minutes")
+        p.add_argument("--name", help="Only traces whose root span name contains this")
+    sub.choices["slowest"].add_argument("--top", type=int, default=10)
+    sub.choices["slowest"].add_argument("--json", action="store_true", help="One trace (all spans) per line")
+    args = parser.parse_args(argv)
+
+    paths = args.dir or [os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ.get('TRACE_DIR') or 'traces')]
+    since = time.time() - args.since * 60 if args.since else None
+    traces = load_spans(paths, since)
+    summaries = [trace_summary(t, spans) for t, spans in traces.items()]
+    if args.name:
+        summaries = [s for s in summaries if args.name in s["root"]["name"]]
+    if not summaries:
+        print(f"No traces in {', '.join(paths)}")
+        return 1
+
+    if args.command == "stages":
+        keep = {s["trace"] for s in summaries}
+        stages: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        for trace_id in keep:
+            for record in traces[trace_id]:
+                stages[(record["service"], _stage_name(record))].append(record["ms"])
+        print(f"{len(keep)} traces\n")
+        print(f"  {'service':<8}{'stage':<58}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+        for (service, name), values in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+            print(f"  {service:<8}{name[:57]:<58}{len(values):>8}{_pct(values, 50):>10.1f}"
+                  f"{_pct(values, 95):>10.1f}{sum(values) / 1000:>10.2f}")
+        return 0
+
+    summaries.sort(key=lambda s: -s["ms"])
+    durations = [s["ms"] for s in summaries]
+    print(f"{len(summaries)} traces: p50 {_pct(durations, 50):.1f} ms, p95 {_pct(durations, 95):.1f} ms, "
+          f"p99 {_pct(durations, 99):.1f} ms")
+    for rank, s in enumerate(summaries[:args.top], 1):
+        if args.json:
+            print(json.dumps({**s, "spans": sorted(traces[s["trace"]], key=lambda r: r["start"])}))
+            continue
+        when = datetime.fromtimestamp(s["start"]).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"\n#{rank}  {s['ms']:.1f} ms  {when}  {s['root']['name']}  trace {s['trace']}  "
+              f"({'+'.join(s['services'])}, {s['spans']} spans)")
+        _print_tree(traces[s["trace"]], s["start"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
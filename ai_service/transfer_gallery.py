@@ -0,0 +1,184 @@
+"""Move a gallery between AI nodes or files as chunked binary (see gallery_transfer.py).
+
+Usage:
+    python transfer_gallery.py export --url http://node-a:8001 -o gallery.fgal [--fp16]
+    python transfer_gallery.py export --index-path faiss_index -o gallery.fgal      # offline, local
+    python transfer_gallery.py import --url http://node-b:8001 -i gallery.fgal
+    python transfer_gallery.py import --index-path faiss_index_new -i gallery.fgal  # offline, local
+    python transfer_gallery.py copy --from http://node-a:8001 --to http://node-b:8001 [--fp16]
+    python transfer_gallery.py verify -i gallery.fgal
+
+import and copy resume an interrupted transfer: the target reports how many
+rows it already has and only the rest is sent. Against a running node, set
+GALLERY_TOKEN to the node's shared secret.
+"""
+import os
+import sys
+import time
+import argparse
+from typing import Iterator
+
+import requests
+
+from gallery_transfer import StreamReader, iter_file_from, TransferError, token_headers
+
+BLOCK = 1 << 20
+
+
+def _progress(label: str, nbytes: int, started: float) -> None:
+    elapsed = max(1e-6, time.time() - started)
+    print(f"\r  {label}: {nbytes / 1e6:,.0f} MB ({nbytes / 1e6 / elapsed:,.0f} MB/s)", end="", flush=True)
+
+
+def _counted(stream: Iterator[bytes], label: str) -> Iterator[bytes]:
+    sent, started, last = 0, time.time(), 0.0
+    for data in stream:
+        sent += len(data)
+        if time.time() - last > 0.5:
+            _progress(label, sent, started)
+            last = time.time()
+        yield data
+    _progress(label, sent, started)
+    print()
+
+
+def _local_system(index_path: str):
+    from face_recognition import FaceRecognitionSystem
+    # 'auto' keeps whatever index type is stored instead of rebuilding it
+    return FaceRecognitionSystem(index_path=os.path.abspath(index_path),
+                                 index_type=os.environ.get('FACE_INDEX_TYPE', 'auto'), shards=None)
+
+
+def _target_rows(url: str) -> int:
+    resp = requests.get(f"{url}/api/face/gallery/import", headers=token_headers(), timeout=30)
+    resp.raise_for_status()
+    status = resp.json()
+    if status["rows"] and not status["importing"]:
+        raise TransferError(f"Target {url} already has {status['rows']} rows and no import in progress")
+    return int(status["rows"])
+
+
+def _post_import(url: str, body: Iterator[bytes]) -> dict:
+    resp = requests.post(f"{url}/api/face/gallery/import", data=body,
+                         headers={"Content-Type": "application/octet-stream", **token_headers()}, timeout=None)
+    if resp.status_code != 200:
+        raise TransferError(f"Import failed: HTTP {resp.status_code}: {resp.text[:300]}")
+    return resp.json()
+
+
+def cmd_export(args) -> int:
+    dtype = 'f16' if args.fp16 else 'f32'
+    started = time.time()
+    with open(args.output, "wb") as out:
+        if args.url:
+            with requests.get(f"{args.url}/api/face/gallery/export", params={"dtype": dtype},
+                              headers=token_headers(), stream=True, timeout=60) as resp:
+                resp.raise_for_status()
+                for data in _counted(resp.iter_content(BLOCK), "export"):
+                    out.write(data)
+        else:
+            from gallery_transfer import export_stream
+            for data in _counted(export_stream(_local_system(args.index_path), dtype=dtype), "export"):
+                out.write(data)
+    print(f"✓ Exported to {args.output} ({os.path.getsize(args.output) / 1e6:,.0f} MB, {time.time() - started:.1f}s)")
+    return 0
+
+
+def cmd_import(args) -> int:
+    started = time.time()
+    if args.url:
+        since = _target_rows(args.url)
+        if since:
+            print(f"🔁 Resuming import at row {since}")
+        with open(args.input, "rb") as f:
+            report = _post_import(args.url, _counted(iter_file_from(f, since, BLOCK), "import"))
+    else:
+        from gallery_transfer import import_file
+        system = _local_system(args.index_path)
+        with open(args.input, "rb") as f:
+            report = import_file(system, f, BLOCK)
+        if system._rebuild_thread is not None:
+            system._rebuild_thread.join()  # auto index selection may have started a rebuild
+    print(f"✓ Imported {report['applied']} rows ({report['skipped']} skipped), gallery has {report['rows']} "
+          f"rows, {time.time() - started:.1f}s")
+    return 0
+
+
+def cmd_copy(args) -> int:
+    src, dst = args.source.rstrip('/'), args.target.rstrip('/')
+    since = _target_rows(dst)
+    if since:
+        print(f"🔁 Resuming copy at row {since}")
+    started = time.time()
+    with requests.get(f"{src}/api/face/gallery/export", params={"since": since, "dtype": 'f16' if args.fp16 else 'f32'},
+                      headers=token_headers(), stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        report = _post_import(dst, _counted(resp.iter_content(BLOCK), "copy"))
+    print(f"✓ Copied {report['applied']} rows {src} -> {dst} in {time.time() - started:.1f}s "
+          f"(gallery has {report['rows']} rows)")
+    return 0
+
+
+def cmd_verify(args) -> int:
+    reader = StreamReader()
+    rows = chunks = 0
+    with open(args.input, "rb") as f:
+        while True:
+            data = f.read(BLOCK)
+            if not data:
+                break
+            for event in reader.feed(data):
+                if event["type"] == "chunk":
+                    chunks += 1
+                    rows += event["rows"]
+    if reader.header is None or reader.total is None:
+        print("⚠️  Truncated: no trailer")
+        return 1
+    expected = reader.total - reader.header["since"]
+    status = "✓" if rows == expected else "⚠️ "
+    print(f"{status} {chunks} chunks, {rows}/{expected} rows, checksums OK "
+          f"({reader.header['model']}, {reader.header['dim']}-d {reader.header['dtype']})")
+    return 0 if rows == expected else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export / import a face gallery as chunked binary")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--url", help="AI service base URL")
+    src.add_argument("--index-path", help="Local index directory (offline)")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--fp16", action="store_true", help="Half-size float16 vectors")
+    p.set_defaults(fn=cmd_export)
+
+    p = sub.add_parser("import")
+    dst = p.add_mutually_exclusive_group(required=True)
+    dst.add_argument("--url", help="AI service base URL")
+    dst.add_argument("--index-path", help="Local index directory (offline)")
+    p.add_argument("-i", "--input", required=True)
+    p.set_defaults(fn=cmd_import)
+
+    p = sub.add_parser("copy")
+    p.add_argument("--from", dest="source", required=True)
+    p.add_argument("--to", dest="target", required=True)
+    p.add_argument("--fp16", action="store_true")
+    p.set_defaults(fn=cmd_copy)
+
+    p = sub.add_parser("verify")
+    p.add_argument("-i", "--input", required=True)
+    p.set_defaults(fn=cmd_verify)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "url", None):
+        args.url = args.url.rstrip('/')
+    try:
+        return args.fn(args)
+    except (TransferError, requests.RequestException) as e:
+        print(f"\n⚠️  {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
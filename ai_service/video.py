@@ -0,0 +1,346 @@
+"""Attendance from recorded lectures: sample a video, track faces, count appearances.
+
+Pipeline:
+    decode thread (cv2.VideoCapture; skipped frames are only grabbed) -> bounded queue
+    -> per sampled frame: detect -> FaceTracker (bounding-box overlap) -> ArcFace
+       for the faces whose track needs it, in one batch -> one batched FAISS search
+
+Once the recognitions of a tracked face agree, the face is re-embedded only
+every `reembed_every` samples, so a hall of mostly seated students costs little
+more than detection. At the end each track takes the identity most of its
+recognitions agreed on, and a student is present when seen in at least
+`min_appearances` sampled frames: a single stray match does not mark anybody.
+
+Output (HTTP endpoint and CLI) is NDJSON: {"progress": {...}} lines while
+running, then one {"summary": true, "present": {student_id: similarity}, ...}
+line, which `manage.py mark_video_attendance --results` also accepts.
+
+CLI usage:
+    python video.py lecture.mp4 --fps 1 -o lecture.ndjson
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import cv2
+
+
+def _put(frames: "queue.Queue", item: Any, stop: threading.Event) -> None:
+    """Hand an item to the consumer, giving up once it has stopped reading (queue full, `stop` set)."""
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """Container properties of a video (raises if OpenCV cannot open it)."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise Exception("Cannot open video (unsupported format or codec)")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": round(fps, 3),
+            "frames": frames,
+            "duration_s": round(frames / fps, 2) if fps > 0 and frames > 0 else None,
+        }
+    finally:
+        cap.release()
+
+
+def _iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of boxes a (n, 4) and b (m, 4) as [x1, y1, x2, y2]."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class Track:
+    """One face followed across sampled frames, with the recognitions made on it."""
+
+    __slots__ = ("id", "bbox", "samples", "votes", "best", "last_embedded")
+
+    def __init__(self, track_id: int, bbox: np.ndarray, sample: int):
+        self.id = track_id
+        self.bbox = bbox
+        self.samples = [sample]      # sampled-frame indices the face was seen in
+        self.votes: Counter = Counter()  # student_id (None = not recognized) -> recognitions
+        self.best: Dict[str, float] = {}  # student_id -> best similarity
+        self.last_embedded = -1      # sample index of the last ArcFace run
+
+    def settled(self) -> bool:
+        """At least two recognitions, two thirds of them agreeing."""
+        if not self.votes:
+            return False
+        count = self.votes.most_common(1)[0][1]
+        return count >= 2 and 3 * count >= 2 * sum(self.votes.values())
+
+    def identity(self) -> Optional[str]:
+        """Most frequent outcome (ties: best similarity); None if that is 'not recognized'."""
+        if not self.votes:
+            return None
+        return max(self.votes, key=lambda sid: (self.votes[sid], self.best.get(sid, 0.0) if sid else -1.0))
+
+
+class FaceTracker:
+    """Greedy IoU association of each frame's detections with the live tracks."""
+
+    def __init__(self, iou_threshold: float = 0.3, max_gap: int = 2):
+        """
+        Args:
+            iou_threshold: Minimum box overlap to continue a track
+            max_gap: Sampled frames a track may go unseen (occlusion, missed detection) before it ends
+        """
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.active: List[Track] = []
+        self.finished: List[Track] = []
+        self._next_id = 0
+
+    def update(self, sample: int, bboxes: List[np.ndarray]) -> List[Track]:
+        """Assign the boxes of sampled frame `sample` to tracks -> one track per box, in order."""
+        live = []
+        for track in self.active:
+            (live if sample - track.samples[-1] <= self.max_gap + 1 else self.finished).append(track)
+        self.active = live
+
+        assigned: List[Optional[Track]] = [None] * len(bboxes)
+        if bboxes and live:
+            iou = _iou_matrix(np.asarray(bboxes, dtype=np.float32), np.stack([t.bbox for t in live]))
+            used = set()
+            for flat in np.argsort(-iou, axis=None):
+                i, j = divmod(int(flat), len(live))
+                if iou[i, j] < self.iou_threshold:
+                    break
+                if assigned[i] is not None or j in used:
+                    continue
+                assigned[i] = live[j]
+                used.add(j)
+        for i, bbox in enumerate(bboxes):
+            track = assigned[i]
+            if track is None:
+                track = Track(self._next_id, np.asarray(bbox, dtype=np.float32), sample)
+                self._next_id += 1
+                self.active.append(track)
+            else:
+                track.bbox = np.asarray(bbox, dtype=np.float32)
+                track.samples.append(sample)
+            assigned[i] = track
+        return assigned
+
+    def tracks(self) -> List[Track]:
+        return self.finished + self.active
+
+
+class VideoAttendance:
+    """Recognize everybody in a recorded lecture and decide who was present."""
+
+    def __init__(self, face_system, sample_fps: float = 1.0, threshold: float = 0.7, min_appearances: int = 3,
+                 reembed_every: int = 5, scheduler=None, queue_size: int = 8):
+        """
+        Args:
+            face_system: FaceRecognitionSystem used for detection, embedding and search
+            sample_fps: Frames analysed per second of video
+            threshold: Cosine similarity threshold for a recognition
+            min_appearances: Sampled frames a student must be seen in to be present
+            reembed_every: Re-run ArcFace on a settled track every this many samples
+            scheduler: Optional InferenceScheduler; each sampled frame then runs as one
+                batch-lane unit, so live recognition is served in between
+            queue_size: Decoded frames buffered between the decode thread and inference
+        """
+        self.face_system = face_system
+        self.sample_fps = sample_fps
+        self.threshold = threshold
+        self.min_appearances = max(1, min_appearances)
+        self.reembed_every = max(1, reembed_every)
+        self.scheduler = scheduler
+        self.queue_size = max(1, queue_size)
+
+    def _decode(self, path: str, frames: "queue.Queue", stop: threading.Event) -> None:
+        """Decode thread: retrieve one frame per sampling interval, only grab the others."""
+        cap = cv2.VideoCapture(path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            interval = 1.0 / self.sample_fps
+            index, sample, next_t = 0, 0, 0.0
+            while not stop.is_set() and cap.grab():
+                t = index / fps
+                index += 1
+                if t + 1e-6 < next_t:
+                    continue
+                ok, img = cap.retrieve()
+                next_t += interval * max(1, int((t - next_t) / interval) + 1)
+                if not ok:
+                    continue
+                _put(frames, (sample, t, img), stop)
+                sample += 1
+        except Exception as e:
+            _put(frames, e, stop)
+        finally:
+            cap.release()
+            _put(frames, None, stop)
+
+    def _process(self, sample: int, img: np.ndarray, tracker: FaceTracker) -> Dict[str, int]:
+        """Detect, track, embed the faces that need it and record the recognitions."""
+        fs = self.face_system
+        faces, _ = fs.detect_faces(img)
+        tracks = tracker.update(sample, [f.bbox for f in faces])
+        need = [i for i, track in enumerate(tracks)
+                if not track.settled() or sample - track.last_embedded >= self.reembed_every]
+        if need:
+            embeddings = fs.backend.embed(img, [faces[i] for i in need])
+            boxes = [{"bbox": [int(v) for v in faces[i].bbox[:4]]} for i in need]
+            matches = fs._match_faces(boxes, list(embeddings), self.threshold)
+            for i, match in zip(need, matches):
+                track = tracks[i]
+                track.last_embedded = sample
+                sid = match["student_id"] if match["recognized"] else None
+                track.votes[sid] += 1
+                if sid is not None:
+                    track.best[sid] = max(track.best.get(sid, 0.0), match["similarity"])
+        return {"faces": len(faces), "embedded": len(need)}
+
+    def run(self, path: str, progress_every_s: float = 2.0) -> Iterator[Dict[str, Any]]:
+        """Process the video; yields progress dicts, then the summary (see module docstring)."""
+        info = probe_video(path)
+        tracker = FaceTracker()
+        frames: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._decode, args=(path, frames, stop), name='video-decode', daemon=True)
+        started = time.time()
+        times: List[float] = []
+        totals = {"faces": 0, "embedded": 0}
+        last_progress = started
+
+        def progress(position: float) -> Dict[str, Any]:
+            elapsed = time.time() - started
+            duration = info["duration_s"]
+            return {
+                "position_s": round(position, 1),
+                "duration_s": duration,
+                "percent": round(100.0 * position / duration, 1) if duration else None,
+                "sampled_frames": len(times),
+                **totals,
+                "tracks": len(tracker.active) + len(tracker.finished),
+                "elapsed_s": round(elapsed, 1),
+                "realtime_factor": round(position / elapsed, 2) if elapsed > 0 else None,
+            }
+
+        reader.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise Exception(f"Video decode failed: {item}")
+                sample, t, img = item
+                times.append(t)
+                if self.scheduler is not None:
+                    counts = self.scheduler.call(self._process, sample, img, tracker, lane='batch')
+                else:
+                    counts = self._process(sample, img, tracker)
+                for key, value in counts.items():
+                    totals[key] += value
+                if time.time() - last_progress >= progress_every_s:
+                    last_progress = time.time()
+                    yield {"progress": progress(t)}
+        finally:
+            stop.set()
+            reader.join(timeout=5)
+
+        position = times[-1] if times else 0.0
+        yield {
+            "summary": True,
+            "video": {"name": os.path.basename(path), **info},
+            "sample_fps": self.sample_fps,
+            "min_appearances": self.min_appearances,
+            **progress(info["duration_s"] or position),
+            **self._aggregate(tracker, times),
+        }
+
+    def _aggregate(self, tracker: FaceTracker, times: List[float]) -> Dict[str, Any]:
+        """Identity per track -> sampled frames per student -> present if >= min_appearances."""
+        seen: Dict[str, set] = {}
+        best: Dict[str, float] = {}
+        track_count: Counter = Counter()
+        for track in tracker.tracks():
+            sid = track.identity()
+            if sid is None:
+                continue
+            seen.setdefault(sid, set()).update(track.samples)
+            best[sid] = max(best.get(sid, 0.0), track.best[sid])
+            track_count[sid] += 1
+        students = {}
+        for sid, samples in seen.items():
+            ordered = sorted(samples)
+            students[sid] = {
+                "appearances": len(ordered),
+                "similarity": round(best[sid], 4),
+                "tracks": track_count[sid],
+                "first_seen_s": round(times[ordered[0]], 1),
+                "last_seen_s": round(times[ordered[-1]], 1),
+                "present": len(ordered) >= self.min_appearances,
+            }
+        return {
+            "present": {sid: s["similarity"] for sid, s in students.items() if s["present"]},
+            "students": students,
+            "unknown_tracks": sum(1 for t in tracker.tracks() if t.identity() is None),
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Attendance from a recorded lecture video")
+    parser.add_argument("input", help="Video file")
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--fps", type=float, default=1.0, help="Frames analysed per second of video")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--min-appearances", type=int, default=3)
+    parser.add_argument("--reembed-every", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from face_recognition import FaceRecognitionSystem
+
+    # 'auto' keeps whatever index type the service stored instead of rebuilding its gallery
+    face_system = FaceRecognitionSystem(index_path=os.environ.get('FACE_INDEX_PATH', 'faiss_index'),
+                                        index_type=os.environ.get('FACE_INDEX_TYPE', 'auto'))
+    job = VideoAttendance(face_system, sample_fps=args.fps, threshold=args.threshold,
+                          min_appearances=args.min_appearances, reembed_every=args.reembed_every)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for item in job.run(args.input):
+            out.write(json.dumps(item) + "\n")
+            out.flush()
+            if "progress" in item:
+                p = item["progress"]
+                print(f"  {p['position_s']:.0f}s / {p['duration_s']}s  {p['sampled_frames']} frames  "
+                      f"{p['faces']} faces  {p['realtime_factor']}x real time", file=sys.stderr)
+            else:
+                print(f"✓ {len(item['present'])} students present "
+                      f"({len(item['students'])} recognized, {item['realtime_factor']}x real time)", file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
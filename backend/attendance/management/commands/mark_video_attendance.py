@@ -0,0 +1,139 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import json
+import os
+import requests
+
+from attendance.models import AttendanceSession
+from attendance_system import tracing
+from attendance.views import _ai_read_url, _bulk_mark_attendance, AI_NAMESPACE_HEADER, AI_SESSION_HEADER
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark a session's attendance from a recorded lecture video. The video is streamed to the "
+        "AI service (recognize_video), or pass --results with NDJSON produced offline by ai_service/video.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("session_id", type=int, help="AttendanceSession to mark")
+        parser.add_argument("video", nargs="?", help="Local video file of the lecture")
+        parser.add_argument(
+            "--results",
+            help="NDJSON output of `python ai_service/video.py` instead of a video",
+        )
+        parser.add_argument(
+            "--fps",
+            type=float,
+            default=1.0,
+            help="Frames analysed per second of video",
+        )
+        parser.add_argument(
+            "--min-appearances",
+            type=int,
+            default=3,
+            help="Sampled frames a student must be seen in to be marked present",
+        )
+        parser.add_argument("--threshold", type=float, default=0.7)
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=3600,
+            help="Seconds to wait for the AI service between progress lines",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report who would be marked without writing attendance records",
+        )
+
+    def handle(self, *args, **options):
+        # One trace for the whole run (with TRACE_DIR set); the AI service's spans join it
+        with tracing.root_span(f"mark_video_attendance {options['session_id']}"):
+            self._handle(options)
+
+    def _handle(self, options):
+        try:
+            session = AttendanceSession.objects.get(pk=options["session_id"])
+        except AttendanceSession.DoesNotExist:
+            raise CommandError(f"AttendanceSession {options['session_id']} does not exist")
+
+        if options["results"]:
+            with open(options["results"], "rb") as f:
+                summary = self._read_ndjson(f)
+        elif options["video"]:
+            summary = self._recognize_video(session, options)
+        else:
+            raise CommandError("Provide a video file or --results")
+        if summary is None:
+            raise CommandError("No summary line in the results: the video was not processed to the end")
+
+        present = summary.get("present") or {}
+        students = summary.get("students") or {}
+        self.stdout.write(
+            f"{len(present)} student(s) present, {len(students) - len(present)} seen fewer than "
+            f"{summary.get('min_appearances')} sampled frames, {summary.get('unknown_tracks', 0)} unknown face track(s)"
+        )
+        if options["dry_run"]:
+            for sid, info in sorted(students.items(), key=lambda kv: -kv[1]["appearances"]):
+                self.stdout.write(
+                    f"  {sid}: {info['appearances']} frames, similarity {info['similarity']}"
+                    f"{'' if info['present'] else ' (not marked)'}"
+                )
+            return
+
+        with tracing.span('mark_attendance', students=len(present)):
+            created, updated, unknown = _bulk_mark_attendance(session, present)
+        if unknown:
+            self.stdout.write(self.style.WARNING(f"Unknown student IDs in the gallery: {', '.join(unknown)}"))
+        self.stdout.write(self.style.SUCCESS(f"Done. session={session.pk} marked={created} updated={updated}"))
+
+    def _recognize_video(self, session, options):
+        path = options["video"]
+        if not os.path.isfile(path):
+            raise CommandError(f"No such video file: {path}")
+        endpoint = f"{_ai_read_url()}/api/face/recognize_video"
+        params = {
+            "sample_fps": options["fps"],
+            "min_appearances": options["min_appearances"],
+            "threshold": options["threshold"],
+        }
+        # Runs in the AI service's batch lane: live recognition is served first
+        headers = {
+            "X-Priority": "batch",
+            "Content-Type": "application/octet-stream",
+            AI_NAMESPACE_HEADER: settings.AI_GALLERY_NAMESPACE,
+            AI_SESSION_HEADER: str(session.pk),
+        }
+        tracing.inject(headers)
+        size_mb = os.path.getsize(path) / 2**20
+        self.stdout.write(f"Uploading {os.path.basename(path)} ({size_mb:.0f} MB) -> {endpoint}")
+        try:
+            with open(path, "rb") as f:
+                # The file object is streamed, not read into memory
+                resp = requests.post(endpoint, data=f, params=params, headers=headers, stream=True,
+                                     timeout=(10, options["timeout"]))
+            with resp:
+                if resp.status_code != 200:
+                    raise CommandError(f"AI service HTTP {resp.status_code}: {resp.text[:500]}")
+                return self._read_ndjson(resp.iter_lines())
+        except requests.RequestException as e:
+            raise CommandError(f"AI service unavailable: {e}")
+
+    def _read_ndjson(self, lines):
+        """Print progress lines; return the summary line (None if the stream ended early)."""
+        for line in lines:
+            if not line:
+                continue
+            item = json.loads(line)
+            if item.get("error"):
+                raise CommandError(f"Video processing failed: {item['error']}")
+            if "progress" in item:
+                p = item["progress"]
+                self.stdout.write(
+                    f"  {p['position_s']:.0f}s / {p['duration_s']}s ({p['percent']}%)  "
+                    f"{p['faces']} faces  {p['realtime_factor']}x real time"
+                )
+            elif item.get("summary"):
+                return item
+        return None
@@ -10,9 +10,208 @@ from .serializers import AttendanceSessionSerializer, AttendanceRecordSerializer
 from students.models import Student, Teacher, TeacherSubjectAssignment
 import requests
 import os
+import json
+import random
 from django.http import HttpResponse
+from django.conf import settings
+from attendance_system import tracing
+from urllib.parse import urlsplit
 import csv
 
+
+def _ai_read_url():
+    """AI service base URL for recognition (read-only) calls.
+
+    AI_SERVICE_READ_URLS lists read replicas (comma-separated); one is picked per
+    request. Registrations keep using AI_SERVICE_URL, the primary.
+    """
+    replicas = [u.strip() for u in os.environ.get('AI_SERVICE_READ_URLS', '').split(',') if u.strip()]
+    if replicas:
+        return random.choice(replicas).rstrip('/')
+    return os.environ.get('AI_SERVICE_URL', 'http://localhost:8001').rstrip('/')
+
+
+# Remaining request budget passed to the AI service, which drops work whose
+# caller has already given up instead of running inference nobody waits for
+AI_DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+AI_DEADLINE_MARGIN_MS = 500  # network + response handling after inference
+AI_NAMESPACE_HEADER = 'X-Gallery-Namespace'
+# Camera client identity and unmarked students, from which the AI service derives
+# the capture hints (next interval, resolution, JPEG quality) of live responses
+AI_CAPTURE_CLIENT_HEADER = 'X-Capture-Client'
+AI_CAPTURE_PENDING_HEADER = 'X-Capture-Pending'
+# Session recorded with each recognition decision in the AI service's audit log
+AI_SESSION_HEADER = 'X-Attendance-Session'
+
+
+def _ai_post(endpoint, timeout, **kwargs):
+    """POST to the AI service, sending our timeout (minus a margin) as its deadline.
+
+    Timed as an `ai POST <path>` span whose traceparent the AI service continues.
+    """
+    connect_read = timeout if isinstance(timeout, (int, float)) else timeout[1]
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers[AI_DEADLINE_HEADER] = str(max(0, int(connect_read * 1000) - AI_DEADLINE_MARGIN_MS))
+    headers[AI_NAMESPACE_HEADER] = settings.AI_GALLERY_NAMESPACE
+    with tracing.span(f"ai POST {urlsplit(endpoint).path}") as sp:
+        resp = requests.post(endpoint, timeout=timeout, headers=tracing.inject(headers), **kwargs)
+        if sp:
+            sp.set('status', resp.status_code)
+        return resp
+
+
+def _session_headers(session):
+    """Audit and capture-hint headers for a live recognition call of `session`.
+
+    Pending counts the active students of the session's department and year
+    without an attendance record; it is omitted when no such roster exists.
+    """
+    headers = {AI_SESSION_HEADER: str(session.pk), AI_CAPTURE_CLIENT_HEADER: f"session-{session.pk}"}
+    with tracing.span('roster'):
+        roster = Student.objects.filter(
+            department__code=session.department, class_year=session.class_year, is_active=True
+        )
+        if roster.exists():
+            pending = roster.exclude(attendancerecord__session=session).count()
+            headers[AI_CAPTURE_PENDING_HEADER] = str(pending)
+    return headers
+
+
+def _ai_busy_response(resp):
+    """503 + Retry-After when the AI service shed the request (overload/deadline), else None."""
+    if resp.status_code not in (429, 503, 504):
+        return None
+    retry_after = resp.headers.get('Retry-After', '1')
+    busy = Response(
+        {"error": "AI service busy, retry shortly", "retry_after": int(retry_after) if retry_after.isdigit() else 1},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+    busy['Retry-After'] = retry_after
+    return busy
+
+
+def _best_matches_from_ndjson(lines):
+    """Collect the best similarity per recognized student from batch NDJSON lines.
+
+    Returns (best: {student_id: similarity}, stats: {images, faces, errors})
+    """
+    best = {}
+    stats = {"images": 0, "faces": 0, "errors": 0}
+    for line in lines:
+        if not line:
+            continue
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        try:
+            item = json.loads(line)
+        except ValueError:
+            stats["errors"] += 1
+            continue
+        if item.get('summary'):
+            continue
+        stats["images"] += 1
+        if item.get('error'):
+            stats["errors"] += 1
+            continue
+        for f in item.get('faces', []):
+            stats["faces"] += 1
+            sid = f.get('student_id')
+            if f.get('recognized') and sid:
+                similarity = float(f.get('similarity') or 0.0)
+                if similarity > best.get(str(sid), -1.0):
+                    best[str(sid)] = similarity
+    return best, stats
+
+
+def _bulk_mark_attendance(session, best):
+    """Mark attendance for many students at once.
+
+    Args:
+        session: AttendanceSession to mark
+        best: {student_id: similarity} - similarity is stored as confidence
+
+    Returns:
+        (created, updated, unknown_ids)
+    """
+    students = Student.objects.in_bulk([int(sid) for sid in best if str(sid).isdigit()])
+    unknown = [sid for sid in best if not str(sid).isdigit() or int(sid) not in students]
+
+    existing = {
+        rec.student_id: rec
+        for rec in AttendanceRecord.objects.filter(session=session, student_id__in=students.keys())
+    }
+    to_create = []
+    to_update = []
+    for pk, student in students.items():
+        similarity = best[str(pk)]
+        rec = existing.get(pk)
+        if rec is None:
+            to_create.append(AttendanceRecord(
+                session=session, student=student, confidence=similarity, status='present'
+            ))
+        elif similarity > (rec.confidence or 0.0) or rec.status != 'present':
+            rec.confidence = max(similarity, rec.confidence or 0.0)
+            rec.status = 'present'
+            to_update.append(rec)
+
+    AttendanceRecord.objects.bulk_create(to_create, ignore_conflicts=True)
+    if to_update:
+        AttendanceRecord.objects.bulk_update(to_update, ['confidence', 'status'])
+    return len(to_create), len(to_update), unknown
+
+
+def _mark_recognized_faces(session, faces):
+    """Mark attendance for every recognized face returned by the AI service.
+
+    Returns the faces enriched with student details, in the same order.
+    """
+    enriched = []
+    for f in faces:
+        student = None
+        if f.get('recognized') and f.get('student_id'):
+            try:
+                student = Student.objects.get(id=f['student_id'])
+            except Student.DoesNotExist:
+                student = None
+        if student:
+            # Use similarity (raw cosine score) not confidence (rescaled)
+            # similarity >= 0.7 means 70%+ match (high accuracy threshold)
+            similarity = float(f.get('similarity') or 0.0)
+            rec, created = AttendanceRecord.objects.get_or_create(
+                session=session,
+                student=student,
+                defaults={"confidence": similarity, "status": "present"}
+            )
+            if not created:
+                # update confidence if current similarity is higher
+                if similarity > (rec.confidence or 0.0):
+                    rec.confidence = similarity
+                rec.status = 'present'
+                rec.save()
+            enriched.append({
+                "bbox": f.get('bbox'),
+                "recognized": True,
+                "student": {
+                    "id": student.id,
+                    "roll_number": student.roll_number,
+                    "full_name": student.full_name,
+                    "department": student.department.code if hasattr(student.department, 'code') else student.department,
+                    "class_year": student.class_year,
+                },
+                "similarity": f.get('similarity'),
+                "confidence": f.get('confidence'),
+            })
+        else:
+            enriched.append({
+                "bbox": f.get('bbox'),
+                "recognized": False,
+                "student": None,
+                "similarity": f.get('similarity'),
+                "confidence": f.get('confidence'),
+            })
+    return enriched
+
+
 class AttendanceSessionViewSet(viewsets.ModelViewSet):
     queryset = AttendanceSession.objects.all()
     serializer_class = AttendanceSessionSerializer
@@ -156,21 +355,25 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
         if not image_file:
             return Response({"error": "face_image file is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        ai_url = os.environ.get('AI_SERVICE_URL', 'http://localhost:8001').rstrip('/')
+        ai_url = _ai_read_url()
         recognize_endpoint = f"{ai_url}/api/face/recognize"
 
         try:
             files = {"file": (image_file.name, image_file, image_file.content_type or 'image/jpeg')}
-            resp = requests.post(recognize_endpoint, files=files, timeout=10)
+            resp = _ai_post(recognize_endpoint, files=files, timeout=10, headers=_session_headers(session))
         except requests.RequestException as e:
             return Response({"error": f"AI service unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+        busy = _ai_busy_response(resp)
+        if busy is not None:
+            return busy
         if resp.status_code != 200:
             return Response({"error": f"AI service error: HTTP {resp.status_code}"}, status=status.HTTP_502_BAD_GATEWAY)
 
         payload = resp.json()
         if not payload.get('recognized'):
-            return Response({"recognized": False, "message": payload.get('message', 'No match')}, status=status.HTTP_200_OK)
+            return Response({"recognized": False, "message": payload.get('message', 'No match'),
+                             "capture": payload.get('capture')}, status=status.HTTP_200_OK)
 
         student_id = payload.get('student_id')
         confidence = float(payload.get('confidence', 0.0))
@@ -202,6 +405,7 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
             },
             "confidence": confidence,
             "attendance_record": rec_serializer.data,
+            "capture": payload.get('capture'),
         }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
@@ -235,7 +439,7 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        ai_url = os.environ.get('AI_SERVICE_URL', 'http://localhost:8001').rstrip('/')
+        ai_url = _ai_read_url()
         endpoint = f"{ai_url}/api/face/recognize_multi"
 
         # Prepare files for multi-frame recognition
@@ -243,7 +447,7 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
         
         try:
             # Uses 0.7 threshold (70% similarity) for marking attendance - High accuracy
-            resp = requests.post(endpoint, files=files, timeout=20)
+            resp = _ai_post(endpoint, files=files, timeout=20, headers={AI_SESSION_HEADER: str(session.pk)})
         except requests.RequestException as e:
             return Response(
                 {
@@ -253,6 +457,9 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
+        busy = _ai_busy_response(resp)
+        if busy is not None:
+            return busy
         if resp.status_code != 200:
             error_detail = resp.json() if resp.headers.get('content-type') == 'application/json' else resp.text
             return Response(
@@ -366,14 +573,17 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
         if not image_file:
             return Response({"error": "frame image is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        ai_url = os.environ.get('AI_SERVICE_URL', 'http://localhost:8001').rstrip('/')
+        ai_url = _ai_read_url()
         endpoint = f"{ai_url}/api/face/recognize_frame"
         try:
             files = {"file": (image_file.name, image_file, getattr(image_file, 'content_type', 'image/jpeg'))}
-            resp = requests.post(endpoint, files=files, timeout=20)
+            resp = _ai_post(endpoint, files=files, timeout=20, headers=_session_headers(session))
         except requests.RequestException as e:
             return Response({"error": f"AI service unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+        busy = _ai_busy_response(resp)
+        if busy is not None:
+            return busy
         if resp.status_code != 200:
             return Response({"error": f"AI service error: HTTP {resp.status_code}"}, status=status.HTTP_502_BAD_GATEWAY)
 
@@ -381,56 +591,104 @@ class AttendanceSessionViewSet(viewsets.ModelViewSet):
         faces = payload.get('faces', [])
         image_meta = payload.get('image', {})
 
-        enriched = []
-        for f in faces:
-            if f.get('recognized') and f.get('student_id'):
-                try:
-                    student = Student.objects.get(id=f['student_id'])
-                except Student.DoesNotExist:
-                    student = None
-                if student:
-                    # Use similarity (raw cosine score) not confidence (rescaled)
-                    # similarity >= 0.7 means 70%+ match (high accuracy threshold)
-                    similarity = float(f.get('similarity') or 0.0)
-                    rec, created = AttendanceRecord.objects.get_or_create(
-                        session=session,
-                        student=student,
-                        defaults={"confidence": similarity, "status": "present"}
-                    )
-                    if not created:
-                        # update confidence if current similarity is higher
-                        if similarity > (rec.confidence or 0.0):
-                            rec.confidence = similarity
-                        rec.status = 'present'
-                        rec.save()
-                    enriched.append({
-                        "bbox": f.get('bbox'),
-                        "recognized": True,
-                        "student": {
-                            "id": student.id,
-                            "roll_number": student.roll_number,
-                            "full_name": student.full_name,
-                            "department": student.department,
-                            "class_year": student.class_year,
-                        },
-                        "similarity": f.get('similarity'),
-                        "confidence": f.get('confidence'),
-                    })
-                else:
-                    enriched.append({
-                        "bbox": f.get('bbox'),
-                        "recognized": False,
-                        "student": None,
-                        "similarity": f.get('similarity'),
-                        "confidence": f.get('confidence'),
-                    })
-            else:
-                enriched.append({
-                    "bbox": f.get('bbox'),
-                    "recognized": False,
-                    "student": None,
-                    "similarity": f.get('similarity'),
-                    "confidence": f.get('confidence'),
-                })
-
-        return Response({"image": image_meta, "faces": enriched})
+        with tracing.span('mark_attendance', faces=len(faces)):
+            enriched = _mark_recognized_faces(session, faces)
+        return Response({"image": image_meta, "faces": enriched, "capture": payload.get('capture')})
+
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def recognize_batch(self, request, pk=None):
+        """Mark attendance in bulk from classroom photos taken during/after the lecture.
+
+        Accepts multipart form with either:
+        - 'photos' (multiple image files) and/or 'archive' (.zip of photos), which are
+          forwarded to the AI service batch endpoint, or
+        - 'results', an NDJSON file produced offline by `ai_service/batch.py`.
+        """
+        session = self.get_object()
+
+        results_file = request.FILES.get('results')
+        photos = request.FILES.getlist('photos')
+        archive = request.FILES.get('archive')
+
+        if results_file:
+            best, stats = _best_matches_from_ndjson(results_file)
+        elif photos or archive:
+            ai_url = _ai_read_url()
+            endpoint = f"{ai_url}/api/face/recognize_batch"
+            files = [('files', (p.name, p, getattr(p, 'content_type', 'image/jpeg'))) for p in photos]
+            if archive:
+                files.append(('archive', (archive.name, archive, 'application/zip')))
+            try:
+                # Batch jobs can take minutes; results are streamed back line by line
+                resp = requests.post(endpoint, files=files, data={'threshold': 0.7}, stream=True, timeout=(10, 300),
+                                     headers=tracing.inject({AI_NAMESPACE_HEADER: settings.AI_GALLERY_NAMESPACE,
+                                                             AI_SESSION_HEADER: str(session.pk)}))
+                # Closed on every path, or the streamed connection never returns to the pool
+                with resp:
+                    if resp.status_code != 200:
+                        return Response({"error": f"AI service error: HTTP {resp.status_code}"},
+                                        status=status.HTTP_502_BAD_GATEWAY)
+                    best, stats = _best_matches_from_ndjson(resp.iter_lines())
+            except requests.RequestException as e:
+                return Response({"error": f"AI service unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        else:
+            return Response(
+                {"error": "Provide 'photos', an 'archive' (.zip) or a 'results' NDJSON file"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        created, updated, unknown = _bulk_mark_attendance(session, best)
+        return Response({
+            "images": stats["images"],
+            "faces": stats["faces"],
+            "errors": stats["errors"],
+            "recognized_students": len(best),
+            "marked": created,
+            "updated": updated,
+            "unknown_student_ids": unknown,
+        })
+
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def recognize_crops(self, request, pk=None):
+        """Mark attendance from face crops produced by a capture station's own detector.
+
+        Accepts multipart form with 'crops' files (112x112 aligned, or any size when
+        'landmarks' is given) and optional 'landmarks' JSON (one [[x, y] x 5] or null
+        per crop). Only embedding + search run on the AI service.
+        Returns: { faces: [{index, recognized, student, similarity, confidence}] }
+        """
+        session = self.get_object()
+        if not session.is_active:
+            return Response({"error": "Session is not active"}, status=status.HTTP_400_BAD_REQUEST)
+
+        crops = request.FILES.getlist('crops')
+        if not crops:
+            return Response({"error": "crops files are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        ai_url = _ai_read_url()
+        endpoint = f"{ai_url}/api/face/recognize_crops"
+        files = [('files', (c.name, c, getattr(c, 'content_type', 'image/jpeg'))) for c in crops]
+        data = {'threshold': 0.7}
+        if request.data.get('landmarks'):
+            data['landmarks'] = request.data.get('landmarks')
+        try:
+            resp = _ai_post(endpoint, files=files, data=data, timeout=10, headers=_session_headers(session))
+        except requests.RequestException as e:
+            return Response({"error": f"AI service unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        busy = _ai_busy_response(resp)
+        if busy is not None:
+            return busy
+        if resp.status_code == 400:
+            return Response({"error": resp.json().get('detail', 'Invalid crops')}, status=status.HTTP_400_BAD_REQUEST)
+        if resp.status_code != 200:
+            return Response({"error": f"AI service error: HTTP {resp.status_code}"}, status=status.HTTP_502_BAD_GATEWAY)
+
+        payload = resp.json()
+        faces = payload.get('faces', [])
+        with tracing.span('mark_attendance', faces=len(faces)):
+            enriched = _mark_recognized_faces(session, faces)
+        for face, out in zip(faces, enriched):
+            out.pop('bbox', None)
+            out['index'] = face.get('index')
+        return Response({"faces": enriched, "capture": payload.get('capture')})
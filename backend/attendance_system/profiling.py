@@ -0,0 +1,235 @@
+"""
+On-demand sampling profiler for the Django API.
+
+Same scheme and output as the AI service's profiler (ai_service/profiler.py):
+a sampler thread reads all Python stacks every PROFILE_INTERVAL_MS and writes
+folded stacks (flamegraph.pl / speedscope / inferno) to PROFILE_DIR, keeping
+the newest PROFILE_KEEP files within PROFILE_MAX_MB.
+
+- Per request: send `X-Profile-Token: <PROFILE_TOKEN>`; the response carries
+  `X-Profile: <file>` (or `busy` while another session runs).
+- Time window: POST /api/profile/?seconds=30 with the same header starts a
+  background session in the process that served it (with several worker
+  processes, repeat per worker or profile a single one).
+- GET /api/profile/ lists profiles, GET /api/profile/<file> downloads one.
+
+Without PROFILE_TOKEN the middleware removes itself (MiddlewareNotUsed) and
+the views answer 404, so a disabled profiler costs nothing per request.
+"""
+import os
+import re
+import sys
+import hmac
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+# Leaf frames of parked threads (runserver's accept loop, idle pools, the sampler's own waits)
+_IDLE = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get'),
+         ('socket.py', 'accept'), ('socketserver.py', 'serve_forever'), ('threading.py', '_wait_for_tstate_lock')}
+
+
+def _stack(frame):
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+        return None
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(codes)
+
+
+class Profiler:
+    """
+    One sampling session at a time for this process.
+    """
+
+    def __init__(self):
+        self.out_dir = os.path.join(settings.BASE_DIR, settings.PROFILE_DIR)
+        self.interval_s = settings.PROFILE_INTERVAL_MS / 1000
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def active(self):
+        return self._session is not None
+
+    def start(self, label, seconds=None):
+        """
+        Begin sampling and return the profile's file name (None if busy).
+        With `seconds`, the session ends and writes itself after that long.
+        """
+        with self._lock:
+            if self._session is not None:
+                return None
+            slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')[:80] or 'profile'
+            seconds = min(seconds or settings.PROFILE_MAX_SECONDS, settings.PROFILE_MAX_SECONDS)
+            session = {
+                'label': label,
+                'file': f"django-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{slug}.folded",
+                'started': time.time(),
+                'deadline': time.time() + seconds,
+                'stop': threading.Event(),
+                'counts': Counter(),
+                'samples': 0,
+                'auto_stop': label.startswith('window'),
+            }
+            session['thread'] = threading.Thread(target=self._sample, args=(session,), name='profiler', daemon=True)
+            self._session = session
+        session['thread'].start()
+        return session['file']
+
+    def stop(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is None:
+            return None
+        session['stop'].set()
+        session['thread'].join()
+        return self._write(session)
+
+    def _sample(self, session):
+        own = threading.get_ident()
+        counts = session['counts']
+        while not session['stop'].wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stack = _stack(frame)
+                    if stack:
+                        counts[(names.get(ident, str(ident)), stack)] += 1
+            session['samples'] += 1
+            if time.time() > session['deadline']:
+                break
+        if session['auto_stop']:
+            with self._lock:
+                if self._session is session:
+                    self._session = None
+            self._write(session)
+
+    def _write(self, session):
+        os.makedirs(self.out_dir, exist_ok=True)
+        names = {}
+        with open(os.path.join(self.out_dir, session['file']), 'w') as f:
+            for (thread, stack), count in session['counts'].most_common():
+                frames = [names.setdefault(c, f"{c.co_name} ({os.path.basename(c.co_filename)}:{c.co_firstlineno})")
+                          for c in reversed(stack)]
+                f.write(f"{thread};{';'.join(frames)} {count}\n")
+        self._prune()
+        return {'file': session['file'], 'label': session['label'], 'samples': session['samples'],
+                'seconds': round(time.time() - session['started'], 3)}
+
+    def _prune(self):
+        total = 0
+        for i, info in enumerate(self.list()):
+            total += info['bytes']
+            if i >= settings.PROFILE_KEEP or total > settings.PROFILE_MAX_MB * 2**20:
+                try:
+                    os.remove(os.path.join(self.out_dir, info['file']))
+                except OSError:
+                    pass
+
+    def list(self):
+        if not os.path.isdir(self.out_dir):
+            return []
+        out = []
+        for name in os.listdir(self.out_dir):
+            if name.endswith('.folded'):
+                st = os.stat(os.path.join(self.out_dir, name))
+                out.append({'file': name, 'bytes': st.st_size, 'modified': st.st_mtime})
+        return sorted(out, key=lambda info: info['modified'], reverse=True)
+
+
+_profiler = None
+
+
+def get_profiler():
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def _token_ok(request):
+    given = request.META.get('HTTP_X_PROFILE_TOKEN')
+    return bool(settings.PROFILE_TOKEN) and given is not None and \
+        hmac.compare_digest(settings.PROFILE_TOKEN.encode(), given.encode())
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that carry a valid X-Profile-Token header.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_TOKEN:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if 'HTTP_X_PROFILE_TOKEN' not in request.META or request.path.startswith('/api/profile/') \
+                or not _token_ok(request):
+            return self.get_response(request)
+        profiler = get_profiler()
+        name = profiler.start(f"{request.method} {request.path}")
+        if name is None:
+            response = self.get_response(request)
+            response['X-Profile'] = 'busy'
+            return response
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        response['X-Profile'] = name
+        return response
+
+
+def _check(request):
+    if not settings.PROFILE_TOKEN:
+        return JsonResponse({'error': 'Profiler disabled (PROFILE_TOKEN not set)'}, status=404)
+    if not _token_ok(request):
+        return JsonResponse({'error': 'Missing or invalid X-Profile-Token'}, status=403)
+    return None
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def profile_view(request):
+    """
+    GET: list saved profiles. POST ?seconds=N: start a background window session.
+    """
+    denied = _check(request)
+    if denied:
+        return denied
+    profiler = get_profiler()
+    if request.method == 'GET':
+        return JsonResponse({'active': profiler.active, 'dir': profiler.out_dir, 'profiles': profiler.list()})
+    try:
+        seconds = max(0.1, float(request.GET.get('seconds', 30)))
+    except ValueError:
+        return JsonResponse({'error': 'seconds must be a number'}, status=400)
+    name = profiler.start(f"window-{seconds:g}s", seconds=seconds)
+    if name is None:
+        return JsonResponse({'error': 'A profiling session is already running'}, status=409)
+    return JsonResponse({'file': name, 'seconds': min(seconds, settings.PROFILE_MAX_SECONDS), 'pid': os.getpid()},
+                        status=202)
+
+
+@require_http_methods(["GET"])
+def profile_download(request, name):
+    denied = _check(request)
+    if denied:
+        return denied
+    profiler = get_profiler()
+    path = os.path.join(profiler.out_dir, name)
+    if os.path.basename(name) != name or not name.endswith('.folded') or not os.path.exists(path):
+        return JsonResponse({'error': 'Profile not found'}, status=404)
+    return FileResponse(open(path, 'rb'), content_type='text/plain', as_attachment=True, filename=name)
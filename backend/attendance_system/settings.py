@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'attendance_system.tracing.TracingMiddleware',  # traceparent + span timings as JSON lines (off without TRACE_DIR)
+    'attendance_system.profiling.ProfilingMiddleware',  # X-Profile-Token sampling profiler (off without PROFILE_TOKEN)
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -148,3 +151,22 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
+
+# Gallery namespace of this deployment in a shared AI service (sent as X-Gallery-Namespace);
+# list it in the AI service's FACE_NAMESPACES so the first registration can create it
+AI_GALLERY_NAMESPACE = os.environ.get('AI_GALLERY_NAMESPACE', 'default')
+
+# On-demand sampling profiler (attendance_system/profiling.py); disabled unless PROFILE_TOKEN is set
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 10))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 120))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_MAX_MB = float(os.environ.get('PROFILE_MAX_MB', 100))
+
+# Distributed request tracing (attendance_system/tracing.py); disabled unless TRACE_DIR is set.
+# Give the AI service the same TRACE_DIR to read both sides with `python ai_service/tracing.py slowest`
+TRACE_DIR = os.environ.get('TRACE_DIR', '')
+TRACE_SAMPLE = float(os.environ.get('TRACE_SAMPLE', 1.0))
+TRACE_FILE_MB = float(os.environ.get('TRACE_FILE_MB', 20))
+TRACE_MAX_MB = float(os.environ.get('TRACE_MAX_MB', 200))
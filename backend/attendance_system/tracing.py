@@ -0,0 +1,271 @@
+"""
+Distributed request tracing for the Django API.
+
+Same span format and exporter as the AI service (ai_service/tracing.py): every
+API request becomes a trace whose root span is this middleware, each SQL
+query a `db <statement> <table>` child span, and the calls to the AI service
+carry a W3C `traceparent` header so the AI service's spans (queue wait,
+detection, ArcFace, search) join the same trace. Spans are appended as JSON lines to
+TRACE_DIR/django-<pid>.jsonl by a background thread; responses carry X-Trace-Id.
+
+Read the slowest requests across both services with the AI service's viewer:
+    python ai_service/tracing.py slowest --dir <TRACE_DIR> --name recognize_frame
+
+Without TRACE_DIR the middleware removes itself (MiddlewareNotUsed) and
+`span` / `inject` are no-ops.
+"""
+import os
+import re
+import atexit
+import json
+import time
+import random
+import threading
+import contextvars
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+SERVICE = 'django'
+
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)"?', re.IGNORECASE)
+_TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})')
+# <service>-<pid>-<stamp>.jsonl: a rotated span file; the one a process is appending to has no stamp
+_ROTATED = re.compile(r'-\d+-\d{8}-\d{6}\.jsonl$')
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(value):
+    """
+    (trace_id, parent span_id, sampled) from a W3C traceparent header, None if absent/invalid.
+    """
+    match = _TRACEPARENT.match((value or '').strip().lower())
+    if not match or match.group(1) == 'ff' or match.group(2) == '0' * 32 or match.group(3) == '0' * 16:
+        return None
+    return match.group(2), match.group(3), bool(int(match.group(4), 16) & 1)
+
+
+class Exporter:
+    """
+    Buffers span records and appends them to TRACE_DIR/django-<pid>.jsonl from a background thread.
+    """
+
+    def __init__(self, directory, file_bytes, max_bytes, flush_s=1.0, max_pending=100_000):
+        self.directory = directory
+        self.file_bytes = file_bytes
+        self.max_bytes = max_bytes
+        self.flush_s = flush_s
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # the export thread vs. the flush at exit
+        self._file = None
+        self._pid = None
+        self._thread = None
+        self.dropped = 0
+
+    def export(self, record):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(record)
+            # Started lazily, and again in a worker forked after the first span (gunicorn --preload)
+            if self._thread is None or self._pid != os.getpid():
+                if self._thread is None:
+                    atexit.register(self.flush)  # management commands exit right after their last span
+                self._pid = os.getpid()
+                self._file = None
+                self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_s)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Span export failed: {e}")
+
+    def flush(self):
+        with self._write_lock:
+            self._write()
+
+    def _write(self):
+        with self._lock:
+            records, self._pending = self._pending, []
+        if not records:
+            return
+        path = os.path.join(self.directory, f"{SERVICE}-{os.getpid()}.jsonl")
+        if self._file is None:
+            self._file = open(path, 'a', encoding='utf-8')
+        self._file.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records))
+        self._file.flush()
+        if self._file.tell() > self.file_bytes:
+            self._file.close()
+            self._file = None
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            os.replace(path, os.path.join(self.directory, f"{SERVICE}-{os.getpid()}-{stamp}.jsonl"))
+            # Only rotated files count against TRACE_MAX_MB: other workers' active files are never deleted
+            files = sorted((os.path.join(self.directory, n) for n in os.listdir(self.directory)
+                            if _ROTATED.search(n)), key=os.path.getmtime)
+            total = sum(os.path.getsize(p) for p in files)
+            for old in files:
+                if total <= self.max_bytes:
+                    break
+                total -= os.path.getsize(old)
+                os.unlink(old)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """
+    The process's exporter, or None when TRACE_DIR is not set.
+    """
+    global _exporter
+    if not settings.TRACE_DIR:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = Exporter(
+                os.path.join(settings.BASE_DIR, settings.TRACE_DIR),
+                file_bytes=int(settings.TRACE_FILE_MB * 2**20),
+                max_bytes=int(settings.TRACE_MAX_MB * 2**20),
+            )
+        return _exporter
+
+
+class Span:
+    """
+    One timed stage of a trace; attributes are added with `set`.
+    """
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'sampled', 'name', 'start', 'attrs', '_t0', '_token')
+
+    def __init__(self, trace_id, parent_id, sampled, name, attrs=None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self, error=None):
+        if not self.sampled:
+            return
+        if error is not None:
+            self.attrs['error'] = f"{type(error).__name__}: {error}"[:300]
+        get_exporter().export({
+            "trace": self.trace_id, "span": self.span_id, "parent": self.parent_id, "service": SERVICE,
+            "name": self.name, "start": round(self.start, 6),
+            "ms": round((time.perf_counter() - self._t0) * 1000, 3), "attrs": self.attrs,
+        })
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(exc)
+        return False
+
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attrs):
+    """
+    Context manager timing a child of the current span (a no-op outside a sampled trace).
+    Yields the Span, or None, so callers can add attributes.
+    """
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return _NO_SPAN
+    return Span(parent.trace_id, parent.span_id, True, name, attrs)
+
+
+def root_span(name, **attrs):
+    """
+    Start a new trace outside a request (management commands); a no-op without TRACE_DIR.
+    """
+    if get_exporter() is None:
+        return _NO_SPAN
+    return Span(_new_id(128), None, random.random() < settings.TRACE_SAMPLE, name, attrs)
+
+
+def inject(headers):
+    """
+    Add the current span's traceparent to outgoing request headers (in place), and return them.
+    """
+    current = _current.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent()
+    return headers
+
+
+class TracingMiddleware:
+    """
+    Root span per request, continuing an incoming traceparent; SQL queries become `db ...` spans.
+    """
+
+    def __init__(self, get_response):
+        if get_exporter() is None:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample = settings.TRACE_SAMPLE
+
+    def __call__(self, request):
+        incoming = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        if incoming is not None:
+            trace_id, parent_id, sampled = incoming
+        else:
+            trace_id, parent_id, sampled = _new_id(128), None, random.random() < self.sample
+        root = Span(trace_id, parent_id, sampled, f"{request.method} {request.path}")
+        with root:
+            if sampled:
+                with connection.execute_wrapper(_db_span):
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+            root.set('status', response.status_code)
+        response[TRACE_ID_HEADER] = trace_id
+        return response
+
+
+def _db_span(execute, sql, params, many, context):
+    # Named by statement and table ("db SELECT students_student") so the viewer can fold repeats
+    op = sql.split(None, 1)[0].upper() if sql else ''
+    table = _SQL_TABLE.search(sql or '')
+    with span(f"db {op} {table.group(1) if table else ''}".rstrip(), sql=sql[:200]):
+        return execute(sql, params, many, context)
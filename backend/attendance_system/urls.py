@@ -22,6 +22,7 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views_auth import me
 from .admin_auth import jwt_admin_login
 from .custom_auth import CustomTokenObtainPairView
+from .profiling import profile_view, profile_download
 
 urlpatterns = [
     path('admin/jwt-login/', jwt_admin_login, name='jwt_admin_login'),
@@ -32,6 +33,9 @@ urlpatterns = [
     path('api/auth/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/auth/me', me, name='auth_me'),
+    # Sampling profiler (X-Profile-Token)
+    path('api/profile/', profile_view, name='profile'),
+    path('api/profile/<str:name>', profile_download, name='profile_download'),
 ]
 
 # Serve media files in development
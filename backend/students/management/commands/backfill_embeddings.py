@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.db.models import Q
 from django.conf import settings
 from decouple import config
+import time
 import requests
 
 from students.models import Student
@@ -23,10 +24,23 @@ class Command(BaseCommand):
             default=15,
             help="HTTP timeout in seconds for AI service calls",
         )
+        parser.add_argument(
+            "--max-retries",
+            type=int,
+            default=5,
+            help="Retries per student when the AI service is busy (HTTP 503, honours Retry-After)",
+        )
 
     def handle(self, *args, **options):
         limit = options["limit"]
         timeout = options["timeout"]
+        max_retries = options["max_retries"]
+        # Backfill runs in the AI service's batch lane: live recognition is served first
+        headers = {
+            "X-Priority": "batch",
+            "X-Request-Deadline-Ms": str(max(0, timeout * 1000 - 500)),
+            "X-Gallery-Namespace": settings.AI_GALLERY_NAMESPACE,
+        }
 
         ai_url = config("AI_SERVICE_URL", default="http://localhost:8001").rstrip("/")
         register_endpoint = f"{ai_url}/api/face/register"
@@ -35,7 +49,7 @@ class Command(BaseCommand):
             Q(face_embedding_id__isnull=True)
             | Q(face_embedding_id__startswith="pending_")
             | Q(face_embedding_id__exact="")
-        ).exclude(face_image="")
+        ).exclude(face_image="").select_related("department")
 
         if limit > 0:
             qs = qs[:limit]
@@ -66,11 +80,20 @@ class Command(BaseCommand):
 
             try:
                 with student.face_image.open("rb") as f:
+                    image_bytes = f.read()
+                data = {"student_id": str(student.id)}
+                if student.department_id:
+                    data["department"] = student.department.code
+                for attempt in range(max_retries + 1):
                     files = {
-                        "file": (student.face_image.name.split("/")[-1], f, "image/jpeg"),
+                        "file": (student.face_image.name.split("/")[-1], image_bytes, "image/jpeg"),
                     }
-                    data = {"student_id": str(student.id)}
-                    resp = requests.post(register_endpoint, files=files, data=data, timeout=timeout)
+                    resp = requests.post(register_endpoint, files=files, data=data, timeout=timeout,
+                                         headers=headers)
+                    if resp.status_code not in (503, 504) or attempt == max_retries:
+                        break
+                    retry_after = resp.headers.get("Retry-After", "1")
+                    time.sleep(int(retry_after) if retry_after.isdigit() else 1)
 
                 if resp.status_code == 200:
                     payload = resp.json()
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from decouple import config
+import requests
+
+from students.models import Student
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed every registered student with a new face model from their stored face images, "
+        "into a shadow gallery on the AI service, then switch over atomically once coverage is 100%."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model",
+            required=True,
+            help="Target model: InsightFace pack name (buffalo_l) or model ID (insightface/buffalo_l)",
+        )
+        parser.add_argument("--workers", type=int, default=4, help="Parallel requests to the AI service")
+        parser.add_argument("--batch-size", type=int, default=16, help="Students per request")
+        parser.add_argument("--timeout", type=int, default=300, help="HTTP timeout in seconds per batch")
+        parser.add_argument(
+            "--max-passes",
+            type=int,
+            default=3,
+            help="Passes over pending students (catches registrations made during the migration)",
+        )
+        parser.add_argument("--restart", action="store_true", help="Discard an existing shadow gallery")
+        parser.add_argument("--no-cutover", action="store_true", help="Build the shadow gallery only")
+
+    def handle(self, *args, **options):
+        self.ai_url = config("AI_SERVICE_URL", default="http://localhost:8001").rstrip("/")
+        self.timeout = options["timeout"]
+        self.session = requests.Session()
+        # Re-embedding runs in the AI service's batch lane: live recognition is served first
+        self.session.headers["X-Priority"] = "batch"
+        # The migration endpoints need the AI service's shared secret
+        self.session.headers["X-Gallery-Token"] = config("GALLERY_TOKEN", default="")
+
+        status = self._call("post", "/api/face/migration/start",
+                            json={"model": options["model"], "restart": options["restart"]})
+        self.stdout.write(
+            f"Migrating {status['source_model']} -> {status['target_model']['model']}: "
+            f"{status['covered']}/{status['live_students']} students already in the shadow gallery"
+        )
+
+        for attempt in range(1, options["max_passes"] + 1):
+            status = self._call("get", "/api/face/migration", params={"pending": "true"})
+            pending = status.get("pending_ids") or []
+            if not pending:
+                break
+            self.stdout.write(f"Pass {attempt}: {len(pending)} student(s) to re-embed")
+            if self._run_pass(pending, options["workers"], max(1, options["batch_size"])) == 0:
+                break  # nothing succeeded: more passes will not help
+
+        status = self._call("get", "/api/face/migration", params={"pending": "true"})
+        self.stdout.write(
+            f"Coverage {status['coverage'] * 100:.2f}% ({status['covered']}/{status['live_students']}), "
+            f"AI throughput {status['throughput_per_s']:.1f} students/s"
+        )
+        if not status["ready"]:
+            raise CommandError(
+                f"{status['pending']} student(s) still pending, not switching models: "
+                + ", ".join(status["pending_ids"][:20])
+            )
+        if options["no_cutover"]:
+            self.stdout.write(self.style.SUCCESS("Shadow gallery complete; run again without --no-cutover to switch."))
+            return
+
+        resp = self.session.post(f"{self.ai_url}/api/face/migration/cutover", timeout=self.timeout)
+        if resp.status_code != 200:
+            raise CommandError(f"Cutover refused: HTTP {resp.status_code}: {resp.text[:300]}")
+        result = resp.json()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Switched to {result['model']} ({result['students']} students, {result['ntotal']} vectors)"
+            )
+        )
+
+    def _call(self, method, path, **kwargs):
+        try:
+            resp = self.session.request(method, f"{self.ai_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise CommandError(f"AI service unreachable: {e}")
+        if resp.status_code != 200:
+            raise CommandError(f"AI service HTTP {resp.status_code} on {path}: {resp.text[:300]}")
+        return resp.json()
+
+    def _run_pass(self, pending, workers, batch_size):
+        """Send pending students in parallel batches; returns how many were re-embedded."""
+        by_id = {
+            str(s.id): s
+            for s in Student.objects.filter(id__in=[int(p) for p in pending if p.isdigit()]).exclude(face_image="")
+        }
+        missing = [p for p in pending if p not in by_id]
+        for sid in missing:
+            self.stdout.write(self.style.WARNING(f"Student {sid}: no stored face image, cannot re-embed"))
+        students = [by_id[p] for p in pending if p in by_id]
+        batches = [students[i:i + batch_size] for i in range(0, len(students), batch_size)]
+
+        total = len(students)
+        done = succeeded = 0
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(self._embed_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                done += len(batch)
+                try:
+                    embedded, failed = future.result()
+                except Exception as e:
+                    embedded, failed = 0, {str(s.id): str(e) for s in batch}
+                succeeded += embedded
+                for sid, error in failed.items():
+                    self.stdout.write(self.style.ERROR(f"Student {sid}: {error}"))
+                elapsed = time.time() - started
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = (total - done) / rate if rate > 0 else 0.0
+                self.stdout.write(
+                    f"[{done}/{total}] {rate:.1f} students/s, ETA {int(eta // 60)}m{int(eta % 60):02d}s"
+                )
+        return succeeded
+
+    def _embed_batch(self, students):
+        files, student_ids, failed = [], [], {}
+        for student in students:
+            try:
+                with student.face_image.open("rb") as f:
+                    files.append(("files", (student.face_image.name.split("/")[-1], f.read(), "image/jpeg")))
+                student_ids.append(str(student.id))
+            except Exception as e:
+                failed[str(student.id)] = f"Cannot read face image: {e}"
+        if not files:
+            return 0, failed
+        resp = self.session.post(
+            f"{self.ai_url}/api/face/migration/embed",
+            files=files,
+            data={"student_ids": student_ids},
+            timeout=self.timeout,
+        )
+        if resp.status_code != 200:
+            raise Exception(f"AI service HTTP {resp.status_code}: {resp.text[:200]}")
+        payload = resp.json()
+        failed.update(payload.get("failed") or {})
+        return payload["embedded"], failed
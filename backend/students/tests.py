@@ -1,3 +1,71 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from .models import Department, Student
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='students-tests-')
+
+
+def _ai_response(status_code, payload):
+    response = mock.Mock(status_code=status_code, headers={'content-type': 'application/json'})
+    response.json.return_value = payload
+    return response
+
+
+def _image(name='face.jpg'):
+    return SimpleUploadedFile(name, b'\xff\xd8\xff\xe0 not really a jpeg', content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RegisterWithFaceDuplicateTests(TestCase):
+    """A face the AI service already knows under another student must not create a second student."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(code='CSE', name='Computer Science', degree_type='UG')
+        self.existing = Student.objects.create(full_name='Existing Student', department=self.department,
+                                               class_year='First Year', face_embedding_id='1')
+        self.form = {'full_name': 'New Student', 'department': self.department.id, 'class_year': 'First Year'}
+        self.conflict = _ai_response(409, {'detail': {
+            'message': 'Face already registered',
+            'duplicates': {'new': [{'student_id': str(self.existing.id), 'similarity': 0.93}]},
+        }})
+
+    def test_single_frame_conflict_rolls_back_the_student(self):
+        with mock.patch('students.views.requests.post', return_value=self.conflict) as post:
+            resp = self.client.post('/api/students/register_with_face/',
+                                    {**self.form, 'face_image': _image()})
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['duplicates'][0]['roll_number'], self.existing.roll_number)
+        self.assertEqual(resp.json()['duplicates'][0]['similarity'], 0.93)
+        self.assertEqual(list(Student.objects.all()), [self.existing])
+        self.assertEqual(post.call_args.kwargs['data']['department'], 'CSE')
+
+    def test_multi_frame_conflict_rolls_back_the_student(self):
+        with mock.patch('students.views.requests.post', return_value=self.conflict):
+            resp = self.client.post('/api/students/register_with_face_multi/',
+                                    {**self.form, 'face_images': [_image(f'f{i}.jpg') for i in range(3)]})
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['duplicates'][0]['full_name'], 'Existing Student')
+        self.assertEqual(list(Student.objects.all()), [self.existing])
+
+    def test_flagged_duplicate_still_registers(self):
+        ok = _ai_response(200, {'embedding_id': 'new', 'frames': 3, 'possible_duplicates': [
+            {'student_id': str(self.existing.id), 'similarity': 0.81}]})
+        with mock.patch('students.views.requests.post', return_value=ok):
+            resp = self.client.post('/api/students/register_with_face_multi/',
+                                    {**self.form, 'face_images': [_image(f'f{i}.jpg') for i in range(3)]})
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json()['possible_duplicates'][0]['roll_number'], self.existing.roll_number)
+        self.assertEqual(Student.objects.count(), 2)
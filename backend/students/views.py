@@ -5,6 +5,8 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.core.files.base import ContentFile
 from django.db.models import Q
+from django.conf import settings
+from attendance_system import tracing
 import requests
 import base64
 import io
@@ -14,6 +16,23 @@ from .serializers import (StudentSerializer, SubjectSerializer, TeacherSerialize
                           TeacherSubjectAssignmentSerializer, DepartmentSerializer)
 
 
+def _duplicate_students(matches):
+    """Resolve AI duplicate matches [{student_id, similarity}] to student summaries."""
+    ids = [m.get('student_id') for m in matches if str(m.get('student_id', '')).isdigit()]
+    students = Student.objects.in_bulk([int(i) for i in ids])
+    out = []
+    for m in matches:
+        sid = str(m.get('student_id', ''))
+        student = students.get(int(sid)) if sid.isdigit() else None
+        out.append({
+            'student_id': sid,
+            'roll_number': student.roll_number if student else None,
+            'full_name': student.full_name if student else None,
+            'similarity': m.get('similarity'),
+        })
+    return out
+
+
 class DepartmentViewSet(viewsets.ModelViewSet):
     """ViewSet for managing departments"""
     queryset = Department.objects.all()
@@ -240,12 +259,18 @@ class StudentViewSet(viewsets.ModelViewSet):
                 face_image.seek(0)
                 files = {'file': (face_image.name, face_image, face_image.content_type)}
                 data = {'student_id': str(student.id)}
+                if student.department:
+                    # Placement key when the AI gallery is sharded by department
+                    data['department'] = student.department.code
                 
                 # Try with a small retry loop
                 last_exc = None
                 for attempt in range(2):
                     try:
-                        response = requests.post(ai_service_url, files=files, data=data, timeout=10)
+                        response = requests.post(ai_service_url, files=files, data=data, timeout=10,
+                                                 headers=tracing.inject({
+                                                     'X-Request-Deadline-Ms': '9500',
+                                                     'X-Gallery-Namespace': settings.AI_GALLERY_NAMESPACE}))
                         break
                     except requests.exceptions.RequestException as ex:
                         last_exc = ex
@@ -257,6 +282,18 @@ class StudentViewSet(viewsets.ModelViewSet):
                     ai_response = response.json()
                     student.face_embedding_id = ai_response.get('embedding_id', str(student.id))
                     student.save()
+                elif response.status_code == 409:
+                    # Same face already registered under another student (FACE_DUPLICATE_POLICY=reject)
+                    detail = response.json().get('detail', {})
+                    matches = [m for ms in detail.get('duplicates', {}).values() for m in ms]
+                    student.delete()  # Rollback student creation
+                    return Response(
+                        {
+                            'error': 'This face is already registered',
+                            'duplicates': _duplicate_students(matches)
+                        },
+                        status=status.HTTP_409_CONFLICT
+                    )
                 else:
                     # If AI service fails, still keep the student but log the error
                     student.face_embedding_id = f"pending_{student.id}"
@@ -350,9 +387,15 @@ class StudentViewSet(viewsets.ModelViewSet):
                 files.append(('files', (f'frame_{idx}.jpg', img, getattr(img, 'content_type', 'image/jpeg'))))
             
             data = {'student_id': str(student.id)}
+            if student.department:
+                # Placement key when the AI gallery is sharded by department
+                data['department'] = student.department.code
             
             try:
-                resp = requests.post(ai_service_url, files=files, data=data, timeout=30)
+                # The AI service drops the job if it cannot start before our timeout
+                resp = requests.post(ai_service_url, files=files, data=data, timeout=30,
+                                     headers=tracing.inject({'X-Request-Deadline-Ms': '29500',
+                                                             'X-Gallery-Namespace': settings.AI_GALLERY_NAMESPACE}))
                 
                 if resp.status_code == 200:
                     ai_response = resp.json()
@@ -365,10 +408,23 @@ class StudentViewSet(viewsets.ModelViewSet):
                             'message': f'Student registered successfully with {len(images)} frames',
                             'student': StudentSerializer(student).data,
                             'frames_processed': ai_response.get('frames', len(images)),
-                            'embedding_id': student.face_embedding_id
+                            'embedding_id': student.face_embedding_id,
+                            'possible_duplicates': _duplicate_students(ai_response.get('possible_duplicates', []))
                         },
                         status=status.HTTP_201_CREATED
                     )
+                elif resp.status_code == 409:
+                    # Same face already registered under another student (FACE_DUPLICATE_POLICY=reject)
+                    detail = resp.json().get('detail', {})
+                    matches = [m for ms in detail.get('duplicates', {}).values() for m in ms]
+                    student.delete()  # Rollback student creation
+                    return Response(
+                        {
+                            'error': 'This face is already registered',
+                            'duplicates': _duplicate_students(matches)
+                        },
+                        status=status.HTTP_409_CONFLICT
+                    )
                 else:
                     # AI service returned error
                     error_detail = resp.json() if resp.headers.get('content-type') == 'application/json' else resp.text
@@ -16,9 +16,17 @@ export default function Attendance() {
   const webcamRef = useRef(null);
   const intervalRef = useRef(null);
   const canvasRef = useRef(null);
-  const [intervalMs, setIntervalMs] = useState(400); // Faster refresh: 400ms = 2.5 FPS
+  const [intervalMs, setIntervalMs] = useState(400); // Fastest scan rate: 400ms = 2.5 FPS
   const [availableSubjects, setAvailableSubjects] = useState([]);
   const processingRef = useRef(false); // Prevent overlapping requests
+  const runningRef = useRef(false);
+  // Capture hints from the server: {interval_ms, max_side, jpeg_quality, reason}
+  const [followHints, setFollowHints] = useState(true);
+  const [captureHint, setCaptureHint] = useState(null);
+  const hintRef = useRef(null);
+  // The frame loop keeps the closure it started with: read settings through a ref
+  const settingsRef = useRef({ intervalMs, followHints });
+  settingsRef.current = { intervalMs, followHints };
 
   // Teacher's teaching options from backend
   const [teacherDepartments, setTeacherDepartments] = useState([]);
@@ -182,16 +190,51 @@ export default function Attendance() {
     if (!session.is_active)
       return alert("Session is not active. Click 'Start Session' first.");
     setRunning(true);
+    runningRef.current = true;
+    hintRef.current = null;
+    setCaptureHint(null);
     detectAndMarkFrame();
-    intervalRef.current = setInterval(detectAndMarkFrame, intervalMs);
+  }
+
+  function stopLoop() {
+    setRunning(false);
+    runningRef.current = false;
+    clearTimeout(intervalRef.current);
+  }
+
+  // Next frame after the user's interval, or later when the server asks for it
+  // (busy, stable scene, everyone marked) or sheds the request (Retry-After)
+  function scheduleNext(retryAfterMs = 0) {
+    if (!runningRef.current) return;
+    const { intervalMs, followHints } = settingsRef.current;
+    const hint = followHints ? hintRef.current : null;
+    const delay = Math.max(intervalMs, hint?.interval_ms || 0, retryAfterMs);
+    clearTimeout(intervalRef.current);
+    intervalRef.current = setTimeout(detectAndMarkFrame, delay);
+  }
+
+  // Screenshot downscaled to the hinted resolution (JPEG quality: screenshotQuality prop)
+  function captureFrame() {
+    const hint = settingsRef.current.followHints ? hintRef.current : null;
+    const video = webcamRef.current?.video;
+    if (!hint || !video || !video.videoWidth) {
+      return webcamRef.current?.getScreenshot();
+    }
+    const scale = Math.min(
+      1,
+      hint.max_side / Math.max(video.videoWidth, video.videoHeight)
+    );
+    return webcamRef.current.getScreenshot({
+      width: Math.round(video.videoWidth * scale),
+      height: Math.round(video.videoHeight * scale),
+    });
   }
 
   async function endSession() {
     if (!session) return;
     // Stop recognition if running
     if (running) {
-      setRunning(false);
-      clearInterval(intervalRef.current);
+      stopLoop();
     }
     try {
       const token = localStorage.getItem("teacher_token");
@@ -238,8 +281,7 @@ export default function Attendance() {
   }
 
   async function stop() {
-    setRunning(false);
-    clearInterval(intervalRef.current);
+    stopLoop();
     if (session) {
       try {
         const token = localStorage.getItem("teacher_token");
@@ -260,16 +302,16 @@ export default function Attendance() {
 
     // Check if session is still active before marking
     if (!session || !session.is_active) {
-      setRunning(false);
-      clearInterval(intervalRef.current);
+      stopLoop();
       alert("Session is no longer active. Stopping attendance marking.");
       return;
     }
 
-    const imageSrc = webcamRef.current?.getScreenshot();
-    if (!imageSrc) return;
+    const imageSrc = captureFrame();
+    if (!imageSrc) return scheduleNext();
 
     processingRef.current = true;
+    let retryAfterMs = 0;
 
     try {
       const formData = new FormData();
@@ -289,14 +331,20 @@ export default function Attendance() {
       if (!res.ok) {
         // Session might have been ended
         if (res.status === 400) {
-          setRunning(false);
-          clearInterval(intervalRef.current);
+          stopLoop();
           alert("Session is not active. Stopping attendance.");
+        } else if (res.status === 503) {
+          // AI service shed the frame: back off as long as it asked
+          retryAfterMs = (parseInt(res.headers.get("Retry-After")) || 1) * 1000;
         }
         return;
       }
 
       const data = await res.json();
+      if (data.capture) {
+        hintRef.current = data.capture;
+        setCaptureHint(data.capture);
+      }
       drawFaces(data);
 
       const faces = Array.isArray(data.faces) ? data.faces : [];
@@ -317,6 +365,7 @@ export default function Attendance() {
       console.error("Recognition error:", err);
     } finally {
       processingRef.current = false;
+      scheduleNext(retryAfterMs);
     }
   }
 
@@ -385,7 +434,7 @@ export default function Attendance() {
     });
   }
 
-  useEffect(() => () => clearInterval(intervalRef.current), []);
+  useEffect(() => () => clearTimeout(intervalRef.current), []);
 
   return (
     <div className="space-y-6">
@@ -499,6 +548,9 @@ export default function Attendance() {
           <Webcam
             ref={webcamRef}
             screenshotFormat="image/jpeg"
+            screenshotQuality={
+              followHints && captureHint ? captureHint.jpeg_quality / 100 : 0.92
+            }
             className="rounded border"
             videoConstraints={{
               facingMode: "user",
@@ -554,9 +606,23 @@ export default function Attendance() {
             <span className="text-xs text-green-600 font-medium">
               ({(1000 / intervalMs).toFixed(1)} FPS)
             </span>
-            <span className="text-xs text-gray-400">
-              Recommended: 300-500ms for best performance
-            </span>
+            <label className="text-xs text-gray-600 flex items-center gap-1">
+              <input
+                type="checkbox"
+                checked={followHints}
+                onChange={(e) => setFollowHints(e.target.checked)}
+              />
+              Adapt to server load
+            </label>
+            {followHints && running && captureHint && (
+              <span
+                className="text-xs text-gray-500"
+                title="Interval, resolution and JPEG quality suggested by the recognition service"
+              >
+                Server pace: {captureHint.interval_ms}ms, {captureHint.max_side}px (
+                {captureHint.reason.replace("_", " ")})
+              </span>
+            )}
           </div>
         </div>
         <div className="flex-1">